@@ -0,0 +1,9 @@
+#!/bin/sh
+
+set -e
+
+# move into red directory
+cd "$(cd "$(dirname "$0")"; pwd)"
+
+# Usage: python md_genfromsql.py --manifest <config.js> <md_schema_name> [test]
+python md_genfromsql.py --manifest ../configs/config.js analytics $1
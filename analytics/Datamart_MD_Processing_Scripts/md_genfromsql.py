@@ -1,9 +1,11 @@
 # md_genfromsql.py
 # 	script takes input of SQL file containing sequence of SQL instructions, and inserts them sequentially into MD files
-#   Assumes that each complete SQL instruction is terminated by ";", and reads multiple lines until it finds a line termined as such
+#   The file is split into instructions by md_sqlsplit.py, one statement at a time -- a ";" inside quotes, $$ function bodies or
+#   comments doesn't end an instruction
 #
 # Usage:
-#   python md_genfromsql.py <input_sql_md_file.sql> <md_schema_name> <job_group> <job_name> <APPEND | REPLACE | DELETE> <job_sequence>
+#   python md_genfromsql.py <input_sql_md_file.sql> <md_schema_name> <job_group> <job_name> <APPEND | REPLACE | DELETE> <job_sequence> [test]
+#   python md_genfromsql.py --manifest <config.js> <md_schema_name> [test]
 #   where
 #       input_sql_md_file - input SQL file
 #       md_schema_name - schema where METADATA tables are stored - this is assumed to be in one shared place for all RED instances
@@ -13,215 +15,356 @@
 #       job_name - group collection of instructions into a specific job name (e.g. L4_LOAD)
 #       <APPEND | REPLACE | DELETE>
 #           - REPLACE (most common) - replace all instructions for a specific JOB with the new ones that are being processed
-#           - APPEND -- concatenate these newly processed instructions ontop of existing metadata for like named JOBGROUP
+#               only the instructions that changed are inserted / updated / deleted, and an unchanged file isn't touched at all
+#           - APPEND -- concatenate these newly processed instructions ontop of existing metadata for like named JOBGROUP, numbered after the existing ones
 #           - DELETE -- just remove instructions for certain job group, don't insert new ones
+#       --manifest - REPLACE every job listed in analyticsJobs of the given config (analytics/configs/config.js), reading each fileName
+#           from ../ETL_SQL_Source -- all jobs are registered over one connection, in one transaction
+#           a job's optional "settings" object is stored as its session settings profile (md_job.settings, see reddm_runjobgroup.py),
+#           e.g. settings: { work_mem: '256MB', max_parallel_workers_per_gather: 4 } -- a job without one has its profile cleared
+#           likewise, a job's optional "guard" query is stored in md_job.guard: the runner skips the job's instructions when it returns false
 #
 # NOTES:
 #   - MD processor assumes that instructions, jobs and job groups will need to be run in a specific sequence order... but only automatically inserts sequence numbers
-#      in for instructions - sequence numbers for jobs are specified in the parameters and job groups need to be manually manipulated in the metadata if special ordering is required
+#      in for instructions - sequence numbers for jobs are specified in the parameters (or the manifest) and job groups need to be manually manipulated in the metadata if special ordering is required
+#   - instructions are inserted with multi-row inserts, INSERT_PAGE_SIZE rows per statement
+#   - every instruction is stored with the md5 of its text (md_instruction.instructionHash), and every job with a hash over all of its
+#     instructions (md_job.fileHash).   REPLACE first compares the file hash (one query); if it differs, the old and new instruction
+#     hashes are diffed, and unchanged instructions are kept -- only renumbered when instructions were added / removed before them.
+#     Renumbering goes through negative sequence numbers first, so a unique ("jobId", "sequenceNumber") never sees two rows on one number
+#   - every instruction also keeps the range of lines it came from in the SQL file (md_instruction.sourceFirstLine / sourceLastLine),
+#     so a failing instruction can be traced back to its source
+#   - the single file form leaves md_job.settings and md_job.guard alone, and md_instruction.settings is never written here -- instruction profiles are
+#     set in the metadata directly, and stay with the instruction row while it is kept or updated in place
+#   - instruction guards are "-- guard: <query>" comments in the SQL itself, so they are deployed with the instruction text
+#   - md_instruction.instructionType is SQL, unless the instruction starts with the name of another instruction type the runner knows
+#     (PARTITION, PYTHON, JOB or JOBGROUP -- see the INSTRUCTION_TYPES of reddm_runjobgroup.py) -- see reddm_runjobgroup.instruction_type()
+#   - RESTARTMART and LOADMART (SQL_ONLY_JOBGROUPS) are also run by the run_analytics_restart_mart_process() / run_analytics_load_process()
+#     procedures, which EXECUTE every instruction as SQL -- an instruction of another type in one of them is refused, and nothing is deployed
+#   - the hash, line, settings and guard columns are added to the metadata tables on first use; instructions registered before that are hashed in the database
 #   - TODO:  each time new metadata is inserted, "updated_at" attribute should be updated on md_job table -- not done yet
-#   - TODO:  APPEND doesn't properly add sequence numbers that are after the existing instructons, just restarts from 1
 
+import os
 import sys
 import json
+import difflib
+import hashlib
+import subprocess
 import psycopg2
-import os
+import psycopg2.extras
+
+import md_sqlsplit
+import reddm_runjobgroup
+
+INSERT_PAGE_SIZE = 100
 
+# job groups the server side run_analytics_* procedures execute too -- plain SQL instructions only
+SQL_ONLY_JOBGROUPS = ("RESTARTMART", "LOADMART")
+
+is_test = (len(sys.argv) > 7 and sys.argv[7] == 'test') or (len(sys.argv) > 4 and sys.argv[1] == "--manifest" and sys.argv[4] == 'test')
 db_host = os.getenv('DATABASE_HOST', "coredb")
 cloud_env = os.getenv('CLOUD_ENV', "dev")
-core_db = 'reva_test' if (len(sys.argv) > 7 and sys.argv[7] == 'test') else 'reva_core'
-mart_db = 'reva_mart_test' if (len(sys.argv) > 7 and sys.argv[7] == 'test') else os.getenv('DATABASE', "reva_mart")
+core_db = 'reva_test' if is_test else 'reva_core'
+mart_db = 'reva_mart_test' if is_test else os.getenv('DATABASE', "reva_mart")
 core_user = 'revauser'
 mart_user = 'revamartuser'
 core_password = os.getenv('DATABASE_PASSWORD', "{your-default-database-password}")
 mart_password = os.getenv('DATABASE_MARTPASSWORD', "{your-default-mart-database-password}")
-host = 'localhost' if (len(sys.argv) > 7 and sys.argv[7] == 'test') else db_host + "." + cloud_env + ".env.reva.tech"
-
-# make sure appopriate input / output parameters are passed in
-if (len(sys.argv) != 7 and not (sys.argv[5].upper() == "APPEND" or sys.argv[5].upper() == "REPLACE" or sys.argv[5].upper() == "DELETE")):
-  print("Usage: python md_genfromsql.py <input_sql_md_file.sql> <md_schema_name> <job_group> <job_name> <APPEND | REPLACE | DELETE> <job_sequence>")
-  exit()
-
-cmd_line = {"SQL_FILE": sys.argv[1], "MD_SCHEMA": sys.argv[
-    2], "JOBGROUP": sys.argv[3], "JOBNAME": sys.argv[4], "OPERATOR": sys.argv[5], "JOBSEQUENCE": sys.argv[6]}
-
-# connect to MD database
-try:
-  conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (core_db, core_user, host, core_password)
-  conn = psycopg2.connect(conn_string)
-
-except:
-  print("Error Connecting to : psycopg2.connect(\"dbname='reva_core' user='xxx' host='coredb.dev.env.reva.tech' password='xxx'\")")
-  exit()
-
-# check to see if jobGroupName already exists - if it does, reuse id,
-# otherwise add it
-md_query = "SELECT \"id\" FROM \"%s\".\"%s\".\"md_jobGroup\" WHERE \"jobGroupName\"='%s'" % (
-    core_db, cmd_line["MD_SCHEMA"], cmd_line["JOBGROUP"])
-jobGroupId = "0"
-try:
-  cur = conn.cursor()
-  cur.execute(md_query)
-  # print "Running [%s]" % (md_query)
+host = 'localhost' if is_test else db_host + "." + cloud_env + ".env.reva.tech"
 
-  jobRow = cur.fetchone()
-  if not jobRow == None:
-    jobGroupId = jobRow[0]
-
-except psycopg2.Error as e:
-  print("Error Connecting to Metadata: [%s] [%s-%s] " %
-        (md_query, e.pgcode, e.pgerror))
-  exit()
-
-if jobGroupId == "0":
-  md_query = "insert into \"%s\".\"%s\".\"md_jobGroup\" ( \"jobGroupName\") VALUES ('%s')" % (
-      core_db, cmd_line["MD_SCHEMA"], cmd_line["JOBGROUP"])
-  print("JobGroup not found - Running [%s]" % (md_query))
-  try:
-    cur.execute(md_query)
-    conn.commit()
-  except psycopg2.Error as e:
-    print("Error Connecting to Metadata: [%s] [%s-%s] " %
-          (md_query, e.pgcode, e.pgerror))
-    exit()
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SQL_SOURCE_DIR = os.path.join(SCRIPT_DIR, "..", "ETL_SQL_Source")
 
-  md_query = "SELECT \"id\" FROM \"%s\".\"%s\".\"md_jobGroup\" WHERE \"jobGroupName\"='%s'" % (
-      core_db, cmd_line["MD_SCHEMA"], cmd_line["JOBGROUP"])
-  try:
-    cur.execute(md_query)
 
-    print("Running [%s]" % (md_query))
-    if cur != "None":
-      jobRow = cur.fetchone()
-      if not jobRow == None:
-        jobGroupId = jobRow[0]
-    else:
-      print("jobName not found: [%s]" % (cmd_line["JOBNAME"]))
+def parse_instructions(sql_file):
+  """yields the instructions of a SQL file one at a time, as {"instruction", "first_line", "last_line"}"""
+  with open(sql_file, "r") as oMdFile:
+    for statement in md_sqlsplit.iter_statements(oMdFile):
+      # variables are written ${var}$ in the SQL source, the runner expects the PSQL %{var}% form
+      statement["instruction"] = statement["instruction"].replace("${", "%{").replace("}$", "}%")
+      yield statement
 
-  except psycopg2.Error as e:
-    print("Error Connecting to Metadata: [%s] [%s-%s] " %
-          (md_query, e.pgcode, e.pgerror))
-    exit()
 
-# check to see if jobName already exists - if it does, reuse id
-jobId = "0"
-md_query = "SELECT \"id\" FROM \"%s\".\"%s\".\"md_job\" WHERE \"jobName\"='%s' AND \"jobGroupId\"=%s" % (
-    core_db, cmd_line["MD_SCHEMA"], cmd_line["JOBNAME"], jobGroupId)
+def instruction_hash(instruction):
+  # same as md5("instruction") in postgres, so rows registered before hashes existed can be compared in place
+  return hashlib.md5(instruction.encode("utf-8")).hexdigest()
 
-try:
-  cur = conn.cursor()
-  cur.execute(md_query)
-  # print "Running [%s]" % (md_query)
 
+def file_hash(instructions):
+  # line ranges are part of the file hash, so moving instructions around in the file still refreshes their stored lines
+  return hashlib.md5("\n".join("%s:%i-%i" % (instruction_hash(i["instruction"]), i["first_line"], i["last_line"])
+                                for i in instructions).encode("utf-8")).hexdigest()
+
+
+def read_manifest(manifest_file):
+  """analyticsJobs of a config.js module -- evaluated by node, since that's what the file is written for"""
+  output = subprocess.check_output(["node", "-p", "JSON.stringify(require(process.argv[1]).analyticsJobs)", os.path.abspath(manifest_file)])
+  return json.loads(output)
+
+
+def ensure_hash_columns(cur, md_schema):
+  cur.execute("ALTER TABLE \"%s\".\"%s\".\"md_instruction\" ADD COLUMN IF NOT EXISTS \"instructionHash\" varchar(32), "
+              "ADD COLUMN IF NOT EXISTS \"sourceFirstLine\" integer, ADD COLUMN IF NOT EXISTS \"sourceLastLine\" integer, "
+              "ADD COLUMN IF NOT EXISTS \"settings\" jsonb;"
+              "ALTER TABLE \"%s\".\"%s\".\"md_job\" ADD COLUMN IF NOT EXISTS \"fileHash\" varchar(32), ADD COLUMN IF NOT EXISTS \"settings\" jsonb, "
+              "ADD COLUMN IF NOT EXISTS \"guard\" text;" % (core_db, md_schema, core_db, md_schema))
+
+
+def find_job(cur, md_schema, jobgroup_ids, jobgroup, jobname, job_sequence):
+  """returns (job id, stored file hash, stored (settings, guard)) -- adding the job group and job when they don't exist yet"""
+  # one query for job group, job and file hash -- for an unchanged file this is the only query of the deploy
+  cur.execute("SELECT jg.\"id\", j.\"id\", j.\"sequenceNumber\", j.\"fileHash\", j.\"settings\", j.\"guard\" FROM \"%s\".\"%s\".\"md_jobGroup\" jg "
+              "LEFT JOIN \"%s\".\"%s\".\"md_job\" j ON j.\"jobGroupId\"=jg.\"id\" AND j.\"jobName\"=%%s WHERE jg.\"jobGroupName\"=%%s"
+              % (core_db, md_schema, core_db, md_schema), (jobname, jobgroup))
   jobRow = cur.fetchone()
-  if not jobRow == None:
-    jobId = jobRow[0]
-
-except psycopg2.Error as e:
-  print("Error Connecting to Metadata: [%s] [%s-%s] " %
-        (md_query, e.pgcode, e.pgerror))
-  exit()
-
-if jobId == "0":
-  md_iquery = "insert into \"%s\".\"%s\".\"md_job\" (\"jobGroupId\", \"jobName\", \"sequenceNumber\") VALUES ( %s, '%s', %s)" % (
-      core_db, cmd_line["MD_SCHEMA"], jobGroupId, cmd_line["JOBNAME"], cmd_line["JOBSEQUENCE"])
-  print("Running [%s]" % (md_iquery))
+
+  # check to see if jobGroupName already exists - if it does, reuse id, otherwise add it
+  if jobRow == None:
+    if jobgroup not in jobgroup_ids:
+      print("JobGroup not found - adding [%s]" % (jobgroup))
+      cur.execute("insert into \"%s\".\"%s\".\"md_jobGroup\" ( \"jobGroupName\") VALUES (%%s) RETURNING \"id\"" % (core_db, md_schema), (jobgroup,))
+      jobgroup_ids[jobgroup] = cur.fetchone()[0]
+    jobRow = (jobgroup_ids[jobgroup], None, None, None, None, None)
+
+  # check to see if jobName already exists - if it does, reuse id (and keep its sequence number in line with the deploy), otherwise add it
+  if jobRow[1] == None:
+    print("Job not found - adding [%s]" % (jobname))
+    cur.execute("insert into \"%s\".\"%s\".\"md_job\" (\"jobGroupId\", \"jobName\", \"sequenceNumber\") VALUES (%%s, %%s, %%s) RETURNING \"id\"" % (core_db, md_schema),
+                (jobRow[0], jobname, job_sequence))
+    return cur.fetchone()[0], None, (None, None)
+
+  if job_sequence != None and str(jobRow[2]) != str(job_sequence):
+    cur.execute("UPDATE \"%s\".\"%s\".\"md_job\" SET \"sequenceNumber\"=%%s WHERE \"id\"=%%s" % (core_db, md_schema), (job_sequence, jobRow[1]))
+
+  return jobRow[1], jobRow[3], (jobRow[4], jobRow[5])
+
+
+def set_file_hash(cur, md_schema, job_id, job_file_hash):
+  cur.execute("UPDATE \"%s\".\"%s\".\"md_job\" SET \"fileHash\"=%%s WHERE \"id\"=%%s" % (core_db, md_schema), (job_file_hash, job_id))
+
+
+def set_job_profile(cur, md_schema, job_id, job_settings, job_guard):
+  cur.execute("UPDATE \"%s\".\"%s\".\"md_job\" SET \"settings\"=%%s, \"guard\"=%%s WHERE \"id\"=%%s" % (core_db, md_schema),
+              (json.dumps(job_settings, sort_keys=True) if job_settings else None, job_guard, job_id))
+
+
+def read_instruction_hashes(cur, md_schema, job_id):
+  cur.execute("SELECT \"id\", \"sequenceNumber\", COALESCE(\"instructionHash\", md5(\"instruction\")), \"sourceFirstLine\", \"sourceLastLine\" FROM \"%s\".\"%s\".\"md_instruction\" "
+              "WHERE \"jobId\"=%%s ORDER BY \"sequenceNumber\"" % (core_db, md_schema), (job_id,))
+  return cur.fetchall()
+
+
+def delete_instructions(cur, md_schema, job_id, instruction_ids=None):
+  if instruction_ids == None:
+    cur.execute("delete from \"%s\".\"%s\".\"md_instruction\" where \"jobId\"=%%s" % (core_db, md_schema), (job_id,))
+  elif instruction_ids:
+    cur.execute("delete from \"%s\".\"%s\".\"md_instruction\" where \"id\" = ANY(%%s)" % (core_db, md_schema), (list(instruction_ids),))
+
+
+def insert_instructions(cur, md_schema, job_id, instructions, first_sequence=1):
+  """instructions is a list of (sequence, instruction) -- or of instructions, numbered from first_sequence"""
+  rows = []
+  for sequence, instruction in enumerate(instructions, first_sequence):
+    if isinstance(instruction, tuple):
+      sequence, instruction = instruction
+    rows.append((job_id, sequence, instruction["instruction"], instruction_hash(instruction["instruction"]),
+                 reddm_runjobgroup.instruction_type(instruction["instruction"]), True,
+                 instruction["first_line"], instruction["last_line"]))
+  if not rows:
+    return
+
+  psycopg2.extras.execute_values(
+      cur, "insert into \"%s\".\"%s\".\"md_instruction\" (\"jobId\", \"sequenceNumber\", \"instruction\", \"instructionHash\", \"instructionType\", \"isEnabled\", "
+      "\"sourceFirstLine\", \"sourceLastLine\") VALUES %%s" % (core_db, md_schema),
+      rows, page_size=INSERT_PAGE_SIZE)
+
+
+def update_instructions(cur, md_schema, updates):
+  """updates is a list of (id, sequence, instruction, changed) -- unchanged rows are only renumbered / moved, their text stays in place"""
+  if not updates:
+    return
+
+  rows = []
+  for row_id, sequence, instruction, changed in updates:
+    text = instruction["instruction"] if changed else None
+    rows.append((row_id, sequence, text, instruction_hash(text) if changed else None, reddm_runjobgroup.instruction_type(text) if changed else None,
+                 instruction["first_line"], instruction["last_line"]))
+  # out of the way first: within one UPDATE a row could move onto the number of a row that hasn't moved off it yet
+  psycopg2.extras.execute_values(
+      cur, "UPDATE \"%s\".\"%s\".\"md_instruction\" i SET \"sequenceNumber\" = -v.\"sequenceNumber\" "
+      "FROM (VALUES %%s) AS v (\"id\", \"sequenceNumber\") WHERE i.\"id\" = v.\"id\"" % (core_db, md_schema),
+      [(row[0], row[1]) for row in rows], page_size=INSERT_PAGE_SIZE)
+  psycopg2.extras.execute_values(
+      cur, "UPDATE \"%s\".\"%s\".\"md_instruction\" i SET \"sequenceNumber\" = v.\"sequenceNumber\", "
+      "\"instruction\" = COALESCE(v.\"instruction\"::text, i.\"instruction\"), \"instructionHash\" = COALESCE(v.\"instructionHash\"::varchar, i.\"instructionHash\", md5(i.\"instruction\")), "
+      "\"instructionType\" = COALESCE(v.\"instructionType\"::varchar, i.\"instructionType\"), "
+      "\"sourceFirstLine\" = v.\"sourceFirstLine\", \"sourceLastLine\" = v.\"sourceLastLine\" "
+      "FROM (VALUES %%s) AS v (\"id\", \"sequenceNumber\", \"instruction\", \"instructionHash\", \"instructionType\", \"sourceFirstLine\", \"sourceLastLine\") WHERE i.\"id\" = v.\"id\"" % (core_db, md_schema),
+      rows, page_size=INSERT_PAGE_SIZE)
+
+
+def diff_instructions(cur, md_schema, job_id, instructions):
+  """bring the job's stored instructions in line with the new ones, touching only the rows that changed; returns (inserted, updated, deleted)"""
+  old_rows = read_instruction_hashes(cur, md_schema, job_id)
+  old_hashes = [row[2] for row in old_rows]
+  new_hashes = [instruction_hash(instruction["instruction"]) for instruction in instructions]
+
+  inserts = []
+  updates = []
+  deletes = []
+  for tag, old_start, old_end, new_start, new_end in difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False).get_opcodes():
+    if tag == "equal":
+      for offset in range(old_end - old_start):
+        row = old_rows[old_start + offset]
+        instruction = instructions[new_start + offset]
+        if row[1] != new_start + offset + 1 or row[3] != instruction["first_line"] or row[4] != instruction["last_line"]:
+          updates.append((row[0], new_start + offset + 1, instruction, False))
+      continue
+
+    # changed instructions reuse the old rows first, the rest is inserted or deleted
+    paired = min(old_end - old_start, new_end - new_start)
+    for offset in range(paired):
+      updates.append((old_rows[old_start + offset][0], new_start + offset + 1, instructions[new_start + offset], True))
+    for pos in range(new_start + paired, new_end):
+      inserts.append((pos + 1, instructions[pos]))
+    for pos in range(old_start + paired, old_end):
+      deletes.append(old_rows[pos][0])
+
+  delete_instructions(cur, md_schema, job_id, deletes)
+  update_instructions(cur, md_schema, updates)
+  insert_instructions(cur, md_schema, job_id, inserts)
+
+  return len(inserts), len([u for u in updates if u[3]]), len(deletes)
+
+
+def deploy_job(cur, md_schema, jobgroup_ids, sql_file, jobgroup, jobname, operator, job_sequence, job_profile=None):
+  """job_profile is the job's (settings, guard) from the manifest (empty ones clear them) -- None leaves the stored ones as they are"""
+  instructions = []
+  if (operator != "DELETE"):
+    print("Processing %s" % (sql_file))
+    instructions = list(parse_instructions(sql_file))
+  job_file_hash = file_hash(instructions)
+
+  if jobgroup.upper() in SQL_ONLY_JOBGROUPS:
+    for instruction in instructions:
+      instruction_type = reddm_runjobgroup.instruction_type(instruction["instruction"])
+      if instruction_type != "SQL":
+        raise ValueError("%s lines %i-%i: %s instructions can't be part of %s, the run_analytics_* procedures run it as SQL"
+                         % (sql_file, instruction["first_line"], instruction["last_line"], instruction_type, jobgroup))
+
+  job_id, stored_file_hash, stored_profile = find_job(cur, md_schema, jobgroup_ids, jobgroup, jobname, job_sequence)
+  if job_profile != None and operator != "DELETE" and (job_profile[0] or None, job_profile[1] or None) != stored_profile:
+    set_job_profile(cur, md_schema, job_id, job_profile[0], job_profile[1] or None)
+    print("Session settings of Job %s: %s" % (jobname, ", ".join("%s=%s" % setting for setting in reddm_runjobgroup.session_settings(job_profile[0])[0]) or "(none)"))
+    print("Guard of Job %s: %s" % (jobname, job_profile[1] or "(none)"))
+
+  if (operator == "DELETE"):
+    delete_instructions(cur, md_schema, job_id)
+    set_file_hash(cur, md_schema, job_id, None)
+    return 0
+
+  if (operator == "REPLACE" and stored_file_hash == job_file_hash):
+    print("SQL File %s unchanged:" % (sql_file))
+    print("\tKept %i instructions for Job Group %s Job  %s" % (len(instructions), jobgroup, jobname))
+    return 0
+
+  if (operator == "APPEND"):
+    # numbered after the existing instructions; the job no longer matches a single file
+    old_rows = read_instruction_hashes(cur, md_schema, job_id)
+    insert_instructions(cur, md_schema, job_id, instructions, (old_rows[-1][1] if old_rows else 0) + 1)
+    set_file_hash(cur, md_schema, job_id, None)
+    inserted, updated, deleted = len(instructions), 0, 0
+  else:
+    inserted, updated, deleted = diff_instructions(cur, md_schema, job_id, instructions)
+    set_file_hash(cur, md_schema, job_id, job_file_hash)
+
+  print("SQL File %s Processed:" % (sql_file))
+  if (len(instructions) > 0):
+    print("\tAdded %i, updated %i, removed %i instructions for Job Group %s Job  %s (%i total)" % (inserted, updated, deleted, jobgroup, jobname, len(instructions)))
+  else:
+    print("\tNo Metadata Instructions found in %s" % (sql_file))
+
+  return inserted + updated + deleted
+
+
+def connect():
+  # connect to MD database
   try:
-    cur.execute(md_iquery)
-    conn.commit()
-  except psycopg2.Error as e:
-    print("Error Connecting to Metadata: [%s] [%s-%s] " %
-          (md_iquery, e.pgcode, e.pgerror))
+    conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (core_db, core_user, host, core_password)
+    return psycopg2.connect(conn_string)
+
+  except psycopg2.Error:
+    print("Error Connecting to : psycopg2.connect(\"dbname='reva_core' user='xxx' host='coredb.dev.env.reva.tech' password='xxx'\")")
     exit()
 
-  try:
-    cur.execute(md_query)
 
-    "Running [%s]" % (md_query)
-    if cur != "None":
-      jobRow = cur.fetchone()
-      if not jobRow == None:
-        jobId = jobRow[0]
-    else:
-      print("jobName not found: [%s]" % (cmd_line["JOBNAME"]))
+def main(argv):
+  manifest_mode = len(argv) > 1 and argv[1] == "--manifest"
 
-  except psycopg2.Error as e:
-    print("Error Connecting to Metadata: [%s] [%s-%s] " %
-          (md_query, e.pgcode, e.pgerror))
+  # make sure appopriate input / output parameters are passed in
+  if manifest_mode:
+    if len(argv) < 4:
+      print("Usage: python md_genfromsql.py --manifest <config.js> <md_schema_name> [test]")
+      exit()
+  elif (len(argv) < 7 or not (argv[5].upper() == "APPEND" or argv[5].upper() == "REPLACE" or argv[5].upper() == "DELETE")):
+    print("Usage: python md_genfromsql.py <input_sql_md_file.sql> <md_schema_name> <job_group> <job_name> <APPEND | REPLACE | DELETE> <job_sequence>")
     exit()
 
-if (cmd_line["OPERATOR"].upper() == "REPLACE" or cmd_line["OPERATOR"].upper() == "DELETE"):
-  md_query = "delete from \"%s\".\"%s\".\"md_instruction\" where \"jobId\"=%s" % (
-      core_db, cmd_line["MD_SCHEMA"], jobId)
-  # print "Running [%s]" % (md_query)
+  if manifest_mode:
+    md_schema = argv[3]
+    try:
+      jobs = read_manifest(argv[2])
+
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+      print("Error Reading Manifest: [%s] %s" % (argv[2], e))
+      exit()
+
+    # a misspelled setting is caught here, rather than ignored by every run of the job
+    for job in jobs:
+      unknown = reddm_runjobgroup.session_settings(job.get("settings"))[1]
+      if unknown:
+        print("Error Reading Manifest: [%s] job %s can't set %s (only %s)" % (argv[2], job["jobName"], ", ".join(unknown), ", ".join(reddm_runjobgroup.SESSION_SETTINGS)))
+        exit()
+  else:
+    md_schema = argv[2]
+    jobs = [{"fileName": argv[1], "jobGroup": argv[3], "jobName": argv[4], "operator": argv[5].upper(), "sequenceNumber": argv[6]}]
+
+  conn = connect()
+  cur = conn.cursor()
+  jobgroup_ids = {}
+  instruction_count = 0
+
+  # every job is deployed in one transaction -- a failure leaves the metadata exactly as it was
   try:
-    cur.execute(md_query)
+    ensure_hash_columns(cur, md_schema)
+    for job in jobs:
+      sql_file = job["fileName"] if not manifest_mode else os.path.join(SQL_SOURCE_DIR, job["fileName"])
+      instruction_count += deploy_job(cur, md_schema, jobgroup_ids, sql_file, job["jobGroup"], job["jobName"],
+                                      job.get("operator", "REPLACE"), job["sequenceNumber"],
+                                      (job.get("settings", {}), job.get("guard")) if manifest_mode else None)
     conn.commit()
-    # print "Old MD for %s:%s removed" % (cmd_line["JOBGROUP"],
-    # cmd_line["JOBNAME"])
 
   except psycopg2.Error as e:
-    print("Error Connecting to Metadata: [%s] [%s-%s] " %
-          (md_query, e.pgcode, e.pgerror))
+    conn.rollback()
+    print("Error Connecting to Metadata: [%s] [%s-%s] " % (cur.query, e.pgcode, e.pgerror))
     exit()
 
-if (cmd_line["OPERATOR"].upper() != "DELETE"):
-  oMdFile = open(sys.argv[1], "r")
+  except OSError as e:
+    conn.rollback()
+    print("Error Reading SQL File: %s" % (e))
+    exit()
 
-  print("Processing %s" % (cmd_line["SQL_FILE"]))
-  instruction = ""
-  instruction_count = 0
-  for inline in oMdFile:
-    line = inline.rstrip()
-    if line != "" and line.lstrip()[:2] != "/*":
-      instruction += line
-      if line[-1:] == ";":
-        instruction_count += 1
-        md_query = "insert into \"database\".\"{0}\".\"md_instruction\" (\"jobId\", \"sequenceNumber\", \"instruction\", \"instructionType\", \"isEnabled\") VALUES ( %s, %s, %s, %s, %s)".format(
-            (cmd_line["MD_SCHEMA"]))
-
-        try:
-          md_query = md_query.replace("database", core_db)
-          instruction = instruction.replace("${", "%{")
-          instruction = instruction.replace("}$", "}%")
-
-          cur.execute(md_query, (jobId, instruction_count,
-                                 instruction, "SQL", "TRUE"))
-        except psycopg2.Error as e:
-          print(
-              "Error Connecting to Metadata: [%s] [%s-%s] " % (md_query, e.pgcode, e.pgerror))
-          exit()
-
-        instruction = ""
-      else:
-        instruction += "\n"
-
-  # if last instruction in file was not semi-colon terminated, then commit
-  # it as well
-  if (instruction != ""):
-    # print "tacking on one last instruction [%s]" % (instruction)
-    # raw_input("Waiting for acknowledgement....")
-
-    instruction_count += 1
-    try:
-      instruction = instruction.replace("${", "%{")
-      instruction = instruction.replace("}$", "}%")
-
-      cur.execute(md_query, (jobId, instruction_count,
-                             instruction, "SQL", "TRUE"))
-    except psycopg2.Error as e:
-      print(
-          "Error Connecting to Metadata: [%s] [%s-%s] " % (md_query, e.pgcode, e.pgerror))
-      exit()
+  except ValueError as e:
+    conn.rollback()
+    print("Invalid Instruction: %s" % (e))
+    exit()
 
-  conn.commit()
+  if manifest_mode:
+    print("Manifest %s Processed:" % (argv[2]))
+    print("\tChanged %i instructions for %i jobs" % (instruction_count, len(jobs)))
 
-  cmd_line = {"SQL_FILE": sys.argv[1], "MD_SCHEMA": sys.argv[
-      2], "JOBGROUP": sys.argv[3], "JOBNAME": sys.argv[4], "OPERATOR": sys.argv[5]}
-  print("SQL File %s Processed:" % (cmd_line["SQL_FILE"]))
-  if (instruction_count > 0):
-    print()
-    print("\tAdded %i instructions for Job Group %s Job  %s" %
-          (instruction_count, cmd_line["JOBGROUP"], cmd_line["JOBNAME"]))
-  else:
-    print("\tNo Metadata Instructions found in %s" % (cmd_line["SQL_FILE"]))
+  conn.close()
+
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -0,0 +1,158 @@
+# md_sqlsplit.py
+#	streaming SQL statement splitter used by md_genfromsql.py -- reads a file line by line and yields one statement at a time,
+#	with the source line range it came from.
+#
+# A statement ends at a ";" outside of:
+#   - 'string literals' (including '' and, for E'...' strings, \' escapes)
+#   - "quoted identifiers"
+#   - $$dollar quoted$$ / $tag$dollar quoted$tag$ bodies, e.g. plpgsql functions
+#   - -- line comments and /* block comments */ (which may nest, as in postgres)
+#
+# NOTES:
+#   - block comments are dropped; line comments are kept, so the "-- d_Property - UPSERT" headers stay with their statement
+#   - outside of literals, lines are right trimmed and blank lines dropped, the same normalisation md_genfromsql.py always applied --
+#     inside a literal or dollar quoted body the text is kept exactly
+#   - ${var}$ tenant variable placeholders are not dollar quotes: a dollar quote tag is an identifier (or nothing) between two "$"
+#   - text without any SQL in it (only comments, or an empty ";") is not a statement; trailing SQL without a ";" still is
+
+import re
+
+DOLLAR_TAG = re.compile(r"\$([A-Za-z_\200-\377][A-Za-z_0-9\200-\377]*)?\$")
+IDENTIFIER_CHARS = re.compile(r"[A-Za-z_0-9$\200-\377]")
+
+
+def iter_statements(lines):
+  """yields {"instruction", "first_line", "last_line"} for each statement of an iterable of lines (e.g. an open file)"""
+  state = None          # None, "'", "E'", '"', "$" (dollar quote) or "/*"
+  dollar_tag = None
+  comment_depth = 0
+
+  statement = []        # finished lines of the current statement
+  first_line = None
+  has_code = False
+
+  for lineno, raw in enumerate(lines, 1):
+    line = raw.rstrip("\r\n")
+    starts_in_literal = state in ("'", "E'", '"', "$")
+    out = []
+    pos = 0
+
+    while pos < len(line):
+      c = line[pos]
+
+      if state == "/*":
+        if line.startswith("*/", pos):
+          comment_depth -= 1
+          pos += 2
+          if comment_depth == 0:
+            state = None
+        elif line.startswith("/*", pos):
+          comment_depth += 1
+          pos += 2
+        else:
+          pos += 1
+        continue
+
+      if state in ("'", "E'"):
+        out.append(c)
+        if c == "\\" and state == "E'" and pos + 1 < len(line):
+          out.append(line[pos + 1])
+          pos += 2
+          continue
+        if c == "'":
+          if line.startswith("''", pos):
+            out.append("'")
+            pos += 2
+            continue
+          state = None
+        pos += 1
+        continue
+
+      if state == '"':
+        out.append(c)
+        if c == '"':
+          state = None
+        pos += 1
+        continue
+
+      if state == "$":
+        closing = "$" + dollar_tag + "$"
+        if line.startswith(closing, pos):
+          out.append(closing)
+          pos += len(closing)
+          state = None
+        else:
+          out.append(c)
+          pos += 1
+        continue
+
+      # outside of any literal or comment
+      if line.startswith("--", pos):
+        out.append(line[pos:])
+        break
+
+      if line.startswith("/*", pos):
+        state = "/*"
+        comment_depth = 1
+        pos += 2
+        continue
+
+      if c == ";" and not has_code:
+        # empty statement (e.g. the second ";" of ";;") -- nothing to run, but keep any comment lines for the next statement
+        pos += 1
+        continue
+
+      if not c.isspace():
+        has_code = True
+
+      if c == "'":
+        escaped = pos > 0 and line[pos - 1] in "eE" and (pos < 2 or not IDENTIFIER_CHARS.match(line[pos - 2]))
+        state = "E'" if escaped else "'"
+      elif c == '"':
+        state = '"'
+      elif c == "$" and (pos == 0 or not IDENTIFIER_CHARS.match(line[pos - 1])):
+        tag = DOLLAR_TAG.match(line, pos)
+        if tag:
+          state = "$"
+          dollar_tag = tag.group(1) or ""
+          out.append(tag.group(0))
+          pos = tag.end()
+          continue
+      elif c == ";":
+        out.append(c)
+        statement.append("".join(out))
+        if first_line == None:
+          first_line = lineno
+        yield {"instruction": _join(statement), "first_line": first_line, "last_line": lineno}
+        statement = []
+        first_line = None
+        has_code = False
+        out = []
+        pos += 1
+        continue
+
+      out.append(c)
+      pos += 1
+
+    text = "".join(out)
+    if starts_in_literal or state in ("'", "E'", '"', "$"):
+      # a literal spans the line break -- keep the line exactly as it is
+      statement.append(text)
+    elif text.strip() != "":
+      statement.append(text.rstrip())
+    else:
+      continue
+    if first_line == None:
+      first_line = lineno
+
+  if has_code:
+    yield {"instruction": _join(statement), "first_line": first_line, "last_line": lineno}
+
+
+def _join(statement):
+  # a statement starting mid line (after the previous ";") starts with the whitespace that followed the ";"
+  while statement and statement[0].strip() == "":
+    statement.pop(0)
+  if statement:
+    statement[0] = statement[0].lstrip()
+  return "\n".join(statement)
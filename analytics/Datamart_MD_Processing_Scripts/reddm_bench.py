@@ -0,0 +1,553 @@
+# reddm_bench.py
+#	repeatable LOADMART benchmark on the local test databases: builds a synthetic tenant at a given scale factor -- a replica schema with
+#	the tables the L3 SQL reads, filled with generated rows -- runs RESTARTMART, a full LOADMART and an incremental LOADMART through
+#	reddm_runjobgroup.py, and appends the per job timings to a results file that can be compared across commits.
+#
+# STATUS: run end to end on reva_test / reva_mart_test (PostgreSQL 18) with a template schema created from the app's schema files --
+#	server/database/schema/leasing-common.sql, tenant.sql and rentapp/server/database/schema/rentapp.sql, db_namespace replaced, with
+#	the migrations' column changes the L3 SQL relies on -- every star table loaded, without errors.   The recorded baseline is in
+#	reddm_bench_results.jsonl (label "baseline", scale 1).
+#
+# Usage:
+#   python reddm_bench.py run <MD_schema> <template_schema> [--scale N [N ...]] [--incremental-pct P] [--workers N] [--results FILE]
+#                         [--label LABEL] [--no-deploy] [--keep]
+#   python reddm_bench.py compare [--results FILE] [--baseline LABEL] [--label LABEL]
+#   where
+#		MD_schema - location schema of MD tables on the test core database (reva_test), see reddm_runjobgroup.py
+#		template_schema - a tenant schema on reva_test whose table definitions (never its rows) the replica tables are created from
+#		--scale - scale factors to run (default 1) -- at scale 1 the entity tables have BASE_ROWS rows (DEFAULT_ROWS if not listed)
+#			and scale linearly; the FIXED_TABLES (properties, teams, programs, ...) don't grow with the scale
+#		--incremental-pct - percentage of the rows touched, and of new rows added, before the incremental LOADMART (default 5)
+#		--workers - passed to reddm_runjobgroup.py (default 1)
+#		--results - JSON lines file the timings are appended to / compared from (default reddm_bench_results.jsonl)
+#		--label - what the timings are recorded under (default: the current git commit, "-dirty" with uncommitted changes)
+#		--no-deploy - don't register the RESTARTMART / LOADMART jobs of ../configs/config.js first (md_genfromsql.py --manifest)
+#		--keep - leave the synthetic tenant (replica and star schemas, tenant variables) behind, to look at it
+#		compare - per scale, phase and job: the latest timings of --label (default: the latest label) against --baseline (default: the
+#			label recorded before it), and the change in percent
+#
+# NOTES:
+#   - the replica tables are the "dstReplicaDB"."dstReplicaSchema" tables referenced by L3_load_dimensions.sql / L3_load_facts.sql, so
+#     the benchmark follows the SQL as it changes.   Only the table's key and indexes are carried over from the template, no
+#     constraints -- enums become text
+#   - rows are generated in SQL (generate_series) and are the same on every run: "id" keys are md5(<table>:<n>) uuids, and a "<x>Id"
+#     column holds the id of a row of the replica table named <x> (e.g. "partyMemberId" -> PartyMember, and an array "parties" a Party
+#     id), so joins match.   Text columns take the labels of their enum, or the values the template has when there are only a few of
+#     them (categorical columns); other values are derived from the row number.   The template has no rows to learn from on a test
+#     database, so COLUMN_CATEGORIES holds the values of the columns the L3 SQL filters on (Communication "type", Tasks "state", the JSON
+#     it reads, ...) -- add to it when the SQL filters a new column, or a fact table loads no rows
+#   - all timestamps are within the star's d_Date, a row's timestamps within hours of its creation: new and touched rows get the
+#     current time as "updated_at" only
+#   - timings come from the run log reddm_runjobgroup.py writes (md_runLog / md_instructionRun): per job, the sum of its instruction
+#     durations, the instruction count and the errors, plus the wall time of the whole job group run
+
+import os
+import re
+import sys
+import json
+import argparse
+import datetime
+import subprocess
+import psycopg2
+
+import md_sqlsplit
+import reddm_l1_jdbc
+import reddm_runjobgroup
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ETL_SQL_DIR = os.path.join(SCRIPT_DIR, "..", "ETL_SQL_Source")
+CONFIG_FILE = os.path.join(SCRIPT_DIR, "..", "configs", "config.js")
+LOAD_SQL_FILES = ("L3_load_dimensions.sql", "L3_load_facts.sql")
+
+# the functions of the star schema the L3 SQL calls (its triggers and the s_LastLoadDate bookkeeping), from the app's schema files --
+# a star schema gets them when it's provisioned, outside the job groups
+SERVER_SQL_DIR = os.path.join(SCRIPT_DIR, "..", "..", "server")
+STAR_FUNCTION_FILES = (os.path.join(SERVER_SQL_DIR, "database", "schema", "leasing-common.sql"),
+                       os.path.join(SERVER_SQL_DIR, "dal", "sqlFiles", "star", "update_last_load_date.sql"))
+STAR_FUNCTIONS = ("update_updated_at_column", "update_last_load_date")
+STAR_FUNCTION = re.compile(r'^\s*CREATE\s+(?:OR\s+REPLACE\s+)?FUNCTION\s+db_namespace\.(\w+)\s*\(', re.IGNORECASE)
+
+DEFAULT_RESULTS_FILE = "reddm_bench_results.jsonl"
+
+# the tables the L3 SQL reads from the replica
+REPLICA_TABLE = re.compile(r'"dstReplicaDB"\."dstReplicaSchema"\."([^"]+)"')
+
+# rows per table at scale 1
+DEFAULT_ROWS = 1000
+BASE_ROWS = {"Property": 10, "Teams": 20, "Programs": 40, "Sources": 20, "Users": 100, "TeamMembers": 150, "TeamProperties": 40,
+             "TeamPropertyProgram": 80, "Building": 30, "Layout": 60, "InventoryGroup": 100, "Amenity": 200, "Fee": 100, "LeaseTerm": 50,
+             "Inventory": 3000, "Party": 10000, "PartyMember": 20000, "Person": 20000, "ContactInfo": 40000, "Communication": 100000,
+             "Tasks": 40000, "Quote": 15000, "Lease": 3000, "rentapp_PartyApplication": 5000, "rentapp_PersonApplication": 8000,
+             "rentapp_ApplicationInvoices": 8000, "rentapp_ApplicationTransactions": 8000, "rentapp_SubmissionRequest": 8000,
+             "rentapp_SubmissionResponse": 8000, "CallDetails": 50000, "CallQueueStatistics": 20000, "RmsPricing": 30000}
+FIXED_TABLES = ("Property", "Teams", "Programs", "Sources", "Users", "TeamMembers", "TeamProperties", "TeamPropertyProgram", "Building", "Layout",
+                "InventoryGroup", "Amenity", "Fee", "LeaseTerm")
+
+# columns the app schema leaves nullable, but the app always fills and the L3 SQL loads into NOT NULL star columns -- never generated NULL
+# (columns with a default in the template aren't generated NULL either -- the app leaves them to the default)
+NOT_NULL_COLUMNS = {"Property": ("timezone", "startDate"), "Teams": ("description",), "Programs": ("outsideDedicatedEmails",),
+                    "Communication": ("type",), "Inventory": ("externalId",),
+                    "RmsPricing": ("status", "availDate", "amenities", "amenityValue", "standardLeaseLength", "standardRent")}
+
+# values of the columns the L3 SQL filters, joins or interprets, when the template has none to offer: the app's values, so that the
+# facts find their rows (e.g. Tasks "name" = 'APPOINTMENT', AT TIME ZONE "timezone", the lease terms of a published quote)
+COLUMN_CATEGORIES = {"Property": {"timezone": ["America/Chicago", "America/Los_Angeles", "America/New_York"]},
+                     "Communication": {"type": ["Call", "Email", "Sms", "Web"], "direction": ["in", "out"],
+                                       "message": ['{"duration": "02:10", "isMissed": false, "isVoiceMail": false}',
+                                                   '{"duration": "00:40", "isMissed": true, "isVoiceMail": true}', '{}']},
+                     "Tasks": {"name": ["APPOINTMENT", "CALL_BACK", "FOLLOWUP_PARTY", "INTRODUCE_YOURSELF"], "state": ["Active", "Canceled", "Completed"],
+                               "metadata": ['{"appointmentResult": "COMPLETE", "endDate": "2023-06-01T15:00:00Z"}',
+                                            '{"appointmentResult": "NO_SHOW", "endDate": "2023-06-02T10:30:00Z"}', '{}']},
+                     "Lease": {"status": ["draft", "executed", "submitted", "voided"]},
+                     "LeaseTerm": {"termLength": ["6", "9", "12", "15", "18"]},
+                     "Quote": {"publishedQuoteData": ['{"leaseTerms": [{"termLength": 6}, {"termLength": 9}, {"termLength": 12}, {"termLength": 15}, '
+                                                      '{"termLength": 18}]}']},
+                     "PartyMember": {"memberType": ["Resident", "Resident", "Occupant", "Guarantor"]},
+                     "Amenity": {"category": ["building", "inventory", "property"]},
+                     "CallQueueStatistics": {"callerRequestedAction": ["call_back", "voicemail"]},
+                     "RmsPricing": {"rentMatrix": ['{"12": {"2023-06-01": {"endDate": "2023-06-30", "rent": "1500.00"}}}',
+                                                   '{"6": {"2023-07-01": {"endDate": "2023-07-31", "rent": "1650.00"}}}']},
+                     "rentapp_ApplicationTransactions": {"transactionType": ["payment", "refund", "hold"],
+                                                         "transactionData": ['{"amount": 5000, "firstName": "Jo", "lastName": "Doe"}']},
+                     "rentapp_SubmissionResponse": {"status": ["Complete", "Incomplete"]}}
+
+# "<x>Id" columns whose <x> isn't the name of the table they refer to
+REFERENCE_ALIASES = {"comm": "Communication", "invoice": "rentapp_ApplicationInvoices"}
+
+# a text column with at most this many distinct values in the template is treated as categorical
+MAX_CATEGORIES = 20
+
+# rows are created over the two years before TIME_SPAN_END -- short of the end of the star's d_Date (L3_DDL.sql), so that all their
+# timestamps have a date key.   Only the "updated_at" of the rows touched before the incremental LOADMART is the time of the change, for it
+# to find them
+TIME_SPAN_END = "2023-12-31 00:00:00+00"
+TIME_SPAN_MINUTES = 2 * 365 * 24 * 60
+
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(usage="python reddm_bench.py run <MD_schema> <template_schema> [--scale N [N ...]] [--incremental-pct P] [--workers N] "
+                                         "[--results FILE] [--label LABEL] [--no-deploy] [--keep] | compare [--results FILE] [--baseline LABEL] [--label LABEL]")
+  actions = parser.add_subparsers(dest="action", required=True)
+
+  run = actions.add_parser("run")
+  run.add_argument("md_schema")
+  run.add_argument("template_schema")
+  run.add_argument("--scale", type=int, nargs="+", default=[1])
+  run.add_argument("--incremental-pct", type=int, default=5)
+  run.add_argument("--workers", type=int, default=1)
+  run.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+  run.add_argument("--label", default=None)
+  run.add_argument("--no-deploy", action="store_true")
+  run.add_argument("--keep", action="store_true")
+
+  compare = actions.add_parser("compare")
+  compare.add_argument("--results", default=DEFAULT_RESULTS_FILE)
+  compare.add_argument("--baseline", default=None)
+  compare.add_argument("--label", default=None)
+  args = parser.parse_args(argv)
+
+  if args.action == "compare":
+    return {"ACTION": "compare", "RESULTS": args.results, "BASELINE": args.baseline, "LABEL": args.label}
+
+  return {"ACTION": "run", "MD_SCHEMA": args.md_schema, "TEMPLATE_SCHEMA": args.template_schema, "SCALES": [max(1, scale) for scale in args.scale],
+          "INCREMENTAL_PCT": min(100, max(1, args.incremental_pct)), "WORKERS": max(1, args.workers), "RESULTS": args.results,
+          "LABEL": args.label or git_label(), "DEPLOY": not args.no_deploy, "KEEP": args.keep}
+
+
+def git_label():
+  try:
+    commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=SCRIPT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    return commit + ("-dirty" if dirty else "")
+  except (OSError, subprocess.CalledProcessError):
+    return "unlabelled"
+
+
+def replica_tables():
+  """the replica tables the L3 load SQL reads, in order of first reference"""
+  tables = []
+  for file_name in LOAD_SQL_FILES:
+    with open(os.path.join(ETL_SQL_DIR, file_name)) as sql_file:
+      for table_name in REPLICA_TABLE.findall(sql_file.read()):
+        if table_name not in tables:
+          tables.append(table_name)
+  return tables
+
+
+def table_rows(table_name, scale):
+  rows = BASE_ROWS.get(table_name, DEFAULT_ROWS)
+  return rows if table_name in FIXED_TABLES else rows * scale
+
+
+def replica_type(column):
+  # enums and other types of the template schema don't exist in the replica schema
+  if column['data_type'] == "USER-DEFINED":
+    return "text"
+  if column['data_type'] == "ARRAY":
+    return column['udt_name'][1:] + "[]" if column['udt_name'][1:] in ("text", "varchar", "uuid", "int4", "int8", "numeric", "bool", "timestamptz", "date", "jsonb") else "text[]"
+  if column['udt_name'] == "varchar" and column['character_maximum_length'] == None:
+    return "varchar"
+  return reddm_l1_jdbc.column_type(column)
+
+
+def reference_table(col_name, table_names):
+  """the replica table a "<x>Id" column refers to -- the longest table name <x> ends with, in singular or plural, without a "rentapp_"
+  style prefix -- or the REFERENCE_ALIASES table of <x>"""
+  if not col_name.lower().endswith("id") or col_name.lower() == "id":
+    return None
+  stem = col_name[:-2].lower()
+  names = {table_name: re.sub(r'^[a-z]+_', '', table_name).lower() for table_name in table_names}
+  matches = [table_name for table_name, name in names.items() if stem.endswith(name) or (name.endswith("s") and stem.endswith(name[:-1]))]
+  if matches:
+    return max(matches, key=lambda table_name: len(names[table_name]))
+  aliases = [alias for alias in REFERENCE_ALIASES if stem.endswith(alias) and REFERENCE_ALIASES[alias] in table_names]
+  return REFERENCE_ALIASES[aliases[0]] if aliases else None
+
+
+def array_reference_table(col_name, table_names):
+  """the replica table the elements of an array column refer to -- "<x>Ids", or the plural of <x> (e.g. "parties" -> Party)"""
+  if col_name.endswith("ies"):
+    return reference_table(col_name[:-3] + "yId", table_names)
+  if col_name.endswith("s"):
+    return reference_table(col_name[:-1] + ("" if col_name.endswith("Ids") else "Id"), table_names)
+  return None
+
+
+def read_categories(cur, template_schema, dm_table):
+  """{column: [values]} of the enum and categorical text columns of a template table"""
+  table_name = dm_table[0]['table_name']
+  categories = {}
+  for column in dm_table:
+    if column['data_type'] == "USER-DEFINED":
+      cur.execute("SELECT array_agg(e.enumlabel::text ORDER BY e.enumsortorder) FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid "
+                  "JOIN pg_namespace ns ON ns.oid = t.typnamespace WHERE t.typname = %s AND ns.nspname IN (%s, 'public');", (column['udt_name'], template_schema))
+      labels = cur.fetchone()[0]
+      if labels:
+        categories[column['column_name']] = labels
+    elif column['udt_name'] in ("varchar", "text", "bpchar"):
+      cur.execute("SELECT array_agg(DISTINCT \"v\") FROM (SELECT \"%s\"::text AS \"v\" FROM \"%s\".\"%s\" WHERE \"%s\" IS NOT NULL LIMIT 10000) AS \"s\";"
+                  % (column['column_name'], template_schema, table_name, column['column_name']))
+      values = cur.fetchone()[0]
+      if values and len(values) <= MAX_CATEGORIES:
+        categories[column['column_name']] = sorted(values)
+  for col_name, values in COLUMN_CATEGORIES.get(table_name, {}).items():
+    categories.setdefault(col_name, values)
+  return categories
+
+
+def quote_literal(value):
+  return "'%s'" % (value.replace("'", "''"))
+
+
+def timestamp_expr(salt, fresh):
+  # a stable point in time per row, its creation (salt 0) -- new rows of an incremental run are from the last hour of the time span.   The
+  # other timestamps of the row are up to ten hours after it (e.g. the entry, exit and call back times of a queued call)
+  if fresh:
+    created = "(timestamptz '%s' - (1 + (\"n\" * 7919) %% 60) * interval '1 minute')" % (TIME_SPAN_END)
+  else:
+    created = "(timestamptz '%s' - interval '%i minutes' + ((\"n\" * 7919) %% %i) * interval '1 minute')" % (TIME_SPAN_END, TIME_SPAN_MINUTES,
+                                                                                                          TIME_SPAN_MINUTES - 60)
+  if salt == 0:
+    return created
+  return "(%s + ((\"n\" + %i) %% 600) * interval '1 minute')" % (created, salt)
+
+
+def column_expr(table, column, tables, fresh=False):
+  """SQL expression of the value of a column in generated row "n" """
+  table_name = table["name"]
+  col_name = column['column_name']
+  col_type = replica_type(column)
+  salt = sum(ord(c) for c in col_name)
+
+  if col_name == "updated_at" and fresh:
+    return "now()"
+  if col_name in ("created_at", "updated_at"):
+    return timestamp_expr(0, fresh) + ("" if col_name == "created_at" else " + interval '1 minute'")
+
+  if column['udt_name'] == "uuid":
+    if table["key"] == [col_name]:
+      return "md5('%s:' || \"n\")::uuid" % (table_name)
+    reference = reference_table(col_name, tables)
+    if reference == table_name:
+      # the previous row -- a row is referenced once at most (e.g. the call a call was transferred from), new rows included
+      return "md5('%s:' || (\"n\" - 1))::uuid" % (table_name)
+    if reference != None:
+      return "md5('%s:' || (1 + (\"n\" * 7919 + %i) %% %i))::uuid" % (reference, salt, tables[reference]["rows"])
+    expr = "md5('%s.%s:' || \"n\")::uuid" % (table_name, col_name)
+  elif col_name in table["categories"]:
+    values = table["categories"][col_name]
+    # hashed per column, the categories of a row are independent of each other (e.g. Tasks "state" and "metadata")
+    expr = "(ARRAY[%s])[1 + abs(hashtext('%s:' || \"n\")) %% %i]" % (", ".join(quote_literal(value) for value in values), col_name, len(values))
+  elif column['udt_name'] in ("varchar", "text", "bpchar"):
+    expr = "left('%s ' || \"n\", %i)" % (col_name.replace("'", "''"), column['character_maximum_length'] or 255)
+  elif column['udt_name'] in ("int2", "int4", "int8"):
+    expr = "((\"n\" * 7919 + %i) %% 1000)" % (salt) if table["key"] != [col_name] else "\"n\""
+  elif column['udt_name'] in ("numeric", "float4", "float8", "money"):
+    expr = "round(((\"n\" * 7919 + %i) %% 100000) / 100.0, 2)" % (salt)
+  elif column['udt_name'] == "bool":
+    expr = "((\"n\" + %i) %% 2 = 0)" % (salt)
+  elif column['udt_name'] in ("timestamptz", "timestamp"):
+    expr = timestamp_expr(salt, fresh)
+  elif column['udt_name'] == "date":
+    expr = "(%s)::date" % (timestamp_expr(salt, fresh))
+  elif column['udt_name'] in ("time", "timetz"):
+    expr = "(time '08:00' + ((\"n\" + %i) %% 600) * interval '1 minute')" % (salt)
+  elif column['udt_name'] == "interval":
+    expr = "(((\"n\" + %i) %% 120) * interval '1 minute')" % (salt)
+  elif column['udt_name'] in ("json", "jsonb"):
+    expr = "'{}'"
+  elif column['data_type'] == "ARRAY" and array_reference_table(col_name, tables) != None:
+    reference = array_reference_table(col_name, tables)
+    expr = "ARRAY[md5('%s:' || (1 + (\"n\" * 7919 + %i) %% %i))::uuid::text]" % (reference, salt, tables[reference]["rows"])
+  elif column['data_type'] == "ARRAY":
+    expr = "'{}'"
+  else:
+    return "NULL::%s" % (col_type)
+
+  # nullable columns are NULL in every fifth row -- keys, references, columns with a default and NOT_NULL_COLUMNS never
+  if column['is_nullable'] == "YES" and col_name not in table["key"] and reference_table(col_name, tables) == None and \
+     col_name not in table["defaults"] and col_name not in NOT_NULL_COLUMNS.get(table_name, ()):
+    return "CASE WHEN (\"n\" + %i) %% 5 = 0 THEN NULL ELSE %s END::%s" % (salt, expr, col_type)
+  return "(%s)::%s" % (expr, col_type)
+
+
+def read_defaults(cur, template_schema):
+  """{table_name: [columns with a default]} of the template schema"""
+  cur.execute("SELECT table_name, array_agg(column_name::text) FROM information_schema.columns WHERE table_schema = %s AND column_default IS NOT NULL "
+              "GROUP BY 1;", (template_schema,))
+  return dict(cur.fetchall())
+
+
+def read_template(core_cur, template_schema, scale):
+  """{table_name: {"name", "columns", "key", "indexes", "defaults", "categories", "rows"}} of the replica tables found in the template schema"""
+  dm_tables = {dm_table[0]['table_name']: dm_table for dm_table in reddm_l1_jdbc.read_data_dictionary(core_cur, template_schema)}
+  dm_indexes = reddm_l1_jdbc.read_indexes(core_cur, template_schema)
+  defaults = read_defaults(core_cur, template_schema)
+
+  tables = {}
+  missing = []
+  for table_name in replica_tables():
+    if table_name not in dm_tables:
+      missing.append(table_name)
+      continue
+    dm_table = dm_tables[table_name]
+    primary = [index['columns'] for index in dm_indexes.get(table_name, []) if index['primary']]
+    tables[table_name] = {"name": table_name, "columns": dm_table, "key": primary[0] if primary else [], "indexes": dm_indexes.get(table_name, []),
+                          "defaults": defaults.get(table_name, []), "categories": read_categories(core_cur, template_schema, dm_table),
+                          "rows": table_rows(table_name, scale)}
+  if missing:
+    print("Replica Tables Not Found in Template Schema: %s" % (", ".join(missing)))
+  return tables
+
+
+def create_replica(mart_cur, replica_schema, tables):
+  mart_cur.execute("DROP SCHEMA IF EXISTS \"%s\" CASCADE;" % (replica_schema))
+  mart_cur.execute("CREATE SCHEMA \"%s\";" % (replica_schema))
+  for table in tables.values():
+    definitions = ["\"%s\" %s" % (column['column_name'], replica_type(column)) for column in table["columns"]]
+    if table["key"]:
+      definitions.append("PRIMARY KEY (%s)" % (", ".join("\"%s\"" % (col_name) for col_name in table["key"])))
+    mart_cur.execute("CREATE TABLE \"%s\".\"%s\" (%s);" % (replica_schema, table["name"], ", ".join(definitions)))
+
+    # unique indexes before the rows (generated duplicates are skipped), the others after
+    for index in table["indexes"]:
+      if index['unique'] and not index['primary']:
+        mart_cur.execute(index_sql(replica_schema, table["name"], index))
+
+
+def index_sql(replica_schema, table_name, index):
+  return "CREATE %sINDEX \"%s\" ON \"%s\".\"%s\" USING %s (%s);" % ("UNIQUE " if index['unique'] else "", index['name'][:reddm_l1_jdbc.MAX_NAME_LENGTH], replica_schema, table_name,
+                                                                   index['method'], ", ".join("\"%s\"" % (col_name) for col_name in index['columns']))
+
+
+def insert_rows(mart_cur, replica_schema, table, tables, first, last, fresh=False):
+  mart_cur.execute("INSERT INTO \"%s\".\"%s\" (%s) SELECT %s FROM generate_series(%i, %i) AS \"n\" ON CONFLICT DO NOTHING;" % (
+                   replica_schema, table["name"], ", ".join("\"%s\"" % (column['column_name']) for column in table["columns"]),
+                   ", ".join(column_expr(table, column, tables, fresh) for column in table["columns"]), first, last))
+
+
+def fill_replica(mart_conn, replica_schema, tables):
+  mart_cur = mart_conn.cursor()
+  for table in tables.values():
+    insert_rows(mart_cur, replica_schema, table, tables, 1, table["rows"])
+    for index in table["indexes"]:
+      if not index['unique']:
+        mart_cur.execute(index_sql(replica_schema, table["name"], index))
+    mart_cur.execute("ANALYZE \"%s\".\"%s\";" % (replica_schema, table["name"]))
+    mart_conn.commit()
+  mart_cur.close()
+
+
+def touch_replica(mart_conn, replica_schema, tables, pct):
+  """the changes an incremental LOADMART picks up: pct percent of the rows updated, and pct percent new rows"""
+  mart_cur = mart_conn.cursor()
+  for table in tables.values():
+    col_names = [column['column_name'] for column in table["columns"]]
+    if "updated_at" not in col_names:
+      continue
+    if table["key"]:
+      mart_cur.execute("UPDATE \"%s\".\"%s\" SET \"updated_at\" = now() WHERE abs(hashtext((%s)::text)) %% 100 < %i;"
+                       % (replica_schema, table["name"], " || '|' || ".join("\"%s\"::text" % (col_name) for col_name in table["key"]), pct))
+    added = max(1, table["rows"] * pct // 100)
+    insert_rows(mart_cur, replica_schema, table, tables, table["rows"] + 1, table["rows"] + added, True)
+    mart_cur.execute("ANALYZE \"%s\".\"%s\";" % (replica_schema, table["name"]))
+    mart_conn.commit()
+  mart_cur.close()
+
+
+def star_function_sql(star_schema):
+  """the CREATE FUNCTION statements of STAR_FUNCTIONS, for the star schema"""
+  statements = []
+  for file_name in STAR_FUNCTION_FILES:
+    with open(file_name) as sql_file:
+      for statement in md_sqlsplit.iter_statements(sql_file):
+        match = STAR_FUNCTION.match(statement["instruction"])
+        if match and match.group(1) in STAR_FUNCTIONS:
+          body = statement["instruction"][match.end():].replace("db_namespace.", "\"%s\"." % (star_schema))
+          statements.append("CREATE OR REPLACE FUNCTION \"%s\".%s(%s" % (star_schema, match.group(1), body))
+  return statements
+
+
+def write_tenant(settings, md_schema, tenant_name, tenant_vars):
+  md_conn = psycopg2.connect(reddm_runjobgroup.core_conn_string(settings))
+  md_cur = md_conn.cursor()
+  table = "\"%s\".\"%s\".\"md_tenantVariable\"" % (settings["core_db"], md_schema)
+  md_cur.execute("DELETE FROM %s WHERE \"tenantName\" = %%s;" % (table), (tenant_name,))
+  for name, value in tenant_vars.items():
+    md_cur.execute("INSERT INTO %s (\"tenantName\", \"name\", \"value\") VALUES (%%s, %%s, %%s);" % (table), (tenant_name, name, value))
+  md_conn.commit()
+  md_conn.close()
+
+
+def run_jobgroup(md_schema, tenant_name, jobgroup, workers):
+  """run a job group for the tenant through reddm_runjobgroup.py; returns its wall time in ms"""
+  start_time = datetime.datetime.now()
+  subprocess.check_call([sys.executable, os.path.join(SCRIPT_DIR, "reddm_runjobgroup.py"), md_schema, tenant_name, jobgroup, "test", "--workers", str(workers)],
+                        cwd=SCRIPT_DIR)
+  return reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())
+
+
+def read_job_timings(settings, md_schema, tenant_name, jobgroup):
+  """[(job, duration ms, instructions, errors)] of the latest run of a job group for the tenant, from the run log"""
+  md_conn = psycopg2.connect(reddm_runjobgroup.core_conn_string(settings))
+  md_cur = md_conn.cursor()
+  prefix = "\"%s\".\"%s\"." % (settings["core_db"], md_schema)
+  md_cur.execute("SELECT i.\"jobName\", sum(i.\"durationMs\"), count(*), count(i.\"errorCode\") FROM " + prefix + "\"md_instructionRun\" i "
+                 "WHERE i.\"runId\" = (SELECT max(\"id\") FROM " + prefix + "\"md_runLog\" WHERE \"tenantName\" = %s AND \"jobGroupName\" = %s) "
+                 "GROUP BY 1 ORDER BY min(i.\"startTime\");", (tenant_name, jobgroup))
+  timings = [(row[0], int(row[1]), row[2], row[3]) for row in md_cur.fetchall()]
+  md_conn.close()
+  return timings
+
+
+def bench_scale(settings, cmd_line, scale, results_file):
+  tenant_name = "bench_sf%i" % (scale)
+  replica_schema = "bench_replica_sf%i" % (scale)
+  star_schema = "bench_star_sf%i" % (scale)
+  write_tenant(settings, cmd_line["MD_SCHEMA"], tenant_name, {"dstReplicaDB": settings["mart_db"], "dstReplicaSchema": replica_schema,
+                                                              "dstStarDB": settings["mart_db"], "dstStarSchema": star_schema})
+
+  core_conn = psycopg2.connect(reddm_runjobgroup.core_conn_string(settings))
+  tables = read_template(core_conn.cursor(), cmd_line["TEMPLATE_SCHEMA"], scale)
+  core_conn.close()
+
+  mart_conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+  mart_cur = mart_conn.cursor()
+  create_replica(mart_cur, replica_schema, tables)
+  # RESTARTMART drops and creates the star tables, the schema (and its functions) have to be there
+  mart_cur.execute("CREATE SCHEMA IF NOT EXISTS \"%s\";" % (star_schema))
+  for statement in star_function_sql(star_schema):
+    mart_cur.execute(statement)
+  mart_conn.commit()
+  start_time = datetime.datetime.now()
+  fill_replica(mart_conn, replica_schema, tables)
+  print("Scale %i: %i replica tables, %i rows generated in %i ms" % (scale, len(tables), sum(table["rows"] for table in tables.values()),
+                                                                    reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())))
+
+  records = []
+  for phase, jobgroup in (("restart", "RESTARTMART"), ("full", "LOADMART"), ("incremental", "LOADMART")):
+    if phase == "incremental":
+      touch_replica(mart_conn, replica_schema, tables, cmd_line["INCREMENTAL_PCT"])
+    wall_ms = run_jobgroup(cmd_line["MD_SCHEMA"], tenant_name, jobgroup, cmd_line["WORKERS"])
+    for job_name, duration_ms, instructions, errors in read_job_timings(settings, cmd_line["MD_SCHEMA"], tenant_name, jobgroup):
+      records.append({"label": cmd_line["LABEL"], "scale": scale, "phase": phase, "jobGroup": jobgroup, "job": job_name, "durationMs": duration_ms,
+                      "instructions": instructions, "errors": errors, "wallMs": wall_ms, "workers": cmd_line["WORKERS"],
+                      "recordedAt": datetime.datetime.now().isoformat(timespec="seconds")})
+      print("\tsf%-4i %-12s %-24s %10i ms %6i instructions %4i errors" % (scale, phase, job_name, duration_ms, instructions, errors))
+
+  with open(results_file, "a") as results:
+    for record in records:
+      results.write(json.dumps(record) + "\n")
+
+  if not cmd_line["KEEP"]:
+    for schema_name in (replica_schema, star_schema):
+      mart_cur.execute("DROP SCHEMA IF EXISTS \"%s\" CASCADE;" % (schema_name))
+    mart_conn.commit()
+    write_tenant(settings, cmd_line["MD_SCHEMA"], tenant_name, {})
+  mart_conn.close()
+
+
+def compare(cmd_line):
+  try:
+    with open(cmd_line["RESULTS"]) as results_file:
+      records = [json.loads(line) for line in results_file if line.strip()]
+  except OSError as e:
+    print("Cannot Read Results: [%s] %s" % (cmd_line["RESULTS"], e))
+    exit()
+
+  # labels in the order they were first recorded
+  labels = []
+  for record in records:
+    if record["label"] not in labels:
+      labels.append(record["label"])
+  label = cmd_line["LABEL"] or (labels[-1] if labels else None)
+  if label not in labels or (labels.index(label) == 0 and cmd_line["BASELINE"] == None):
+    print("Nothing to Compare: %s" % (", ".join(labels) or "no results"))
+    exit()
+  baseline = cmd_line["BASELINE"] or labels[labels.index(label) - 1]
+
+  # the latest timing of each (scale, phase, job) per label
+  latest = {}
+  for record in records:
+    latest[(record["label"], record["scale"], record["phase"], record["job"])] = record
+
+  print("LOADMART Benchmark: %s against %s" % (label, baseline))
+  print("\t%-6s %-12s %-24s %12s %12s %8s" % ("scale", "phase", "job", baseline[:12], label[:12], "change"))
+  for key in sorted(k[1:] for k in latest if k[0] == label):
+    current = latest[(label,) + key]
+    before = latest.get((baseline,) + key)
+    if before == None:
+      print("\tsf%-4i %-12s %-24s %12s %12i %8s" % (key + ("-", current["durationMs"], "new")))
+      continue
+    change = "%+.1f%%" % (100.0 * (current["durationMs"] - before["durationMs"]) / before["durationMs"]) if before["durationMs"] else "-"
+    print("\tsf%-4i %-12s %-24s %12i %12i %8s" % (key + (before["durationMs"], current["durationMs"], change)))
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  if cmd_line["ACTION"] == "compare":
+    compare(cmd_line)
+    return
+
+  settings = reddm_runjobgroup.db_settings(True)
+  results_file = os.path.abspath(cmd_line["RESULTS"])
+
+  if cmd_line["DEPLOY"]:
+    subprocess.check_call([sys.executable, os.path.join(SCRIPT_DIR, "md_genfromsql.py"), "--manifest", CONFIG_FILE, cmd_line["MD_SCHEMA"], "test"], cwd=SCRIPT_DIR)
+
+  print("LOADMART Benchmark [%s]: scale %s, %i%% incremental, %i workers" % (cmd_line["LABEL"], ", ".join(str(scale) for scale in cmd_line["SCALES"]),
+                                                                            cmd_line["INCREMENTAL_PCT"], cmd_line["WORKERS"]))
+  for scale in cmd_line["SCALES"]:
+    try:
+      bench_scale(settings, cmd_line, scale, results_file)
+
+    except psycopg2.Error as e:
+      print("***ERROR*** Scale %i: [%s-%s] " % (scale, e.pgcode, (e.pgerror or str(e)).strip()))
+    except subprocess.CalledProcessError as e:
+      print("***ERROR*** Scale %i: %s" % (scale, e))
+
+  print("\tResults appended to: %s" % (results_file))
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,465 @@
+# reddm_l1_cdc.py
+#	change data capture ingest for the L1 normalized tables of a tenant: instead of polling every source table by "updated_at", reads
+#	the inserts, updates and deletes of the tenant's source schema from a logical replication slot on the source database, and applies
+#	them to the n_ tables in batches -- hard deletes included.
+#
+# STATUS: EXPERIMENTAL -- the test_decoding parser, the per key folding of a batch and the checkpoint skip of run_slot are unit tested
+#	(tests/test_reddm_l1_cdc.py), against fake connections.   Slots and the checkpoint / crash recovery have not been run against a
+#	source with wal_level=logical, and the lag and load it puts on a source are unmeasured.   Don't create slots on production sources
+#	before a create-slot / run / drop-slot cycle on reva_test.
+#
+# Usage:
+#   python reddm_l1_cdc.py <MD_schema> <src_tenant_name> <create-slot | run | drop-slot> [test] [--slot NAME] [--batch-changes N]
+#                          [--follow] [--poll-seconds S] [--tables T [T ...]]
+#   where
+#		MD_schema - location schema of MD tables (see reddm_runjobgroup.py)
+#		src_tenant_name - tenant whose tenant variables say where to read from and write to (see reddm_l1_copy.py)
+#		create-slot - create the tenant's replication slot; changes are kept for the slot from then on.   Run a regular L1 load after
+#			creating it, so the n_ tables are complete up to the slot's start -- changes replayed on top of it are idempotent
+#		run - apply the changes waiting in the slot, then stop (or, with --follow, keep polling every --poll-seconds, default 5)
+#		drop-slot - drop the slot, e.g. to go back to polling -- a slot nobody reads makes the source keep its WAL forever
+#		--slot - replication slot name (default reddm_l1_<srcSchema>, lower case, other characters as "_")
+#		--batch-changes - changes read (and applied in one mart transaction) per batch (default 10000), rounded up to whole transactions
+#		--tables - OPTIONALLY only apply changes of these source tables (default: every table reddm_l1_jdbc.py generates a load for)
+#		test - OPTIONALLY run against the local test databases (reva_test / reva_mart_test)
+#
+# NOTES:
+#   - the source needs wal_level=logical, and srcUser the REPLICATION attribute.   The slot uses the test_decoding plugin that ships
+#     with postgres, read through the SQL interface (pg_logical_slot_peek_changes), so no extension and no replication connection is needed
+#   - a slot decodes the whole source database: changes of other schemas, and of tables the L1 layer doesn't load, are read and skipped
+#   - each batch is applied in one mart transaction, together with the LSN of its last source transaction in s_L1CdcCheckpoint (in the
+#     normalized schema); the slot is moved past the batch only after that commit.   After a crash in between, the batch is read again,
+#     and the transactions up to the checkpoint are skipped -- every change is applied exactly once
+#   - within a batch, the changes of a key are folded into the last one: inserts and updates are upserted (only the columns the change
+#     carries -- unchanged TOASTed values are left alone), deletes are deleted
+#   - deletes carry the key only when the source table's replica identity covers it: a primary key does by default, a table loaded on
+#     a unique index needs REPLICA IDENTITY USING INDEX -- deletes without a key are counted and reported, not applied
+#   - applied upserts also move the table's s_L1Watermark, so a polling load after CDC doesn't read the same rows again
+#   - source columns added after the n_ tables were created are ignored until reddm_l1_jdbc.py --diff has added them
+
+import re
+import sys
+import time
+import argparse
+import datetime
+import psycopg2
+import psycopg2.extras
+
+import reddm_l1_copy
+import reddm_l1_jdbc
+import reddm_runjobgroup
+
+OUTPUT_PLUGIN = "test_decoding"
+CHECKPOINT_TABLE = "s_L1CdcCheckpoint"
+
+DEFAULT_BATCH_CHANGES = 10000
+DEFAULT_POLL_SECONDS = 5
+
+# a test_decoding change line: table <schema>.<table>: <INSERT|UPDATE|DELETE|TRUNCATE>: <columns>
+CHANGE_LINE = re.compile(r'table ((?:"(?:[^"]|"")*"|[^.]+))\.((?:"(?:[^"]|"")*"|[^:]+)): (INSERT|UPDATE|DELETE|TRUNCATE):(.*)$', re.DOTALL)
+
+# marks a column whose TOASTed value didn't change (and so isn't in the change)
+UNCHANGED_TOAST = "unchanged-toast-datum"
+
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(usage="python reddm_l1_cdc.py <MD_schema> <src_tenant_name> <create-slot | run | drop-slot> [test] [--slot NAME] "
+                                         "[--batch-changes N] [--follow] [--poll-seconds S] [--tables T [T ...]]")
+  parser.add_argument("md_schema")
+  parser.add_argument("src_tenant")
+  parser.add_argument("action", choices=("create-slot", "run", "drop-slot"))
+  parser.add_argument("env", nargs="?")
+  parser.add_argument("--slot", default=None)
+  parser.add_argument("--batch-changes", type=int, default=DEFAULT_BATCH_CHANGES)
+  parser.add_argument("--follow", action="store_true")
+  parser.add_argument("--poll-seconds", type=int, default=DEFAULT_POLL_SECONDS)
+  parser.add_argument("--tables", nargs="+", default=None)
+  args = parser.parse_args(argv)
+
+  return {"MD_SCHEMA": args.md_schema, "SRC_TENANT": args.src_tenant, "ACTION": args.action, "TEST": args.env == "test", "SLOT": args.slot,
+          "BATCH_CHANGES": max(1, args.batch_changes), "FOLLOW": args.follow, "POLL_SECONDS": max(1, args.poll_seconds), "TABLES": args.tables}
+
+
+def slot_name(tenant_vars):
+  return ("reddm_l1_" + re.sub(r"[^a-z0-9_]", "_", tenant_vars["srcSchema"].lower()))[:reddm_l1_jdbc.MAX_NAME_LENGTH]
+
+
+def lsn_value(lsn):
+  # "16/B374D848" -> comparable int
+  high, low = lsn.split("/")
+  return (int(high, 16) << 32) + int(low, 16)
+
+
+def unquote_name(name):
+  if name.startswith('"'):
+    return name[1:-1].replace('""', '"')
+  return name
+
+
+def parse_tuple(text):
+  """{column: value} of the columns of a test_decoding change -- values as text, None for NULL, UNCHANGED_TOAST when not sent"""
+  values = {}
+  pos = 0
+  while pos < len(text):
+    if text[pos] == " ":
+      pos += 1
+      continue
+
+    # name: "quoted" or plain, up to the "[" of its type
+    if text[pos] == '"':
+      end = pos + 1
+      while True:
+        end = text.index('"', end)
+        if text.startswith('""', end):
+          end += 2
+          continue
+        break
+      name = text[pos:end + 1]
+      pos = end + 1
+    else:
+      end = text.index("[", pos)
+      name = text[pos:end]
+      pos = end
+
+    # [type] -- array types have brackets of their own, e.g. [text[]]
+    depth = 0
+    while True:
+      if text[pos] == "[":
+        depth += 1
+      elif text[pos] == "]":
+        depth -= 1
+        if depth == 0:
+          break
+      pos += 1
+    pos += 2    # "]:"
+
+    # 'quoted value' (quotes doubled), or a bare token: null, numbers, booleans, unchanged-toast-datum
+    if pos < len(text) and text[pos] == "'":
+      value = []
+      pos += 1
+      while True:
+        end = text.index("'", pos)
+        value.append(text[pos:end])
+        if text.startswith("''", end):
+          value.append("'")
+          pos = end + 2
+          continue
+        pos = end + 1
+        break
+      value = "".join(value)
+    else:
+      end = text.find(" ", pos)
+      if end < 0:
+        end = len(text)
+      value = text[pos:end]
+      pos = end
+      if value == "null":
+        value = None
+
+    values[unquote_name(name)] = value
+
+  return values
+
+
+def parse_change(data):
+  """{"schema", "table", "op", "old_key", "values"} of a test_decoding change line, None for anything else (BEGIN, COMMIT, messages)"""
+  match = CHANGE_LINE.match(data)
+  if not match:
+    return None
+
+  change = {"schema": unquote_name(match.group(1)), "table": unquote_name(match.group(2)), "op": match.group(3), "old_key": None, "values": {}}
+  body = match.group(4).strip()
+  if change["op"] == "TRUNCATE" or body == "(no-tuple data)":
+    return change
+
+  if body.startswith("old-key: "):
+    # an update that changed the key (or a table with REPLICA IDENTITY FULL): the old key, then the new row
+    old, new = body[len("old-key: "):].split(" new-tuple: ", 1)
+    change["old_key"] = parse_tuple(old)
+    body = new
+  change["values"] = parse_tuple(body)
+  return change
+
+
+def read_transactions(src_cur, slot, batch_changes):
+  """[(commit lsn, [change])] of the next complete source transactions waiting in the slot -- nothing is consumed"""
+  src_cur.execute("SELECT lsn::text, data FROM pg_logical_slot_peek_changes(%s, NULL, %s, 'include-xids', '0', 'skip-empty-xacts', '1');",
+                  (slot, batch_changes))
+  transactions = []
+  changes = []
+  for lsn, data in src_cur.fetchall():
+    if data.startswith("BEGIN"):
+      changes = []
+    elif data.startswith("COMMIT"):
+      transactions.append((lsn, changes))
+      changes = []
+    else:
+      change = parse_change(data)
+      if change != None:
+        changes.append(change)
+  return transactions
+
+
+def advance_slot(src_cur, slot, lsn):
+  # moving a slot backwards is an error -- a checkpoint the slot is already past is left alone
+  src_cur.execute("SELECT pg_replication_slot_advance(\"slot_name\", %s::pg_lsn) FROM pg_replication_slots "
+                  "WHERE \"slot_name\" = %s AND \"confirmed_flush_lsn\" < %s::pg_lsn;", (lsn, slot, lsn))
+
+
+def checkpoint_ddl(norm_schema):
+  return ("CREATE TABLE IF NOT EXISTS %s.\"%s\" (\n"
+          "\t\"slotName\"\tvarchar(63)\tNOT NULL PRIMARY KEY,\n"
+          "\t\"lsn\"\tpg_lsn\tNOT NULL,\n"
+          "\t\"changeCount\"\tbigint,\n"
+          "\t\"appliedAt\"\ttimestamptz\tNOT NULL DEFAULT now()\n"
+          ");" % (norm_schema, CHECKPOINT_TABLE))
+
+
+def read_checkpoint(dst_cur, norm_schema, slot):
+  dst_cur.execute("SELECT \"lsn\"::text FROM %s.\"%s\" WHERE \"slotName\" = %%s;" % (norm_schema, CHECKPOINT_TABLE), (slot,))
+  row = dst_cur.fetchone()
+  return row[0] if row else None
+
+
+def write_checkpoint(dst_cur, norm_schema, slot, lsn, change_count):
+  dst_cur.execute("INSERT INTO %s.\"%s\" (\"slotName\", \"lsn\", \"changeCount\", \"appliedAt\") VALUES (%%s, %%s::pg_lsn, %%s, now()) "
+                  "ON CONFLICT (\"slotName\") DO UPDATE SET \"lsn\" = EXCLUDED.\"lsn\", \"changeCount\" = EXCLUDED.\"changeCount\", \"appliedAt\" = now();"
+                  % (norm_schema, CHECKPOINT_TABLE), (slot, lsn, change_count))
+
+
+class TableBatch:
+  """the changes of one source table in a batch, folded per key, and applied to its n_ table"""
+
+  def __init__(self, dm_table, dm_key):
+    self.dm_table = dm_table
+    self.dm_key = dm_key
+    self.table_name = dm_table[0]['table_name']
+    self.columns = {column['column_name']: column for column in dm_table}
+    self.rows = {}            # key -> {column: value}, or None for a delete
+    self.missing_keys = 0
+
+  def key_of(self, values):
+    if values == None or any(values.get(col_name) in (None, UNCHANGED_TOAST) for col_name in self.dm_key["columns"]):
+      return None
+    return tuple(values[col_name] for col_name in self.dm_key["columns"])
+
+  def add(self, change):
+    if change["op"] == "DELETE":
+      key = self.key_of(change["values"])
+      if key == None:
+        self.missing_keys += 1
+      else:
+        self.rows[key] = None
+      return
+
+    values = {name: value for name, value in change["values"].items() if name in self.columns and value != UNCHANGED_TOAST}
+    key = self.key_of(values)
+    if key == None:
+      self.missing_keys += 1
+      return
+    # a later change of the same key only overrides what it carries -- a changed key carries on from the old one
+    row = dict(self.rows.get(key) or {})
+    old_key = self.key_of(change["old_key"])
+    if old_key != None and old_key != key:
+      row = dict(self.rows.get(old_key) or {})
+      self.rows[old_key] = None
+    row.update(values)
+    self.rows[key] = row
+
+  def cast(self, col_name):
+    if col_name in reddm_l1_jdbc.TIMESTAMP_COLUMNS:
+      return "timestamptz"
+    return reddm_l1_jdbc.column_type(self.columns[col_name])
+
+  def apply(self, dst_cur, norm_schema):
+    """returns (rows upserted, rows deleted)"""
+    target = "%s.\"n_%s\"" % (norm_schema, self.table_name)
+    out_key = [reddm_l1_jdbc.out_column(self.table_name, col_name, self.dm_key) for col_name in self.dm_key["columns"]]
+
+    deletes = [key for key, row in self.rows.items() if row == None]
+    if deletes:
+      psycopg2.extras.execute_values(dst_cur,
+        "DELETE FROM %s AS \"n\" USING (VALUES %%s) AS \"d\" (%s) WHERE %s;" % (target, reddm_l1_copy.quote_names(self.dm_key["columns"]),
+                                                                            " AND ".join("\"n\".\"%s\" = \"d\".\"%s\"" % (out_name, col_name)
+                                                                                         for out_name, col_name in zip(out_key, self.dm_key["columns"]))),
+        deletes, template="(%s)" % (", ".join("%%s::%s" % (self.cast(col_name)) for col_name in self.dm_key["columns"])), page_size=1000)
+
+    # rows carrying the same columns are upserted together
+    groups = {}
+    for row in self.rows.values():
+      if row != None:
+        groups.setdefault(tuple(name for name in reddm_l1_jdbc.load_columns(self.dm_table) if name in row), []).append(row)
+
+    updated_at = []
+    for col_names, rows in groups.items():
+      out_names = [reddm_l1_jdbc.out_column(self.table_name, col_name, self.dm_key) for col_name in col_names]
+      updates = ["\"%s\" = EXCLUDED.\"%s\"" % (out_name, out_name) for col_name, out_name in zip(col_names, out_names) if col_name not in self.dm_key["columns"]]
+      psycopg2.extras.execute_values(dst_cur,
+        "INSERT INTO %s AS \"n\" (%s) VALUES %%s ON CONFLICT (%s) %s;" % (target, reddm_l1_copy.quote_names(out_names), reddm_l1_copy.quote_names(out_key),
+                                                                        "DO UPDATE SET " + ", ".join(updates) if updates else "DO NOTHING"),
+        [tuple(row[col_name] for col_name in col_names) for row in rows],
+        template="(%s)" % (", ".join("%%s::%s" % (self.cast(col_name)) for col_name in col_names)), page_size=1000)
+      updated_at += [row["updated_at"] for row in rows if row.get("updated_at") != None]
+
+    if updated_at:
+      # keep the polling loads' watermark in step, the same way their merge moves it
+      dst_cur.execute("INSERT INTO %s.\"%s\" AS \"w\" (\"tableName\", \"highWaterMark\", \"rowCount\", \"loadedAt\") "
+                      "SELECT %%s, max(\"v\"::timestamptz), %%s, now() FROM unnest(%%s::text[]) AS \"v\" "
+                      "ON CONFLICT (\"tableName\") DO UPDATE SET \"highWaterMark\" = GREATEST(\"w\".\"highWaterMark\", EXCLUDED.\"highWaterMark\"), "
+                      "\"rowCount\" = EXCLUDED.\"rowCount\", \"loadedAt\" = EXCLUDED.\"loadedAt\";" % (norm_schema, reddm_l1_jdbc.WATERMARK_TABLE),
+                      (self.table_name, len(updated_at), updated_at))
+
+    return len(self.rows) - len(deletes), len(deletes)
+
+
+def apply_batch(dst_conn, tenant_vars, tables, slot, transactions):
+  """apply the changes of [(commit lsn, [change])] to the n_ tables, and checkpoint the last lsn -- in one mart transaction"""
+  batches = {}
+  truncated = []
+  change_count = 0
+  for lsn, changes in transactions:
+    for change in changes:
+      if change["schema"] != tenant_vars["srcSchema"] or change["table"] not in tables:
+        continue
+      change_count += 1
+      if change["op"] == "TRUNCATE":
+        # the L1 layer is a historical copy -- a source TRUNCATE is reported, not replayed
+        truncated.append(change["table"])
+        continue
+      if change["table"] not in batches:
+        batches[change["table"]] = TableBatch(*tables[change["table"]])
+      batches[change["table"]].add(change)
+
+  result = {"changes": change_count, "upserted": 0, "deleted": 0, "missing_keys": 0, "truncated": truncated}
+  dst_cur = dst_conn.cursor()
+  try:
+    for batch in batches.values():
+      upserted, deleted = batch.apply(dst_cur, reddm_l1_copy.norm_schema(tenant_vars))
+      result["upserted"] += upserted
+      result["deleted"] += deleted
+      result["missing_keys"] += batch.missing_keys
+    write_checkpoint(dst_cur, reddm_l1_copy.norm_schema(tenant_vars), slot, transactions[-1][0], change_count)
+    dst_conn.commit()
+
+  except psycopg2.Error:
+    dst_conn.rollback()
+    raise
+
+  finally:
+    dst_cur.close()
+
+  return result
+
+
+def run_slot(src_conn, dst_conn, tenant_vars, tables, slot, cmd_line):
+  norm_schema = reddm_l1_copy.norm_schema(tenant_vars)
+  src_cur = src_conn.cursor()
+  dst_cur = dst_conn.cursor()
+  checkpoint = read_checkpoint(dst_cur, norm_schema, slot)
+  dst_conn.commit()
+  dst_cur.close()
+
+  totals = {"batches": 0, "changes": 0, "upserted": 0, "deleted": 0, "missing_keys": 0}
+  while True:
+    transactions = read_transactions(src_cur, slot, cmd_line["BATCH_CHANGES"])
+    src_conn.commit()
+
+    # applied before a crash, but the slot wasn't moved past them yet
+    if checkpoint != None:
+      transactions = [(lsn, changes) for lsn, changes in transactions if lsn_value(lsn) > lsn_value(checkpoint)]
+      advance_slot(src_cur, slot, checkpoint)
+      src_conn.commit()
+      checkpoint = None
+
+    if not transactions:
+      if not cmd_line["FOLLOW"]:
+        break
+      time.sleep(cmd_line["POLL_SECONDS"])
+      continue
+
+    start_time = datetime.datetime.now()
+    result = apply_batch(dst_conn, tenant_vars, tables, slot, transactions)
+    # the batch is committed on the mart -- only now may the source let go of it
+    advance_slot(src_cur, slot, transactions[-1][0])
+    src_conn.commit()
+
+    reddm_runjobgroup.log("Applied [%s] %i transactions up to %s: %i changes, %i upserted, %i deleted in %i ms" % (
+                          slot, len(transactions), transactions[-1][0], result["changes"], result["upserted"], result["deleted"],
+                          reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())))
+    if result["missing_keys"]:
+      reddm_runjobgroup.log("***WARNING*** [%s] %i changes without a key skipped -- check the replica identity of their tables" % (slot, result["missing_keys"]))
+    for table_name in result["truncated"]:
+      reddm_runjobgroup.log("***WARNING*** [%s] source table %s was truncated -- n_%s was left as is" % (slot, table_name, table_name))
+
+    totals["batches"] += 1
+    for count in ("changes", "upserted", "deleted", "missing_keys"):
+      totals[count] += result[count]
+
+  src_cur.close()
+  return totals
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  settings = reddm_runjobgroup.db_settings(cmd_line["TEST"])
+
+  tenant_vars = reddm_l1_copy.read_l1_tenantvars(settings, cmd_line["MD_SCHEMA"], cmd_line["SRC_TENANT"])
+  slot = cmd_line["SLOT"] or slot_name(tenant_vars)
+
+  try:
+    src_conn = psycopg2.connect(reddm_l1_copy.source_conn_string(tenant_vars))
+    src_cur = src_conn.cursor()
+
+    if cmd_line["ACTION"] == "create-slot":
+      src_cur.execute("SELECT lsn::text FROM pg_create_logical_replication_slot(%s, %s);", (slot, OUTPUT_PLUGIN))
+      print("Replication Slot Created: [%s] at %s" % (slot, src_cur.fetchone()[0]))
+      src_conn.commit()
+      src_conn.close()
+      return
+
+    if cmd_line["ACTION"] == "drop-slot":
+      src_cur.execute("SELECT pg_drop_replication_slot(%s);", (slot,))
+      print("Replication Slot Dropped: [%s]" % (slot))
+      src_conn.commit()
+      src_conn.close()
+      return
+
+    tables = {dm_table[0]['table_name']: (dm_table, dm_key) for dm_table, dm_key in
+              reddm_l1_copy.select_tables(src_cur, tenant_vars["srcSchema"], cmd_line["TABLES"])}
+    src_conn.commit()
+    dst_conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+    dst_conn.cursor().execute(reddm_l1_jdbc.watermark_ddl(reddm_l1_copy.norm_schema(tenant_vars)) + "\n" + checkpoint_ddl(reddm_l1_copy.norm_schema(tenant_vars)))
+    dst_conn.commit()
+
+  except psycopg2.Error as e:
+    print("Error Connecting to Source / Mart: [%s-%s] " % (e.pgcode, e.pgerror))
+    exit()
+
+  start_time = datetime.datetime.now()
+  try:
+    totals = run_slot(src_conn, dst_conn, tenant_vars, tables, slot, cmd_line)
+
+  except psycopg2.Error as e:
+    print("***ERROR*** Applying [%s]: [%s-%s] " % (slot, e.pgcode, (e.pgerror or str(e)).strip()))
+    exit()
+
+  except KeyboardInterrupt:
+    # a batch is either committed with its checkpoint or not at all -- stopping is always safe
+    totals = None
+
+  finally:
+    src_conn.close()
+    dst_conn.close()
+
+  if totals != None:
+    print("L1 Changes Applied: [%s]" % (slot))
+    print("\tBatches: %i" % totals["batches"])
+    print("\tChanges: %i" % totals["changes"])
+    print("\tRows Upserted: %i" % totals["upserted"])
+    print("\tRows Deleted: %i" % totals["deleted"])
+    print("\tChanges Without Key: %i" % totals["missing_keys"])
+    print("\tTotal Duration: %i ms" % reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now()))
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,394 @@
+# reddm_l1_copy.py
+#	loads the L1 normalized tables of a tenant without DB LINK: the changed rows of each source table are streamed from the tenant's
+#	source database with COPY ... TO STDOUT straight into COPY ... FROM STDIN on the mart, into a session temp table, and merged
+#	into n_<table> from there -- the same upsert L1_LOAD.sql runs from its t_<table> staging tables (see reddm_l1_jdbc.py).
+#
+# STATUS: EXPERIMENTAL -- not yet run against a tenant's source database and a mart.   The COPY pipe, the temp table merge and
+#	--chunk-rows paging are untested end to end, and their speed against the dblink load of L1_LOAD.sql is unmeasured.   Keep the
+#	dblink load for production tenants until a run on reva_test / reva_mart_test has compared the n_ tables both produce.
+#
+# Usage:
+#   python reddm_l1_copy.py <MD_schema> <src_tenant_name> [test] [--tables T [T ...]] [--buffer-chunks N] [--chunk-rows N]
+#   where
+#		MD_schema - location schema of MD tables (see reddm_runjobgroup.py)
+#		src_tenant_name - tenant whose tenant variables (srcDB, srcSchema, srcServer, srcUser, srcPassword, dstNormDB, dstNormSchema)
+#			say where to read from and write to
+#		--tables - OPTIONALLY only load these source tables (default: every table of srcSchema that reddm_l1_jdbc.py generates a load for)
+#		--buffer-chunks - how many COPY_CHUNK_SIZE chunks may be in flight between source and mart (default 8)
+#		--chunk-rows - OPTIONALLY read each table's delta in keyset chunks of at most N rows, each one merged and committed on its own
+#			(default 0: the whole delta at once)
+#		test - OPTIONALLY run against the local test databases (reva_test / reva_mart_test)
+#
+# NOTES:
+#   - a table is read and written at the same time, by two threads joined by a bounded queue -- memory use is at most
+#     --buffer-chunks x COPY_CHUNK_SIZE per table, however large the delta is
+#   - the temp table is unlogged and emptied on commit, and has no indexes, so staging costs neither WAL nor catalog churn in tmpNormSchema
+#   - each table is merged and committed on its own; a table that fails is rolled back and reported, and the next one is loaded on a
+#     fresh source connection -- the one its COPY was aborted on isn't reused.   Whatever stops the source side (a database error, rows
+#     that don't decode, a dropped socket) is reported as the table's L1LoadError, not raised out of the run
+#   - with --chunk-rows, the delta is paged through in ("updated_at", key) order: each chunk reads the next N rows after the last row of
+#     the previous one, and is merged, moves the watermark and commits before the next one is read.   Initial and catch-up loads then
+#     use bounded memory, transactions and WAL, and an interrupted load resumes from the last committed chunk (less the overlap window).
+#     Text key columns are ordered COLLATE "C" on both sides, so source and mart agree on where a chunk ends
+#   - like L1_LOAD.sql, a table only loads the rows updated since its watermark in s_L1Watermark (less the overlap window), and moves
+#     the watermark in the same statement as its merge -- see reddm_l1_jdbc.py
+
+import sys
+import queue
+import argparse
+import datetime
+import threading
+import psycopg2
+
+import reddm_l1_jdbc
+import reddm_runjobgroup
+
+# tenant variables an L1 load needs
+L1_TENANT_VARS = ("srcDB", "srcSchema", "srcServer", "srcUser", "srcPassword", "dstNormDB", "dstNormSchema")
+
+COPY_CHUNK_SIZE = 1024 * 1024
+DEFAULT_BUFFER_CHUNKS = 8
+
+# how often a blocked side of the pipe checks whether the other side gave up
+PIPE_POLL_SECONDS = 1
+
+
+class CopyAborted(Exception):
+  pass
+
+
+class L1LoadError(Exception):
+  """the source side of a table's COPY failed -- wraps whatever the producer thread raised"""
+
+  def __init__(self, cause):
+    Exception.__init__(self, "Source COPY Failed: %s: %s" % (type(cause).__name__, (getattr(cause, "pgerror", None) or str(cause)).strip()))
+    self.cause = cause
+
+
+class CopyPipe:
+  """file-like pipe between a COPY TO STDOUT (which calls write) and a COPY FROM STDIN (which calls read) running in two threads"""
+
+  def __init__(self, max_chunks):
+    self.chunks = queue.Queue(max_chunks)
+    self.buffer = bytearray()
+    self.pending = b""
+    self.aborted = False
+
+  def _put(self, chunk):
+    while True:
+      if self.aborted:
+        raise CopyAborted()
+      try:
+        self.chunks.put(chunk, timeout=PIPE_POLL_SECONDS)
+        return
+      except queue.Full:
+        pass
+
+  def write(self, data):
+    # psycopg2 writes one row at a time -- rows are collected into chunks, so the queue handles a few large items
+    self.buffer += data
+    if len(self.buffer) >= COPY_CHUNK_SIZE:
+      self._put(bytes(self.buffer))
+      self.buffer = bytearray()
+
+  def close_writer(self):
+    if self.buffer:
+      self._put(bytes(self.buffer))
+      self.buffer = bytearray()
+    self._put(None)
+
+  def read(self, size=-1):
+    if not self.pending:
+      while True:
+        if self.aborted:
+          raise CopyAborted()
+        try:
+          chunk = self.chunks.get(timeout=PIPE_POLL_SECONDS)
+          break
+        except queue.Empty:
+          pass
+      if chunk is None:
+        # end of data -- keep answering EOF
+        self.chunks.put(None)
+        return b""
+      self.pending = chunk
+
+    if size < 0 or size >= len(self.pending):
+      data, self.pending = self.pending, b""
+    else:
+      data, self.pending = self.pending[:size], self.pending[size:]
+    return data
+
+  def abort(self):
+    self.aborted = True
+
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(usage="python reddm_l1_copy.py <MD_schema> <src_tenant_name> [test] [--tables T [T ...]] [--buffer-chunks N] [--chunk-rows N]")
+  parser.add_argument("md_schema")
+  parser.add_argument("src_tenant")
+  parser.add_argument("env", nargs="?")
+  parser.add_argument("--tables", nargs="+", default=None)
+  parser.add_argument("--buffer-chunks", type=int, default=DEFAULT_BUFFER_CHUNKS)
+  parser.add_argument("--chunk-rows", type=int, default=0)
+  args = parser.parse_args(argv)
+
+  return {"MD_SCHEMA": args.md_schema, "SRC_TENANT": args.src_tenant, "TEST": args.env == "test", "TABLES": args.tables,
+          "BUFFER_CHUNKS": max(1, args.buffer_chunks), "CHUNK_ROWS": max(0, args.chunk_rows)}
+
+
+def read_l1_tenantvars(settings, md_schema, src_tenant):
+  """the tenant variables of src_tenant -- exits when the metadata can't be read, or a variable the L1 load needs is missing"""
+  try:
+    md_conn = psycopg2.connect(reddm_runjobgroup.core_conn_string(settings))
+    md_cur = md_conn.cursor()
+    tenant_vars = reddm_runjobgroup.read_tenantvars(md_cur, settings, md_schema, src_tenant).get(src_tenant, {})
+    md_conn.close()
+
+  except psycopg2.Error as e:
+    print("Error Connecting to Metadata: [%s-%s] " % (e.pgcode, e.pgerror))
+    exit()
+
+  missing = [var for var in L1_TENANT_VARS if var not in tenant_vars]
+  if missing:
+    print("Tenant Variables Not Found: [%s] %s" % (src_tenant, ", ".join(missing)))
+    exit()
+
+  return tenant_vars
+
+
+def source_conn_string(tenant_vars):
+  # the same connection L1_LOAD.sql opens with dblink_connect
+  return "dbname='%s' port=5432 host='%s' user='%s' password='%s'" % (tenant_vars["srcDB"], tenant_vars["srcServer"], tenant_vars["srcUser"],
+                                                                      tenant_vars["srcPassword"])
+
+
+def quote_names(names):
+  return ", ".join("\"%s\"" % (name) for name in names)
+
+
+def norm_schema(tenant_vars):
+  return "\"%s\".\"%s\"" % (tenant_vars["dstNormDB"], tenant_vars["dstNormSchema"])
+
+
+def read_watermark(dst_cur, tenant_vars, table_name):
+  # as text, so the source compares against exactly the stored value (-infinity for a table never loaded)
+  dst_cur.execute("SELECT %s::text;" % (reddm_l1_jdbc.watermark_sql(table_name, norm_schema(tenant_vars))))
+  return dst_cur.fetchone()[0]
+
+
+def create_staging_table(dst_cur, dm_table, staging_table):
+  columns = {column['column_name']: column for column in dm_table}
+  definitions = []
+  for name in reddm_l1_jdbc.load_columns(dm_table):
+    # created_at / updated_at are always staged as timestamptz, the same as in the n_ tables
+    definitions.append("\"%s\" %s" % (name, "timestamptz" if name in reddm_l1_jdbc.TIMESTAMP_COLUMNS else reddm_l1_jdbc.column_type(columns[name])))
+  # emptied, not dropped, on commit -- a chunked load commits once per chunk into the same staging table
+  dst_cur.execute("DROP TABLE IF EXISTS %s;" % (staging_table))
+  dst_cur.execute("CREATE TEMP TABLE %s (%s) ON COMMIT DELETE ROWS;" % (staging_table, ", ".join(definitions)))
+
+
+def keyset(dm_table, dm_key):
+  """[(column, cast, collate)] of the order a chunked load pages through a table in: updated_at, then the key columns"""
+  columns = {column['column_name']: column for column in dm_table}
+  ordering = [("updated_at", "timestamptz", "")]
+  for name in dm_key["columns"]:
+    if name != "updated_at":
+      type = reddm_l1_jdbc.column_type(columns[name])
+      # byte order on both sides, whatever the source and mart databases' collations are
+      ordering.append((name, type, " COLLATE \"C\"" if columns[name]['udt_name'] in ("varchar", "text", "bpchar") else ""))
+  return ordering
+
+
+def keyset_order(ordering, direction=""):
+  return ", ".join("\"%s\"%s%s" % (name, collate, direction) for name, type, collate in ordering)
+
+
+def keyset_after(ordering):
+  # row comparison: the rows after the last one of the previous chunk, in keyset order
+  return "(%s) > (%s)" % (", ".join("\"%s\"%s" % (name, collate) for name, type, collate in ordering),
+                          ", ".join("%%s::%s%s" % (type, collate) for name, type, collate in ordering))
+
+
+def chunk_query(src_cur, tenant_vars, table_name, columns, ordering, watermark, last_row, chunk_rows):
+  query = "SELECT %s FROM \"%s\".\"%s\" WHERE \"updated_at\" > %%s::timestamptz" % (columns, tenant_vars["srcSchema"], table_name)
+  params = [watermark]
+  if last_row != None:
+    query += " AND " + keyset_after(ordering)
+    params += last_row
+  if chunk_rows:
+    query += " ORDER BY %s LIMIT %i" % (keyset_order(ordering), chunk_rows)
+  return src_cur.mogrify(query, params).decode()
+
+
+def stream_rows(src_conn, dst_cur, source_query, staging_copy, buffer_chunks):
+  """COPY source_query from the source into staging_copy on the mart, through a CopyPipe of at most buffer_chunks chunks"""
+  pipe = CopyPipe(buffer_chunks)
+  errors = []
+
+  def produce():
+    src_cur = src_conn.cursor()
+    try:
+      src_cur.copy_expert("COPY (%s) TO STDOUT" % (source_query), pipe, COPY_CHUNK_SIZE)
+      pipe.close_writer()
+    except CopyAborted:
+      pass
+    except Exception as e:
+      errors.append(e)
+      pipe.abort()
+    finally:
+      src_cur.close()
+
+  producer = threading.Thread(target=produce, name="l1-copy-source")
+  producer.start()
+  try:
+    dst_cur.copy_expert("COPY %s FROM STDIN" % (staging_copy), pipe, COPY_CHUNK_SIZE)
+
+  except Exception:
+    pipe.abort()
+    producer.join()
+    # the source side failing makes the mart side see an aborted read -- report the error that started it
+    if errors:
+      raise L1LoadError(errors[0]) from errors[0]
+    raise
+
+  producer.join()
+  if errors:
+    raise L1LoadError(errors[0]) from errors[0]
+
+  # end the transaction the source COPY ran in, so its snapshot is released before the next table
+  src_conn.commit()
+
+
+def load_table(src_conn, dst_conn, tenant_vars, dm_table, dm_key, buffer_chunks, chunk_rows=0):
+  """stream the delta of one source table into its n_ table, in chunks of at most chunk_rows rows (0: in one go);
+  returns {"table", "rows", "merged", "chunks", "duration_ms"}"""
+  start_time = datetime.datetime.now()
+  table_name = dm_table[0]['table_name']
+  staging_table = "\"t_%s\"" % (table_name)
+  columns = quote_names(reddm_l1_jdbc.load_columns(dm_table))
+  ordering = keyset(dm_table, dm_key)
+  rows = merged = chunks = 0
+
+  dst_cur = dst_conn.cursor()
+  try:
+    watermark = read_watermark(dst_cur, tenant_vars, table_name)
+    create_staging_table(dst_cur, dm_table, staging_table)
+    dst_conn.commit()
+
+    last_row = None
+    while True:
+      src_cur = src_conn.cursor()
+      source_query = chunk_query(src_cur, tenant_vars, table_name, columns, ordering, watermark, last_row, chunk_rows)
+      src_cur.close()
+      stream_rows(src_conn, dst_cur, source_query, "%s (%s)" % (staging_table, columns), buffer_chunks)
+
+      dst_cur.execute("SELECT count(*) FROM %s;" % (staging_table))
+      chunk_count = dst_cur.fetchone()[0]
+      if chunk_rows and chunk_count == chunk_rows:
+        # where the next chunk starts -- as text, so the source compares against exactly the staged values
+        dst_cur.execute("SELECT %s FROM %s ORDER BY %s LIMIT 1;" % (", ".join("\"%s\"::text" % (name) for name, type, collate in ordering), staging_table,
+                                                                 keyset_order(ordering, " DESC")))
+        last_row = list(dst_cur.fetchone())
+      dst_cur.execute(reddm_l1_jdbc.merge_sql(dm_table, dm_key, norm_schema(tenant_vars), staging_table) + ";")
+      merged += dst_cur.fetchone()[0] if dst_cur.rowcount > 0 else 0
+      dst_conn.commit()
+
+      rows += chunk_count
+      chunks += 1
+      if not chunk_rows or chunk_count < chunk_rows:
+        break
+
+    dst_cur.execute("DROP TABLE IF EXISTS %s;" % (staging_table))
+    dst_conn.commit()
+
+  except (psycopg2.Error, L1LoadError, CopyAborted):
+    # the source connection is left as it is -- main() replaces it, a COPY aborted on it may still be in flight
+    dst_conn.rollback()
+    raise
+
+  finally:
+    dst_cur.close()
+
+  return {"table": table_name, "rows": rows, "merged": merged, "chunks": chunks,
+          "duration_ms": reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())}
+
+
+def select_tables(src_cur, schema_name, table_names):
+  """returns [(dm_table, dm_key)] of the tables to load -- the same tables, on the same keys, as the generated L1 SQL"""
+  planned, skipped = reddm_l1_jdbc.plan_tables(reddm_l1_jdbc.read_data_dictionary(src_cur, schema_name), reddm_l1_jdbc.read_indexes(src_cur, schema_name))
+  if table_names == None:
+    return planned
+
+  for table_name, reason in skipped:
+    if table_name in table_names:
+      print("Table Skipped: [%s] %s" % (table_name, reason))
+
+  by_name = {dm_table[0]['table_name']: (dm_table, dm_key) for dm_table, dm_key in planned}
+  missing = [name for name in table_names if name not in by_name and name not in [table_name for table_name, reason in skipped]]
+  if missing:
+    print("Tables Not Found in Source Schema: %s" % (", ".join(missing)))
+  return [by_name[name] for name in table_names if name in by_name]
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  settings = reddm_runjobgroup.db_settings(cmd_line["TEST"])
+
+  tenant_vars = read_l1_tenantvars(settings, cmd_line["MD_SCHEMA"], cmd_line["SRC_TENANT"])
+
+  try:
+    src_conn = psycopg2.connect(source_conn_string(tenant_vars))
+    dst_conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+    dm_tables = select_tables(src_conn.cursor(), tenant_vars["srcSchema"], cmd_line["TABLES"])
+    src_conn.commit()
+    dst_conn.cursor().execute(reddm_l1_jdbc.watermark_ddl(norm_schema(tenant_vars)))
+    dst_conn.commit()
+
+  except psycopg2.Error as e:
+    print("Error Connecting to Source / Mart: [%s-%s] " % (e.pgcode, e.pgerror))
+    exit()
+
+  start_time = datetime.datetime.now()
+  results = []
+  err_count = 0
+  for dm_table, dm_key in dm_tables:
+    try:
+      result = load_table(src_conn, dst_conn, tenant_vars, dm_table, dm_key, cmd_line["BUFFER_CHUNKS"], cmd_line["CHUNK_ROWS"])
+      print("Loaded [%s] %i rows in %i chunk(s), %i merged in %i ms" % (result["table"], result["rows"], result["chunks"], result["merged"],
+                                                                       result["duration_ms"]))
+      results.append(result)
+
+    except psycopg2.Error as e:
+      err_count += 1
+      print("***ERROR*** Loading [%s]: [%s-%s] " % (dm_table[0]['table_name'], e.pgcode, (e.pgerror or str(e)).strip()))
+
+    except (L1LoadError, CopyAborted) as e:
+      err_count += 1
+      print("***ERROR*** Loading [%s]: %s " % (dm_table[0]['table_name'], e))
+
+    else:
+      continue
+
+    # the next table reads over a fresh source connection
+    src_conn.close()
+    try:
+      src_conn = psycopg2.connect(source_conn_string(tenant_vars))
+    except psycopg2.Error as e:
+      print("Error Connecting to Source: [%s-%s] " % (e.pgcode, e.pgerror))
+      break
+
+  src_conn.close()
+  dst_conn.close()
+
+  print("L1 Tables Loaded:")
+  for result in sorted(results, key=lambda r: r["duration_ms"], reverse=True):
+    print("\t%-45s %12i rows %10i ms" % (result["table"], result["rows"], result["duration_ms"]))
+  print("\tTables Loaded: %i" % len(results))
+  print("\tRows Loaded: %i" % sum(r["rows"] for r in results))
+  print("\tErrors Encountered: %i" % err_count)
+  print("\tTotal Duration: %i ms" % reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now()))
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -2,23 +2,66 @@
 # datamart integration.   L1 represents "Level 1 Normalized", which is just a historical copy of all of the operational data for a schema, mimicing
 # the source system data model, identical -- but with a couple of datamart centric changes.
 #
-# Usage: python reddm_l1_jdbc.py <schema_name> <output_L1_DROP.sql> <output_L1_DDL.sql> <output_L1_LOAD.sql>
-# Example: python reddm_l1_jdbc.py 6081d13f-85fb-436a-a5b6-53bd89ffeb42 L1_DROP.sql L1_DDL.sql L1_LOAD.sql
+# Usage: python reddm_l1_jdbc.py <schema_name> <output_L1_DROP.sql> <output_L1_DDL.sql> <output_L1_LOAD.sql> [<output_L1_SRC_INDEXES.sql>] [--staging=<strategy>]
+# Example: python reddm_l1_jdbc.py 6081d13f-85fb-436a-a5b6-53bd89ffeb42 L1_DROP.sql L1_DDL.sql L1_LOAD.sql L1_SRC_INDEXES.sql
 #
 # It creates 3 output SQL files:
 #    - L1_DROP.SQL -- the SQL used to drop all of the normalized tables - Only intended to be used to reload / restart datamart from scratch
 #    - L1_DDL.SQL -- the SQL used to create anew all of the L1 Normalized tables - Only intended to be used to reload / restart datamart from scratch
 #    - L1_LOAD.SQL -- use DB LINK to link back to source schema, potentially from another source - Intended to incrementally load data from source system
+#      when its name ends in .json, the same load is written as a manifest of per table load units instead, which reddm_l1_runner.py runs
+#      in parallel (largest delta first) -- the tables of the L1 layer don't depend on each other
+# and OPTIONALLY a 4th one:
+#    - L1_SRC_INDEXES.SQL -- CREATE INDEX CONCURRENTLY on "updated_at" for the source tables that don't have one yet, so the incremental
+#      reads are index range scans -- run it on the source database by hand (e.g. with psql), CONCURRENTLY can't run inside a transaction
+#
+# --staging says how L1_LOAD stages the rows it reads from the source before merging them into the n_ tables:
+#    - table (default) -- DROP and CREATE a regular t_<table> in tmpNormSchema on every load, as always
+#    - temp -- a session TEMP table, created once per session and emptied with TRUNCATE: no WAL for the staged rows, nothing left in tmpNormSchema.
+#      The load must run on one connection, as the DB LINK connection already requires
+#    - unlogged -- an UNLOGGED t_<table> in tmpNormSchema, created once and emptied with TRUNCATE: no WAL for the staged rows, no catalog
+#      churn.   L1_DROP drops it too, so RESTARTMART recreates it when the source columns change
+#    - direct -- no staging table: INSERT ... SELECT FROM dblink ... ON CONFLICT straight into the n_ table.   Nothing is written twice,
+#      but the source is read for as long as the merge takes, and duplicate keys in the source fail the merge instead of the staging insert
+# reddm_l1_stagebench.py compares them on a local database (its header has the figures): temp, unlogged and direct write half the WAL of
+# table on a full load and a fifth less on an incremental one, direct is also the fastest -- table stays the default.
+#
+# Diff mode: python reddm_l1_jdbc.py --diff <schema_name> <mart_norm_schema_name> <output_L1_MIGRATE.sql> [--staging=<strategy>]
+# compares the source schema (columns and keys) with the n_ tables already in the mart's normalized schema, and writes only the
+# statements needed to catch up with a source schema change -- instead of L1_DROP / L1_DDL and reloading everything:
+#    - a new source table gets its n_ table, and is loaded in full by the next L1 load
+#    - a new column is added (nullable) and filled for the rows already loaded, from the source's key and that column only
+#    - a changed column type is altered in place, a column that became nullable (or was dropped from the source) drops NOT NULL --
+#      dropped columns are kept, as are n_ tables whose source table is gone (they are listed)
+#    - missing carried-over indexes are created
+#    - a table whose key changed is rebuilt: dropped, created and loaded in full
+# Regenerate L1_LOAD (and L1_DDL) at the same time, so the loads use the new columns.
+#
+# The same L1 load can also be run without DB LINK, streaming the rows with COPY -- see reddm_l1_copy.py, which uses the data dictionary
+# and upsert helpers below -- or from a logical replication slot, deletes included, with reddm_l1_cdc.py.
 #
 # NOTE:
-#    - to do:  add support for detection of compound keys on source tables.... script assumes that the first column listed in the source table is usually the PK
-
+#    - each table is loaded on its real key, read from pg_index (which backs every primary key and unique constraint): the primary key,
+#      else the first unique index on NOT NULL columns, else -- as before -- the first column named "id", "uuid" or "name".   Keys may be
+#      composite; a single "id" / "uuid" / "name" key is renamed to a distinct DM name (e.g. "partyId"), composite key columns keep their names
+#    - the other plain column indexes of the source table are carried over to the n_ table (as non unique indexes -- the L1 layer is a
+#      historical copy, and is loaded in batches), so lookups and merges against the normalized layer are index backed too
+#    - tables without a usable key, or without an "updated_at" column to load incrementally on, are skipped and reported
+#    - every load records the highest "updated_at" it read in s_L1Watermark (in the normalized schema), in the same statement as its
+#      merge -- the next load reads from there instead of scanning the n_ table for max("updated_at").   Each read starts OVERLAP_WINDOW
+#      before the watermark, so rows sharing the watermark's timestamp and rows committed late (after a later updated_at was already read)
+#      are picked up; the overlap is read again, but only rows whose updated_at changed are rewritten
+
+import io
 import csv
 import sys
 import json
+import hashlib
 import psycopg2
 import os
 
+import md_sqlsplit
+
 db_host = os.getenv('DATABASE_HOST', "coredb")
 cloud_env = os.getenv('CLOUD_ENV', "dev")
 core_db = 'reva_core'
@@ -32,6 +75,38 @@ host = db_host + "." + cloud_env + ".env.reva.tech"
 # for it to work add this line to /etc/hosts file on local machine
 # 127.0.0.1 coredb.{ your CLOUD_ENV var }.env.reva.tech localhost
 
+# Save header row, to extract metadata names later
+DD_HEADER = [ "table_catalog",	"table_schema",	"table_name", "column_name", "ordinal_position", "is_nullable", "data_type", "character_maximum_length", "udt_name" ]
+
+# the following skip list are tables that are never loaded into L1 -- migration bookkeeping, not operational data
+# (tables that can't be loaded automatically are detected and skipped, see plan_tables -- if they are important, they must be added into
+# the L1_DDL/LOAD_MANUAL.SQL for manual processing there)
+SKIPLIST = ("knex_migrations", "knex_migrations_lock")
+
+# index methods carried over to the n_ tables
+INDEX_METHODS = ("btree", "hash", "gin", "gist", "brin")
+
+# postgres truncates longer identifiers (in bytes) -- see pg_name
+MAX_NAME_LENGTH = 63
+
+# per table high-water mark of the L1 loads, kept in the normalized schema
+WATERMARK_TABLE = "s_L1Watermark"
+OVERLAP_WINDOW = "5 minutes"
+
+NORM_SCHEMA = "\"${dstNormDB}$\".\"${dstNormSchema}$\""
+TMP_SCHEMA = "\"${tmpNormDB}$\".\"${tmpNormSchema}$\""
+
+# how L1_LOAD stages the rows read from the source before merging them (--staging=, see the header)
+STAGING_STRATEGIES = ("table", "temp", "unlogged", "direct")
+
+DBLINK_CONNECT = "SELECT public.dblink_connect('${srcDB}$', 'dbname=${srcDB}$ port=5432 host=${srcServer}$ user=${srcUser}$ password=${srcPassword}$');"
+DBLINK_DISCONNECT = "SELECT public.dblink_disconnect('${srcDB}$');"
+
+MANIFEST_FORMAT = 2
+
+# operational transaction timestamps -- for DM purposes, always the last two columns of an L1 table
+TIMESTAMP_COLUMNS = ("created_at", "updated_at")
+
 
 def find_inkey ( dm_table ):
 
@@ -43,6 +118,44 @@ def find_inkey ( dm_table ):
 
 	return ""
 
+def find_key ( dm_table, dm_indexes ):
+
+	# the key a table is loaded on: { "columns": key columns, "inkey": key column renamed for DM purposes (or ""), "indexes": other indexes }
+	not_null = [column['column_name'] for column in dm_table if column['is_nullable']=='NO']
+	key_columns = None
+	for index in dm_indexes:
+		if index['primary'] or (index['unique'] and all(col_name in not_null for col_name in index['columns'])):
+			key_columns = index['columns']
+			break
+
+	if key_columns == None:
+		inkey_name = find_inkey(dm_table)
+		if inkey_name=="":
+			return None
+		key_columns = [inkey_name]
+
+	if len(key_columns)==1 and key_columns[0] in ("id", "uuid", "name"):
+		inkey_name = key_columns[0]
+	else:
+		inkey_name = ""
+
+	# every other index, once per column list
+	indexes = []
+	seen = [key_columns]
+	for index in dm_indexes:
+		if index['columns'] not in seen and index['method'] in INDEX_METHODS:
+			indexes.append(index)
+			seen.append(index['columns'])
+
+	return {"columns": key_columns, "inkey": inkey_name, "indexes": indexes}
+
+def out_column ( table_name, col_name, dm_key ):
+
+	# for DM purposes, rename the key to a distinct name -- every other column keeps its source name
+	if col_name==dm_key['inkey']:
+		return make_outkeyname(table_name, col_name)
+	return col_name
+
 def make_outkeyname (table_name, inkey_name ):
 	# for DM purposes, put key first -- and rename it to a distinct name
 	entity_name = table_name.lower()
@@ -55,26 +168,158 @@ def make_outkeyname (table_name, inkey_name ):
 
 	return outkey_name
 
-def gen_dropsql ( oDropFile, dm_table ):
+def column_type ( column ):
+
+	# derive appropriate DDL type name
+	type = column['udt_name']
+	if type=="varchar":
+		type = "varchar({})".format( column['character_maximum_length'] )
+
+	return type
+
+def load_columns ( dm_table ):
+
+	# source columns in L1 order -- created_at and updated_at at the end
+	return [column['column_name'] for column in dm_table if column['column_name'] not in TIMESTAMP_COLUMNS] + list(TIMESTAMP_COLUMNS)
+
+def upsert_sql ( dm_table, dm_key, target_table, staging_table ):
+
+	# INSERT ... ON CONFLICT of the staged rows into the n_ table, with the key column renamed the same way as in the DDL
+	table_name = dm_table[0]['table_name']
+	sql = []
+
+	sql.append("INSERT INTO %s AS \"n\" (" % (target_table))
+	for column in dm_table:
+
+		# derive output column name
+		col_name = out_column(table_name, column['column_name'], dm_key)
+
+		# emit column details, unless is one of the special handled columns
+		if  col_name!="created_at" and col_name!="updated_at":
+			sql.append("\t\"%s\", " % (col_name))
+
+	sql.append("\t\"created_at\",")
+	sql.append("\t\"updated_at\"")
+	sql.append(")")
+
+	sql.append("SELECT	")
+	for column in dm_table:
+
+		# emit column details, unless is one of the special handled columns
+		if  column['column_name']!="created_at" and column['column_name']!="updated_at":
+			sql.append("\t\"%s\", " % (column['column_name']))
+
+	sql.append("\t\"created_at\",")
+	sql.append("\t\"updated_at\"")
+	sql.append("FROM \t%s" % (staging_table))
+
+	sql.append("ON CONFLICT (%s)" % (", ".join("\"%s\"" % (out_column(table_name, col_name, dm_key)) for col_name in dm_key['columns'])))
+	sql.append("\tDO UPDATE")
+	sql.append("\tSET")
+
+	for column in dm_table:
+
+		# emit column details, unless is one of the special handled columns
+		if  column['column_name'] not in dm_key['columns'] and column['column_name']!="created_at" and column['column_name']!="updated_at":
+			sql.append("\t\t\"%s\" = EXCLUDED.\"%s\"," % (column['column_name'], column['column_name']))
+
+	sql.append("\t\t\"created_at\" = EXCLUDED.\"created_at\",")
+	sql.append("\t\t\"updated_at\" = EXCLUDED.\"updated_at\"")
+	# rows read again within the overlap window are left alone
+	sql.append("\tWHERE \"n\".\"updated_at\" IS DISTINCT FROM EXCLUDED.\"updated_at\"")
+
+	return "\n".join(sql)
+
+def watermark_ddl ( norm_schema ):
+
+	return ("CREATE TABLE IF NOT EXISTS %s.\"%s\" (\n"
+	        "\t\"tableName\"\tvarchar(255)\tNOT NULL PRIMARY KEY,\n"
+	        "\t\"highWaterMark\"\ttimestamptz\tNOT NULL,\n"
+	        "\t\"rowCount\"\tbigint,\n"
+	        "\t\"loadedAt\"\ttimestamptz\tNOT NULL DEFAULT now()\n"
+	        ");" % (norm_schema, WATERMARK_TABLE))
+
+def watermark_sql ( table_name, norm_schema ):
+
+	# where the next read of a table starts: its high-water mark less the overlap window -- tables loaded before there was a
+	# watermark table start from their own max("updated_at"), once
+	return ("(SELECT COALESCE((SELECT \"highWaterMark\" FROM %s.\"%s\" WHERE \"tableName\" = '%s'), "
+	        "(SELECT max(\"updated_at\") FROM %s.\"n_%s\"), '-infinity') - interval '%s')"
+	        % (norm_schema, WATERMARK_TABLE, table_name, norm_schema, table_name, OVERLAP_WINDOW))
+
+def merge_sql ( dm_table, dm_key, norm_schema, staging_table, source_sql=None ):
+
+	# the upsert into the n_ table and the move of its watermark, as one statement -- both happen, or neither does
+	# returns the number of rows merged (no row when nothing was staged)
+	# with source_sql, the rows are not staged: source_sql is read once, as the staging_table CTE both the upsert and the watermark read
+	table_name = dm_table[0]['table_name']
+	sql = []
+	if source_sql != None:
+		sql.append("WITH %s AS (" % (staging_table))
+		sql.append(source_sql)
+		sql.append("),")
+		sql.append("\"merged\" AS (")
+	else:
+		sql.append("WITH \"merged\" AS (")
+	sql.append(upsert_sql(dm_table, dm_key, "%s.\"n_%s\"" % (norm_schema, table_name), staging_table))
+	sql.append("\tRETURNING 1")
+	sql.append(")")
+	sql.append("INSERT INTO %s.\"%s\" AS \"w\" (\"tableName\", \"highWaterMark\", \"rowCount\", \"loadedAt\")" % (norm_schema, WATERMARK_TABLE))
+	sql.append("SELECT '%s', max(\"updated_at\"), (SELECT count(*) FROM \"merged\"), now() FROM %s HAVING max(\"updated_at\") IS NOT NULL" % (table_name, staging_table))
+	sql.append("ON CONFLICT (\"tableName\")")
+	sql.append("\tDO UPDATE")
+	sql.append("\tSET")
+	sql.append("\t\t\"highWaterMark\" = GREATEST(\"w\".\"highWaterMark\", EXCLUDED.\"highWaterMark\"),")
+	sql.append("\t\t\"rowCount\" = EXCLUDED.\"rowCount\",")
+	sql.append("\t\t\"loadedAt\" = EXCLUDED.\"loadedAt\"")
+	sql.append("RETURNING \"rowCount\"")
+
+	return "\n".join(sql)
+
+def pg_name ( name ):
+
+	# a name that postgres would truncate is cut short and ends in a hash of the whole name instead, so two long index names that only
+	# differ after MAX_NAME_LENGTH bytes don't collide
+	encoded = name.encode("utf-8")
+	if len(encoded)<=MAX_NAME_LENGTH:
+		return name
+	return "%s_%s" % (encoded[:MAX_NAME_LENGTH - 9].decode("utf-8", "ignore"), hashlib.md5(encoded).hexdigest()[:8])
+
+def has_updated_at_index ( dm_key ):
+
+	for index in dm_key['indexes']:
+		if index['columns'][0]=="updated_at":
+			return True
+	return False
+
+def gen_srcindexsql ( oSrcIndexFile, dm_table, dm_key ):
+
+	table_name = dm_table[0]['table_name']
+	if not has_updated_at_index(dm_key):
+		print("CREATE INDEX CONCURRENTLY IF NOT EXISTS \"%s\" ON \"%s\".\"%s\" (\"updated_at\");" % (pg_name("%s_updated_at_index" % (table_name.lower())),
+		      dm_table[0]['table_schema'], table_name), file=oSrcIndexFile)
+
+	return
+
+def gen_dropsql ( oDropFile, dm_table, strategy="table" ):
 
 	table_name = dm_table[0]['table_name']
 	print("DROP TABLE \"${dstNormDB}$\".\"${dstNormSchema}$\".\"n_%s\";" % (table_name), file=oDropFile)
+	if strategy=="unlogged":
+		# the staging table outlives a load -- a restart recreates it with the source's current columns
+		print("DROP TABLE IF EXISTS %s;" % (staging_name(table_name, strategy)), file=oDropFile)
 
 	return
 
-def gen_ddlsql ( oDDLfile, dm_table, inkey_name ):
+def gen_ddlsql ( oDDLfile, dm_table, dm_key ):
 
 	table_name = dm_table[0]['table_name']
 	print("CREATE TABLE \"${dstNormDB}$\".\"${dstNormSchema}$\".\"n_%s\" (" % (table_name), file=oDDLfile)
 
-	# for DM purposes, put key first -- and rename it to a distinct name
-	outkey_name = make_outkeyname(table_name, inkey_name)
-
 	for column in dm_table:
-		# derive output column name
-		col_name = column['column_name']
-		if col_name==inkey_name:
-			col_name = outkey_name
+		# derive output column name -- for DM purposes, a single key column is renamed to a distinct name
+		col_name = out_column(table_name, column['column_name'], dm_key)
+		if dm_key['columns']==[column['column_name']]:
 			pk = "PRIMARY KEY"
 		else:
 			pk = ""
@@ -95,32 +340,60 @@ def gen_ddlsql ( oDDLfile, dm_table, inkey_name ):
 
 	# for DM purposes, put operation transaction timestamps at the end
 	print("\t\"created_at\"	timestamptz,", file=oDDLfile)
-	print("\t\"updated_at\"	timestamptz", file=oDDLfile)
+	print("\t\"updated_at\"	timestamptz%s" % (key_constraint(table_name, dm_key)), file=oDDLfile)
 	print(");\n", file=oDDLfile)
 
+	for index_name, index_ddl in norm_indexes(dm_table, dm_key):
+		print(index_ddl, file=oDDLfile)
+	print("", file=oDDLfile)
+
 	return
 
-def gen_loadsql ( oL1file, dm_table, inkey_name ):
+def norm_indexes ( dm_table, dm_key, if_not_exists=False ):
 
+	# [ (index name, CREATE INDEX) ] of the indexes of an n_ table, other than its key
 	table_name = dm_table[0]['table_name']
-	outkey_name=make_outkeyname(table_name, inkey_name)
+	create = "CREATE INDEX IF NOT EXISTS" if if_not_exists else "CREATE INDEX"
+	indexes = []
+
+	# carry the source's other indexes over, so lookups on the normalized copy are index backed as well
+	for index in dm_key['indexes']:
+		index_name = pg_name("n_" + index['name'])
+		indexes.append((index_name, "%s \"%s\" ON \"${dstNormDB}$\".\"${dstNormSchema}$\".\"n_%s\" USING %s (%s);" % (create, index_name, table_name, index['method'],
+		                ", ".join("\"%s\"" % (out_column(table_name, col_name, dm_key)) for col_name in index['columns']))))
+	# incremental loads and star loads read the n_ tables by "updated_at"
+	if not has_updated_at_index(dm_key):
+		index_name = pg_name("n_%s_updated_at_index" % (table_name.lower()))
+		indexes.append((index_name, "%s \"%s\" ON \"${dstNormDB}$\".\"${dstNormSchema}$\".\"n_%s\" (\"updated_at\");" % (create, index_name, table_name)))
+
+	return indexes
+
+def key_constraint ( table_name, dm_key ):
+
+	# a composite key is declared after the columns (a single key column is declared inline)
+	if len(dm_key['columns'])==1:
+		return ""
+	return ",\n\tPRIMARY KEY (%s)" % (", ".join("\"%s\"" % (out_column(table_name, col_name, dm_key)) for col_name in dm_key['columns']))
 
-	print("DROP TABLE IF EXISTS \"${tmpNormDB}$\".\"${tmpNormSchema}$\".\"t_%s\";" % (table_name), file=oL1file)
-	print("CREATE TABLE \"${tmpNormDB}$\".\"${tmpNormSchema}$\".\"t_%s\" (" % (table_name), file=oL1file)
+def staging_name ( table_name, strategy ):
 
+	# where a table's rows are staged before they are merged into its n_ table
+	if strategy=="temp":
+		return "pg_temp.\"t_%s\"" % (table_name)
+	return "%s.\"t_%s\"" % (TMP_SCHEMA, table_name)
+
+def staging_columns ( dm_table, dm_key ):
+
+	# the column list of a staging table, under the source column names
+	table_name = dm_table[0]['table_name']
+	sql = []
 	for column in dm_table:
-		# derive output column name
 		col_name = column['column_name']
-		if col_name==inkey_name:
+		if dm_key['columns']==[col_name]:
 			pk = "PRIMARY KEY"
 		else:
 			pk = ""
 
-		# derive appropriate DDL type name
-		type = column['udt_name']
-		if type=="varchar":
-			type = "varchar({})".format( column['character_maximum_length'] )
-
 		if column['is_nullable']=='NO':
 			nn = "NOT NULL"
 		else:
@@ -128,74 +401,81 @@ def gen_loadsql ( oL1file, dm_table, inkey_name ):
 
 		# emit column details, unless is one of the special handled columns
 		if  column['column_name']!="created_at" and column['column_name']!="updated_at":
-			print("\t\"%s\"\t%s\t%s\t%s, " % (col_name, type, nn, pk), file=oL1file)
+			sql.append("\t\"%s\"\t%s\t%s\t%s, " % (col_name, column_type(column), nn, pk))
 
 	# for DM purposes, put operation transaction timestamps at the end
-	print("\t\"created_at\"	timestamptz,", file=oL1file)
-	print("\t\"updated_at\"	timestamptz", file=oL1file)
-	print(");\n", file=oL1file)
+	sql.append("\t\"created_at\"	timestamptz,")
+	sql.append("\t\"updated_at\"	timestamptz%s" % (key_constraint(table_name, {"columns": dm_key['columns'], "inkey": ""})))
 
-	print("INSERT INTO \"${tmpNormDB}$\".\"${tmpNormSchema}$\".\"t_%s\" (" % (table_name), file=oL1file)
-	for column in dm_table:
+	return "\n".join(sql)
 
-		# emit column details, unless is one of the special handled columns
-		if  column['column_name']!="created_at" and column['column_name']!="updated_at":
-			print("\t\"%s\", " % (column['column_name']), file=oL1file)
+def dblink_sql ( dm_table ):
 
-	print("\t\"created_at\",", file=oL1file)
-	print("\t\"updated_at\"", file=oL1file)
-	print(")\n", file=oL1file)
+	# the rows of a source table updated since its watermark, read over the DB LINK opened by DBLINK_CONNECT
+	table_name = dm_table[0]['table_name']
+	sql = []
 
-	print("SELECT * FROM public.dblink('${srcDB}$',", file=oL1file)
-	print("\t'SELECT", file=oL1file)
+	sql.append("SELECT * FROM public.dblink('${srcDB}$',")
+	sql.append("\t'SELECT")
 	for column in dm_table:
 
 		# emit column details, unless is one of the special handled columns
 		if  column['column_name']!="created_at" and column['column_name']!="updated_at":
-			print("\t\t\"%s\", " % (column['column_name']), file=oL1file)
+			sql.append("\t\t\"%s\", " % (column['column_name']))
 
-	print("\t\t\"created_at\",", file=oL1file)
-	print("\t\t\"updated_at\"", file=oL1file)
-	print("", file=oL1file)
-	print("\tFROM \"${srcDB}$\".\"${srcSchema}$\".\"%s\"" % (table_name), file=oL1file)
-	print("\tWHERE \"updated_at\"> ''' ||  (select COALESCE(max(\"updated_at\"), '-infinity') FROM \"${dstNormDB}$\".\"${dstNormSchema}$\".\"n_%s\") || ''''" % (table_name), file=oL1file)
+	sql.append("\t\t\"created_at\",")
+	sql.append("\t\t\"updated_at\"")
+	sql.append("")
+	sql.append("\tFROM \"${srcDB}$\".\"${srcSchema}$\".\"%s\"" % (table_name))
+	sql.append("\tWHERE \"updated_at\"> ''' ||  %s || ''''" % (watermark_sql(table_name, NORM_SCHEMA)))
 
-	print("\n) AS (", file=oL1file)
+	sql.append("\n) AS (")
 
 	for column in dm_table:
 
-		# derive appropriate DDL type name
-		type = column['udt_name']
-		if type=="varchar":
-			type = "varchar({})".format( column['character_maximum_length'] )
-
 		# emit column details, unless is one of the special handled columns
 		if  column['column_name']!="created_at" and column['column_name']!="updated_at":
-			print("\t\"%s\"\t%s, " % (column['column_name'], type), file=oL1file)
+			sql.append("\t\"%s\"\t%s, " % (column['column_name'], column_type(column)))
 
 	# for DM purposes, put operation transaction timestamps at the end
-	print("\t\"created_at\"	timestamptz,", file=oL1file)
-	print("\t\"updated_at\"	timestamptz", file=oL1file)
+	sql.append("\t\"created_at\"	timestamptz,")
+	sql.append("\t\"updated_at\"	timestamptz")
+	sql.append(")")
 
-	print(");\n", file=oL1file)
+	return "\n".join(sql)
 
-	print("INSERT INTO \"${dstNormDB}$\".\"${dstNormSchema}$\".\"n_%s\" (" % (table_name), file=oL1file)
-	for column in dm_table:
+def gen_loadsql ( oL1file, dm_table, dm_key, strategy="table" ):
 
-		# derive output column name
-		col_name = column['column_name']
-		if col_name==inkey_name:
-			col_name = outkey_name
-
-		# emit column details, unless is one of the special handled columns
-		if  col_name!="created_at" and col_name!="updated_at":
-			print("\t\"%s\", " % (col_name), file=oL1file)
-
-	print("\t\"created_at\",", file=oL1file)
-	print("\t\"updated_at\"", file=oL1file)
-	print(")", file=oL1file)
+	table_name = dm_table[0]['table_name']
+	staging_table = staging_name(table_name, strategy)
+
+	if strategy=="direct":
+		# no staging table -- the rows read over the DB LINK are merged as they arrive
+		print(merge_sql(dm_table, dm_key, NORM_SCHEMA, "\"staged\"", dblink_sql(dm_table)), file=oL1file)
+		print(";", file=oL1file)
+		return
+
+	if strategy=="temp":
+		# session temp table: no WAL for the staged rows, and created once per session, not once per load
+		print("CREATE TEMP TABLE IF NOT EXISTS %s (" % (staging_table), file=oL1file)
+		print(staging_columns(dm_table, dm_key), file=oL1file)
+		print(");\n", file=oL1file)
+		print("TRUNCATE %s;\n" % (staging_table), file=oL1file)
+	elif strategy=="unlogged":
+		# kept between loads and emptied with TRUNCATE -- no catalog churn, and no WAL for the staged rows
+		print("CREATE UNLOGGED TABLE IF NOT EXISTS %s (" % (staging_table), file=oL1file)
+		print(staging_columns(dm_table, dm_key), file=oL1file)
+		print(");\n", file=oL1file)
+		print("TRUNCATE %s;\n" % (staging_table), file=oL1file)
+		# a t_ table left behind by --staging=table is a regular table, IF NOT EXISTS keeps it -- a no-op once it's unlogged
+		print("ALTER TABLE %s SET UNLOGGED;\n" % (staging_table), file=oL1file)
+	else:
+		print("DROP TABLE IF EXISTS %s;" % (staging_table), file=oL1file)
+		print("CREATE TABLE %s (" % (staging_table), file=oL1file)
+		print(staging_columns(dm_table, dm_key), file=oL1file)
+		print(");\n", file=oL1file)
 
-	print("SELECT	", file=oL1file)
+	print("INSERT INTO %s (" % (staging_table), file=oL1file)
 	for column in dm_table:
 
 		# emit column details, unless is one of the special handled columns
@@ -204,21 +484,11 @@ def gen_loadsql ( oL1file, dm_table, inkey_name ):
 
 	print("\t\"created_at\",", file=oL1file)
 	print("\t\"updated_at\"", file=oL1file)
-	print("FROM \t\"${tmpNormDB}$\".\"${tmpNormSchema}$\".\"t_%s\"" % (table_name), file=oL1file)
-
-	print("ON CONFLICT (\"%s\")" % (outkey_name), file=oL1file)
-	print("\tDO UPDATE", file=oL1file)
-	print("\tSET", file=oL1file)
-
-	for column in dm_table:
-
-		# emit column details, unless is one of the special handled columns
-		if  column['column_name']!=inkey_name and column['column_name']!="created_at" and column['column_name']!="updated_at":
-			print("\t\t\"%s\" = EXCLUDED.\"%s\"," % (column['column_name'], column['column_name']), file=oL1file)
+	print(")\n", file=oL1file)
 
-	print("\t\t\"created_at\" = EXCLUDED.\"created_at\",", file=oL1file)
-	print("\t\t\"updated_at\" = EXCLUDED.\"updated_at\"", file=oL1file)
+	print("%s;\n" % (dblink_sql(dm_table)), file=oL1file)
 
+	print(merge_sql(dm_table, dm_key, NORM_SCHEMA, staging_table), file=oL1file)
 	print(";", file=oL1file)
 
 
@@ -226,87 +496,349 @@ def gen_loadsql ( oL1file, dm_table, inkey_name ):
 
 
 
-# make sure appopriate input / output parameters are passed in
-if len(sys.argv)!=5:
-	print("Usage: python reddm_l1_jdbc.py <source_schema_name> <output_drop_n.sql> <output_ddl.sql> <output_L1_SQL.sql>")
-	exit()
-
-# connect to data directionary for given schema
-try:
-  conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (core_db, core_user, host, core_password)
-  conn = psycopg2.connect(conn_string)
+def gen_loadmanifest ( oL1file, planned, strategy="table" ):
 
-except:
-	print("Error Connecting to : psycopg2.connect(\"dbname='reva_core' user='xxx' host='coredb.dev.env.reva.tech' password='xxx'\")")
-	exit()
+	# the L1 load as per table units: "setup" runs once, before any table -- every worker connection runs "connect" once, then any
+	# number of table units (each one the same instructions L1_LOAD.sql has for the table), then "disconnect".   A unit's "merge" is the
+	# index of its merge_sql instruction, which returns the number of rows merged
+	manifest = {"format": MANIFEST_FORMAT, "connect": DBLINK_CONNECT, "setup": [watermark_ddl(NORM_SCHEMA)], "disconnect": DBLINK_DISCONNECT, "tables": []}
 
-dd_query = "SELECT table_catalog, table_schema, table_name, column_name, ordinal_position, is_nullable, data_type, character_maximum_length, udt_name FROM information_schema.columns WHERE table_schema = '%s' order by 1,2,3,5;" % ( sys.argv[1] )
+	for mytable, dm_key in planned:
+		oUnitFile = io.StringIO()
+		gen_loadsql (oUnitFile, mytable, dm_key, strategy)
+		instructions = [statement['instruction'] for statement in md_sqlsplit.iter_statements(oUnitFile.getvalue().splitlines())]
+		manifest['tables'].append({"table": mytable[0]['table_name'], "instructions": instructions, "merge": len(instructions) - 1})
 
-try:
-	cur = conn.cursor()
-	cur.execute(dd_query)
-except:
-	print("Error Connecting to Data Dictionary: [%s]" % (dd_queryy))
-	exit()
+	json.dump(manifest, oL1file, indent=1)
 
-print("Analyzing Data Directionary for reva_core schema: ", sys.argv[1])
-reader = cur.fetchall()
-
-oDropFile  = open(sys.argv[2], "w")
-oDDLfile  = open(sys.argv[3], "w")
-oL1file  = open(sys.argv[4], "w")
-
-rownum = 0
-tablerownum = 0
-tablecount = 0
-skipcount = 0
-myrow = []
-mytable = []
-
-print("SELECT public.dblink_connect('${srcDB}$', 'dbname=${srcDB}$ port=5432 host=${srcServer}$ user=${srcUser}$ password=${srcPassword}$');\n", file=oL1file)
-
-# Save header row, to extract metadata names later
-header = [ "table_catalog",	"table_schema",	"table_name", "column_name", "ordinal_position", "is_nullable", "data_type", "character_maximum_length", "udt_name" ]
-
-for row in reader:
-
-	myrow = {header[0] : row[0], header[1] : row[1], header[2] : row[2], header[3]: row[3], header[4]: row[4], header[5]: row[5], header[6]: row[6], header[7]: row[7], header[8]: row[8]}
+	return
 
-	if tablerownum==0 or myrow['table_name']==mytable[0]['table_name']:
-		mytable.append(myrow)
-		tablerownum += 1
+def diff_table ( dm_table, dm_key, n_table, n_indexes ):
 
-	else:
-		# we've run into the next table on the list...  mytable now contains all of the columns in the last table.
-		inkey_name = find_inkey(mytable)
-
-		# the following skip list are tables that don't follow the assumed operational table pattern for some reason
-		# each of these are skipped, not loaded into L1 automatically -- and if they are important, must be added into the L1_DDL/LOAD_MANUAL.SQL for manual processing there
-		# note -- support for tables with compound PK's will fix most of the remaining tables on this list.
-		skiplist = ("knex_migrations", "knex_migrations_lock", "TeamProperties",  "Associated_Fee", "ResetTokens")
-		if not mytable[0]['table_name'] in skiplist:
-			gen_dropsql (oDropFile, mytable)
-			gen_ddlsql (oDDLfile, mytable, inkey_name)
-			gen_loadsql (oL1file, mytable, inkey_name)
+	# compares a planned source table with its existing n_ table (its data dictionary rows and pg_index rows in the mart)
+	# returns { "rebuild": reason or None, "alter": [ ALTER TABLE ], "backfill": [ source columns added ], "indexes": [ CREATE INDEX ], "changes": [ text ] }
+	table_name = dm_table[0]['table_name']
+	target = "%s.\"n_%s\"" % (NORM_SCHEMA, table_name)
+	diff = {"rebuild": None, "alter": [], "backfill": [], "indexes": [], "changes": []}
+
+	# a different key (or a key renamed differently) can't be altered in place -- the table is rebuilt and reloaded
+	key_columns = [out_column(table_name, col_name, dm_key) for col_name in dm_key['columns']]
+	n_key = [index['columns'] for index in n_indexes if index['primary']]
+	if n_key != [key_columns]:
+		diff['rebuild'] = "key (%s) was (%s)" % (", ".join(key_columns), ", ".join(n_key[0]) if n_key else "none")
+		return diff
+
+	n_columns = {column['column_name']: column for column in n_table}
+	out_names = []
+	for column in dm_table:
+		col_name = out_column(table_name, column['column_name'], dm_key)
+		out_names.append(col_name)
+		if col_name in TIMESTAMP_COLUMNS:
+			continue
+		n_column = n_columns.get(col_name)
+
+		if n_column == None:
+			# added as nullable -- the rows already loaded get their value from the backfill
+			diff['alter'].append("ALTER TABLE %s ADD COLUMN \"%s\" %s;" % (target, col_name, column_type(column)))
+			diff['backfill'].append(column)
+			diff['changes'].append("add column %s %s" % (col_name, column_type(column)))
+			continue
+
+		if column_type(n_column) != column_type(column):
+			diff['alter'].append("ALTER TABLE %s ALTER COLUMN \"%s\" TYPE %s USING \"%s\"::%s;" % (target, col_name, column_type(column), col_name, column_type(column)))
+			diff['changes'].append("column %s %s was %s" % (col_name, column_type(column), column_type(n_column)))
+
+		# a column that became nullable must take NULLs -- one that became NOT NULL is left as is, older rows may be NULL
+		if column['is_nullable']=='YES' and n_column['is_nullable']=='NO':
+			diff['alter'].append("ALTER TABLE %s ALTER COLUMN \"%s\" DROP NOT NULL;" % (target, col_name))
+			diff['changes'].append("column %s nullable" % (col_name))
+
+	# columns dropped from the source are kept (the n_ tables are a historical copy), but must take NULLs from now on
+	for n_column in n_table:
+		if n_column['column_name'] not in out_names and n_column['is_nullable']=='NO':
+			diff['alter'].append("ALTER TABLE %s ALTER COLUMN \"%s\" DROP NOT NULL;" % (target, n_column['column_name']))
+			diff['changes'].append("column %s dropped from source" % (n_column['column_name']))
+
+	n_index_names = [index['name'] for index in n_indexes]
+	for index_name, index_ddl in norm_indexes(dm_table, dm_key, True):
+		if index_name not in n_index_names:
+			diff['indexes'].append(index_ddl)
+			diff['changes'].append("add index %s" % (index_name))
+
+	return diff
+
+def backfill_sql ( dm_table, dm_key, columns ):
+
+	# fills columns added to an n_ table for the rows already loaded, reading only the key and those columns from the source
+	table_name = dm_table[0]['table_name']
+	by_name = {column['column_name']: column for column in dm_table}
+	read = [by_name[col_name] for col_name in dm_key['columns']] + columns
+	sql = []
+
+	sql.append("UPDATE %s.\"n_%s\" AS \"n\"" % (NORM_SCHEMA, table_name))
+	sql.append("SET")
+	sql.append(",\n".join("\t\"%s\" = \"s\".\"%s\"" % (column['column_name'], column['column_name']) for column in columns))
+	sql.append("FROM public.dblink('${srcDB}$',")
+	sql.append("\t'SELECT %s FROM \"${srcDB}$\".\"${srcSchema}$\".\"%s\"'" % (", ".join("\"%s\"" % (column['column_name']) for column in read), table_name))
+	sql.append(") AS \"s\" (%s)" % (", ".join("\"%s\" %s" % (column['column_name'], column_type(column)) for column in read)))
+	sql.append("WHERE %s;" % (" AND ".join("\"n\".\"%s\" = \"s\".\"%s\"" % (out_column(table_name, col_name, dm_key), col_name) for col_name in dm_key['columns'])))
+
+	return "\n".join(sql)
+
+def gen_migratesql ( oMigrateFile, planned, n_tables, n_indexes, strategy="table" ):
+
+	# the statements that bring an existing normalized layer in line with the source -- new tables are created, changed tables altered
+	# (and rebuilt only when their key changed), and only what changed is loaded again.   returns [ (table_name, action, changes) ]
+	report = []
+	backfills = []
+
+	print("%s\n" % (watermark_ddl(NORM_SCHEMA)), file=oMigrateFile)
+	for mytable, dm_key in planned:
+		table_name = mytable[0]['table_name']
+		n_table = n_tables.get("n_" + table_name)
+
+		if n_table == None or n_table == []:
+			action, changes = "create", []
 		else:
-			skipcount += 1
-
-		# reset the table index for the next one
-		mytable=[ myrow ]
-		tablerownum = 1
-		tablecount += 1
+			diff = diff_table(mytable, dm_key, n_table, n_indexes.get("n_" + table_name, []))
+			if diff['rebuild'] != None:
+				action, changes = "rebuild", [diff['rebuild']]
+			elif diff['alter'] or diff['indexes']:
+				action, changes = "alter", diff['changes']
+			else:
+				continue
+
+		report.append((table_name, action, changes))
+		print("-- n_%s: %s%s" % (table_name, action, "".join("\n-- \t%s" % (change) for change in changes)), file=oMigrateFile)
+
+		if action == "rebuild":
+			print("DROP TABLE %s.\"n_%s\";" % (NORM_SCHEMA, table_name), file=oMigrateFile)
+		if action != "alter":
+			# a new or rebuilt table is loaded in full by the next L1 load: without a watermark or rows, it reads from -infinity
+			gen_ddlsql (oMigrateFile, mytable, dm_key)
+			print("DELETE FROM %s.\"%s\" WHERE \"tableName\" = '%s';\n" % (NORM_SCHEMA, WATERMARK_TABLE, table_name), file=oMigrateFile)
+		else:
+			for statement in diff['alter'] + diff['indexes']:
+				print(statement, file=oMigrateFile)
+			print("", file=oMigrateFile)
+			if diff['backfill']:
+				backfills.append(backfill_sql(mytable, dm_key, diff['backfill']))
+
+		# a persistent staging table has the old columns
+		if strategy=="unlogged":
+			print("DROP TABLE IF EXISTS %s;\n" % (staging_name(table_name, strategy)), file=oMigrateFile)
+
+	if backfills:
+		print("%s\n" % (DBLINK_CONNECT), file=oMigrateFile)
+		for backfill in backfills:
+			print("%s\n" % (backfill), file=oMigrateFile)
+		print("%s\n" % (DBLINK_DISCONNECT), file=oMigrateFile)
+
+	return report
+
+def connect_mart ():
+
+	# connect to the mart, to read the normalized tables a diff compares against
+	try:
+		conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (mart_db, mart_user, host, mart_password)
+		return psycopg2.connect(conn_string)
+
+	except psycopg2.Error:
+		print("Error Connecting to : psycopg2.connect(\"dbname='reva_mart' user='xxx' host='coredb.dev.env.reva.tech' password='xxx'\")")
+		exit()
+
+def connect_core ():
+
+	# connect to data directionary for given schema
+	try:
+		conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (core_db, core_user, host, core_password)
+		return psycopg2.connect(conn_string)
+
+	except psycopg2.Error:
+		print("Error Connecting to : psycopg2.connect(\"dbname='reva_core' user='xxx' host='coredb.dev.env.reva.tech' password='xxx'\")")
+		exit()
+
+def read_data_dictionary ( cur, schema_name ):
+
+	# returns the tables of a schema, each as the list of its column rows (DD_HEADER dicts) in ordinal order
+	dd_query = "SELECT table_catalog, table_schema, table_name, column_name, ordinal_position, is_nullable, data_type, character_maximum_length, udt_name FROM information_schema.columns WHERE table_schema = %s order by 1,2,3,5;"
+	cur.execute(dd_query, (schema_name,))
+
+	tables = []
+	for row in cur.fetchall():
+		myrow = dict(zip(DD_HEADER, row))
+		if not tables or myrow['table_name']!=tables[-1][0]['table_name']:
+			tables.append([])
+		tables[-1].append(myrow)
+
+	return tables
+
+def read_indexes ( cur, schema_name ):
+
+	# returns { table_name: [ { "name", "columns", "primary", "unique", "method" } ] } -- primary key first, then unique indexes
+	# only plain column indexes: expression (attnum 0) and partial indexes can't back an ON CONFLICT on columns, and aren't carried over
+	index_query = """SELECT t.relname, i.relname, x.indisprimary, x.indisunique, am.amname,
+		array(SELECT a.attname FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k (attnum, n) JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum ORDER BY k.n)
+	FROM pg_index x
+		JOIN pg_class t ON t.oid = x.indrelid
+		JOIN pg_class i ON i.oid = x.indexrelid
+		JOIN pg_namespace ns ON ns.oid = t.relnamespace
+		JOIN pg_am am ON am.oid = i.relam
+	WHERE ns.nspname = %s AND x.indpred IS NULL AND NOT (0 = ANY (x.indkey::int2[])) AND x.indisvalid
+	ORDER BY 1, 3 DESC, 4 DESC, 2;"""
+	cur.execute(index_query, (schema_name,))
+
+	dm_indexes = {}
+	for row in cur.fetchall():
+		dm_indexes.setdefault(row[0], []).append({"name": row[1], "primary": row[2], "unique": row[3], "method": row[4], "columns": list(row[5])})
+
+	return dm_indexes
+
+def plan_tables ( dm_tables, dm_indexes ):
+
+	# returns ([ (dm_table, dm_key) ] of the tables that are loaded, [ (table_name, reason) ] of the ones that are skipped)
+	planned = []
+	skipped = []
+	for dm_table in dm_tables:
+		table_name = dm_table[0]['table_name']
+		dm_key = find_key(dm_table, dm_indexes.get(table_name, []))
+
+		if table_name in SKIPLIST:
+			skipped.append((table_name, "skip list"))
+		elif dm_key == None:
+			skipped.append((table_name, "no primary key or unique index"))
+		elif "updated_at" not in [column['column_name'] for column in dm_table]:
+			skipped.append((table_name, "no updated_at column"))
+		else:
+			planned.append((dm_table, dm_key))
+
+	return planned, skipped
+
+def main_diff ( argv, strategy ):
+
+	# make sure appopriate input / output parameters are passed in
+	if len(argv)!=4 or strategy not in STAGING_STRATEGIES:
+		print("Usage: python reddm_l1_jdbc.py --diff <source_schema_name> <mart_norm_schema_name> <output_L1_MIGRATE.sql> [--staging=%s]" % ("|".join(STAGING_STRATEGIES)))
+		exit()
+
+	conn = connect_core()
+	try:
+		cur = conn.cursor()
+		dm_tables = read_data_dictionary(cur, argv[1])
+		dm_indexes = read_indexes(cur, argv[1])
+	except psycopg2.Error:
+		print("Error Connecting to Data Dictionary: [%s]" % (argv[1]))
+		exit()
+
+	mart_conn = connect_mart()
+	try:
+		mart_cur = mart_conn.cursor()
+		n_tables = {n_table[0]['table_name']: n_table for n_table in read_data_dictionary(mart_cur, argv[2])}
+		n_indexes = read_indexes(mart_cur, argv[2])
+	except psycopg2.Error:
+		print("Error Reading Normalized Schema: [%s]" % (argv[2]))
+		exit()
+
+	print("Comparing Data Directionary for reva_core schema: %s with normalized schema: %s" % (argv[1], argv[2]))
+
+	planned, skipped = plan_tables(dm_tables, dm_indexes)
+	oMigrateFile = open(argv[3], "w")
+	report = gen_migratesql(oMigrateFile, planned, n_tables, n_indexes, strategy)
+	oMigrateFile.close()
+
+	for action in ("create", "rebuild", "alter"):
+		tables = [(table_name, changes) for table_name, table_action, changes in report if table_action==action]
+		print("\tTables to %s: %d" % (action.capitalize(), len(tables)))
+		for table_name, changes in tables:
+			print("\t\t%s" % (table_name))
+			for change in changes:
+				print("\t\t\t%s" % (change))
+	# n_ tables are never dropped by a diff -- they keep the history of a table the source no longer has
+	planned_names = ["n_" + mytable[0]['table_name'] for mytable, dm_key in planned]
+	orphans = [table_name for table_name in n_tables if table_name.startswith("n_") and table_name not in planned_names]
+	print("\tNormalized Tables No Longer Loaded: %d" % (len(orphans)))
+	for table_name in orphans:
+		print("\t\t%s" % (table_name))
+	print("\tOutput file written:  %s" % (argv[3]))
+
+	cur.close()
+	conn.close()
+	mart_cur.close()
+	mart_conn.close()
+
+def main ( argv ):
+
+	# the staging strategy option may come anywhere, the rest are positional
+	strategy = "table"
+	for arg in [arg for arg in argv if arg.startswith("--staging=")]:
+		strategy = arg[len("--staging="):]
+		argv = [other for other in argv if other!=arg]
+
+	if "--diff" in argv:
+		main_diff([arg for arg in argv if arg!="--diff"], strategy)
+		return
+
+	# make sure appopriate input / output parameters are passed in
+	if (len(argv)!=5 and len(argv)!=6) or strategy not in STAGING_STRATEGIES:
+		print("Usage: python reddm_l1_jdbc.py <source_schema_name> <output_drop_n.sql> <output_ddl.sql> <output_L1_SQL.sql> [<output_src_indexes.sql>] [--staging=%s]" % ("|".join(STAGING_STRATEGIES)))
+		exit()
+
+	conn = connect_core()
+
+	try:
+		cur = conn.cursor()
+		dm_tables = read_data_dictionary(cur, argv[1])
+		dm_indexes = read_indexes(cur, argv[1])
+	except psycopg2.Error:
+		print("Error Connecting to Data Dictionary: [%s]" % (argv[1]))
+		exit()
+
+	print("Analyzing Data Directionary for reva_core schema: ", argv[1])
+
+	oDropFile  = open(argv[2], "w")
+	oDDLfile  = open(argv[3], "w")
+	oL1file  = open(argv[4], "w")
+	oSrcIndexFile = open(argv[5], "w") if len(argv)==6 else None
+
+	planned, skipped = plan_tables(dm_tables, dm_indexes)
+
+	load_manifest = argv[4].lower().endswith(".json")
+
+	print("%s\n" % (watermark_ddl(NORM_SCHEMA)), file=oDDLfile)
+	if not load_manifest:
+		print("%s\n" % (DBLINK_CONNECT), file=oL1file)
+		# marts created before the watermark table existed get it on their first load
+		print("%s\n" % (watermark_ddl(NORM_SCHEMA)), file=oL1file)
+
+	for mytable, dm_key in planned:
+		gen_dropsql (oDropFile, mytable, strategy)
+		gen_ddlsql (oDDLfile, mytable, dm_key)
+		if not load_manifest:
+			gen_loadsql (oL1file, mytable, dm_key, strategy)
+		if oSrcIndexFile != None:
+			gen_srcindexsql (oSrcIndexFile, mytable, dm_key)
+
+	print("DROP TABLE IF EXISTS %s.\"%s\";" % (NORM_SCHEMA, WATERMARK_TABLE), file=oDropFile)
+	if load_manifest:
+		gen_loadmanifest (oL1file, planned, strategy)
+	else:
+		print("%s\n" % (DBLINK_DISCONNECT), file=oL1file)
 
-	rownum += 1
+	print("\tTables Read: %d" % (len(dm_tables)))
+	print("\tTables Skipped: %d" % (len(skipped)))
+	for table_name, reason in skipped:
+		print("\t\t%s -- %s" % (table_name, reason))
+	print("\tOutput files written:  %s" % (" ".join(argv[2:])))
 
-print("SELECT public.dblink_disconnect('${srcDB}$');\n", file=oL1file)
+	cur.close()
+	conn.close()
 
-print("\tTables Read: %d" % (tablecount))
-print("\tTables Skipped: %d" % (skipcount))
-print("\tOutput files written:  %s %s %s" % (sys.argv[2], sys.argv[3], sys.argv[4]))
+	oDropFile.close()
+	oDDLfile.close()
+	oL1file.close()
+	if oSrcIndexFile != None:
+		oSrcIndexFile.close()
 
-cur.close()
-conn.close()
 
-oDropFile.close()
-oDDLfile.close()
-oL1file.close()
+if __name__ == "__main__":
+	main(sys.argv)
@@ -0,0 +1,299 @@
+# reddm_l1_runner.py
+#	runs the L1 load of a tenant as independent per table load units over N worker connections.   The L1 tables don't depend on each
+#	other, so a refresh takes about as long as its slowest table instead of the sum of all of them.
+#
+# Usage:
+#   python reddm_l1_runner.py <MD_schema> <src_tenant_name> (--manifest <L1_LOAD.json> | --copy) [test] [--workers N] [--tables T [T ...]]
+#   where
+#		MD_schema - location schema of MD tables (see reddm_runjobgroup.py)
+#		src_tenant_name - tenant whose tenant variables say where to read from and write to (see reddm_l1_copy.py)
+#		--manifest - run the per table units of a load manifest written by reddm_l1_jdbc.py (an L1_LOAD output named *.json): DB LINK
+#			SQL, with the tenant variables expanded the same way reddm_runjobgroup.py does it
+#		--copy - load each table with reddm_l1_copy.py (COPY streaming, no DB LINK) -- --buffer-chunks and --chunk-rows as there.
+#			EXPERIMENTAL, see reddm_l1_copy.py
+#		--workers - number of tables loaded at the same time (default 4); each worker has its own mart (and, with --copy, source) connection
+#		--tables - OPTIONALLY only load these source tables
+#		test - OPTIONALLY run against the local test databases (reva_test / reva_mart_test)
+#
+# NOTES:
+#   - before anything is loaded, the delta of every table (rows updated since its watermark) is estimated from the source planner
+#     (EXPLAIN, no rows are read), and tables are handed out largest delta first, so the slow tables start early and the small ones
+#     fill in the gaps
+#   - the manifest's "setup" instructions run once, before any table; a worker opens its connections (and runs the manifest's
+#     "connect") once, for all of its tables
+#   - a table unit stops at its first failing instruction (the rest of the unit works on what that one staged); other tables carry on
+#   - the summary lists every table with its estimated delta, the rows its merge wrote (the "rowCount" recorded in s_L1Watermark: rows
+#     read again within the overlap window and left alone aren't counted) and its duration, and compares the elapsed time with the sum
+#     of the table durations.   Manifests written before the merge reported its rows (format 1) are refused -- regenerate them
+
+import sys
+import json
+import queue
+import argparse
+import datetime
+import threading
+import psycopg2
+
+import reddm_l1_copy
+import reddm_l1_jdbc
+import reddm_template
+import reddm_runjobgroup
+
+DEFAULT_WORKERS = 4
+
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(usage="python reddm_l1_runner.py <MD_schema> <src_tenant_name> (--manifest <L1_LOAD.json> | --copy) [test] [--workers N] [--tables T [T ...]]")
+  parser.add_argument("md_schema")
+  parser.add_argument("src_tenant")
+  parser.add_argument("env", nargs="?")
+  mode = parser.add_mutually_exclusive_group(required=True)
+  mode.add_argument("--manifest", default=None)
+  mode.add_argument("--copy", action="store_true")
+  parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+  parser.add_argument("--tables", nargs="+", default=None)
+  parser.add_argument("--buffer-chunks", type=int, default=reddm_l1_copy.DEFAULT_BUFFER_CHUNKS)
+  parser.add_argument("--chunk-rows", type=int, default=0)
+  args = parser.parse_args(argv)
+
+  return {"MD_SCHEMA": args.md_schema, "SRC_TENANT": args.src_tenant, "TEST": args.env == "test", "MANIFEST": args.manifest,
+          "WORKERS": max(1, args.workers), "TABLES": args.tables, "BUFFER_CHUNKS": max(1, args.buffer_chunks),
+          "CHUNK_ROWS": max(0, args.chunk_rows)}
+
+
+def read_manifest(manifest_file):
+  with open(manifest_file, "r") as oManifest:
+    manifest = json.load(oManifest)
+  if manifest.get("format") != reddm_l1_jdbc.MANIFEST_FORMAT:
+    raise ValueError("unsupported manifest format %s" % (manifest.get("format")))
+  return manifest
+
+
+class ManifestExpander:
+  """expands the ${var}$ placeholders of manifest instructions with one tenant's variables"""
+
+  def __init__(self, tenant_name, tenant_vars):
+    self.tenant_name = tenant_name
+    self.tenant_vars = tenant_vars
+    self.engine = reddm_template.TemplateEngine(tenant_vars)
+
+  def unknown_vars(self, instructions):
+    unknown = set()
+    for instruction in instructions:
+      unknown.update(self.engine.unknown_vars(self.compile(instruction), self.tenant_vars))
+    return unknown
+
+  def compile(self, instruction):
+    # the same rewrite md_genfromsql.py applies when it registers generated SQL
+    return self.engine.compile(instruction.replace("${", "%{").replace("}$", "}%"))
+
+  def expand(self, instruction):
+    return reddm_template.render(self.engine.expand(self.tenant_name, self.tenant_vars, self.compile(instruction)))
+
+
+def estimate_delta(src_cur, dst_cur, tenant_vars, table_name):
+  """planner estimate of the rows a table's next load reads -- None when it can't be estimated (e.g. the n_ table doesn't exist yet)"""
+  try:
+    watermark = reddm_l1_copy.read_watermark(dst_cur, tenant_vars, table_name)
+    src_cur.execute("EXPLAIN (FORMAT JSON) SELECT 1 FROM \"%s\".\"%s\" WHERE \"updated_at\" > %%s::timestamptz" % (tenant_vars["srcSchema"], table_name),
+                    (watermark,))
+    plan = src_cur.fetchone()[0]
+    if isinstance(plan, str):
+      plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+  except psycopg2.Error:
+    src_cur.connection.rollback()
+    dst_cur.connection.rollback()
+    return None
+
+
+def order_units(settings, tenant_vars, units):
+  """estimate every unit's delta and sort the units largest first (units that couldn't be estimated go first -- likely never loaded)"""
+  src_conn = psycopg2.connect(reddm_l1_copy.source_conn_string(tenant_vars))
+  dst_conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+  src_cur = src_conn.cursor()
+  dst_cur = dst_conn.cursor()
+  for unit in units:
+    unit["estimate"] = estimate_delta(src_cur, dst_cur, tenant_vars, unit["table"])
+  src_conn.close()
+  dst_conn.close()
+
+  return sorted(units, key=lambda unit: (unit["estimate"] is not None, -(unit["estimate"] or 0)))
+
+
+def run_manifest_unit(worker, unit):
+  rows = 0
+  for index, instruction in enumerate(unit["instructions"]):
+    err_code, err_string, rowcount = reddm_runjobgroup.execute_instruction(worker["dst_conn"], worker["expander"].expand(instruction),
+                                                                           fetch=index == unit["merge"])
+    if err_code != None or err_string != "":
+      raise psycopg2.Error("[%s-%s]" % (err_code, err_string))
+    # the merge returns the rows it merged -- the "rowCount" it records in s_L1Watermark, whichever way the rows were staged
+    if index == unit["merge"]:
+      rows = rowcount
+  return rows
+
+
+def run_copy_unit(worker, unit):
+  result = reddm_l1_copy.load_table(worker["src_conn"], worker["dst_conn"], worker["tenant_vars"], unit["dm_table"], unit["dm_key"],
+                                    worker["buffer_chunks"], worker["chunk_rows"])
+  return result["merged"]
+
+
+def open_worker(settings, cmd_line, tenant_vars, manifest):
+  worker = {"tenant_vars": tenant_vars, "buffer_chunks": cmd_line["BUFFER_CHUNKS"], "chunk_rows": cmd_line["CHUNK_ROWS"], "src_conn": None, "expander": None}
+  worker["dst_conn"] = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+
+  if manifest != None:
+    worker["expander"] = ManifestExpander(cmd_line["SRC_TENANT"], tenant_vars)
+    err_code, err_string, rowcount = reddm_runjobgroup.execute_instruction(worker["dst_conn"], worker["expander"].expand(manifest["connect"]))
+    if err_code != None or err_string != "":
+      raise psycopg2.Error("[%s-%s]" % (err_code, err_string))
+  else:
+    worker["src_conn"] = psycopg2.connect(reddm_l1_copy.source_conn_string(tenant_vars))
+
+  return worker
+
+
+def close_worker(worker, manifest):
+  if manifest != None:
+    reddm_runjobgroup.execute_instruction(worker["dst_conn"], worker["expander"].expand(manifest["disconnect"]))
+  else:
+    worker["src_conn"].close()
+  worker["dst_conn"].close()
+
+
+def run_units(settings, cmd_line, tenant_vars, manifest, units):
+  """run the units, in list order, on cmd_line["WORKERS"] workers; returns one result per unit"""
+  pending = queue.Queue()
+  for unit in units:
+    pending.put(unit)
+  results = []
+  results_lock = threading.Lock()
+  run_unit = run_manifest_unit if manifest != None else run_copy_unit
+
+  def work():
+    try:
+      worker = open_worker(settings, cmd_line, tenant_vars, manifest)
+    except psycopg2.Error as e:
+      reddm_runjobgroup.log("***ERROR*** Opening Worker: [%s-%s] " % (e.pgcode, (e.pgerror or str(e)).strip()))
+      return
+
+    while True:
+      try:
+        unit = pending.get_nowait()
+      except queue.Empty:
+        break
+
+      start_time = datetime.datetime.now()
+      result = {"table": unit["table"], "estimate": unit["estimate"], "rows": 0, "status": "Success"}
+      try:
+        result["rows"] = run_unit(worker, unit)
+      except psycopg2.Error as e:
+        result["status"] = "Failure"
+        reddm_runjobgroup.log("***ERROR*** Loading [%s]: %s" % (unit["table"], (e.pgerror or str(e)).strip()))
+      result["duration_ms"] = reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())
+      reddm_runjobgroup.log("Loaded [%s] %i rows in %i ms  %s" % (unit["table"], result["rows"], result["duration_ms"], result["status"]))
+
+      with results_lock:
+        results.append(result)
+
+    try:
+      close_worker(worker, manifest)
+    except psycopg2.Error:
+      pass
+
+  threads = [threading.Thread(target=work, name="l1-worker-%i" % (n)) for n in range(min(cmd_line["WORKERS"], len(units)))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  # units no worker got to (every worker failed to connect)
+  done = set(result["table"] for result in results)
+  for unit in units:
+    if unit["table"] not in done:
+      results.append({"table": unit["table"], "estimate": unit["estimate"], "rows": 0, "status": "Not Run", "duration_ms": 0})
+
+  return results
+
+
+def manifest_units(manifest, table_names):
+  units = [{"table": unit["table"], "instructions": unit["instructions"], "merge": unit["merge"]} for unit in manifest["tables"]]
+  if table_names != None:
+    missing = [name for name in table_names if name not in [unit["table"] for unit in units]]
+    if missing:
+      print("Tables Not Found in Manifest: %s" % (", ".join(missing)))
+    units = [unit for unit in units if unit["table"] in table_names]
+  return units
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  settings = reddm_runjobgroup.db_settings(cmd_line["TEST"])
+  tenant_vars = reddm_l1_copy.read_l1_tenantvars(settings, cmd_line["MD_SCHEMA"], cmd_line["SRC_TENANT"])
+
+  manifest = None
+  if cmd_line["MANIFEST"] != None:
+    try:
+      manifest = read_manifest(cmd_line["MANIFEST"])
+
+    except (OSError, ValueError) as e:
+      print("Error Reading Manifest: [%s] %s" % (cmd_line["MANIFEST"], e))
+      exit()
+
+    units = manifest_units(manifest, cmd_line["TABLES"])
+    unknown = ManifestExpander(cmd_line["SRC_TENANT"], tenant_vars).unknown_vars(
+        [manifest["connect"], manifest["disconnect"]] + manifest["setup"] + [i for unit in units for i in unit["instructions"]])
+    if unknown:
+      print("Unknown Tenant Variables: [%s] %s" % (cmd_line["SRC_TENANT"], ", ".join(sorted(unknown))))
+      exit()
+
+  try:
+    if manifest == None:
+      src_conn = psycopg2.connect(reddm_l1_copy.source_conn_string(tenant_vars))
+      units = [{"table": dm_table[0]['table_name'], "dm_table": dm_table, "dm_key": dm_key}
+               for dm_table, dm_key in reddm_l1_copy.select_tables(src_conn.cursor(), tenant_vars["srcSchema"], cmd_line["TABLES"])]
+      src_conn.close()
+      setup = [reddm_l1_jdbc.watermark_ddl(reddm_l1_copy.norm_schema(tenant_vars))]
+    else:
+      expander = ManifestExpander(cmd_line["SRC_TENANT"], tenant_vars)
+      setup = [expander.expand(instruction) for instruction in manifest["setup"]]
+
+    # once up front, so the workers don't race to create the same tables
+    dst_conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+    dst_cur = dst_conn.cursor()
+    for instruction in setup:
+      dst_cur.execute(instruction)
+    dst_conn.commit()
+    dst_conn.close()
+
+    units = order_units(settings, tenant_vars, units)
+
+  except psycopg2.Error as e:
+    print("Error Connecting to Source / Mart: [%s-%s] " % (e.pgcode, e.pgerror))
+    exit()
+
+  if not units:
+    print("No L1 Tables Found: [%s]" % (cmd_line["SRC_TENANT"]))
+    return
+
+  start_time = datetime.datetime.now()
+  results = run_units(settings, cmd_line, tenant_vars, manifest, units)
+  duration_ms = reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())
+
+  print("L1 Tables Loaded (%i workers):" % (min(cmd_line["WORKERS"], len(units))))
+  print("\t%-45s %12s %12s %10s  %s" % ("Table", "Est. Rows", "Merged", "ms", "Status"))
+  for result in sorted(results, key=lambda r: r["duration_ms"], reverse=True):
+    print("\t%-45s %12s %12i %10i  %s" % (result["table"], "?" if result["estimate"] is None else result["estimate"], result["rows"],
+                                          result["duration_ms"], result["status"]))
+  print("\tTables Loaded: %i" % len([r for r in results if r["status"] == "Success"]))
+  print("\tRows Merged: %i" % sum(r["rows"] for r in results))
+  print("\tErrors Encountered: %i" % len([r for r in results if r["status"] != "Success"]))
+  print("\tSum of Table Durations: %i ms" % sum(r["duration_ms"] for r in results))
+  print("\tTotal Duration: %i ms" % duration_ms)
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
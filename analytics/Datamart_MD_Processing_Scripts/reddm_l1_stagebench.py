@@ -0,0 +1,223 @@
+# reddm_l1_stagebench.py
+#	compares the L1_LOAD staging strategies of reddm_l1_jdbc.py (--staging=table|temp|unlogged|direct) on a local database: each one
+#	loads the same synthetic source table, first in full and then incrementally, and reports time and WAL written per load.
+#
+# STATUS: run on an otherwise idle reva_mart_test (PostgreSQL 18, local disk), with the defaults -- the same figures on a second run:
+#	strategy     initial ms    initial WAL   incremental ms    incremental WAL
+#	table              2537      184886960              894           63746608
+#	temp               2394       88776248             1054           49355080
+#	unlogged           2538       84560752             1049           49357624
+#	direct             2047       84443784              737           49336392
+#	Staging in temp, unlogged or direct halves the WAL of a full load and cuts that of an incremental one by a fifth (what's left is the
+#	n_ table merge); time is dominated by the dblink read, direct saves the second pass over the rows.
+#
+# Usage:
+#   python reddm_l1_stagebench.py [--rows N] [--delta N] [--runs N] [--strategies S [S ...]] [--keep]
+#   where
+#		--rows - rows in the synthetic source table (default 200000)
+#		--delta - rows updated before each incremental load (default 20000)
+#		--runs - incremental loads per strategy (default 5)
+#		--strategies - OPTIONALLY only compare these strategies (default: all of them)
+#		--keep - OPTIONALLY leave the benchmark schemas behind, to look at them
+#
+# NOTES:
+#   - runs against the local test mart database (reva_mart_test, see reddm_runjobgroup.py), which needs the dblink extension: the
+#     "source" is a schema of the same database, read back over a DB LINK to localhost, so every strategy pays the same dblink cost
+#   - the generated SQL runs the way reddm_runjobgroup.py runs it -- one statement at a time, each committed, on one connection
+#   - WAL is measured with pg_current_wal_lsn() around each load, so anything else writing to the database skews it -- run it on an
+#     otherwise idle database.   Temp and unlogged staging still write WAL for the n_ table merge and the catalog, just not for the staged rows
+#   - each load starts with a CHECKPOINT (when the user may run one, e.g. superuser or pg_checkpoint), so the full page images written
+#     after a checkpoint are part of every load, not of whichever load a timed checkpoint happens to precede
+
+import io
+import sys
+import argparse
+import datetime
+import psycopg2
+
+import md_sqlsplit
+import reddm_l1_jdbc
+import reddm_runjobgroup
+
+BENCH_SRC_SCHEMA = "l1bench_src"
+BENCH_NORM_SCHEMA = "l1bench_norm"
+BENCH_TMP_SCHEMA = "l1bench_tmp"
+BENCH_TABLE = "BenchItem"
+
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(usage="python reddm_l1_stagebench.py [--rows N] [--delta N] [--runs N] [--strategies S [S ...]] [--keep]")
+  parser.add_argument("--rows", type=int, default=200000)
+  parser.add_argument("--delta", type=int, default=20000)
+  parser.add_argument("--runs", type=int, default=5)
+  parser.add_argument("--strategies", nargs="+", choices=reddm_l1_jdbc.STAGING_STRATEGIES, default=list(reddm_l1_jdbc.STAGING_STRATEGIES))
+  parser.add_argument("--keep", action="store_true")
+  args = parser.parse_args(argv)
+
+  return {"ROWS": max(1, args.rows), "DELTA": max(1, min(args.delta, args.rows)), "RUNS": max(1, args.runs), "STRATEGIES": args.strategies,
+          "KEEP": args.keep}
+
+
+def bench_vars(settings):
+  # the tenant variables the generated SQL expects, all pointing at the local mart database
+  return {"srcDB": settings["mart_db"], "srcSchema": BENCH_SRC_SCHEMA, "srcServer": settings["host"], "srcUser": settings["mart_user"],
+          "srcPassword": settings["mart_password"], "dstNormDB": settings["mart_db"], "dstNormSchema": BENCH_NORM_SCHEMA,
+          "tmpNormDB": settings["mart_db"], "tmpNormSchema": BENCH_TMP_SCHEMA}
+
+
+def expand(sql, tenant_vars):
+  for name, value in tenant_vars.items():
+    sql = sql.replace("${%s}$" % (name), value)
+  return sql
+
+
+def run_sql(conn, sql):
+  """run generated SQL one statement at a time, as reddm_runjobgroup.py does"""
+  for statement in md_sqlsplit.iter_statements(sql.splitlines()):
+    err_code, err_string, rowcount = reddm_runjobgroup.execute_instruction(conn, statement["instruction"])
+    if err_code != None:
+      raise psycopg2.Error("[%s-%s] %s" % (err_code, err_string, statement["instruction"][:80].replace("\n", " ")))
+
+
+def generate(gen, *args):
+  # the text one of reddm_l1_jdbc.py's gen_ functions writes
+  out = io.StringIO()
+  gen(out, *args)
+  return out.getvalue()
+
+
+def create_source(conn, rows):
+  # no autovacuum on the source: vacuuming the rows one strategy updated would write WAL during the next strategy's loads
+  cur = conn.cursor()
+  cur.execute("CREATE EXTENSION IF NOT EXISTS dblink;")
+  for schema_name in (BENCH_SRC_SCHEMA, BENCH_NORM_SCHEMA, BENCH_TMP_SCHEMA):
+    cur.execute("DROP SCHEMA IF EXISTS \"%s\" CASCADE;" % (schema_name))
+    cur.execute("CREATE SCHEMA \"%s\";" % (schema_name))
+  cur.execute("CREATE TABLE \"%s\".\"%s\" (\"id\" bigint PRIMARY KEY, \"name\" varchar(80) NOT NULL, \"amount\" numeric, \"notes\" text, "
+              "\"created_at\" timestamptz NOT NULL, \"updated_at\" timestamptz NOT NULL) WITH (autovacuum_enabled = false);" % (BENCH_SRC_SCHEMA, BENCH_TABLE))
+  cur.execute("INSERT INTO \"%s\".\"%s\" SELECT n, 'item ' || n, n * 1.5, repeat(md5(n::text), 4), now() - interval '1 day', now() - interval '1 day' "
+              "FROM generate_series(1, %i) AS n;" % (BENCH_SRC_SCHEMA, BENCH_TABLE, rows))
+  cur.execute("CREATE INDEX \"%s_updated_at_index\" ON \"%s\".\"%s\" (\"updated_at\");" % (BENCH_TABLE.lower(), BENCH_SRC_SCHEMA, BENCH_TABLE))
+  cur.execute("ANALYZE \"%s\".\"%s\";" % (BENCH_SRC_SCHEMA, BENCH_TABLE))
+  conn.commit()
+
+  planned, skipped = reddm_l1_jdbc.plan_tables(reddm_l1_jdbc.read_data_dictionary(cur, BENCH_SRC_SCHEMA), reddm_l1_jdbc.read_indexes(cur, BENCH_SRC_SCHEMA))
+  conn.commit()
+  cur.close()
+  return planned[0]
+
+
+def touch_source(conn, rows, delta, run):
+  # a different slice of the table each run, so the delta is always new rows to merge
+  first = (run * delta) % rows
+  cur = conn.cursor()
+  cur.execute("UPDATE \"%s\".\"%s\" SET \"amount\" = \"amount\" + 1, \"updated_at\" = clock_timestamp() WHERE (\"id\" - 1) %% %i >= %i AND (\"id\" - 1) %% %i < %i;"
+              % (BENCH_SRC_SCHEMA, BENCH_TABLE, rows, first, rows, first + delta))
+  conn.commit()
+  cur.close()
+
+
+def timed_load(conn, load_sql, checkpoint):
+  cur = conn.cursor()
+  if checkpoint:
+    # full page images after a checkpoint would land on whichever load follows it
+    cur.execute("CHECKPOINT;")
+  cur.execute("SELECT pg_current_wal_lsn();")
+  start_lsn = cur.fetchone()[0]
+  conn.commit()
+
+  start_time = datetime.datetime.now()
+  run_sql(conn, load_sql)
+  duration_ms = reddm_runjobgroup.millis_interval(start_time, datetime.datetime.now())
+
+  cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)::bigint;", (start_lsn,))
+  wal_bytes = cur.fetchone()[0]
+  conn.commit()
+  cur.close()
+  return duration_ms, wal_bytes
+
+
+def bench_strategy(conn, tenant_vars, dm_table, dm_key, strategy, cmd_line):
+  drop_sql = expand(generate(reddm_l1_jdbc.gen_dropsql, dm_table, strategy), tenant_vars)
+  ddl_sql = expand(reddm_l1_jdbc.watermark_ddl(reddm_l1_jdbc.NORM_SCHEMA) + "\n" + generate(reddm_l1_jdbc.gen_ddlsql, dm_table, dm_key), tenant_vars)
+  load_sql = expand(generate(reddm_l1_jdbc.gen_loadsql, dm_table, dm_key, strategy), tenant_vars)
+  connect_sql = expand(reddm_l1_jdbc.DBLINK_CONNECT, tenant_vars)
+  disconnect_sql = expand(reddm_l1_jdbc.DBLINK_DISCONNECT, tenant_vars)
+
+  # every strategy starts from an empty normalized layer and the same source rows
+  cur = conn.cursor()
+  cur.execute("DROP TABLE IF EXISTS \"%s\".\"%s\";" % (BENCH_NORM_SCHEMA, reddm_l1_jdbc.WATERMARK_TABLE))
+  cur.execute("DROP TABLE IF EXISTS \"%s\".\"n_%s\";" % (BENCH_NORM_SCHEMA, BENCH_TABLE))
+  conn.commit()
+  cur.close()
+  run_sql(conn, ddl_sql)
+
+  run_sql(conn, connect_sql)
+  try:
+    initial_ms, initial_wal = timed_load(conn, load_sql, cmd_line["CHECKPOINT"])
+    runs = []
+    for run in range(cmd_line["RUNS"]):
+      touch_source(conn, cmd_line["ROWS"], cmd_line["DELTA"], run)
+      runs.append(timed_load(conn, load_sql, cmd_line["CHECKPOINT"]))
+  finally:
+    run_sql(conn, disconnect_sql)
+
+  run_sql(conn, drop_sql)
+  return {"strategy": strategy, "initial_ms": initial_ms, "initial_wal": initial_wal,
+          "incremental_ms": sorted(ms for ms, wal in runs)[len(runs) // 2], "incremental_wal": sorted(wal for ms, wal in runs)[len(runs) // 2]}
+
+
+def can_checkpoint(conn):
+  cur = conn.cursor()
+  try:
+    cur.execute("CHECKPOINT;")
+    conn.commit()
+    return True
+  except psycopg2.Error:
+    conn.rollback()
+    return False
+  finally:
+    cur.close()
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  settings = reddm_runjobgroup.db_settings(True)
+  tenant_vars = bench_vars(settings)
+
+  try:
+    conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+    dm_table, dm_key = create_source(conn, cmd_line["ROWS"])
+
+  except psycopg2.Error as e:
+    print("Error Setting Up Benchmark: [%s-%s] " % (e.pgcode, e.pgerror))
+    exit()
+
+  cmd_line["CHECKPOINT"] = can_checkpoint(conn)
+  if not cmd_line["CHECKPOINT"]:
+    print("No CHECKPOINT Privilege: a checkpoint during a load adds its full page images to that load's WAL")
+
+  print("L1 Staging Benchmark: %i source rows, %i row delta, %i incremental loads per strategy" % (cmd_line["ROWS"], cmd_line["DELTA"], cmd_line["RUNS"]))
+  results = []
+  for strategy in cmd_line["STRATEGIES"]:
+    try:
+      results.append(bench_strategy(conn, tenant_vars, dm_table, dm_key, strategy, cmd_line))
+    except psycopg2.Error as e:
+      conn.rollback()
+      print("***ERROR*** Strategy [%s]: %s" % (strategy, e))
+
+  if not cmd_line["KEEP"]:
+    cur = conn.cursor()
+    for schema_name in (BENCH_SRC_SCHEMA, BENCH_NORM_SCHEMA, BENCH_TMP_SCHEMA):
+      cur.execute("DROP SCHEMA IF EXISTS \"%s\" CASCADE;" % (schema_name))
+    conn.commit()
+  conn.close()
+
+  print("\t%-10s %12s %14s %16s %18s" % ("strategy", "initial ms", "initial WAL", "incremental ms", "incremental WAL"))
+  for result in results:
+    print("\t%-10s %12i %14i %16i %18i" % (result["strategy"], result["initial_ms"], result["initial_wal"], result["incremental_ms"], result["incremental_wal"]))
+  print("\t(incremental: median of the runs; WAL in bytes)")
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,129 @@
+# reddm_partition.py
+#	PARTITION instructions: keeps a fact table that is range partitioned on a date key (e.g. "utcDateKey", YYYYMMDD integers) partitioned by month --
+#	creates the partitions of the coming months, and detaches (or archives) the ones that fell out of the retention window.
+#
+# Usage (an instruction of a job's SQL file -- the PARTITIONFACTS job group, L3_partition_facts.sql -- tenant variables are expanded as in any other instruction):
+#   PARTITION "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds" AHEAD 3 RETAIN 36 [ARCHIVE "archiveSchema"];
+#   where
+#		AHEAD - how many months after the current one get their partition ahead of time
+#		RETAIN - how many months before the current one stay attached -- older partitions are detached, and with ARCHIVE moved to that schema
+#
+# NOTES:
+#   - the runner rewrites the instruction into a DO block (partition_sql), so it runs server side like any other instruction -- same
+#     transaction, savepoint, session settings and run log -- and a multi tenant run never reads the catalog from here
+#   - partitions are named <table>_pYYYYMM, next to their table.   Rows outside of every partition land in <table>_default, created on
+#     first use: the rows of months before the retention window (a full reload of the history), or unknown dates (19000101)
+#   - when the partition of a month is created while the default partition holds rows of that month, those rows are moved into it
+#   - a table that isn't partitioned is left alone (a NOTICE), so the same job runs for tenants that don't partition their facts
+#   - partitioned fact tables need PostgreSQL 13 or later:  the facts keep their BEFORE UPDATE ... FOR EACH ROW updated_at triggers, which
+#     older servers don't allow on a partitioned table.   L3_DDL.sql only creates the partitioned variants there (one DO block per table
+#     picks the variant), and creates the plain tables on older servers even when partitionFacts is on.   A partitioned table starts with
+#     its DEFAULT partition only, so loads work before PARTITIONFACTS first runs; the months are moved out of it then
+#   - PARTITION is not SQL:  keep it out of RESTARTMART and LOADMART, which the run_analytics_* procedures EXECUTE instruction by instruction
+
+import re
+
+IDENTIFIER = r'(?:"[^"]+"|\w+)'
+PARTITION_INSTRUCTION = re.compile(r"^\s*PARTITION\s+((?:%s\s*\.\s*){1,2}%s)\s+AHEAD\s+(\d+)\s+RETAIN\s+(\d+)(?:\s+ARCHIVE\s+(%s))?\s*;?\s*$"
+                                   % (IDENTIFIER, IDENTIFIER, IDENTIFIER), re.IGNORECASE)
+LINE_COMMENT = re.compile(r"^[ \t]*--.*$", re.MULTILINE)
+
+PARTITION_DO_BLOCK = """DO $reddm_partition$
+DECLARE
+  schema_name CONSTANT text := %(schema)s;
+  table_name CONSTANT text := %(table)s;
+  archive_schema CONSTANT text := %(archive)s;
+  parent regclass := to_regclass(format('%%I.%%I', %(schema)s, %(table)s));
+  default_name CONSTANT text := %(table)s || '_default';
+  first_month CONSTANT date := date_trunc('month', current_date) - interval '%(retain)i months';
+  last_month CONSTANT date := date_trunc('month', current_date) + interval '%(ahead)i months';
+  key_column text;
+  part_month date;
+  part_name text;
+  lower_key integer;
+  upper_key integer;
+  has_rows boolean;
+  old_part record;
+BEGIN
+  SELECT a.attname INTO key_column
+  FROM pg_partitioned_table AS p
+    INNER JOIN pg_attribute AS a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+  WHERE p.partrelid = parent;
+  IF key_column IS NULL THEN
+    RAISE NOTICE '%%.%% is not partitioned -- nothing to maintain', schema_name, table_name;
+    RETURN;
+  END IF;
+
+  IF to_regclass(format('%%I.%%I', schema_name, default_name)) IS NULL THEN
+    EXECUTE format('CREATE TABLE %%I.%%I PARTITION OF %%s DEFAULT', schema_name, default_name, parent);
+  END IF;
+
+  FOR part_month IN SELECT generate_series(first_month, last_month, interval '1 month')::date LOOP
+    part_name := table_name || '_p' || to_char(part_month, 'YYYYMM');
+    CONTINUE WHEN to_regclass(format('%%I.%%I', schema_name, part_name)) IS NOT NULL;
+    lower_key := to_char(part_month, 'YYYYMMDD')::integer;
+    upper_key := to_char(part_month + interval '1 month', 'YYYYMMDD')::integer;
+
+    -- a month's rows can't stay in the default partition once the month has its own partition
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %%I.%%I WHERE %%I >= %%s AND %%I < %%s)', schema_name, default_name, key_column, lower_key, key_column, upper_key) INTO has_rows;
+    IF has_rows THEN
+      EXECUTE format('CREATE TEMP TABLE reddm_partition_rows ON COMMIT DROP AS SELECT * FROM %%I.%%I WHERE %%I >= %%s AND %%I < %%s',
+                     schema_name, default_name, key_column, lower_key, key_column, upper_key);
+      EXECUTE format('DELETE FROM %%I.%%I WHERE %%I >= %%s AND %%I < %%s', schema_name, default_name, key_column, lower_key, key_column, upper_key);
+    END IF;
+    EXECUTE format('CREATE TABLE %%I.%%I PARTITION OF %%s FOR VALUES FROM (%%s) TO (%%s)', schema_name, part_name, parent, lower_key, upper_key);
+    IF has_rows THEN
+      EXECUTE format('INSERT INTO %%s SELECT * FROM reddm_partition_rows', parent);
+      EXECUTE 'DROP TABLE reddm_partition_rows';
+    END IF;
+    RAISE NOTICE 'created partition %%.%%', schema_name, part_name;
+  END LOOP;
+
+  FOR old_part IN
+    SELECT c.oid::regclass AS part, c.relname
+    FROM pg_inherits AS i
+      INNER JOIN pg_class AS c ON c.oid = i.inhrelid
+    WHERE i.inhparent = parent
+      AND c.relname = table_name || '_p' || right(c.relname, 6)
+      AND right(c.relname, 6) ~ '^[0-9]{6}$'
+      AND right(c.relname, 6) < to_char(first_month, 'YYYYMM')
+  LOOP
+    EXECUTE format('ALTER TABLE %%s DETACH PARTITION %%s', parent, old_part.part);
+    IF archive_schema IS NOT NULL THEN
+      EXECUTE format('CREATE SCHEMA IF NOT EXISTS %%I', archive_schema);
+      EXECUTE format('ALTER TABLE %%s SET SCHEMA %%I', old_part.part, archive_schema);
+    END IF;
+    RAISE NOTICE 'detached partition %%', old_part.relname;
+  END LOOP;
+END
+$reddm_partition$;"""
+
+
+def unquote(identifier):
+  identifier = identifier.strip()
+  if identifier.startswith('"'):
+    return identifier[1:-1]
+  return identifier
+
+
+def sql_literal(value):
+  return "NULL" if value == None else "'%s'" % (value.replace("'", "''"))
+
+
+def parse(instruction):
+  """returns {"schema", "table", "ahead", "retain", "archive"} of a PARTITION instruction, raises ValueError when it doesn't parse"""
+  match = PARTITION_INSTRUCTION.match(LINE_COMMENT.sub("", instruction))
+  if match == None:
+    raise ValueError("expected PARTITION <schema>.<table> AHEAD <months> RETAIN <months> [ARCHIVE <schema>]")
+
+  # a database part (e.g. "dstStarDB") is only there to match the other instructions -- the DO block runs in the mart database anyway
+  names = [unquote(name) for name in re.findall(IDENTIFIER, match.group(1))]
+  return {"schema": names[-2], "table": names[-1], "ahead": int(match.group(2)), "retain": int(match.group(3)),
+          "archive": unquote(match.group(4)) if match.group(4) != None else None}
+
+
+def partition_sql(instruction):
+  """the DO block that carries out a (tenant expanded) PARTITION instruction"""
+  spec = parse(instruction)
+  return PARTITION_DO_BLOCK % {"schema": sql_literal(spec["schema"]), "table": sql_literal(spec["table"]),
+                               "archive": sql_literal(spec["archive"]), "ahead": spec["ahead"], "retain": spec["retain"]}
@@ -0,0 +1,116 @@
+# reddm_pysteps.py
+#	the steps PYTHON instructions run: Python callables called inside reddm_runjobgroup.py, on the load unit's own mart connection,
+#	for the work that is better done in Python than pushed through SQL and dblink -- bulk COPY transfers, batched transforms, checksums.
+#
+# Usage (an instruction of a job's SQL file, tenant variables are expanded as in any other instruction):
+#   PYTHON <step> [<argument> ...];
+#   e.g. PYTHON table_checksum "dstStarSchema"."d_Property" "dstStarSchema"."d_Party";
+#   where
+#		step - name of a registered step (PYTHON_STEPS)
+#		argument - passed to the step as a string, arguments are separated by whitespace
+#
+# NOTES:
+#   - a step is registered with @python_step("name"), and called as step(context, *arguments), where context is
+#       {"mart": mart connection, "core": core (metadata) connection, "vars": tenant variables, "tenant": tenant name, "log": log(message)}
+#     it returns the row count recorded in the run log (or None)
+#   - the mart connection is the unit's: the runner commits the step's work after it returns, or keeps it in the wider --commit
+#     transaction behind a savepoint, so a step doesn't commit it.   Steps registered with commits=True manage their own
+#     transactions (e.g. l1_copy commits per table), so they only run with --commit instruction
+#   - the core connection is shared by the steps of a tenant run -- a step that writes to it commits its own work
+#   - an exception raised by a step is the instruction's error (PYTHON_ERRCODE, the message is the exception), and its mart work is
+#     rolled back like a failed SQL instruction
+
+import re
+import hashlib
+
+# md_instructionRun.errorCode of a step that raised something other than a database error
+PYTHON_ERRCODE = "PY000"
+
+# rows fetched per round trip by the steps that stream a table
+FETCH_ROWS = 10000
+
+# table_checksum adds up the rows' 128 bit md5 modulo this -- it stays 32 hex digits
+CHECKSUM_MODULUS = 1 << 128
+
+LINE_COMMENT = re.compile(r"^[ \t]*--.*$", re.MULTILINE)
+
+PYTHON_STEPS = {}
+
+
+def python_step(name, commits=False):
+  def register(function):
+    PYTHON_STEPS[name] = {"name": name, "function": function, "commits": commits}
+    return function
+  return register
+
+
+def parse(instruction):
+  """returns (step, arguments) of a PYTHON instruction, raises ValueError when it doesn't name a registered step"""
+  words = LINE_COMMENT.sub("", instruction).strip().rstrip(";").split()
+  if len(words) < 2 or words[0].upper() != "PYTHON":
+    raise ValueError("expected PYTHON <step> [<argument> ...]")
+  if words[1] not in PYTHON_STEPS:
+    raise ValueError("unknown step %s -- registered steps: %s" % (words[1], ", ".join(sorted(PYTHON_STEPS))))
+
+  return PYTHON_STEPS[words[1]], words[2:]
+
+
+@python_step("table_checksum")
+def table_checksum(context, *tables):
+  """logs the row count and an order independent checksum (sum of the rows' md5, mod 2^128) of each table -- e.g. to compare a mart table
+  with its source, or the same table before and after a change, without sorting or aggregating it in the database.   A sum, not
+  an xor: duplicate rows would cancel out of an xor, so a table that gained or lost a pair of them would keep its checksum"""
+  total = 0
+  for table in tables:
+    # the argument is looked up in the catalog, and only the name Postgres returns for it (quoted as needed) goes into the query
+    cur = context["mart"].cursor()
+    cur.execute("SELECT to_regclass(%s)::text;", [table])
+    relation = cur.fetchone()[0]
+    cur.close()
+    if relation == None:
+      raise ValueError("table_checksum: no table %s" % (table))
+
+    cur = context["mart"].cursor(name="reddm_table_checksum")
+    cur.itersize = FETCH_ROWS
+    cur.execute("SELECT t::text FROM %s AS t;" % (relation))
+    rows = 0
+    checksum = 0
+    for row in cur:
+      checksum = (checksum + int(hashlib.md5(row[0].encode("utf-8")).hexdigest(), 16)) % CHECKSUM_MODULUS
+      rows += 1
+    cur.close()
+
+    context["log"]("Checksum %s: %i rows %032x" % (table, rows, checksum))
+    total += rows
+
+  return total
+
+
+@python_step("l1_copy", commits=True)
+def l1_copy(context, *table_names):
+  """the L1 load of reddm_l1_copy.py -- every source table, or only the given ones -- as a step of a job group"""
+  # imported here: reddm_l1_copy imports the runner, which imports this module
+  import psycopg2
+  import reddm_l1_copy
+  import reddm_l1_jdbc
+
+  # the watermark table the loads read and advance -- created on first use, as reddm_l1_copy.py does
+  context["mart"].cursor().execute(reddm_l1_jdbc.watermark_ddl(reddm_l1_copy.norm_schema(context["vars"])))
+  context["mart"].commit()
+
+  src_conn = psycopg2.connect(reddm_l1_copy.source_conn_string(context["vars"]))
+  try:
+    src_cur = src_conn.cursor()
+    tables = reddm_l1_copy.select_tables(src_cur, context["vars"]["srcSchema"], list(table_names) or None)
+    src_conn.commit()
+
+    rows = 0
+    for dm_table, dm_key in tables:
+      result = reddm_l1_copy.load_table(src_conn, context["mart"], context["vars"], dm_table, dm_key, reddm_l1_copy.DEFAULT_BUFFER_CHUNKS)
+      context["log"]("L1 Copy %s: %i rows, %i merged, %i ms" % (result["table"], result["rows"], result["merged"], result["duration_ms"]))
+      rows += result["rows"]
+
+  finally:
+    src_conn.close()
+
+  return rows
@@ -0,0 +1,337 @@
+# reddm_report.py
+#	runs a report query of analytics/ReportsQueries against a tenant's star schema, and streams the result out as CSV or JSON.
+#	Results are cached per (tenant, report, parameters), and the cache is invalidated by the mart load state (s_LastLoadDate).
+#
+# Usage:
+#   python reddm_report.py <MD_schema> <tenant_name> <report> [test] [--param NAME=VALUE ...] [--format csv|json] [--out FILE] [--cache-dir DIR | --no-cache]
+#   where
+#		MD_schema - location schema of MD tables, where the tenant variables are read from (see reddm_runjobgroup.py)
+#		tenant_name - the tenant whose star schema is reported on
+#		report - a report of ../ReportsQueries: its file name without .sql (e.g. CSR12, DiscountedPipelineProp), or a path to any .sql file
+#		test - OPTIONALLY run against the local test databases (reva_test / reva_mart_test)
+#		--param - a report parameter, e.g. --param date=2022-03-31 -- every ${name}$ of the report that isn't a tenant variable needs one
+#		--format - csv (default) or json
+#		--out - OPTIONALLY write to FILE instead of stdout
+#		--cache-dir - where cached results are kept (default $REDDM_REPORT_CACHE_DIR, or <tmp>/reddm_reports-<user>); --no-cache always runs the query
+#
+# NOTES:
+#   - ${var}$ placeholders naming a tenant variable (e.g. ${dstStarSchema}$) are replaced by its value, the way md_genfromsql.py / the runner
+#     expand instructions.   Every other ${name}$ is a report parameter, always a value: together with any quotes around it ("${date}$",
+#     '${date}$' or '"${date}$"') it is bound as a query parameter, so parameters are never spliced into the SQL
+#   - a report file may hold several queries (e.g. TrafficSummary); each one is a result set -- in CSV, result sets are separated by an
+#     empty line and each has its own header, in JSON they are {"results": [{"columns": [...], "rows": [[...], ...]}, ...]}
+#   - queries run on a server side cursor and rows are written as they are fetched (FETCH_ROWS at a time), so the result is never held
+#     in memory -- neither when it is written, nor when it is cached or served from the cache
+#   - the cache version of a result is the loadDate of every s_LastLoadDate row of the star tables the report reads.   A table without a
+#     row there (loaded some other way) makes the latest loadDate of the whole table part of the version instead, so any load invalidates it.
+#     Without s_LastLoadDate (a mart that was never loaded) nothing is cached.   The *Aggregate reports read the r_ aggregates, whose
+#     s_LastLoadDate rows REFRESHREPORTS moves on each refresh, so their cache lives exactly as long as the aggregate it was read from
+#   - a cache entry is a gzipped file of JSON lines, written next to the output as the query streams and renamed into place once it is
+#     complete, so a failed or interrupted query never leaves a partial entry behind.   Values are written the way JSON output writes them
+#     (dates, timestamps and numerics as text), so CSV and JSON output is the same whether it comes from the cache or the database
+#   - cache entries are served as report results, so they are only read from a directory the current user owns and nobody else can
+#     write to, the same way reddm_snapshot.py treats snapshots:  the default directory is per user, created with mode 0700, and an
+#     entry owned by another user is ignored
+#   - an entry is read through once before it is served, so a corrupt or truncated one (a full disk, a killed copy) is a cache miss --
+#     it is removed, and the query runs -- instead of a half written report
+
+import os
+import re
+import sys
+import csv
+import gzip
+import json
+import hashlib
+import argparse
+import tempfile
+import zlib
+import psycopg2
+
+import reddm_runjobgroup
+import reddm_snapshot
+import md_sqlsplit
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORTS_DIR = os.path.join(SCRIPT_DIR, "..", "ReportsQueries")
+
+FETCH_ROWS = 2000
+CACHE_FORMAT = 1
+# what reading a damaged cache entry raises -- gzip (OSError, EOFError, zlib.error) or JSON / UTF-8 decoding (ValueError)
+CACHE_READ_ERRORS = (OSError, EOFError, zlib.error, ValueError)
+
+# a ${name}$ placeholder, with the quotes a report may have put around it
+PLACEHOLDER = re.compile(r"""'"\$\{(\w+)\}\$"'|'\$\{(\w+)\}\$'|"\$\{(\w+)\}\$"|\$\{(\w+)\}\$""")
+# "${dstStarSchema}$"."f_TrafficSummary"
+STAR_TABLE = re.compile(r"\"\$\{dstStarSchema\}\$\"\.\"([^\"]+)\"")
+
+
+def default_cache_dir():
+  return os.getenv('REDDM_REPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), "reddm_reports-%s" % (reddm_snapshot.current_user())))
+
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(
+      usage="python reddm_report.py <MD_schema> <tenant_name> <report> [test] [--param NAME=VALUE ...] [--format csv|json] [--out FILE] [--cache-dir DIR | --no-cache]")
+  parser.add_argument("md_schema")
+  parser.add_argument("tenant")
+  parser.add_argument("report")
+  parser.add_argument("env", nargs="?")
+  parser.add_argument("--param", action="append", default=[])
+  parser.add_argument("--format", choices=("csv", "json"), default="csv")
+  parser.add_argument("--out", default=None)
+  parser.add_argument("--cache-dir", default=default_cache_dir())
+  parser.add_argument("--no-cache", action="store_true")
+  args = parser.parse_args(argv)
+
+  params = {}
+  for param in args.param:
+    name, sep, value = param.partition("=")
+    if not sep or not name:
+      parser.error("--param must be NAME=VALUE: %s" % (param))
+    params[name] = value
+
+  return {"MD_SCHEMA": args.md_schema, "TENANT": args.tenant, "REPORT": args.report, "TEST": args.env == "test", "PARAMS": params,
+          "FORMAT": args.format, "OUT": args.out, "CACHE_DIR": None if args.no_cache else args.cache_dir}
+
+
+def find_report(report):
+  """path of a report -- a .sql file, or the name of one under ReportsQueries"""
+  if os.path.isfile(report):
+    return report
+  for dir_path, dir_names, file_names in sorted(os.walk(REPORTS_DIR)):
+    if report + ".sql" in file_names:
+      return os.path.join(dir_path, report + ".sql")
+  return None
+
+
+def read_queries(report_path):
+  with open(report_path, "r") as report_file:
+    return [statement["instruction"] for statement in md_sqlsplit.iter_statements(report_file)]
+
+
+def bind_query(query, tenant_vars, params):
+  """returns (sql, unknown names) -- tenant variables expanded in place, parameters turned into %(name)s placeholders"""
+  unknown = set()
+
+  def bind(match):
+    name = next(group for group in match.groups() if group)
+    if name in tenant_vars:
+      return match.group(0).replace("${%s}$" % (name), tenant_vars[name].replace("%", "%%"))
+    if name not in params:
+      unknown.add(name)
+    return "%%(%s)s" % (name)
+
+  return PLACEHOLDER.sub(bind, query.replace("%", "%%")), unknown
+
+
+def star_tables(queries):
+  tables = set()
+  for query in queries:
+    tables.update(STAR_TABLE.findall(query))
+  return sorted(tables)
+
+
+def cache_version(cur, tenant_vars, tables):
+  """the load state of the tables a report reads, or None when the mart has no s_LastLoadDate to go by"""
+  try:
+    cur.execute("SELECT \"tableName\", \"loadDate\" FROM \"%s\".\"s_LastLoadDate\" ORDER BY 1;" % (tenant_vars.get("dstStarSchema", "")))
+    load_dates = dict(cur.fetchall())
+    cur.connection.commit()
+
+  except psycopg2.Error:
+    cur.connection.rollback()
+    return None
+
+  if not load_dates:
+    return None
+  state = [(table, str(load_dates[table])) for table in tables if table in load_dates]
+  if len(state) < len(tables):
+    state.append(("*", str(max(load_dates.values()))))
+  return hashlib.md5(json.dumps(state).encode("utf-8")).hexdigest()
+
+
+def cache_path(cache_dir, tenant_name, report_path, params):
+  key = hashlib.sha1(json.dumps([tenant_name, os.path.abspath(report_path), sorted(params.items())]).encode("utf-8")).hexdigest()
+  return os.path.join(cache_dir, "report_%s.cache" % (key[:24]))
+
+
+def cache_entry(path, version):
+  """the header of the cache entry for version when it is there, trusted and readable to the end -- None otherwise.
+  An entry that can't be read is removed"""
+  try:
+    if not reddm_snapshot.is_trusted(path):
+      print("Report cache entry ignored, not owned by this user or writable by others: %s" % (path), file=sys.stderr)
+      return None
+
+    with gzip.open(path, "rt", encoding="utf-8") as cache_file:
+      header = json.loads(cache_file.readline() or "{}")
+      if not isinstance(header, dict) or header.get("format") != CACHE_FORMAT or header.get("version") != version:
+        return None
+      for line in cache_file:
+        json.loads(line)
+
+  except FileNotFoundError:
+    return None
+
+  except CACHE_READ_ERRORS as e:
+    print("Report cache entry unreadable, removed: %s (%s)" % (path, e), file=sys.stderr)
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    return None
+
+  return header
+
+
+def read_cache(path):
+  """yields the cached result as ("columns", [...]) / ("row", [...]) events -- check the entry with cache_entry() first"""
+  with gzip.open(path, "rt", encoding="utf-8") as cache_file:
+    cache_file.readline()
+    for line in cache_file:
+      item = json.loads(line)
+      yield ("columns", item["columns"]) if isinstance(item, dict) else ("row", item)
+
+
+def query_events(conn, queries, params):
+  """yields ("columns", [...]) / ("row", [...]) events, streaming each query through a server side cursor"""
+  for index, sql in enumerate(queries):
+    cur = conn.cursor(name="reddm_report_%i" % (index))
+    cur.itersize = FETCH_ROWS
+    cur.execute(sql, params)
+    rows = iter(cur)
+    first = next(rows, None)
+    # a named cursor only knows its columns once the first rows are fetched
+    yield ("columns", [column[0] for column in cur.description])
+    if first != None:
+      yield ("row", [plain_value(value) for value in first])
+      for row in rows:
+        yield ("row", [plain_value(value) for value in row])
+    cur.close()
+  conn.commit()
+
+
+def plain_value(value):
+  # what JSON can hold as is stays, anything else (dates, numerics, intervals ...) is written as text -- same as a cached value
+  if value is None or isinstance(value, (str, int, float, bool)):
+    return value
+  return str(value)
+
+
+def cached_events(events, path, header):
+  """pass events through, writing them to a new cache entry that replaces the old one once the result is complete"""
+  os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+  try:
+    with os.fdopen(fd, "wb") as raw_file, gzip.open(raw_file, "wt", encoding="utf-8") as cache_file:
+      cache_file.write(json.dumps(header) + "\n")
+      for event in events:
+        cache_file.write(json.dumps({"columns": event[1]} if event[0] == "columns" else event[1]) + "\n")
+        yield event
+    os.replace(tmp_path, path)
+
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+
+def write_csv(events, out):
+  writer = csv.writer(out)
+  result_sets = 0
+  for kind, values in events:
+    if kind == "columns":
+      if result_sets > 0:
+        out.write("\n")
+      result_sets += 1
+    writer.writerow(["" if value is None else value for value in values])
+
+
+def write_json(events, out):
+  out.write("{\"results\": [")
+  result_sets = 0
+  rows = 0
+  for kind, values in events:
+    if kind == "columns":
+      out.write("%s{\"columns\": %s, \"rows\": [" % ("]}, " if result_sets > 0 else "", json.dumps(values)))
+      result_sets += 1
+      rows = 0
+    else:
+      out.write("%s%s" % (", " if rows > 0 else "", json.dumps(values)))
+      rows += 1
+  out.write("%s]}\n" % ("]}" if result_sets > 0 else ""))
+
+
+def run_report(conn, tenant_name, tenant_vars, report_path, params, out, output_format="csv", cache_dir=None):
+  """stream a report to out; returns "cache" when it was served from the cache, "query" otherwise.
+  Raises ValueError for placeholders without a value, psycopg2.Error when a query fails"""
+  queries = read_queries(report_path)
+  bound = []
+  unknown = set()
+  for query in queries:
+    sql, query_unknown = bind_query(query, tenant_vars, params)
+    bound.append(sql)
+    unknown.update(query_unknown)
+  if unknown:
+    raise ValueError("no value for %s -- pass them with --param NAME=VALUE" % (", ".join(sorted(unknown))))
+
+  writer = write_json if output_format == "json" else write_csv
+  version = None
+  path = None
+  if cache_dir != None:
+    version = cache_version(conn.cursor(), tenant_vars, star_tables(queries))
+    path = cache_path(cache_dir, tenant_name, report_path, params)
+
+  if version != None and cache_entry(path, version) != None:
+    writer(read_cache(path), out)
+    return "cache"
+
+  events = query_events(conn, bound, params)
+  if version != None:
+    events = cached_events(events, path, {"format": CACHE_FORMAT, "version": version, "tenant": tenant_name,
+                                          "report": os.path.basename(report_path), "params": params})
+  writer(events, out)
+  return "query"
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  settings = reddm_runjobgroup.db_settings(cmd_line["TEST"])
+
+  report_path = find_report(cmd_line["REPORT"])
+  if report_path == None:
+    print("Report Not Found: [%s]" % (cmd_line["REPORT"]), file=sys.stderr)
+    exit()
+
+  try:
+    md_conn = psycopg2.connect(reddm_runjobgroup.core_conn_string(settings))
+    tenant_vars = reddm_runjobgroup.read_tenantvars(md_conn.cursor(), settings, cmd_line["MD_SCHEMA"], cmd_line["TENANT"]).get(cmd_line["TENANT"], {})
+    md_conn.close()
+    conn = psycopg2.connect(reddm_runjobgroup.mart_conn_string(settings))
+    conn.set_session(readonly=True)
+
+  except psycopg2.Error as e:
+    print("Error Connecting to Metadata / Mart: [%s-%s] " % (e.pgcode, e.pgerror), file=sys.stderr)
+    exit()
+
+  out = open(cmd_line["OUT"], "w", newline="") if cmd_line["OUT"] != None else sys.stdout
+  try:
+    source = run_report(conn, cmd_line["TENANT"], tenant_vars, report_path, cmd_line["PARAMS"], out, cmd_line["FORMAT"], cmd_line["CACHE_DIR"])
+
+  except ValueError as e:
+    print("Error Binding Report %s: %s" % (cmd_line["REPORT"], e), file=sys.stderr)
+    exit()
+
+  except psycopg2.Error as e:
+    print("Error Running Report %s: [%s-%s] " % (cmd_line["REPORT"], e.pgcode, e.pgerror), file=sys.stderr)
+    exit()
+
+  finally:
+    if out is not sys.stdout:
+      out.close()
+    conn.close()
+
+  print("Report %s for %s: served from the %s" % (cmd_line["REPORT"], cmd_line["TENANT"], "cache" if source == "cache" else "database"), file=sys.stderr)
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
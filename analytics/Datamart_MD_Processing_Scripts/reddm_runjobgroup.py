@@ -2,19 +2,38 @@
 #	reads encoded metadata for jobgroups and jobs, executes them to faciliate RED Datamart ETL.
 #
 # Usage:
-#   "python reddm_runjobgroup.py <MD_schema> <src_tenant_name> <jobgroupname> [<jobname>]
+#   "python reddm_runjobgroup.py <MD_schema> <src_tenant_name> <jobgroupname> [test] [<jobname>] [--workers N] [--commit LEVEL] [--batch N]
+#   "python reddm_runjobgroup.py <MD_schema> <ALL | tenant,tenant,...> <jobgroupname> [test] [<jobname>] [--tenant-group G] [--tenants N] [--tenants-per-host N]
 #   where
 #		MD_schema - location schema of MD tables, typically shared between many data mart tenants -- should be very few metadata table copies
 #			As of today, assumed --> d5f86cf0-4b7f-4a10-9d2b-f400ccecdbcf
 #		src_tenant_name - which of the tenant source systems are we processing -- tenant will be looked up in the md_tenantvariable table, and all of the
 #			context variables will be processed from there.
+#			ALL (or a comma separated list of tenants) runs the job group for every tenant in md_tenantVariable, reading the instructions only once
+#		--tenant-group - OPTIONALLY only run the tenants whose "tenantGroup" tenant variable matches
+#		--tenants - how many tenants are processed at the same time (default 4)
+#		--tenants-per-host - OPTIONALLY cap concurrent tenants per source database host (the "srcServer" tenant variable)
+#		--no-runlog - OPTIONALLY don't record the run in md_runLog / md_instructionRun
+#		--resume - skip the instructions that completed in the previous run of the tenant's job group, and restart each load at its first
+#			failed or unfinished instruction
+#		--stop-on-error - when an instruction fails, don't run the rest of its load, nor any load that depends on it
+#		--snapshot-dir - where compiled metadata snapshots are kept (default $REDDM_SNAPSHOT_DIR, or <tmp>/reddm_snapshots-<user>); --no-snapshot always reads the metadata
 #		jobgroupname - which job group are we processing (e.g. RESTARTMART or LOADMART)
 #       jobname -- OPTIONALLY choose specific job to run (usually run all jobs with in a job group sequentially, but can just run one if we need to
+#		test - OPTIONALLY run against the local test databases (reva_test / reva_mart_test)
+#		--workers - number of mart connections used to run independent table loads at the same time (default 1, i.e. sequential)
+#		--commit - how much work one mart transaction covers: instruction (default), unit (a table's load unit), job or jobgroup --
+#			job and jobgroup keep one connection for the whole run, so they need --workers 1
+#		--batch - OPTIONALLY send up to N consecutive lightweight instructions of a load unit in one round trip (default 1, i.e. no batching)
 #
 # Intended Usage:
-#   Presently, metadata is organized into 2 job groups:  RESTARTMART and LOADMART
+#   Presently, metadata is organized into 4 job groups:  RESTARTMART, PARTITIONFACTS, LOADMART and REFRESHREPORTS
 #   	RESTARTMART is used to create a new datamart from scratch, or reset an existing one
+#       PARTITIONFACTS keeps the monthly partitions of the partitioned fact tables (tenants with partitionFacts on) -- run it after RESTARTMART
+#         and before LOADMART.   It holds the PARTITION instructions, which only this runner understands: RESTARTMART and LOADMART stay
+#         plain SQL, since the run_analytics_restart_mart_process() / run_analytics_load_process() procedures run them too
 #       LOADMART is to be used to incrementally reload data from the source system, and recalculate the associated star schema
+#       REFRESHREPORTS refreshes the materialized report aggregates (r_ tables) whose sources LOADMART loaded since their last refresh -- run it after LOADMART
 #   - When new tenants need to be provisioned, we will want to have a script that creates the associated datamart schemas, sets the tenant variables to point
 #   	at those new locations, and runs RESTARTMART for that tenant.
 #   - On a nightly basis, we will want to run LOADMART for all tenants, to get them their latest information.   And for tenants that need data refreshes more frequently than that,
@@ -22,43 +41,165 @@
 #     into their own job groups.
 
 # NOTES:
-#   - Metadata is processsed sequentially, as determined by JobGroup.SequenceNum, Job.SequenceNum, Instruction.SequenceNum
+#   - Metadata is processsed in order, as determined by JobGroup.SequenceNum, Job.SequenceNum, Instruction.SequenceNum
 #		- However, only instruction.SequenceNum is automatically populated -- the other sequence numbers need to be manually set in the metadata
-#   - TODO -- add processing for tenant groups;  presently only does processing on individual tenants at a time
-#		This will be important for processing all tenants at the same time.
-#   - TODO -- presently, only SQL instructions are supported.  Design is intended to support other InstructionTypes, including
-#   	SCRIPT to run an external script for process
-#  		JOB - to run another job within a job
-# 		JOBGROUP -- to run another job group within a JOB
+#		- With --workers > 1, instructions are grouped into per-table load units and scheduled as a dependency graph built from s_LoadDependency
+#		  (see reddm_scheduler.py) -- a unit starts as soon as the units it depends on are done, everything else keeps metadata order
+#   - The plan (instructions, tenant variables, compiled templates) is kept in a local snapshot (see reddm_snapshot.py).   Each run only asks
+#     the core database for a content hash of the metadata, and re-reads the metadata tables when it changed
+#   - Every run is recorded in md_runLog, with per instruction telemetry in md_instructionRun (see reddm_runlog.py, reported on by reddm_runstats.py)
+#   - Every executed instruction is checkpointed per (tenant, job group, job, instruction) in md_runCheckpoint.   A run that is not resumed
+#     clears the checkpoints of its scope first, so --resume only ever continues the most recent run
+#   - Tenant variables are expanded through compiled templates (see reddm_template.py); variables a tenant doesn't define are reported,
+#     and that tenant is not run
+#   - 'resultPrevInstr' in an instruction is replaced by the outcome (Success / Failure) of the previous instruction of the same load unit,
+#     the same way run_analytics_load_process() does it
+#   - A job (md_job.settings) and an instruction (md_instruction.settings) can carry a session settings profile, a JSON object such as
+#     {"work_mem": "256MB", "jit": "off"} -- the instruction's settings override its job's.   They are applied with set_config(..., true),
+#     i.e. SET LOCAL, in the instruction's own transaction, so they never leak into the next instruction.   Only SESSION_SETTINGS can be
+#     set; other names are reported and ignored.   The settings columns are added to the metadata tables on first use
+#   - An instruction can carry guard queries: a "-- guard: <query>" line comment in its SQL, and / or its job's md_job.guard.   The guards
+#     run first (tenant variables expanded), and when one returns false (or no row) the instruction is skipped -- e.g. a dimension load
+#     guarded by "any Party.updated_at > its s_LastLoadDate.loadDate".   A guard is evaluated once per tenant run, the first time
+#     an instruction needs it; a guard that fails to run never skips anything.   Skipped instructions are recorded with status Skipped,
+#     count as completed for --resume, and the run summary reports them with the time saved, estimated from their last successful run
+#   - --commit wider than instruction commits at the end of the unit / job / job group instead of after every instruction, saving an
+#     fsync (and a round trip) per instruction.   Each instruction still runs behind its own savepoint, so a failing instruction is
+#     rolled back on its own and reported exactly as before, and the rest of the transaction carries on.   Only deadlocks are retried
+#     there -- a serialization failure (40001) is reported as the instruction's error, since retrying it in the same transaction can't
+#     succeed; use --commit instruction where those are expected.   Checkpoints are only written once their transaction commits; if the
+#     commit itself fails, it is reported as an error and --resume runs its instructions again
+#   - --batch groups lightweight instructions -- short ones (BATCH_MAX_CHARS) without a session settings profile or a dblink call, such as
+#     the update_last_load_date() steps -- into one multi-statement round trip, rendered as if every instruction before them succeeded.
+#     A batch that fails is rolled back as a whole and replayed one instruction at a time, so the error is attributed to the instruction
+#     that caused it and resultPrevInstr sees the real outcomes.   dblink calls are never batched: their connections are not undone by a rollback.
+#     The run log records a batch's duration split evenly over its instructions, and no rowcount for them
+#   - Multi tenant runs end with one combined summary of per-tenant instruction counts, errors and durations.   Each tenant uses its own
+#     pool of --workers mart connections, so a run opens up to --tenants x --workers connections.
+#   - Instructions are SQL, except for the other INSTRUCTION_TYPES.   md_genfromsql.py sets md_instruction.instructionType from the
+#     instruction's first word; an unknown type, or an instruction of another type that doesn't parse, stops the run before it starts
+#   	PARTITION keeps a fact table's monthly partitions -- rewritten into SQL once its tenant variables are expanded (see reddm_partition.py).
+#   	  Keep these instructions (and the other non SQL types) out of the job groups the run_analytics_* procedures execute
+#   	PYTHON <step> [<argument> ...] calls a registered Python step in this process, with the unit's mart connection, a core connection
+#   	  and the tenant variables (see reddm_pysteps.py) -- it runs in the same transaction / savepoint as an SQL instruction would
+#   	JOB <jobName> (or <jobGroupName>.<jobName>) and JOBGROUP <jobGroupName> are replaced by the instructions of that job / job group
+#   	  when the plan is built, recursively.   The included instructions run as part of the including job, named <job>:<sequence>:<included job>
+#   	  in the run log and checkpoints, and only when the guards of the including instruction pass.   A change to an included job
+#   	  rebuilds the snapshot too
+#   - TODO -- SCRIPT to run an external script for process
 #
 
+import re
 import sys
 import json
+import argparse
+import threading
+import concurrent.futures
 import psycopg2
+import psycopg2.pool
 import datetime
 import os
 
-db_host = os.getenv('DATABASE_HOST', "coredb")
-cloud_env = os.getenv('CLOUD_ENV', "dev")
-core_db = 'reva_test' if (len(sys.argv) >= 5  and sys.argv[4] == 'test') else 'reva_core'
-mart_db = 'reva_mart_test' if (len(sys.argv) >= 5 and sys.argv[4] == 'test') else os.getenv('DATABASE', "reva_mart")
-core_user = 'revauser'
-mart_user = 'revamartuser'
-core_password = os.getenv('DATABASE_PASSWORD', "{your-default-database-password}")
-mart_password = os.getenv('DATABASE_MARTPASSWORD', "{your-default-mart-database-password}")
-host = 'localhost' if (len(sys.argv) >= 5  and sys.argv[4] == 'test') else db_host + "." + cloud_env + ".env.reva.tech"
+import reddm_partition
+import reddm_pysteps
+import reddm_runlog
+import reddm_scheduler
+import reddm_snapshot
+import reddm_template
+
+# concurrent load units can collide on s_LastLoadDate rows (update_last_load_date touches the rows of dependent tables too),
+# so deadlock / serialization failures are retried instead of being reported as instruction errors
+RETRY_PGCODES = ("40001", "40P01")
+# inside a wide transaction (--commit unit / job / jobgroup) only a deadlock is retried, after rolling back to the step's savepoint:
+# a serialization failure belongs to the whole transaction's snapshot, so running the step again in the same transaction can't succeed
+STEP_RETRY_PGCODES = ("40P01",)
+RETRY_ATTEMPTS = 3
+
+# <src_tenant_name> value that runs the job group for every tenant in md_tenantVariable
+ALL_TENANTS = "ALL"
+# tenant variable naming the group a tenant belongs to (--tenant-group), and the one naming its source database host (--tenants-per-host)
+TENANT_GROUP_VAR = "tenantGroup"
+TENANT_HOST_VAR = "srcServer"
+# tenant variables with a default, for the tenants that don't define them in md_tenantVariable
+# partitionFacts - "on" creates the fact tables that support it range partitioned on "utcDateKey" (L3_DDL.sql, see reddm_partition.py) --
+#   PostgreSQL 13 or later only, older mart servers keep them unpartitioned
+TENANT_VAR_DEFAULTS = {"partitionFacts": "off"}
+
+# instruction attributes read from the metadata, in plan order -- the snapshot version hash covers the same columns
+INSTRUCTION_COLUMNS = [
+    ("jobGroup", "jg.\"jobGroupName\""),
+    ("jobGroupSequence", "jg.\"sequenceNumber\""),
+    ("job", "j.\"jobName\""),
+    ("jobSequence", "j.\"sequenceNumber\""),
+    ("sequence", "i.\"sequenceNumber\""),
+    ("instruction", "i.\"instruction\""),
+    ("jobSettings", "j.\"settings\""),
+    ("jobGuard", "j.\"guard\""),
+    ("settings", "i.\"settings\""),
+    ("type", "i.\"instructionType\"")]
+INSTRUCTION_ORDER = "jg.\"sequenceNumber\", j.\"sequenceNumber\", i.\"sequenceNumber\""
+# content hash of a set of metadata rows -- ROW_HASH % (columns, order)
+ROW_HASH = "md5(COALESCE(string_agg(md5(ROW(%s)::text), '' ORDER BY %s), ''))"
+
+# --commit levels, and the savepoint each instruction of a wider transaction runs behind
+COMMIT_LEVELS = ("instruction", "unit", "job", "jobgroup")
+STEP_SAVEPOINT = "reddm_step"
+# --batch only groups instructions up to this length -- anything longer is assumed to do enough work to be worth its own round trip
+BATCH_MAX_CHARS = 500
+
+# md_instruction.instructionType -- an instruction is of a type other than SQL when its first word (after comments) names the type
+INSTRUCTION_TYPES = ("SQL", "PARTITION", "PYTHON", "JOB", "JOBGROUP")
+FIRST_WORD = re.compile(r"^(?:\s*--[^\n]*\n)*\s*(\w+)")
+# types rewritten into the SQL they execute, once their tenant variables are expanded
+SQL_REWRITES = {"PARTITION": reddm_partition.partition_sql}
+# types whose instructions are replaced by the instructions of the job / job group they name, when the plan is built
+INCLUDE_TYPES = ("JOB", "JOBGROUP")
+# JOB <jobName> | JOB <jobGroupName>.<jobName> | JOBGROUP <jobGroupName>
+INCLUDE_INSTRUCTION = re.compile(r"^\s*(JOB|JOBGROUP)\s+(\w+)(?:\.(\w+))?\s*;?\s*$", re.IGNORECASE)
+LINE_COMMENT = re.compile(r"^[ \t]*--.*$", re.MULTILINE)
+# how deep JOB / JOBGROUP instructions may nest -- deeper than this is taken for a job that (indirectly) includes itself
+MAX_INCLUDE_DEPTH = 8
+
+# -- guard: SELECT EXISTS (SELECT 1 FROM "dstReplicaDB"."dstReplicaSchema"."Party" ...)
+GUARD_COMMENT = re.compile(r"^[ \t]*--[ \t]*guard:[ \t]*(.*?)[ \t]*$", re.MULTILINE | re.IGNORECASE)
+
+# session settings a job or instruction settings profile may change -- memory, parallelism, commit durability and time limits only
+SESSION_SETTINGS = ("work_mem", "max_parallel_workers_per_gather", "synchronous_commit", "jit", "statement_timeout")
+
+print_lock = threading.Lock()
+
+
+def db_settings(is_test):
+  db_host = os.getenv('DATABASE_HOST', "coredb")
+  cloud_env = os.getenv('CLOUD_ENV', "dev")
+  return {
+      "core_db": 'reva_test' if is_test else 'reva_core',
+      "mart_db": 'reva_mart_test' if is_test else os.getenv('DATABASE', "reva_mart"),
+      "core_user": 'revauser',
+      "mart_user": 'revamartuser',
+      "core_password": os.getenv('DATABASE_PASSWORD', "{your-default-database-password}"),
+      "mart_password": os.getenv('DATABASE_MARTPASSWORD', "{your-default-mart-database-password}"),
+      "host": 'localhost' if is_test else db_host + "." + cloud_env + ".env.reva.tech"}
+
+
+def core_conn_string(settings):
+  return "dbname='%s' user='%s' host='%s' password='%s'" % (settings["core_db"], settings["core_user"], settings["host"], settings["core_password"])
 
-def expand_tenantvar(tenant_vars, in_instruction):
 
-  out_instruction = in_instruction
-  for var in tenant_vars:
-    # replace $( pattern variables, which is what DBAnalyzer uses
-    out_instruction = out_instruction.replace(var, tenant_vars[var])
-    # replace %( pattern variables, which is PSQL spec
-    out_instruction = out_instruction.replace(
-        "%{" + var + "}%", tenant_vars[var])
+def mart_conn_string(settings):
+  return "dbname='%s' user='%s' host='%s' password='%s'" % (settings["mart_db"], settings["mart_user"], settings["host"], settings["mart_password"])
 
-  return out_instruction
+
+def log(message):
+  # output lines of concurrently running load units must not interleave
+  with print_lock:
+    print(message)
+
+
+def expand_tenantvar(tenant_vars, in_instruction):
+  """one-off expansion of both the $( (bare, DBAnalyzer) and %( (PSQL) variable patterns -- job group instructions go through a shared TemplateEngine"""
+  engine = reddm_template.TemplateEngine(tenant_vars)
+  return reddm_template.render(engine.expand(None, tenant_vars, engine.compile(in_instruction)))
 
 
 def millis_interval(start, end):
@@ -69,121 +210,880 @@ def millis_interval(start, end):
   millis += diff.microseconds / 1000
   return millis
 
-# make sure appopriate input / output parameters are passed in
-if len(sys.argv) < 4 or len(sys.argv) > 5:
-  print(
-      "Usage: python reddm_runjobgroup.py <MD_schema> <src_tenant_name> <jobgroupname> [<jobname>]")
-  exit()
-
-cmd_line = {"MD_SCHEMA": sys.argv[
-    1], "SRC_TENANT": sys.argv[2], "JOBGROUP": sys.argv[3]}
-if len(sys.argv) == 6:
-  cmd_line["JOBNAME"] = sys.argv[5]
-else:
-  cmd_line["JOBNAME"] = None
-
-# connect to data directionary for given MD schema
-try:
-  conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (core_db, core_user, host, core_password)
-  md_conn = psycopg2.connect(conn_string)
-  md_cur = md_conn.cursor()
-
-except psycopg2.Error as e:
-  print("Error Connecting to Metadata: [%s-%s] " % (e.pgcode, e.pgerror))
-  exit()
-
-# populate tenant context variable list for provide tenant
-md_query = "SELECT \"name\", \"value\" FROM \"%s\".\"%s\".\"md_tenantVariable\"  WHERE \"tenantName\" = '%s' ;" % (
-    core_db, cmd_line["MD_SCHEMA"], cmd_line["SRC_TENANT"])
-try:
+
+def parse_cmd_line(argv):
+  parser = argparse.ArgumentParser(
+      usage="python reddm_runjobgroup.py <MD_schema> <src_tenant_name | tenant,tenant,... | ALL> <jobgroupname> [test] [<jobname>] [--workers N] [--commit LEVEL] [--batch N] [--tenant-group G] [--tenants N] [--tenants-per-host N] [--snapshot-dir DIR | --no-snapshot] [--no-runlog] [--resume] [--stop-on-error]")
+  parser.add_argument("md_schema")
+  parser.add_argument("src_tenant")
+  parser.add_argument("jobgroup")
+  parser.add_argument("env", nargs="?")
+  parser.add_argument("jobname", nargs="?")
+  parser.add_argument("--workers", type=int, default=1)
+  parser.add_argument("--commit", choices=COMMIT_LEVELS, default="instruction")
+  parser.add_argument("--batch", type=int, default=1)
+  parser.add_argument("--tenant-group", default=None)
+  parser.add_argument("--tenants", type=int, default=4)
+  parser.add_argument("--tenants-per-host", type=int, default=None)
+  parser.add_argument("--snapshot-dir", default=reddm_snapshot.default_snapshot_dir())
+  parser.add_argument("--no-snapshot", action="store_true")
+  parser.add_argument("--no-runlog", action="store_true")
+  parser.add_argument("--resume", action="store_true")
+  parser.add_argument("--stop-on-error", action="store_true")
+  args = parser.parse_args(argv)
+
+  # <jobname> may be given without the test flag in front of it
+  if args.env is not None and args.env != "test" and args.jobname is None:
+    args.jobname = args.env
+    args.env = None
+
+  if args.resume and args.no_runlog:
+    parser.error("--resume reads its checkpoints from the run log, it can't be combined with --no-runlog")
+
+  if args.workers < 1 or args.tenants < 1 or args.batch < 1 or (args.tenants_per_host != None and args.tenants_per_host < 1):
+    parser.error("--workers, --batch, --tenants and --tenants-per-host must be at least 1")
+
+  if args.commit in ("job", "jobgroup") and args.workers > 1:
+    parser.error("--commit %s keeps one transaction over many load units, it can't be combined with --workers" % (args.commit))
+
+  return {"MD_SCHEMA": args.md_schema, "SRC_TENANT": args.src_tenant, "JOBGROUP": args.jobgroup, "JOBNAME": args.jobname,
+          "TEST": args.env == "test", "WORKERS": args.workers, "COMMIT": args.commit, "BATCH": args.batch, "TENANT_GROUP": args.tenant_group,
+          "TENANTS": args.tenants, "TENANTS_PER_HOST": args.tenants_per_host,
+          "SNAPSHOT_DIR": None if args.no_snapshot else args.snapshot_dir, "RUNLOG": not args.no_runlog,
+          "RESUME": args.resume, "STOP_ON_ERROR": args.stop_on_error}
+
+
+def tenantvar_query(settings, md_schema, tenant_name, select):
+  md_query = "SELECT %s FROM \"%s\".\"%s\".\"md_tenantVariable\"" % (select, settings["core_db"], md_schema)
+  if tenant_name != None:
+    md_query += "  WHERE \"tenantName\" = '%s'" % (tenant_name)
+  return md_query
+
+
+def read_tenantvars(md_cur, settings, md_schema, tenant_name=None):
+  """returns { tenantName: { variable: value } } for the given tenant, or for every tenant when tenant_name is None -- TENANT_VAR_DEFAULTS included"""
+  # populate tenant context variable list for provide tenant
+  md_cur.execute(tenantvar_query(settings, md_schema, tenant_name, "\"tenantName\", \"name\", \"value\"") + " ORDER BY 1;")
+
+  tenantvars = {}
+  for var in md_cur:
+    tenantvars.setdefault(var[0], dict(TENANT_VAR_DEFAULTS))[var[1]] = var[2]
+
+  return tenantvars
+
+
+def select_tenants(tenantvars, src_tenant, tenant_group):
+  """resolve <src_tenant_name> -- a tenant, a comma separated list of tenants, or ALL -- optionally narrowed to one tenant group"""
+  if src_tenant.upper() == ALL_TENANTS:
+    tenant_names = sorted(tenantvars)
+  else:
+    tenant_names = [name.strip() for name in src_tenant.split(",") if name.strip()]
+
+  if tenant_group != None:
+    tenant_names = [name for name in tenant_names if tenantvars.get(name, {}).get(TENANT_GROUP_VAR) == tenant_group]
+
+  return tenant_names
+
+
+def session_settings(*profiles):
+  """merge settings profiles (later ones win) into [(setting, value)] -- returns it with the names that aren't SESSION_SETTINGS"""
+  merged = {}
+  for profile in profiles:
+    if isinstance(profile, str):
+      profile = json.loads(profile)
+    merged.update(profile or {})
+
+  session = []
+  unknown = []
+  for name in sorted(merged):
+    value = merged[name]
+    if name not in SESSION_SETTINGS:
+      unknown.append(name)
+    elif value is not None:
+      # null in an instruction profile keeps the session default, even when the job sets it
+      session.append((name, ("on" if value else "off") if isinstance(value, bool) else str(value)))
+
+  return session, unknown
+
+
+def ensure_profile_columns(md_cur, settings, md_schema):
+  # only altered when missing -- ALTER TABLE locks the metadata tables even when there's nothing to add
+  md_cur.execute("SELECT count(*) FROM \"%s\".information_schema.columns WHERE table_schema=%%s AND ((table_name IN ('md_job', 'md_instruction') "
+                 "AND column_name='settings') OR (table_name='md_job' AND column_name='guard'));" % (settings["core_db"]), (md_schema,))
+  if md_cur.fetchone()[0] < 3:
+    md_cur.execute("ALTER TABLE \"%s\".\"%s\".\"md_job\" ADD COLUMN IF NOT EXISTS \"settings\" jsonb, ADD COLUMN IF NOT EXISTS \"guard\" text;"
+                   "ALTER TABLE \"%s\".\"%s\".\"md_instruction\" ADD COLUMN IF NOT EXISTS \"settings\" jsonb;"
+                   % (settings["core_db"], md_schema, settings["core_db"], md_schema))
+  md_cur.connection.commit()
+
+
+def instruction_query(settings, cmd_line, select):
+  md_query = "select %s from \"database\".\"%s\".\"md_jobGroup\" jg, \"database\".\"%s\".\"md_job\" j, \"database\".\"%s\".\"md_instruction\" i WHERE i.\"jobId\"=j.\"id\" AND j.\"jobGroupId\"=jg.\"id\" AND jg.\"jobGroupName\"='%s'" % (
+      select, cmd_line["MD_SCHEMA"], cmd_line["MD_SCHEMA"], cmd_line["MD_SCHEMA"], cmd_line["JOBGROUP"])
+  if cmd_line["JOBNAME"] != None:
+    md_query += " AND j.\"jobName\"='%s'" % (cmd_line["JOBNAME"])
+
+  # only the "database" placeholders of the from clause are replaced -- column expressions may legitimately contain the word
+  return md_query.replace("\"database\".", "\"%s\"." % (settings["core_db"]))
+
+
+def read_instructions(md_cur, settings, cmd_line):
+  # for particular jobgroup, grab all of the instructions in order
+  select = ", ".join(column for name, column in INSTRUCTION_COLUMNS)
+  md_cur.execute(instruction_query(settings, cmd_line, select) + " ORDER BY %s;" % (INSTRUCTION_ORDER))
+
+  md_lines = []
+  for row in md_cur.fetchall():
+    md_lines.append(dict(zip([name for name, column in INSTRUCTION_COLUMNS], row)))
+
+  return md_lines
+
+
+def read_plan_version(md_cur, settings, cmd_line, tenant_name):
+  """content hash of everything a plan is built from, computed in the core database so no instruction text is transferred"""
+  md_query = "SELECT (%s), (%s);" % (
+      instruction_query(settings, cmd_line, ROW_HASH % (", ".join(column for name, column in INSTRUCTION_COLUMNS), INSTRUCTION_ORDER)),
+      tenantvar_query(settings, cmd_line["MD_SCHEMA"], tenant_name, ROW_HASH % ("\"tenantName\", \"name\", \"value\"", "\"tenantName\", \"name\"")))
   md_cur.execute(md_query)
+  row = md_cur.fetchone()
+
+  return "%s-%s" % (row[0], row[1])
+
 
-except psycopg2.Error as e:
-  print("Error Connecting to Metadata: [%s] [%s-%s] " %
-        (md_query, e.pgcode, e.pgerror))
-  exit()
-
-tenantvar = {}
-for var in md_cur:
-  tenantvar[var[0]] = var[1]
-
-# for particular jobgroup, grab all of the instructions in order
-md_lines = None
-if cmd_line["JOBNAME"] != None:
-  md_query = "select jg.\"jobGroupName\", jg.\"sequenceNumber\" as \"jobGroupSequence\", j.\"jobName\", j.\"sequenceNumber\" as \"jobSequence\", i.\"sequenceNumber\" as \"instSequence\", i.\"instruction\"  from \"database\".\"%s\".\"md_jobGroup\" jg, \"database\".\"%s\".\"md_job\" j, \"database\".\"%s\".\"md_instruction\" i WHERE i.\"jobId\"=j.\"id\" AND j.\"jobGroupId\"=jg.\"id\" AND jg.\"jobGroupName\"='%s' AND j.\"jobName\"='%s' ORDER BY 2,4,5;" % (cmd_line[
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                           "MD_SCHEMA"], cmd_line["MD_SCHEMA"], cmd_line["MD_SCHEMA"], cmd_line["JOBGROUP"], cmd_line["JOBNAME"])
-else:
-  md_query = "select jg.\"jobGroupName\", jg.\"sequenceNumber\" as \"jobGroupSequence\", j.\"jobName\", j.\"sequenceNumber\" as \"jobSequence\", i.\"sequenceNumber\" as \"instSequence\", i.\"instruction\"  from \"database\".\"%s\".\"md_jobGroup\" jg, \"database\".\"%s\".\"md_job\" j, \"database\".\"%s\".\"md_instruction\" i WHERE i.\"jobId\"=j.\"id\" AND j.\"jobGroupId\"=jg.\"id\" AND jg.\"jobGroupName\"='%s'ORDER BY 2,4,5;" % (cmd_line[
-                                                                                                                                                                                                                                                                                                                                                                                                                                                   "MD_SCHEMA"], cmd_line["MD_SCHEMA"], cmd_line["MD_SCHEMA"], cmd_line["JOBGROUP"])
-
-try:
-  md_query = md_query.replace("database", core_db)
+def read_include_version(md_cur, settings, cmd_line, includes):
+  """content hash of the instructions of the included (job group, job) -- part of the plan's version, even though the plan's own query doesn't read them"""
+  md_query = "SELECT %s;" % (", ".join(
+      "(%s)" % (instruction_query(settings, dict(cmd_line, JOBGROUP=jobgroup, JOBNAME=jobname),
+                                  ROW_HASH % (", ".join(column for name, column in INSTRUCTION_COLUMNS), INSTRUCTION_ORDER))) for jobgroup, jobname in includes))
   md_cur.execute(md_query)
-  md_lines = md_cur.fetchall()
 
-except psycopg2.Error as e:
-  print("Error Reading Instructions: [%s] [%s-%s] " %
-        (md_query, e.pgcode, e.pgerror))
-  exit()
+  return "-".join(md_cur.fetchone())
 
-err_count = 0
-inst_count = 0
-start_time = datetime.datetime.now()
 
-md_conn.close()
+def include_target(line):
+  """the (job group, job) a JOB / JOBGROUP instruction names -- job is None for a whole job group; raises ValueError when it doesn't parse"""
+  match = INCLUDE_INSTRUCTION.match(LINE_COMMENT.sub("", line["instruction"]))
+  if match == None or match.group(1).upper() != line["type"] or (line["type"] == "JOBGROUP" and match.group(3) != None):
+    raise ValueError("expected JOB <jobName>, JOB <jobGroupName>.<jobName> or JOBGROUP <jobGroupName>")
+  if line["type"] == "JOBGROUP":
+    return (match.group(2), None)
+  if match.group(3) == None:
+    return (line["jobGroup"], match.group(2))
+  return (match.group(2), match.group(3))
 
-# for all retrieved instructions, execute them
-if not md_lines == None:
+
+def expand_includes(md_cur, settings, cmd_line, md_lines, includes, depth=0):
+  """replace every JOB / JOBGROUP instruction by the instructions of the job / job group it names, recursively -- includes collects the
+  (job group, job) read along the way.   Raises ValueError for an instruction that doesn't parse, names nothing, or nests too deep"""
+  expanded = []
+  for line in md_lines:
+    line["type"] = (line["type"] or "SQL").upper()
+    if line["type"] not in INCLUDE_TYPES:
+      expanded.append(line)
+      continue
+
+    try:
+      target = include_target(line)
+      if depth >= MAX_INCLUDE_DEPTH:
+        raise ValueError("nested more than %i levels deep -- does a job include itself?" % (MAX_INCLUDE_DEPTH))
+      nested = read_instructions(md_cur, settings, dict(cmd_line, JOBGROUP=target[0], JOBNAME=target[1]))
+      if not nested:
+        raise ValueError("no instructions found for %s" % (".".join(name for name in target if name != None)))
+    except ValueError as e:
+      raise ValueError("[%s-%s-%i] %s" % (line["jobGroup"], line["job"], line["sequence"], e))
+
+    includes.append(target)
+    # an included instruction runs as part of the including job: logged, checkpointed and resumed as <job>:<sequence>:<included job>,
+    # and only when the guards of the including instruction pass
+    include_guards = line_guards(line)
+    for nested_line in expand_includes(md_cur, settings, cmd_line, nested, includes, depth + 1):
+      expanded.append(dict(nested_line, jobGroup=line["jobGroup"], job="%s:%i:%s" % (line["job"], line["sequence"], nested_line["job"]),
+                           includeGuards=include_guards + nested_line.get("includeGuards", [])))
+
+  return expanded
+
+
+def line_guards(line):
+  # the guards of the JOB / JOBGROUP instructions that included the line come first
+  return line.get("includeGuards", []) + ([line["jobGuard"]] if line["jobGuard"] else []) + [guard for guard in GUARD_COMMENT.findall(line["instruction"]) if guard]
+
+
+def instruction_type(instruction):
+  first_word = FIRST_WORD.match(instruction)
+  if first_word != None and first_word.group(1).upper() in INSTRUCTION_TYPES:
+    return first_word.group(1).upper()
+  return "SQL"
+
+
+def compile_plan(tenantvars, md_lines):
+  # every instruction is parsed once, against the variable names of all tenants in this run
+  var_names = set()
+  for tenant_vars in tenantvars.values():
+    var_names.update(tenant_vars)
+  engine = reddm_template.TemplateEngine(var_names)
+  for line in md_lines:
+    line["template"] = engine.compile(line["instruction"])
+    line["type"] = (line["type"] or "SQL").upper()
+    if line["type"] not in INSTRUCTION_TYPES or line["type"] in INCLUDE_TYPES:
+      print("Unknown Instruction Type [%s-%s-%i]: %s" % (line["jobGroup"], line["job"], line["sequence"], line["type"]))
+      exit()
+    # the unexpanded text is enough to check the syntax, before any tenant runs it
+    try:
+      if line["type"] in SQL_REWRITES:
+        SQL_REWRITES[line["type"]](line["instruction"])
+      elif line["type"] == "PYTHON":
+        reddm_pysteps.parse(line["instruction"])
+    except ValueError as e:
+      print("Invalid %s Instruction [%s-%s-%i]: %s" % (line["type"], line["jobGroup"], line["job"], line["sequence"], e))
+      exit()
+    line["session"], unknown = session_settings(line["jobSettings"], line["settings"])
+    if unknown:
+      print("Session settings ignored for [%s-%s-%i]: %s" % (line["jobGroup"], line["job"], line["sequence"], ", ".join(unknown)))
+    line["guards"] = [engine.compile(guard) for guard in line_guards(line)]
+
+  return {"tenantvars": tenantvars, "md_lines": md_lines, "var_names": var_names, "templates": engine.templates}
+
+
+def load_plan(settings, cmd_line, single_tenant):
+  """read tenant variables and instructions, from the local snapshot when the metadata hasn't changed since it was written"""
+  # connect to data directionary for given MD schema
   try:
-    conn_string = "dbname='%s' user='%s' host='%s' password='%s'" % (mart_db, mart_user, host, mart_password)
-    md_conn_mart = psycopg2.connect(conn_string)
-    md_cur_mart = md_conn_mart.cursor()
+    md_conn = psycopg2.connect(core_conn_string(settings))
+    md_cur = md_conn.cursor()
+    ensure_profile_columns(md_cur, settings, cmd_line["MD_SCHEMA"])
 
   except psycopg2.Error as e:
-    print("Error Connecting to Mart: [%s-%s] " % (e.pgcode, e.pgerror))
+    print("Error Connecting to Metadata: [%s-%s] " % (e.pgcode, e.pgerror))
     exit()
 
-  print("Processing Tenant %s:" % (cmd_line["SRC_TENANT"]))
-  for var in tenantvar:
-    print("\t%s = %s" % (var, tenantvar[var]))
+  tenant_name = cmd_line["SRC_TENANT"] if single_tenant else None
+  plan = None
+  version = None
+  path = None
+  if cmd_line["SNAPSHOT_DIR"] != None:
+    path = reddm_snapshot.snapshot_path(cmd_line["SNAPSHOT_DIR"], [settings["host"], settings["core_db"], cmd_line["MD_SCHEMA"],
+                                                                   cmd_line["JOBGROUP"], cmd_line["JOBNAME"], tenant_name])
+    try:
+      version = read_plan_version(md_cur, settings, cmd_line, tenant_name)
+      plan = reddm_snapshot.load_snapshot(path, version)
+      # the instructions of included jobs are part of the plan too -- a change to any of them rebuilds it
+      if plan != None and plan.get("includes") and read_include_version(md_cur, settings, cmd_line, plan["includes"]) != plan["include_version"]:
+        plan = None
 
-  for line in md_lines:
-    instruction = line[5]
+    except psycopg2.Error as e:
+      md_conn.rollback()
+      print("Metadata version not available, reading metadata: [%s-%s] " % (e.pgcode, e.pgerror))
+      version = None
+      plan = None
+
+  if plan != None:
+    print("Using metadata snapshot %s" % (path))
+
+  else:
+    try:
+      tenantvars = read_tenantvars(md_cur, settings, cmd_line["MD_SCHEMA"], tenant_name)
+
+    except psycopg2.Error as e:
+      print("Error Connecting to Metadata: [%s-%s] " % (e.pgcode, e.pgerror))
+      exit()
 
-    exp_instruction = expand_tenantvar(tenantvar, instruction)
+    # the job group instructions are read once, and shared by every tenant
+    includes = []
+    try:
+      md_lines = expand_includes(md_cur, settings, cmd_line, read_instructions(md_cur, settings, cmd_line), includes)
+      include_version = read_include_version(md_cur, settings, cmd_line, includes) if includes and version != None else None
+
+    except psycopg2.Error as e:
+      print("Error Reading Instructions: [%s-%s] " % (e.pgcode, e.pgerror))
+      exit()
+
+    except ValueError as e:
+      print("Invalid Include Instruction %s" % (e))
+      exit()
+
+    plan = compile_plan(tenantvars, md_lines)
+    plan["includes"] = includes
+    plan["include_version"] = include_version
+    if version != None and md_lines:
+      try:
+        size = reddm_snapshot.save_snapshot(path, version, plan)
+        print("Metadata snapshot written: %s (%i bytes)" % (path, size))
+
+      except OSError as e:
+        print("Metadata snapshot not written: [%s] %s" % (path, e))
+
+  md_conn.close()
+
+  engine = reddm_template.TemplateEngine(plan["var_names"])
+  engine.templates.update(plan["templates"])
+  return plan["tenantvars"], plan["md_lines"], engine
+
+
+def read_load_dependencies(conn, tenantvar):
+  # s_LoadDependency lives in the tenant's star schema -- it doesn't exist yet before RESTARTMART, in which case we run sequentially
+  dep_query = expand_tenantvar(tenantvar, "SELECT \"tableName\", \"dependsOnTable\" FROM \"dstStarDB\".\"dstStarSchema\".\"s_LoadDependency\";")
+  try:
+    cur = conn.cursor()
+    cur.execute(dep_query)
+    load_dependencies = cur.fetchall()
+    conn.commit()
+
+  except psycopg2.Error as e:
+    conn.rollback()
+    log("Load dependencies not available, running sequentially: [%s-%s] " % (e.pgcode, (e.pgerror or "").strip()))
+    return None
+
+  return load_dependencies
+
+
+def execute_instruction(conn, exp_instruction, session=None, fetch=False):
+  """run one instruction in its own transaction, after applying its session settings ([(setting, value)]) to that transaction only --
+  with fetch, the count returned is the first column of the row the statement returns (0 when it returns none), not its rowcount"""
+  err_code = None
+  err_string = ""
+  rowcount = None
+
+  cur = conn.cursor()
+  for attempt in range(1, RETRY_ATTEMPTS + 1):
     err_code = None
     err_string = ""
+    try:
+      if session:
+        cur.execute("SELECT %s;" % (", ".join(["set_config(%s, %s, true)"] * len(session))), [value for setting in session for value in setting])
+      cur.execute(exp_instruction)
+      rowcount = cur.rowcount
+      if fetch:
+        row = cur.fetchone() if rowcount > 0 else None
+        rowcount = row[0] if row != None else 0
+      conn.commit()
+
+    except psycopg2.Error as e:
+      err_code = e.pgcode
+      err_string = (e.pgerror or str(e)).strip()
+      conn.rollback()
+
+    if err_code not in RETRY_PGCODES:
+      break
+
+  cur.close()
+  return err_code, err_string, rowcount
+
+
+def new_transaction(conn, level):
+  """a transaction that spans several instructions (--commit unit / job / jobgroup); pending holds (line, status) awaiting the commit"""
+  return {"conn": conn, "level": level, "job": None, "pending": [], "savepoint": False, "reset": []}
 
-    # for particular jobgroup, grab all of the instructions in order
-    dt_sql_start = datetime.datetime.now()
+
+def step_sql(cur, txn, statements, session=None):
+  # one round trip of a wide transaction: release the previous step's savepoint (and session settings), then open this step's
+  parts = []
+  if txn["savepoint"]:
+    parts.append("RELEASE SAVEPOINT %s;" % (STEP_SAVEPOINT))
+  parts.extend("RESET %s;" % (name) for name in txn["reset"])
+  parts.append("SAVEPOINT %s;" % (STEP_SAVEPOINT))
+  if session:
+    parts.append(cur.mogrify("SELECT %s;" % (", ".join(["set_config(%s, %s, true)"] * len(session))),
+                             [value for setting in session for value in setting]).decode("utf-8"))
+  parts.append(statements)
+  return "\n".join(parts)
+
+
+def execute_step(conn, txn, exp_instruction, session=None):
+  """execute_instruction() inside a wide transaction -- a failing instruction is rolled back to its savepoint, the rest of the transaction is kept.
+  Only deadlocks are retried (STEP_RETRY_PGCODES).   Raises psycopg2.Error when even that isn't possible (the connection is gone)"""
+  err_code = None
+  err_string = ""
+  rowcount = None
+
+  cur = conn.cursor()
+  for attempt in range(1, RETRY_ATTEMPTS + 1):
+    err_code = None
+    err_string = ""
     try:
-      md_cur_mart.execute(exp_instruction)
-      md_conn_mart.commit()
+      cur.execute(step_sql(cur, txn, exp_instruction, session))
+      rowcount = cur.rowcount
+      # SET LOCAL lasts until the commit -- the next step puts the settings back
+      txn["reset"] = [name for name, value in session or []]
 
     except psycopg2.Error as e:
       err_code = e.pgcode
-      err_string = e.pgerror.strip()
-      md_conn_mart.rollback()
+      err_string = (e.pgerror or str(e)).strip()
+      cur.execute("ROLLBACK TO SAVEPOINT %s;" % (STEP_SAVEPOINT))
+      txn["reset"] = []
+    txn["savepoint"] = True
+
+    if err_code not in STEP_RETRY_PGCODES:
+      break
+
+  cur.close()
+  return err_code, err_string, rowcount
+
+
+def execute_batch(conn, txn, statements):
+  """run several instructions in one round trip; returns (err_code, err_string) -- a failed batch is undone as a whole"""
+  batch_sql = "\n;\n".join(statements)
+  cur = conn.cursor()
+  try:
+    if txn != None:
+      cur.execute(step_sql(cur, txn, batch_sql))
+    else:
+      cur.execute(batch_sql)
+      conn.commit()
+
+  except psycopg2.Error as e:
+    if txn != None:
+      cur.execute("ROLLBACK TO SAVEPOINT %s;" % (STEP_SAVEPOINT))
+    else:
+      conn.rollback()
+    return e.pgcode, (e.pgerror or str(e)).strip()
+
+  finally:
+    if txn != None:
+      txn["savepoint"] = True
+      txn["reset"] = []
+    cur.close()
+
+  return None, ""
+
+
+def execute_python(run, conn, txn, exp_instruction, session=None):
+  """run the step of a PYTHON instruction on the unit's mart connection -- in a transaction of its own, or behind a savepoint of the
+  wide one, exactly like an SQL instruction; an exception the step raises is its error"""
+  step, arguments = reddm_pysteps.parse(exp_instruction)
+  if step["commits"] and txn != None:
+    return reddm_pysteps.PYTHON_ERRCODE, "step %s commits on its own -- it needs --commit instruction" % (step["name"]), None
+
+  tenant = run["tenant"]
+  context = {"mart": conn, "core": run["core_conn"], "vars": tenant["vars"], "tenant": tenant["name"],
+             "log": lambda message: log("%s%s" % (tenant["prefix"], message))}
+  err_code = None
+  err_string = ""
+  rowcount = None
+
+  cur = conn.cursor()
+  try:
+    if txn != None:
+      cur.execute(step_sql(cur, txn, "", session))
+      txn["savepoint"] = True
+    elif session:
+      cur.execute("SELECT %s;" % (", ".join(["set_config(%s, %s, true)"] * len(session))), [value for setting in session for value in setting])
+    rowcount = step["function"](context, *arguments)
+    if txn != None:
+      txn["reset"] = [name for name, value in session or []]
+    else:
+      conn.commit()
+
+  except Exception as e:
+    if isinstance(e, psycopg2.Error):
+      err_code = e.pgcode
+      err_string = (e.pgerror or str(e)).strip()
+    else:
+      err_code = reddm_pysteps.PYTHON_ERRCODE
+      err_string = "%s: %s" % (type(e).__name__, e)
+    if txn != None:
+      cur.execute("ROLLBACK TO SAVEPOINT %s;" % (STEP_SAVEPOINT))
+      txn["reset"] = []
+    else:
+      conn.rollback()
+
+  finally:
+    cur.close()
+
+  return err_code, err_string, rowcount
+
+
+def commit_transaction(run, txn, counts):
+  """commit a wide transaction, and only then checkpoint the instructions it ran"""
+  if txn["savepoint"] or txn["pending"]:
+    try:
+      txn["conn"].commit()
+      run["runlog"].checkpoint(run["run_id"], run["tenant"]["name"], txn["pending"])
+
+    except psycopg2.Error as e:
+      txn["conn"].rollback()
+      lines = [line for line, status in txn["pending"]]
+      log("%sCommit Failed [%s] %i instructions Err: %s %s" % (run["tenant"]["prefix"], ", ".join("%s-%s-%i" % (line["jobGroup"], line["job"], line["sequence"]) for line in lines[:1] + lines[-1:]),
+                                                               len(lines), e.pgcode, (e.pgerror or str(e)).strip()))
+      counts["err_count"] += 1
+
+  txn["pending"] = []
+  txn["savepoint"] = False
+  txn["reset"] = []
+
+
+def evaluate_guard(conn, txn, guard_sql):
+  """returns (passed, err_code, err_string) -- a guard passes unless its first column is false / null / 0, or it returns no row"""
+  cur = conn.cursor()
+  try:
+    cur.execute(step_sql(cur, txn, guard_sql) if txn != None else guard_sql)
+    row = cur.fetchone() if cur.description != None else None
+    if txn == None:
+      conn.commit()
+    return row != None and bool(row[0]), None, ""
+
+  except psycopg2.Error as e:
+    if txn != None:
+      cur.execute("ROLLBACK TO SAVEPOINT %s;" % (STEP_SAVEPOINT))
+    else:
+      conn.rollback()
+    return True, e.pgcode, (e.pgerror or str(e)).strip()
+
+  finally:
+    if txn != None:
+      txn["savepoint"] = True
+      txn["reset"] = []
+    cur.close()
+
+
+def guards_pass(run, conn, txn, line):
+  """evaluate the line's guards, each guard at most once per tenant run; False when one of them says the instruction has nothing to do"""
+  tenant = run["tenant"]
+  for guard in line["guards"]:
+    guard_sql = reddm_template.render(run["engine"].expand(tenant["name"], tenant["vars"], guard))
+    with run["guard_lock"]:
+      passed = run["guard_results"].get(guard_sql)
+    if passed == None:
+      passed, err_code, err_string = evaluate_guard(conn, txn, guard_sql)
+      if err_code != None:
+        log("%sGuard Failed [%s-%s-%i], running the instruction: %s %s" % (tenant["prefix"], line["jobGroup"], line["job"], line["sequence"], err_code, err_string))
+      with run["guard_lock"]:
+        run["guard_results"][guard_sql] = passed
+    if not passed:
+      return False
+
+  return True
+
+
+def render_instruction(line, bound, result_prev_instr):
+  """the SQL an instruction executes -- an instruction of another type is rewritten into SQL once its tenant variables are expanded"""
+  exp_instruction = reddm_template.render(bound, {"resultPrevInstr": result_prev_instr})
+  to_sql = SQL_REWRITES.get(line.get("type", "SQL"))
+  return to_sql(exp_instruction) if to_sql != None else exp_instruction
+
+
+def batchable(line):
+  instruction = line["instruction"]
+  return line.get("type", "SQL") == "SQL" and not line.get("session") and not line.get("guards") and len(instruction) <= BATCH_MAX_CHARS and "dblink" not in instruction.lower()
+
+
+def next_batch(run, lines, pos):
+  # the consecutive lightweight instructions starting at pos -- a single one isn't worth a batch
+  end = pos
+  while end < len(lines) and end - pos < run["batch"] and batchable(lines[end]):
+    end += 1
+  return lines[pos:end] if end - pos > 1 else []
+
+
+def run_unit(run, unit):
+  """execute all instructions of a load unit in order, on one pooled mart connection"""
+  counts = {"inst_count": 0, "err_count": 0, "resumed_count": 0, "guard_count": 0, "saved_ms": 0, "skipped_count": 0}
+  result_prev_instr = ""
+  tenant = run["tenant"]
+  # when resuming, the unit restarts at its first instruction that didn't complete (or whose text changed since) -- everything after it runs again
+  resuming = True
+
+  # job / jobgroup transactions are shared by every unit of the run, a unit transaction belongs to this unit
+  txn = run["txn"]
+  if txn != None:
+    conn = txn["conn"]
+  else:
+    conn = run["pool"].getconn()
+    if run["commit"] == "unit":
+      txn = new_transaction(conn, "unit")
+
+  lines = unit["lines"]
+  pos = 0
+  # instructions of a failed batch, which are replayed one at a time
+  replay_end = 0
+  try:
+    while pos < len(lines):
+      line = lines[pos]
+      if resuming and run["completed"].get((line["job"], line["sequence"])) == line["template"]["hash"]:
+        counts["resumed_count"] += 1
+        result_prev_instr = "Success"
+        pos += 1
+        continue
+      resuming = False
+
+      if txn != None:
+        if txn["level"] == "job" and txn["job"] not in (None, line["job"]):
+          commit_transaction(run, txn, counts)
+        txn["job"] = line["job"]
+
+      if line.get("guards"):
+        dt_sql_start = datetime.datetime.now()
+        if not guards_pass(run, conn, txn, line):
+          dt_sql_end = datetime.datetime.now()
+          saved_ms = max(0, run["durations"].get((line["job"], line["sequence"]), 0) - millis_interval(dt_sql_start, dt_sql_end))
+          log("%sSkipped By Guard [%s-%s-%i] ~%0ims saved" % (tenant["prefix"], line["jobGroup"], line["job"], line["sequence"], saved_ms))
+          run["runlog"].record(run["run_id"], tenant["name"], line, dt_sql_start, dt_sql_end, millis_interval(dt_sql_start, dt_sql_end), None, None, "", "Skipped")
+          # nothing left to do counts as done -- a resumed run doesn't start over at a skipped instruction
+          if txn != None:
+            txn["pending"].append((line, "Success"))
+          else:
+            run["runlog"].checkpoint(run["run_id"], tenant["name"], [(line, "Success")])
+          counts["guard_count"] += 1
+          counts["saved_ms"] += saved_ms
+          result_prev_instr = "Success"
+          pos += 1
+          continue
+
+      batch = next_batch(run, lines, pos) if pos >= replay_end and run["batch"] > 1 else []
+      if batch:
+        statements = []
+        for batch_pos, batch_line in enumerate(batch):
+          bound = run["engine"].expand(tenant["name"], tenant["vars"], batch_line["template"])
+          statements.append(render_instruction(batch_line, bound, result_prev_instr if batch_pos == 0 else "Success"))
+
+        dt_sql_start = datetime.datetime.now()
+        err_code, err_string = execute_batch(conn, txn, statements)
+        dt_sql_end = datetime.datetime.now()
+
+        if err_code == None:
+          duration_ms = millis_interval(dt_sql_start, dt_sql_end) / len(batch)
+          for batch_line, statement in zip(batch, statements):
+            log("%sRun [%s-%s-%i] [%s] [%s] %0ims %s Err: None (batch of %i)" % (tenant["prefix"], batch_line["jobGroup"], batch_line["job"], batch_line["sequence"],
+                                                                                dt_sql_start, dt_sql_end, duration_ms, statement.replace("\n", " ")[:80], len(batch)))
+            run["runlog"].record(run["run_id"], tenant["name"], batch_line, dt_sql_start, dt_sql_end, duration_ms, None, None, "", "Success")
+          if txn != None:
+            txn["pending"].extend((batch_line, "Success") for batch_line in batch)
+          else:
+            run["runlog"].checkpoint(run["run_id"], tenant["name"], [(batch_line, "Success") for batch_line in batch])
+          counts["inst_count"] += len(batch)
+          result_prev_instr = "Success"
+          pos += len(batch)
+          continue
+
+        # replayed one instruction at a time, so the error is reported against the instruction that caused it
+        log("%sBatch [%s-%s-%i..%i] failed, replaying one at a time: %s %s" % (tenant["prefix"], line["jobGroup"], line["job"], line["sequence"],
+                                                                              batch[-1]["sequence"], err_code, err_string))
+        replay_end = pos + len(batch)
+
+      bound = run["engine"].expand(tenant["name"], tenant["vars"], line["template"])
+      exp_instruction = render_instruction(line, bound, result_prev_instr)
+
+      dt_sql_start = datetime.datetime.now()
+      if line.get("type") == "PYTHON":
+        err_code, err_string, rowcount = execute_python(run, conn, txn, exp_instruction, line.get("session"))
+      elif txn != None:
+        err_code, err_string, rowcount = execute_step(conn, txn, exp_instruction, line.get("session"))
+      else:
+        err_code, err_string, rowcount = execute_instruction(conn, exp_instruction, line.get("session"))
+      dt_sql_end = datetime.datetime.now()
+
+      log_instruction = exp_instruction.replace("\n", " ")
+      duration_ms = millis_interval(dt_sql_start, dt_sql_end)
+      log("%sRun [%s-%s-%i] [%s] [%s] %0ims %s Err: %s %s" % (tenant["prefix"], line["jobGroup"], line["job"], line["sequence"],
+                                                               dt_sql_start, dt_sql_end, duration_ms, log_instruction[:80], err_code, err_string))
+      if err_code != None:
+        counts["err_count"] += 1
+        result_prev_instr = "Failure"
+      else:
+        result_prev_instr = "Success"
+
+      run["runlog"].record(run["run_id"], tenant["name"], line, dt_sql_start, dt_sql_end, duration_ms, rowcount, err_code, err_string, result_prev_instr)
+      if txn != None:
+        txn["pending"].append((line, result_prev_instr))
+      else:
+        run["runlog"].checkpoint(run["run_id"], tenant["name"], [(line, result_prev_instr)])
+      counts["inst_count"] += 1
+      pos += 1
+
+      if err_code != None and run["stop_on_error"]:
+        # the rest of the unit, and every unit depending on it, would run against partial data
+        counts["skipped_count"] += len(lines) - pos
+        counts["failed"] = True
+        break
+
+    if txn != None and txn is not run["txn"]:
+      commit_transaction(run, txn, counts)
+
+  finally:
+    if run["txn"] == None:
+      # a transaction left open by an error is rolled back by the pool
+      run["pool"].putconn(conn)
+
+  return counts
+
+
+def skip_unit(run, unit):
+  log("%sSkipped [%s-%s] %s: depends on a failed load" % (run["tenant"]["prefix"], unit["lines"][0]["jobGroup"], unit["lines"][0]["job"], unit["table"] or "barrier"))
+  return {"inst_count": 0, "err_count": 0, "resumed_count": 0, "guard_count": 0, "saved_ms": 0, "skipped_count": len(unit["lines"]), "failed": True}
+
+
+def run_jobgroup(settings, cmd_line, engine, runlog, tenant, md_lines):
+  """run the job group for one tenant; raises psycopg2.Error when the mart can't be reached"""
+  start_time = datetime.datetime.now()
+  workers = cmd_line["WORKERS"]
+
+  # report every variable the tenant doesn't define before running anything -- a half expanded instruction must never reach the mart
+  unknown = set()
+  for line in md_lines:
+    for template in [line["template"]] + line["guards"]:
+      unknown.update(engine.unknown_vars(template, tenant["vars"]))
+  if unknown:
+    log("%sUnknown Tenant Variables for %s: %s" % (tenant["prefix"], tenant["name"], ", ".join(sorted(unknown))))
+    return {"inst_count": 0, "err_count": 1, "resumed_count": 0, "guard_count": 0, "saved_ms": 0, "skipped_count": 0, "duration_ms": 0,
+            "status": "Unknown Tenant Variables: %s" % (", ".join(sorted(unknown)))}
+
+  # completed instructions from the previous run(s) of this tenant's job group, which a resumed run skips
+  completed = {}
+  if cmd_line["RESUME"]:
+    completed = runlog.read_checkpoints(tenant["name"], cmd_line["JOBGROUP"], cmd_line["JOBNAME"])
+    if completed == None:
+      log("%sCannot resume %s: run log not available" % (tenant["prefix"], tenant["name"]))
+      return {"inst_count": 0, "err_count": 1, "resumed_count": 0, "guard_count": 0, "saved_ms": 0, "skipped_count": 0, "duration_ms": 0, "status": "Cannot resume: run log not available"}
+  else:
+    runlog.clear_checkpoints(tenant["name"], cmd_line["JOBGROUP"], cmd_line["JOBNAME"])
+
+  pool = psycopg2.pool.ThreadedConnectionPool(1, workers, mart_conn_string(settings))
+  run = {"pool": pool, "engine": engine, "runlog": runlog, "tenant": tenant, "completed": completed, "stop_on_error": cmd_line["STOP_ON_ERROR"],
+         "commit": cmd_line["COMMIT"], "batch": cmd_line["BATCH"], "txn": None, "guard_results": {}, "guard_lock": threading.Lock(),
+         # last successful durations, to estimate the time guards save -- only read when there are guards
+         "durations": runlog.read_durations(tenant["name"], cmd_line["JOBGROUP"], cmd_line["JOBNAME"]) if any(line["guards"] for line in md_lines) else {},
+         "run_id": runlog.start_run(tenant["name"], cmd_line["JOBGROUP"], cmd_line["JOBNAME"], start_time), "core_conn": None}
+
+  try:
+    if any(line["type"] == "PYTHON" for line in md_lines):
+      run["core_conn"] = psycopg2.connect(core_conn_string(settings))
+    if cmd_line["COMMIT"] in ("job", "jobgroup"):
+      # --workers 1 -- the pool's only connection stays with the run's transaction
+      run["txn"] = new_transaction(pool.getconn(), cmd_line["COMMIT"])
+
+    units = reddm_scheduler.split_units(md_lines)
+    load_dependencies = None
+    if workers > 1 and any(unit["table"] for unit in units):
+      conn = pool.getconn()
+      load_dependencies = read_load_dependencies(conn, tenant["vars"])
+      pool.putconn(conn)
+    reddm_scheduler.build_graph(units, load_dependencies)
+
+    lines = ["%sProcessing Tenant %s:" % (tenant["prefix"], tenant["name"])]
+    for var in tenant["vars"]:
+      lines.append("%s\t%s = %s" % (tenant["prefix"], var, tenant["vars"][var]))
+    lines.append("%s\tLoad Units: %i (%i workers, commit per %s)" % (tenant["prefix"], len(units), workers, cmd_line["COMMIT"]))
+    log("\n".join(lines))
+
+    results = reddm_scheduler.run_graph(units, workers, lambda unit: run_unit(run, unit),
+                                        (lambda unit: skip_unit(run, unit)) if run["stop_on_error"] else None)
+    if run["txn"] != None:
+      results.append({"inst_count": 0, "err_count": 0, "resumed_count": 0, "guard_count": 0, "saved_ms": 0, "skipped_count": 0})
+      commit_transaction(run, run["txn"], results[-1])
+
+  finally:
+    pool.closeall()
+    if run["core_conn"] != None:
+      run["core_conn"].close()
+
+  summary = {"duration_ms": millis_interval(start_time, datetime.datetime.now()), "status": "Success"}
+  for count in ("inst_count", "err_count", "resumed_count", "guard_count", "saved_ms", "skipped_count"):
+    summary[count] = sum(r[count] for r in results)
+  if summary["err_count"] > 0:
+    summary["status"] = "Errors"
+  if summary["skipped_count"] > 0:
+    summary["status"] = "Stopped on Error"
+  runlog.finish_run(run["run_id"], datetime.datetime.now(), summary)
+  return summary
+
+
+def run_tenants(settings, cmd_line, engine, runlog, tenants, md_lines):
+  """run the same job group instructions for many tenants at once -- at most --tenants concurrently, and --tenants-per-host per source host"""
+  host_slots = {}
+  if cmd_line["TENANTS_PER_HOST"] != None:
+    for tenant in tenants:
+      host = tenant["vars"].get(TENANT_HOST_VAR, settings["host"])
+      host_slots.setdefault(host, threading.Semaphore(cmd_line["TENANTS_PER_HOST"]))
+
+  def run_tenant(tenant):
+    host_slot = host_slots.get(tenant["vars"].get(TENANT_HOST_VAR, settings["host"]))
+    if host_slot != None:
+      host_slot.acquire()
+    try:
+      return run_jobgroup(settings, cmd_line, engine, runlog, tenant, md_lines)
+
+    except psycopg2.Error as e:
+      log("%sError Connecting to Mart: [%s-%s] " % (tenant["prefix"], e.pgcode, e.pgerror))
+      return {"inst_count": 0, "err_count": 1, "resumed_count": 0, "guard_count": 0, "saved_ms": 0, "skipped_count": 0, "duration_ms": 0, "status": "Error Connecting to Mart: %s" % (e.pgcode)}
+
+    finally:
+      if host_slot != None:
+        host_slot.release()
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=cmd_line["TENANTS"]) as executor:
+    summaries = list(executor.map(run_tenant, tenants))
+
+  return summaries
+
+
+def main(argv):
+  cmd_line = parse_cmd_line(argv)
+  settings = db_settings(cmd_line["TEST"])
+
+  single_tenant = cmd_line["SRC_TENANT"].upper() != ALL_TENANTS and "," not in cmd_line["SRC_TENANT"] and cmd_line["TENANT_GROUP"] == None
+  tenantvars, md_lines, engine = load_plan(settings, cmd_line, single_tenant)
+
+  # for all retrieved instructions, execute them
+  if not md_lines:
+    print("No Metadata Found: [%s] [%s]" % (cmd_line["JOBGROUP"], cmd_line["JOBNAME"]))
+    return
+
+  runlog = reddm_runlog.RunLog(core_conn_string(settings), settings["core_db"], cmd_line["MD_SCHEMA"])
+  if cmd_line["RUNLOG"]:
+    runlog.open()
+
+  if single_tenant:
+    tenant = {"name": cmd_line["SRC_TENANT"], "vars": tenantvars.get(cmd_line["SRC_TENANT"], {}), "prefix": ""}
+    try:
+      summary = run_jobgroup(settings, cmd_line, engine, runlog, tenant, md_lines)
+
+    except psycopg2.Error as e:
+      print("Error Connecting to Mart: [%s-%s] " % (e.pgcode, e.pgerror))
+      exit()
+
+    finally:
+      runlog.close()
+
+    if summary["inst_count"] == 0 and summary["err_count"] > 0:
+      print(summary["status"])
+      exit()
 
-    dt_sql_end = datetime.datetime.now()
+    print("Metadata Processed:")
+    print("\tInstructions Executed: %i" % summary["inst_count"])
+    print("\tErrors Encountered: %i" % summary["err_count"])
+    if cmd_line["RESUME"]:
+      print("\tAlready Completed (resumed): %i" % summary["resumed_count"])
+    if cmd_line["STOP_ON_ERROR"]:
+      print("\tSkipped After Error: %i" % summary["skipped_count"])
+    if summary["guard_count"] > 0:
+      print("\tSkipped By Guard: %i (~%i ms saved)" % (summary["guard_count"], summary["saved_ms"]))
+    print("\tTotal Duration: %i ms" % summary["duration_ms"])
+    return
 
-    log_instruction = exp_instruction.replace("\n", " ")
-    duration_ms = millis_interval(dt_sql_start, dt_sql_end)
-    print("Run [%s-%s-%i] [%s] [%s] %0ims %s Err: %s %s" % (line[0], line[2], line[4],
-                                                            dt_sql_start, dt_sql_end, duration_ms, log_instruction[:80], err_code, err_string))
-    if err_code != None:
-      err_count += 1
-      # raw_input("Error - Hit enter to continue")
+  tenant_names = select_tenants(tenantvars, cmd_line["SRC_TENANT"], cmd_line["TENANT_GROUP"])
+  if not tenant_names:
+    print("No Tenants Found: [%s] [%s]" % (cmd_line["SRC_TENANT"], cmd_line["TENANT_GROUP"]))
+    return
 
-    inst_count += 1
+  start_time = datetime.datetime.now()
+  tenants = [{"name": name, "vars": tenantvars.get(name, {}), "prefix": "[%s] " % (name)} for name in tenant_names]
+  summaries = run_tenants(settings, cmd_line, engine, runlog, tenants, md_lines)
+  runlog.close()
 
-  print("Metadata Processed:")
-  print("\tInstructions Executed: %i" % inst_count)
-  print("\tErrors Encountered: %i" % err_count)
-  duration_ms = millis_interval(start_time, datetime.datetime.now())
-  print("\tTotal Duration: %i ms" % duration_ms)
+  print("Metadata Processed for %i Tenants:" % len(tenants))
+  for tenant, summary in zip(tenants, summaries):
+    print("\t%-40s %6i instructions %4i errors %4i guarded %10i ms  %s" % (tenant["name"], summary["inst_count"], summary["err_count"],
+                                                                            summary["guard_count"], summary["duration_ms"], summary["status"]))
+  print("\tInstructions Executed: %i" % sum(s["inst_count"] for s in summaries))
+  print("\tErrors Encountered: %i" % sum(s["err_count"] for s in summaries))
+  if cmd_line["RESUME"]:
+    print("\tAlready Completed (resumed): %i" % sum(s["resumed_count"] for s in summaries))
+  if cmd_line["STOP_ON_ERROR"]:
+    print("\tSkipped After Error: %i" % sum(s["skipped_count"] for s in summaries))
+  if any(s["guard_count"] > 0 for s in summaries):
+    print("\tSkipped By Guard: %i (~%i ms saved)" % (sum(s["guard_count"] for s in summaries), sum(s["saved_ms"] for s in summaries)))
+  print("\tTenants With Errors: %i" % len([s for s in summaries if s["err_count"] > 0]))
+  print("\tTotal Duration: %i ms" % millis_interval(start_time, datetime.datetime.now()))
 
-else:
-  print("No Metadata Found: [%s] [%s-%s] " % (md_query, e.pgcode, e.pgerror))
 
-md_conn_mart.close()
+if __name__ == "__main__":
+  main(sys.argv[1:])
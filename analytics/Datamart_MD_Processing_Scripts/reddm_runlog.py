@@ -0,0 +1,252 @@
+# reddm_runlog.py
+#	persists run history for reddm_runjobgroup.py into the metadata schema, next to md_jobGroup / md_job / md_instruction:
+#		md_runLog          -- one row per (tenant, job group) run: start / end time, duration, instruction and error counts, status
+#		md_instructionRun  -- one row per executed instruction: tenant, job group, job, sequence, start / end time, duration,
+#		                      rowcount, error code and status (Success, Failure, or Skipped when a guard skipped it)
+#		md_runCheckpoint   -- latest outcome per (tenant, job group, job, instruction), used by reddm_runjobgroup.py --resume
+#	Reported on by reddm_runstats.py.
+#
+# NOTES:
+#   - tables are created on first use (CREATE TABLE IF NOT EXISTS), the runner only needs to be pointed at the MD schema
+#   - instruction records are buffered and written with multi-row inserts every FLUSH_SIZE records (and when a run finishes),
+#     on a dedicated core connection, so logging costs one round trip per batch instead of one per instruction
+#   - checkpoints are written right after their instructions commit (not buffered) -- one multi-row write per commit, which is one
+#     instruction, or a whole batch / transaction with reddm_runjobgroup.py --batch / --commit.   A crash can only lose the checkpoints
+#     of the very last commit, in which case those instructions are run again on resume
+#   - the instructions of a job included by a JOB / JOBGROUP instruction are logged under the including job, as "<job>:<sequence>:<included job>"
+#     (see reddm_runjobgroup.py) -- reading or clearing a job's checkpoints and durations covers the jobs it includes
+#   - logging must never fail a load: write errors are reported once, and logging is switched off for the rest of the run
+
+import threading
+import psycopg2
+import psycopg2.extras
+
+FLUSH_SIZE = 200
+
+RUNLOG_DDL = """
+CREATE TABLE IF NOT EXISTS "{db}"."{schema}"."md_runLog" (
+  "id" bigserial PRIMARY KEY,
+  "tenantName" varchar(255) NOT NULL,
+  "jobGroupName" varchar(255) NOT NULL,
+  "jobName" varchar(255),
+  "startTime" timestamptz NOT NULL,
+  "endTime" timestamptz,
+  "durationMs" numeric,
+  "instructionCount" integer,
+  "errorCount" integer,
+  "status" varchar(255) NOT NULL,
+  "created_at" timestamptz NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS "{db}"."{schema}"."md_instructionRun" (
+  "id" bigserial PRIMARY KEY,
+  "runId" bigint NOT NULL REFERENCES "{db}"."{schema}"."md_runLog" ("id") ON DELETE CASCADE,
+  "tenantName" varchar(255) NOT NULL,
+  "jobGroupName" varchar(255) NOT NULL,
+  "jobName" varchar(255) NOT NULL,
+  "sequenceNumber" integer NOT NULL,
+  "startTime" timestamptz NOT NULL,
+  "endTime" timestamptz NOT NULL,
+  "durationMs" numeric NOT NULL,
+  "rowCount" bigint,
+  "errorCode" varchar(5),
+  "errorMessage" text,
+  "status" varchar(20) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "{db}"."{schema}"."md_runCheckpoint" (
+  "tenantName" varchar(255) NOT NULL,
+  "jobGroupName" varchar(255) NOT NULL,
+  "jobName" varchar(255) NOT NULL,
+  "sequenceNumber" integer NOT NULL,
+  "instructionHash" varchar(40) NOT NULL,
+  "runId" bigint,
+  "status" varchar(20) NOT NULL,
+  "updated_at" timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY ("tenantName", "jobGroupName", "jobName", "sequenceNumber")
+);
+CREATE INDEX IF NOT EXISTS "md_instructionRun_runId_idx" ON "{db}"."{schema}"."md_instructionRun" ("runId");
+CREATE INDEX IF NOT EXISTS "md_instructionRun_instruction_idx" ON "{db}"."{schema}"."md_instructionRun" ("jobGroupName", "jobName", "sequenceNumber", "startTime");
+CREATE INDEX IF NOT EXISTS "md_runLog_tenant_idx" ON "{db}"."{schema}"."md_runLog" ("tenantName", "jobGroupName", "startTime");
+"""
+
+INSTRUCTION_RUN_COLUMNS = ("runId", "tenantName", "jobGroupName", "jobName", "sequenceNumber", "startTime", "endTime",
+                           "durationMs", "rowCount", "errorCode", "errorMessage", "status")
+
+
+class RunLog:
+
+  def __init__(self, conn_string, core_db, md_schema):
+    self.conn_string = conn_string
+    self.table_prefix = "\"%s\".\"%s\"." % (core_db, md_schema)
+    self.ddl = RUNLOG_DDL.format(db=core_db, schema=md_schema)
+    self.conn = None
+    self.buffer = []
+    self.lock = threading.Lock()
+
+  def open(self):
+    """connect and make sure the run log tables exist; returns False (and logs nothing afterwards) if that isn't possible"""
+    try:
+      self.conn = psycopg2.connect(self.conn_string)
+      cur = self.conn.cursor()
+      cur.execute(self.ddl)
+      self.conn.commit()
+      cur.close()
+
+    except psycopg2.Error as e:
+      print("Run log disabled: [%s-%s] " % (e.pgcode, e.pgerror))
+      self.conn = None
+
+    return self.conn != None
+
+  def _disable(self, e):
+    print("Run log disabled: [%s-%s] " % (e.pgcode, e.pgerror))
+    try:
+      self.conn.close()
+    except psycopg2.Error:
+      pass
+    self.conn = None
+    self.buffer = []
+
+  def start_run(self, tenant_name, jobgroup, jobname, start_time):
+    with self.lock:
+      if self.conn == None:
+        return None
+      try:
+        cur = self.conn.cursor()
+        cur.execute("INSERT INTO " + self.table_prefix + "\"md_runLog\" (\"tenantName\", \"jobGroupName\", \"jobName\", \"startTime\", \"status\") "
+                    "VALUES (%s, %s, %s, %s, 'Running') RETURNING \"id\";", (tenant_name, jobgroup, jobname, start_time))
+        run_id = cur.fetchone()[0]
+        self.conn.commit()
+        cur.close()
+        return run_id
+
+      except psycopg2.Error as e:
+        self._disable(e)
+        return None
+
+  def record(self, run_id, tenant_name, line, start, end, duration_ms, rowcount, err_code, err_string, status):
+    if run_id == None:
+      return
+    with self.lock:
+      if self.conn == None:
+        return
+      self.buffer.append((run_id, tenant_name, line["jobGroup"], line["job"], line["sequence"], start, end, duration_ms,
+                          rowcount, err_code, err_string or None, status))
+      if len(self.buffer) >= FLUSH_SIZE:
+        self._flush()
+
+  def _flush(self):
+    if not self.buffer or self.conn == None:
+      return
+    try:
+      cur = self.conn.cursor()
+      psycopg2.extras.execute_values(
+          cur, "INSERT INTO " + self.table_prefix + "\"md_instructionRun\" (%s) VALUES %%s" % (", ".join("\"%s\"" % (c) for c in INSTRUCTION_RUN_COLUMNS)),
+          self.buffer, page_size=FLUSH_SIZE)
+      self.conn.commit()
+      cur.close()
+      self.buffer = []
+
+    except psycopg2.Error as e:
+      self._disable(e)
+
+  def finish_run(self, run_id, end_time, summary):
+    if run_id == None:
+      return
+    with self.lock:
+      self._flush()
+      if self.conn == None:
+        return
+      try:
+        cur = self.conn.cursor()
+        cur.execute("UPDATE " + self.table_prefix + "\"md_runLog\" SET \"endTime\" = %s, \"durationMs\" = %s, \"instructionCount\" = %s, "
+                    "\"errorCount\" = %s, \"status\" = %s WHERE \"id\" = %s;",
+                    (end_time, summary["duration_ms"], summary["inst_count"], summary["err_count"], summary["status"], run_id))
+        self.conn.commit()
+        cur.close()
+
+      except psycopg2.Error as e:
+        self._disable(e)
+
+  def clear_checkpoints(self, tenant_name, jobgroup, jobname):
+    """forget the checkpoints of a tenant's job group (or of one job in it) -- a run that isn't resuming starts from scratch"""
+    with self.lock:
+      if self.conn == None:
+        return
+      try:
+        cur = self.conn.cursor()
+        cur.execute("DELETE FROM " + self.table_prefix + "\"md_runCheckpoint\" WHERE \"tenantName\" = %s AND \"jobGroupName\" = %s"
+                    " AND (%s IS NULL OR \"jobName\" = %s OR left(\"jobName\", length(%s) + 1) = %s || ':');", (tenant_name, jobgroup, jobname, jobname, jobname, jobname))
+        self.conn.commit()
+        cur.close()
+
+      except psycopg2.Error as e:
+        self._disable(e)
+
+  def read_checkpoints(self, tenant_name, jobgroup, jobname):
+    """returns { (jobName, sequenceNumber): instructionHash } of the instructions that completed successfully, or None without a run log"""
+    with self.lock:
+      if self.conn == None:
+        return None
+      try:
+        cur = self.conn.cursor()
+        cur.execute("SELECT \"jobName\", \"sequenceNumber\", \"instructionHash\" FROM " + self.table_prefix + "\"md_runCheckpoint\" "
+                    "WHERE \"tenantName\" = %s AND \"jobGroupName\" = %s AND (%s IS NULL OR \"jobName\" = %s OR left(\"jobName\", length(%s) + 1) = %s || ':') AND \"status\" = 'Success';",
+                    (tenant_name, jobgroup, jobname, jobname, jobname, jobname))
+        completed = {}
+        for row in cur.fetchall():
+          completed[(row[0], row[1])] = row[2]
+        self.conn.commit()
+        cur.close()
+        return completed
+
+      except psycopg2.Error as e:
+        self._disable(e)
+        return None
+
+  def read_durations(self, tenant_name, jobgroup, jobname):
+    """returns { (jobName, sequenceNumber): durationMs } of each instruction's latest successful run, or {} without a run log"""
+    with self.lock:
+      if self.conn == None:
+        return {}
+      try:
+        cur = self.conn.cursor()
+        cur.execute("SELECT DISTINCT ON (\"jobName\", \"sequenceNumber\") \"jobName\", \"sequenceNumber\", \"durationMs\" FROM " + self.table_prefix + "\"md_instructionRun\" "
+                    "WHERE \"tenantName\" = %s AND \"jobGroupName\" = %s AND (%s IS NULL OR \"jobName\" = %s OR left(\"jobName\", length(%s) + 1) = %s || ':') AND \"status\" = 'Success' "
+                    "ORDER BY \"jobName\", \"sequenceNumber\", \"startTime\" DESC;", (tenant_name, jobgroup, jobname, jobname, jobname, jobname))
+        durations = {}
+        for row in cur.fetchall():
+          durations[(row[0], row[1])] = float(row[2])
+        self.conn.commit()
+        cur.close()
+        return durations
+
+      except psycopg2.Error as e:
+        self._disable(e)
+        return {}
+
+  def checkpoint(self, run_id, tenant_name, outcomes):
+    """outcomes is a list of (instruction line, status), all committed in the same transaction"""
+    with self.lock:
+      if self.conn == None or not outcomes:
+        return
+      try:
+        cur = self.conn.cursor()
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO " + self.table_prefix + "\"md_runCheckpoint\" (\"tenantName\", \"jobGroupName\", \"jobName\", \"sequenceNumber\", "
+            "\"instructionHash\", \"runId\", \"status\") VALUES %s "
+            "ON CONFLICT (\"tenantName\", \"jobGroupName\", \"jobName\", \"sequenceNumber\") DO UPDATE SET "
+            "\"instructionHash\" = EXCLUDED.\"instructionHash\", \"runId\" = EXCLUDED.\"runId\", \"status\" = EXCLUDED.\"status\", \"updated_at\" = now();",
+            [(tenant_name, line["jobGroup"], line["job"], line["sequence"], line["template"]["hash"], run_id, status) for line, status in outcomes],
+            page_size=FLUSH_SIZE)
+        self.conn.commit()
+        cur.close()
+
+      except psycopg2.Error as e:
+        self._disable(e)
+
+  def close(self):
+    with self.lock:
+      self._flush()
+      if self.conn != None:
+        self.conn.close()
+        self.conn = None
@@ -0,0 +1,117 @@
+# reddm_runstats.py
+#	reports on the run history that reddm_runjobgroup.py records in md_runLog / md_instructionRun.
+#
+# Usage:
+#   python reddm_runstats.py <MD_schema> slowest [--top N] [--days D] [--tenant T] [--jobgroup G] [test]
+#   python reddm_runstats.py <MD_schema> trends [--days D] [--tenant T] [--jobgroup G] [test]
+#   python reddm_runstats.py <MD_schema> regressions [--baseline-runs N] [--threshold PCT] [--min-ms MS] [--top N] [--days D] [--tenant T] [--jobgroup G] [test]
+#   where
+#		slowest - top N instructions by average duration over the last D days (with p95, max and rows affected)
+#		trends - per tenant, per day: number of runs, average / max run duration and errors
+#		regressions - instructions whose latest successful run is more than PCT percent (and MS milliseconds) slower than the
+#			average of their previous N successful runs for the same tenant
+
+import sys
+import argparse
+import psycopg2
+
+import reddm_runjobgroup
+
+
+def history_filter(args, time_column):
+  conditions = ["%s > now() - interval '%i days'" % (time_column, args.days)]
+  params = []
+  if args.tenant != None:
+    conditions.append("\"tenantName\" = %s")
+    params.append(args.tenant)
+  if args.jobgroup != None:
+    conditions.append("\"jobGroupName\" = %s")
+    params.append(args.jobgroup)
+  return " AND ".join(conditions), params
+
+
+def report_slowest(cur, table_prefix, args):
+  where, params = history_filter(args, "\"startTime\"")
+  cur.execute("SELECT \"jobGroupName\", \"jobName\", \"sequenceNumber\", count(*), round(avg(\"durationMs\")), "
+              "round(percentile_cont(0.95) WITHIN GROUP (ORDER BY \"durationMs\")::numeric), round(max(\"durationMs\")), sum(\"rowCount\") "
+              "FROM " + table_prefix + "\"md_instructionRun\" WHERE " + where + " "
+              "GROUP BY 1, 2, 3 ORDER BY avg(\"durationMs\") DESC LIMIT %i;" % (args.top), params)
+
+  print("Slowest Instructions (last %i days):" % (args.days))
+  print("\t%-45s %6s %10s %10s %10s %12s" % ("Instruction", "Runs", "Avg ms", "p95 ms", "Max ms", "Rows"))
+  for row in cur.fetchall():
+    print("\t%-45s %6i %10i %10i %10i %12s" % ("%s-%s-%i" % (row[0], row[1], row[2]), row[3], row[4], row[5], row[6], row[7]))
+
+
+def report_trends(cur, table_prefix, args):
+  where, params = history_filter(args, "\"startTime\"")
+  cur.execute("SELECT \"tenantName\", \"jobGroupName\", \"startTime\"::date, count(*), round(avg(\"durationMs\")), round(max(\"durationMs\")), "
+              "sum(\"errorCount\") FROM " + table_prefix + "\"md_runLog\" WHERE \"endTime\" IS NOT NULL AND " + where + " "
+              "GROUP BY 1, 2, 3 ORDER BY 1, 2, 3;", params)
+
+  print("Run Duration Trends (last %i days):" % (args.days))
+  print("\t%-40s %-15s %-10s %6s %10s %10s %7s" % ("Tenant", "Job Group", "Day", "Runs", "Avg ms", "Max ms", "Errors"))
+  for row in cur.fetchall():
+    print("\t%-40s %-15s %-10s %6i %10i %10i %7i" % (row[0], row[1], row[2], row[3], row[4], row[5], row[6] or 0))
+
+
+def report_regressions(cur, table_prefix, args):
+  where, params = history_filter(args, "\"startTime\"")
+  cur.execute("""
+    WITH runs AS (
+      SELECT "tenantName", "jobGroupName", "jobName", "sequenceNumber", "startTime", "durationMs",
+        avg("durationMs") OVER baseline AS "baselineMs",
+        count(*) OVER baseline AS "baselineRuns",
+        row_number() OVER (PARTITION BY "tenantName", "jobGroupName", "jobName", "sequenceNumber" ORDER BY "startTime" DESC) AS "latest"
+      FROM """ + table_prefix + """"md_instructionRun"
+      WHERE "status" = 'Success' AND """ + where + """
+      WINDOW baseline AS (PARTITION BY "tenantName", "jobGroupName", "jobName", "sequenceNumber" ORDER BY "startTime"
+                          ROWS BETWEEN %i PRECEDING AND 1 PRECEDING)
+    )
+    SELECT "tenantName", "jobGroupName", "jobName", "sequenceNumber", "startTime", round("durationMs"), round("baselineMs"), "baselineRuns"
+    FROM runs
+    WHERE "latest" = 1
+      AND "baselineRuns" >= %i
+      AND "durationMs" > "baselineMs" * %f
+      AND "durationMs" - "baselineMs" > %i
+    ORDER BY "durationMs" - "baselineMs" DESC
+    LIMIT %i;""" % (args.baseline_runs, min(args.baseline_runs, 3), 1 + args.threshold / 100.0, args.min_ms, args.top), params)
+
+  print("Duration Regressions (latest run vs average of previous %i, > %i%% and > %i ms):" % (args.baseline_runs, args.threshold, args.min_ms))
+  print("\t%-40s %-45s %-26s %10s %10s %5s" % ("Tenant", "Instruction", "Run", "Latest ms", "Base ms", "Runs"))
+  for row in cur.fetchall():
+    print("\t%-40s %-45s %-26s %10i %10i %5i" % (row[0], "%s-%s-%i" % (row[1], row[2], row[3]), row[4], row[5], row[6], row[7]))
+
+
+REPORTS = {"slowest": report_slowest, "trends": report_trends, "regressions": report_regressions}
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(usage="python reddm_runstats.py <MD_schema> <slowest | trends | regressions> [options] [test]")
+  parser.add_argument("md_schema")
+  parser.add_argument("report", choices=sorted(REPORTS))
+  parser.add_argument("env", nargs="?")
+  parser.add_argument("--top", type=int, default=20)
+  parser.add_argument("--days", type=int, default=30)
+  parser.add_argument("--tenant", default=None)
+  parser.add_argument("--jobgroup", default=None)
+  parser.add_argument("--baseline-runs", type=int, default=7)
+  parser.add_argument("--threshold", type=int, default=25)
+  parser.add_argument("--min-ms", type=int, default=1000)
+  args = parser.parse_args(argv)
+
+  settings = reddm_runjobgroup.db_settings(args.env == "test")
+  try:
+    conn = psycopg2.connect(reddm_runjobgroup.core_conn_string(settings))
+    cur = conn.cursor()
+    REPORTS[args.report](cur, "\"%s\".\"%s\"." % (settings["core_db"], args.md_schema), args)
+
+  except psycopg2.Error as e:
+    print("Error Reading Run Log: [%s-%s] " % (e.pgcode, e.pgerror))
+    exit()
+
+  conn.close()
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,148 @@
+# reddm_scheduler.py
+#	builds a dependency graph over the instructions of a job group, and executes it over a bounded pool of workers.
+#	Used by reddm_runjobgroup.py so that independent star table loads (e.g. d_Property, d_Team, d_Program) run at the same time.
+#
+# NOTES:
+#   - Instructions are split into load units.   A unit ends with the update_last_load_date('<table>', ..., 'final') call that marks
+#     <table> as loaded, so each unit loads exactly one star table and runs its instructions in order on a single connection.
+#   - Instructions that don't belong to a table (e.g. "prepare for loading", or every instruction of a DDL job) form barrier units:
+#     a barrier waits for everything before it, and everything after it waits for the barrier.   Job groups without table markers,
+#     like RESTARTMART, therefore still run strictly sequentially.
+#   - A table unit depends on the units of the tables listed for it in s_LoadDependency, and on any other loaded table its SQL references.
+#   - Only edges pointing backwards in metadata sequence order are kept, so the graph is always acyclic and running it with a
+#     single worker reproduces the original sequential order.
+
+import re
+import heapq
+import concurrent.futures
+
+# SELECT "dstStarDB"."dstStarSchema".update_last_load_date('d_Property', 'resultPrevInstr', 'final');
+LOAD_MARKER = re.compile(r"update_last_load_date\s*\(\s*'([^']+)'\s*,\s*'[^']*'\s*,\s*'final'\s*\)", re.IGNORECASE)
+QUOTED_NAME = re.compile(r'"([^"]+)"')
+
+
+def split_units(md_lines):
+  """split ordered instructions into load units; md_lines are instruction dicts in metadata sequence order"""
+  units = []
+  current = []
+
+  def close_unit(table_name):
+    units.append({"index": len(units), "table": table_name, "lines": current[:], "deps": set()})
+    del current[:]
+
+  for line in md_lines:
+    # a table unit never spans jobs -- anything left over from the previous job is a barrier
+    if current and current[-1]["job"] != line["job"]:
+      close_unit(None)
+
+    current.append(line)
+    marker = LOAD_MARKER.search(line["instruction"])
+    if marker:
+      table_name = marker.group(1)
+      # leading instructions that never mention the table are not part of its load (e.g. "prepare for loading") -- run them as a barrier
+      leading = 0
+      while table_name not in current[leading]["instruction"]:
+        leading += 1
+      if leading > 0:
+        units.append({"index": len(units), "table": None, "lines": current[:leading], "deps": set()})
+        del current[:leading]
+      close_unit(table_name)
+
+  if current:
+    close_unit(None)
+
+  return units
+
+
+def build_graph(units, load_dependencies):
+  """fill in unit["deps"]; load_dependencies is a list of (tableName, dependsOnTable) rows, or None to force sequential order"""
+  if load_dependencies is None:
+    for unit in units:
+      if unit["index"] > 0:
+        unit["deps"].add(unit["index"] - 1)
+    return units
+
+  declared = {}
+  for table_name, depends_on in load_dependencies:
+    if depends_on:
+      declared.setdefault(table_name, set()).add(depends_on)
+
+  loaded = {}
+  last_barrier = None
+  for unit in units:
+    index = unit["index"]
+
+    if unit["table"] is None:
+      # barrier waits for every unit since the previous barrier (and, transitively, everything before that)
+      unit["deps"].update(range(0 if last_barrier is None else last_barrier, index))
+      last_barrier = index
+      continue
+
+    if last_barrier is not None:
+      unit["deps"].add(last_barrier)
+
+    referenced = set()
+    for line in unit["lines"]:
+      referenced.update(QUOTED_NAME.findall(line["instruction"]))
+
+    for table_name in declared.get(unit["table"], set()) | referenced:
+      if table_name != unit["table"] and table_name in loaded:
+        unit["deps"].add(loaded[table_name])
+
+    # a table loaded twice in one run (e.g. in two jobs) keeps its loads in order
+    if unit["table"] in loaded:
+      unit["deps"].add(loaded[unit["table"]])
+    loaded[unit["table"]] = index
+
+  return units
+
+
+def run_graph(units, worker_count, run_unit, skip_unit=None):
+  """run every unit through run_unit(unit) once its dependencies finished, at most worker_count at a time; returns results in unit order
+
+  With skip_unit, a unit whose result has "failed" set stops everything downstream: dependent units aren't run, skip_unit(unit)
+  provides their result instead (and they count as failed for their own dependents).   Without it, dependents always run."""
+  pending = {}
+  dependents = {}
+  for unit in units:
+    pending[unit["index"]] = len(unit["deps"])
+    for dep in unit["deps"]:
+      dependents.setdefault(dep, []).append(unit["index"])
+
+  # ready units are started in metadata order, so earlier (usually upstream) loads are never starved by later ones
+  ready = [index for index in pending if pending[index] == 0]
+  heapq.heapify(ready)
+  results = {}
+  running = {}
+  failed = set()
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+    while ready or running:
+      while ready and len(running) < worker_count:
+        index = heapq.heappop(ready)
+        if skip_unit != None and units[index]["deps"] & failed:
+          # resolved without running -- its dependents become ready right away
+          results[index] = skip_unit(units[index])
+          failed.add(index)
+          for dependent in dependents.get(index, []):
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+              heapq.heappush(ready, dependent)
+          continue
+        running[executor.submit(run_unit, units[index])] = index
+
+      if not running:
+        continue
+
+      done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        index = running.pop(future)
+        results[index] = future.result()
+        if results[index].get("failed"):
+          failed.add(index)
+        for dependent in dependents.get(index, []):
+          pending[dependent] -= 1
+          if pending[dependent] == 0:
+            heapq.heappush(ready, dependent)
+
+  return [results[unit["index"]] for unit in units]
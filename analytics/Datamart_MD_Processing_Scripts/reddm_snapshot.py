@@ -0,0 +1,111 @@
+# reddm_snapshot.py
+#	keeps an on-disk snapshot of a compiled job group plan (instructions, tenant variables and parsed templates),
+#	so reddm_runjobgroup.py doesn't re-read instruction text from the core database on every run.
+#
+# NOTES:
+#   - the snapshot is a zlib compressed pickle, written atomically (temp file + rename) so concurrent runs never see a partial file
+#   - every snapshot carries the version of the metadata it was built from -- a content hash computed by the core database over the
+#     md_jobGroup / md_job / md_instruction rows of the plan and the md_tenantVariable rows.   The runner asks for the current version
+#     (one small query), and only rebuilds the snapshot when it differs
+#   - every snapshot also carries SNAPSHOT_FORMAT and CODE_VERSION, a hash of the modules that build the plan (PLAN_MODULES) -- a snapshot
+#     written by another version of the runner is never used, even if the metadata didn't change.   SNAPSHOT_FORMAT must still be bumped
+#     whenever the shape of the plan changes without a change to PLAN_MODULES
+#   - snapshots are pickles, so they are only read from a directory the current user owns and nobody else can write to:  the default
+#     directory is per user (<tmp>/reddm_snapshots-<user>), created with mode 0700, and a snapshot file owned by another user is ignored
+
+import os
+import stat
+import zlib
+import pickle
+import getpass
+import hashlib
+import tempfile
+
+SNAPSHOT_FORMAT = 2
+
+# the modules whose code decides what a plan contains -- a change to any of them invalidates every existing snapshot
+PLAN_MODULES = ("reddm_runjobgroup.py", "reddm_template.py", "reddm_partition.py", "reddm_pysteps.py", "reddm_snapshot.py")
+
+
+def read_code_version():
+  code_hash = hashlib.sha1()
+  module_dir = os.path.dirname(os.path.abspath(__file__))
+  for module in PLAN_MODULES:
+    try:
+      with open(os.path.join(module_dir, module), "rb") as module_file:
+        code_hash.update(module_file.read())
+
+    except OSError:
+      code_hash.update(("missing:%s" % (module)).encode("utf-8"))
+
+  return code_hash.hexdigest()
+
+
+CODE_VERSION = read_code_version()
+
+
+def current_user():
+  if hasattr(os, "getuid"):
+    return str(os.getuid())
+  return getpass.getuser()
+
+
+def default_snapshot_dir():
+  return os.getenv('REDDM_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), "reddm_snapshots-%s" % (current_user())))
+
+
+def snapshot_path(snapshot_dir, key_parts):
+  key = hashlib.sha1("|".join(str(part) for part in [SNAPSHOT_FORMAT, CODE_VERSION] + list(key_parts)).encode("utf-8")).hexdigest()
+  return os.path.join(snapshot_dir, "plan_%s.snapshot" % (key[:24]))
+
+
+def is_trusted(path):
+  """True when the file and its directory belong to the current user, and nobody else can write to either"""
+  if not hasattr(os, "getuid"):
+    return True
+
+  for checked in (os.path.dirname(path), path):
+    status = os.stat(checked)
+    if status.st_uid != os.getuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+      return False
+
+  return True
+
+
+def load_snapshot(path, version):
+  """returns the stored plan if the snapshot exists and matches version, otherwise None"""
+  try:
+    if not is_trusted(path):
+      print("Metadata snapshot ignored, not owned by this user or writable by others: %s" % (path))
+      return None
+
+    with open(path, "rb") as snapshot_file:
+      snapshot = pickle.loads(zlib.decompress(snapshot_file.read()))
+
+  except (OSError, EOFError, zlib.error, pickle.UnpicklingError, AttributeError, ImportError):
+    return None
+
+  if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("code") != CODE_VERSION or snapshot.get("version") != version:
+    return None
+
+  return snapshot["plan"]
+
+
+def save_snapshot(path, version, plan):
+  snapshot_dir = os.path.dirname(path)
+  os.makedirs(snapshot_dir, mode=0o700, exist_ok=True)
+
+  data = zlib.compress(pickle.dumps({"format": SNAPSHOT_FORMAT, "code": CODE_VERSION, "version": version, "plan": plan},
+                                    pickle.HIGHEST_PROTOCOL))
+  fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, suffix=".tmp")
+  try:
+    with os.fdopen(fd, "wb") as snapshot_file:
+      snapshot_file.write(data)
+    os.replace(tmp_path, path)
+
+  except OSError:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+
+  return len(data)
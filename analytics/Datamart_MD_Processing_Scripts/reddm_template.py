@@ -0,0 +1,105 @@
+# reddm_template.py
+#	compiles metadata instructions into templates, so tenant variables are expanded in a single pass instead of two str.replace passes per variable.
+#
+# Two variable forms are recognised, the same ones expand_tenantvar() always handled:
+#   - %{var}%  -- PSQL style, md_genfromsql.py rewrites ${var}$ in the SQL source into this form
+#   - var      -- bare token, which is what DBAnalyzer uses (e.g. "dstStarDB"."dstStarSchema") -- only known variable names can be matched this way
+#
+# NOTES:
+#   - an instruction is parsed once into literal text and variable references; the template is cached by the instruction's hash
+#   - binding a template to a tenant substitutes the tenant variables and is cached per (tenant, instruction hash), so retries and
+#     multi tenant runs don't expand the same text again
+#   - runtime variables (RUNTIME_VARS, e.g. resultPrevInstr) are left in the bound template, and filled in right before execution
+#   - unknown_vars() lets the runner report every variable a tenant doesn't define before anything executes
+
+import re
+import hashlib
+import threading
+import collections
+
+# variables whose value is only known while the job group runs, never defined in md_tenantVariable
+RUNTIME_VARS = ("resultPrevInstr",)
+
+# bound instructions kept in memory -- enough for every instruction of a job group for a few hundred tenants
+EXPANSION_CACHE_SIZE = 65536
+
+
+def instruction_hash(instruction):
+  return hashlib.sha1(instruction.encode("utf-8")).hexdigest()
+
+
+class TemplateEngine:
+  """compiles instructions against a fixed set of variable names (the union of all tenants' variables in this run)"""
+
+  def __init__(self, var_names):
+    names = set(var_names) | set(RUNTIME_VARS)
+    # longest names first, so a name that is a prefix of another one (dstStar / dstStarSchema) never wins the match
+    bare = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    self.pattern = re.compile(r"%\{(\w+)\}%" + ("|(" + bare + ")" if bare else ""))
+    self.templates = {}
+    self.expansions = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+  def compile(self, instruction):
+    """returns {"hash", "parts", "vars"} -- parts alternate literal text (str) and variable references (1-tuples)"""
+    key = instruction_hash(instruction)
+    template = self.templates.get(key)
+    if template is not None:
+      return template
+
+    parts = []
+    var_names = set()
+    pos = 0
+    for match in self.pattern.finditer(instruction):
+      if match.start() > pos:
+        parts.append(instruction[pos:match.start()])
+      name = match.group(1) or match.group(2)
+      parts.append((name,))
+      var_names.add(name)
+      pos = match.end()
+    if pos < len(instruction):
+      parts.append(instruction[pos:])
+
+    template = {"hash": key, "parts": parts, "vars": var_names}
+    self.templates[key] = template
+    return template
+
+  def unknown_vars(self, template, tenant_vars):
+    return sorted(name for name in template["vars"] if name not in tenant_vars and name not in RUNTIME_VARS)
+
+  def expand(self, tenant_name, tenant_vars, template):
+    """substitute the tenant variables; returns the bound parts, where only runtime variables are left"""
+    key = (tenant_name, template["hash"])
+    with self.lock:
+      bound = self.expansions.get(key)
+      if bound is not None:
+        self.expansions.move_to_end(key)
+        return bound
+
+    bound = []
+    literal = []
+    for part in template["parts"]:
+      if isinstance(part, tuple) and part[0] not in tenant_vars:
+        if literal:
+          bound.append("".join(literal))
+          literal = []
+        bound.append(part)
+      elif isinstance(part, tuple):
+        literal.append(tenant_vars[part[0]])
+      else:
+        literal.append(part)
+    if literal:
+      bound.append("".join(literal))
+
+    with self.lock:
+      self.expansions[key] = bound
+      if len(self.expansions) > EXPANSION_CACHE_SIZE:
+        self.expansions.popitem(last=False)
+
+    return bound
+
+
+def render(bound, runtime_vars=None):
+  """join bound parts into the final instruction text; variables without a runtime value become empty strings"""
+  runtime_vars = runtime_vars or {}
+  return "".join(part if not isinstance(part, tuple) else runtime_vars.get(part[0], "") for part in bound)
@@ -0,0 +1,47 @@
+# pgstub.py
+#	lets the unit tests import the modules that import psycopg2 where psycopg2 isn't installed -- a stand in module with the names
+#	those modules use at import time.   Nothing in the tests connects to a database; calls that would are patched by the test itself.
+#
+# Usage:
+#   import pgstub
+#   pgstub.install()      # before importing md_genfromsql, reddm_runjobgroup, reddm_l1_cdc, ...
+
+import sys
+import types
+
+
+class Error(Exception):
+  pgcode = None
+  pgerror = None
+
+
+def install():
+  """registers the stand in psycopg2 in sys.modules, unless the real one can be imported"""
+  try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+    return False
+
+  except ImportError:
+    pass
+
+  psycopg2 = types.ModuleType("psycopg2")
+  psycopg2.__path__ = []
+  psycopg2.Error = Error
+  psycopg2.DatabaseError = Error
+  psycopg2.OperationalError = Error
+
+  def connect(*args, **kwargs):
+    raise Error("psycopg2 is not installed -- the unit tests don't connect")
+  psycopg2.connect = connect
+
+  for name in ("extras", "pool", "sql", "extensions"):
+    submodule = types.ModuleType("psycopg2." + name)
+    setattr(psycopg2, name, submodule)
+    sys.modules["psycopg2." + name] = submodule
+
+  psycopg2.extras.execute_values = connect
+  psycopg2.pool.ThreadedConnectionPool = connect
+  sys.modules["psycopg2"] = psycopg2
+  return True
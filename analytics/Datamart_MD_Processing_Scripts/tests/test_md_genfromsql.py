@@ -0,0 +1,140 @@
+# test_md_genfromsql.py
+#	unit tests of the instruction registration of md_genfromsql.py (diff_instructions, SQL only job groups), against a recording cursor
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import md_genfromsql
+
+
+class RecordingCursor:
+  """returns the stored md_instruction rows to read_instruction_hashes(), and records the deletes"""
+
+  def __init__(self, rows):
+    self.rows = rows
+    self.deleted = []
+
+  def execute(self, query, params=None):
+    if query.startswith("delete"):
+      self.deleted.extend(params[0])
+
+  def fetchall(self):
+    return self.rows
+
+
+def statement(text, first_line, last_line=None):
+  return {"instruction": text, "first_line": first_line, "last_line": last_line or first_line}
+
+
+def stored(row_id, sequence, instruction):
+  return (row_id, sequence, md_genfromsql.instruction_hash(instruction["instruction"]), instruction["first_line"], instruction["last_line"])
+
+
+class DiffInstructionsTest(unittest.TestCase):
+
+  def diff(self, old_instructions, new_instructions):
+    cur = RecordingCursor([stored(100 + sequence, sequence, instruction) for sequence, instruction in enumerate(old_instructions, 1)])
+    written = {"insert": [], "renumber": [], "update": []}
+
+    def execute_values(cur, query, rows, page_size=None):
+      if query.startswith("insert"):
+        written["insert"].extend(rows)
+      elif "= -v.\"sequenceNumber\"" in query:
+        written["renumber"].extend(rows)
+      else:
+        # every row is out of the way on its negative number before any gets its new one
+        self.assertEqual(written["renumber"], [(row[0], row[1]) for row in rows])
+        written["update"].extend(rows)
+
+    with unittest.mock.patch.object(md_genfromsql.psycopg2.extras, "execute_values", execute_values, create=True):
+      counts = md_genfromsql.diff_instructions(cur, "md", 7, new_instructions)
+
+    return counts, cur.deleted, written["insert"], written["update"]
+
+  def test_unchanged_file_writes_nothing(self):
+    instructions = [statement("SELECT 1;", 1), statement("SELECT 2;", 2)]
+
+    self.assertEqual(self.diff(instructions, instructions), ((0, 0, 0), [], [], []))
+
+  def test_changed_instruction_is_updated_in_place(self):
+    old = [statement("SELECT 1;", 1), statement("SELECT 2;", 2), statement("SELECT 3;", 3)]
+    new = [statement("SELECT 1;", 1), statement("SELECT 20;", 2), statement("SELECT 3;", 3)]
+    counts, deleted, inserted, updated = self.diff(old, new)
+
+    self.assertEqual(counts, (0, 1, 0))
+    self.assertEqual(deleted, [])
+    self.assertEqual(inserted, [])
+    self.assertEqual(len(updated), 1)
+    row_id, sequence, text, text_hash, instruction_type = updated[0][:5]
+    self.assertEqual((row_id, sequence, text, text_hash, instruction_type),
+                     (102, 2, "SELECT 20;", md_genfromsql.instruction_hash("SELECT 20;"), "SQL"))
+
+  def test_inserted_instruction_renumbers_the_rest(self):
+    old = [statement("SELECT 1;", 1), statement("SELECT 2;", 2)]
+    new = [statement("SELECT 0;", 1), statement("SELECT 1;", 2), statement("SELECT 2;", 3)]
+    counts, deleted, inserted, updated = self.diff(old, new)
+
+    self.assertEqual(counts, (1, 0, 0))
+    self.assertEqual([(row[1], row[2]) for row in inserted], [(1, "SELECT 0;")])
+    # the kept rows are only moved: no text, hash or type is written for them
+    self.assertEqual([(row[0], row[1], row[2], row[3], row[4]) for row in updated], [(101, 2, None, None, None), (102, 3, None, None, None)])
+
+  def test_removed_instruction_is_deleted(self):
+    old = [statement("SELECT 1;", 1), statement("SELECT 2;", 2), statement("SELECT 3;", 3)]
+    new = [statement("SELECT 1;", 1), statement("SELECT 3;", 2)]
+    counts, deleted, inserted, updated = self.diff(old, new)
+
+    self.assertEqual(counts, (0, 0, 1))
+    self.assertEqual(deleted, [102])
+    self.assertEqual([(row[0], row[1]) for row in updated], [(103, 2)])
+
+  def test_moved_lines_are_refreshed(self):
+    old = [statement("SELECT 1;", 1)]
+    new = [statement("SELECT 1;", 5, 7)]
+    counts, deleted, inserted, updated = self.diff(old, new)
+
+    self.assertEqual(counts, (0, 0, 0))
+    self.assertEqual([(row[0], row[5], row[6]) for row in updated], [(101, 5, 7)])
+
+  def test_instruction_type_is_stored(self):
+    new = [statement("-- keep the partitions\nPARTITION \"s\".\"f_PaymentsAndRefunds\" AHEAD 3 RETAIN 36;", 1)]
+    counts, deleted, inserted, updated = self.diff([], new)
+
+    self.assertEqual(counts, (1, 0, 0))
+    self.assertEqual(inserted[0][4], "PARTITION")
+
+
+class SqlOnlyJobGroupsTest(unittest.TestCase):
+
+  def test_partition_instruction_is_refused_in_loadmart(self):
+    with tempfile.NamedTemporaryFile("w", suffix=".sql", delete=False) as sql_file:
+      sql_file.write("SELECT 1;\nPARTITION \"s\".\"f\" AHEAD 3 RETAIN 36;\n")
+    try:
+      with self.assertRaises(ValueError) as raised:
+        md_genfromsql.deploy_job(RecordingCursor([]), "md", {}, sql_file.name, "LOADMART", "L3_LOAD_FACTS", "REPLACE", 81)
+    finally:
+      os.remove(sql_file.name)
+
+    self.assertIn("lines 2-2: PARTITION", str(raised.exception))
+
+  def test_manifest_keeps_restartmart_and_loadmart_plain_sql(self):
+    # the same jobs config.js deploys -- run_analytics_restart_mart_process / run_analytics_load_process EXECUTE them as they are
+    for sql_file in ("L3_drop.sql", "L3_DDL.sql", "L4_reports_DDL.sql", "L3_load_dimensions.sql", "L3_load_facts.sql"):
+      for instruction in md_genfromsql.parse_instructions(os.path.join(md_genfromsql.SQL_SOURCE_DIR, sql_file)):
+        self.assertEqual(md_genfromsql.reddm_runjobgroup.instruction_type(instruction["instruction"]), "SQL",
+                         "%s line %i" % (sql_file, instruction["first_line"]))
+
+
+if __name__ == "__main__":
+  unittest.main()
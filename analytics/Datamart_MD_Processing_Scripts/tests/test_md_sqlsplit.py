@@ -0,0 +1,79 @@
+# test_md_sqlsplit.py
+#	unit tests of the streaming SQL statement splitter md_sqlsplit.py
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import md_sqlsplit
+
+
+def split(text):
+  return list(md_sqlsplit.iter_statements(text.splitlines(True)))
+
+
+def instructions(text):
+  return [statement["instruction"] for statement in split(text)]
+
+
+class IterStatementsTest(unittest.TestCase):
+
+  def test_statements_and_line_ranges(self):
+    statements = split("SELECT 1;\n\nSELECT\n  2;   \nSELECT 3; SELECT 4;\n")
+
+    self.assertEqual([s["instruction"] for s in statements], ["SELECT 1;", "SELECT\n  2;", "SELECT 3;", "SELECT 4;"])
+    self.assertEqual([(s["first_line"], s["last_line"]) for s in statements], [(1, 1), (3, 4), (5, 5), (5, 5)])
+
+  def test_line_comments_stay_with_their_statement(self):
+    self.assertEqual(instructions("-- d_Property - UPSERT\nINSERT INTO x VALUES (1); -- done\n-- trailing ; comment\n"),
+                     ["-- d_Property - UPSERT\nINSERT INTO x VALUES (1);"])
+
+  def test_semicolons_in_literals(self):
+    self.assertEqual(instructions("SELECT 'a;b', 'it''s;', \"odd;name\";\nSELECT E'\\';' AS x;\n"),
+                     ["SELECT 'a;b', 'it''s;', \"odd;name\";", "SELECT E'\\';' AS x;"])
+
+  def test_identifier_ending_in_e_is_not_an_escape_string(self):
+    self.assertEqual(instructions("SELECT name'\\'; SELECT 2;"), ["SELECT name'\\';", "SELECT 2;"])
+
+  def test_dollar_quoted_bodies(self):
+    body = ("CREATE FUNCTION f() RETURNS void AS $$\nBEGIN\n  PERFORM 1;\n\n    -- keep ; this\nEND;\n$$ LANGUAGE plpgsql;\n"
+            "DO $body$ BEGIN RAISE NOTICE '$$;'; END $body$;\n")
+    statements = split(body)
+
+    self.assertEqual([s["instruction"] for s in statements],
+                     ["CREATE FUNCTION f() RETURNS void AS $$\nBEGIN\n  PERFORM 1;\n\n    -- keep ; this\nEND;\n$$ LANGUAGE plpgsql;",
+                      "DO $body$ BEGIN RAISE NOTICE '$$;'; END $body$;"])
+    self.assertEqual((statements[0]["first_line"], statements[0]["last_line"]), (1, 7))
+
+  def test_nested_block_comments_are_dropped(self):
+    self.assertEqual(instructions("SELECT /* outer /* inner ; */ still ; comment */ 1;\n/* only\n a comment; */\nSELECT 2;"),
+                     ["SELECT  1;", "SELECT 2;"])
+
+  def test_tenant_variables_are_not_dollar_quotes(self):
+    self.assertEqual(instructions("SELECT * FROM \"${dstStarDB}$\".\"${dstStarSchema}$\".\"d_Property\";\nSELECT '${date}$';\n"),
+                     ["SELECT * FROM \"${dstStarDB}$\".\"${dstStarSchema}$\".\"d_Property\";", "SELECT '${date}$';"])
+
+  def test_bare_tenant_variable_next_to_code(self):
+    self.assertEqual(instructions("SELECT x${n}$; SELECT $1;"), ["SELECT x${n}$;", "SELECT $1;"])
+
+  def test_empty_statements_and_comment_only_text(self):
+    self.assertEqual(instructions(";;\n-- nothing here\n/* nor here */\n"), [])
+    self.assertEqual(instructions("SELECT 1;;\n;SELECT 2;"), ["SELECT 1;", "SELECT 2;"])
+
+  def test_trailing_statement_without_semicolon(self):
+    statements = split("SELECT 1;\nSELECT 2\n")
+
+    self.assertEqual([s["instruction"] for s in statements], ["SELECT 1;", "SELECT 2"])
+    self.assertEqual(statements[1]["first_line"], 2)
+
+  def test_multi_line_literal_is_kept_exactly(self):
+    self.assertEqual(instructions("SELECT 'first   \n\n  last';\n"), ["SELECT 'first   \n\n  last';"])
+
+
+if __name__ == "__main__":
+  unittest.main()
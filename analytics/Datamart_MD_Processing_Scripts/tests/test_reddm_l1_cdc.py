@@ -0,0 +1,329 @@
+# test_reddm_l1_cdc.py
+#	unit tests of the test_decoding change parser of reddm_l1_cdc.py (parse_tuple, parse_change), of the per key folding and application
+#	of a batch (TableBatch), and of the checkpoint skip of run_slot, against fake source and mart connections
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_l1_cdc
+
+
+class ParseTupleTest(unittest.TestCase):
+
+  def test_values_are_text(self):
+    self.assertEqual(reddm_l1_cdc.parse_tuple("id[integer]:1 name[character varying]:'Acme' active[boolean]:true"),
+                     {"id": "1", "name": "Acme", "active": "true"})
+
+  def test_null_and_unchanged_toast(self):
+    self.assertEqual(reddm_l1_cdc.parse_tuple("id[uuid]:'a1' note[text]:null body[text]:unchanged-toast-datum"),
+                     {"id": "a1", "note": None, "body": reddm_l1_cdc.UNCHANGED_TOAST})
+
+  def test_quotes_and_spaces_in_values(self):
+    self.assertEqual(reddm_l1_cdc.parse_tuple("name[text]:'it''s a [test]: x' n[integer]:2"),
+                     {"name": "it's a [test]: x", "n": "2"})
+
+  def test_array_types(self):
+    self.assertEqual(reddm_l1_cdc.parse_tuple("tags[text[]]:'{a,\"b c\"}' ids[integer[]]:'{1,2}'"),
+                     {"tags": "{a,\"b c\"}", "ids": "{1,2}"})
+
+  def test_quoted_column_names(self):
+    self.assertEqual(reddm_l1_cdc.parse_tuple("\"partyId\"[uuid]:'p1' \"odd \"\"name\"\"\"[integer]:3"),
+                     {"partyId": "p1", "odd \"name\"": "3"})
+
+  def test_timestamps(self):
+    self.assertEqual(reddm_l1_cdc.parse_tuple("updated_at[timestamp with time zone]:'2020-01-31 10:00:00+00'"),
+                     {"updated_at": "2020-01-31 10:00:00+00"})
+
+
+class ParseChangeTest(unittest.TestCase):
+
+  def test_insert(self):
+    change = reddm_l1_cdc.parse_change("table tenant_acme.\"Party\": INSERT: id[uuid]:'p1' state[text]:'Lead'")
+
+    self.assertEqual(change, {"schema": "tenant_acme", "table": "Party", "op": "INSERT", "old_key": None,
+                              "values": {"id": "p1", "state": "Lead"}})
+
+  def test_update_that_changes_the_key(self):
+    change = reddm_l1_cdc.parse_change("table \"tenant acme\".\"Party\": UPDATE: old-key: id[uuid]:'p1' "
+                                       "new-tuple: id[uuid]:'p2' state[text]:'Applicant'")
+
+    self.assertEqual(change["schema"], "tenant acme")
+    self.assertEqual(change["op"], "UPDATE")
+    self.assertEqual(change["old_key"], {"id": "p1"})
+    self.assertEqual(change["values"], {"id": "p2", "state": "Applicant"})
+
+  def test_delete(self):
+    change = reddm_l1_cdc.parse_change("table tenant_acme.\"Party\": DELETE: id[uuid]:'p1'")
+
+    self.assertEqual((change["op"], change["old_key"], change["values"]), ("DELETE", None, {"id": "p1"}))
+
+  def test_delete_without_replica_identity(self):
+    change = reddm_l1_cdc.parse_change("table tenant_acme.\"Notes\": DELETE: (no-tuple data)")
+
+    self.assertEqual((change["op"], change["values"]), ("DELETE", {}))
+
+  def test_truncate(self):
+    change = reddm_l1_cdc.parse_change("table tenant_acme.\"Party\": TRUNCATE: (no-flags)")
+
+    self.assertEqual((change["table"], change["op"], change["values"]), ("Party", "TRUNCATE", {}))
+
+  def test_multi_line_value(self):
+    change = reddm_l1_cdc.parse_change("table tenant_acme.\"Notes\": INSERT: id[integer]:1 body[text]:'line one\nline two'")
+
+    self.assertEqual(change["values"], {"id": "1", "body": "line one\nline two"})
+
+  def test_other_lines_are_not_changes(self):
+    for data in ("BEGIN 5012", "COMMIT 5012", "message: transactional: 1 prefix: p, sz: 1 content:x"):
+      self.assertIsNone(reddm_l1_cdc.parse_change(data))
+
+
+TENANT_VARS = {"srcSchema": "tenant_acme", "dstNormDB": "reva_mart", "dstNormSchema": "norm_acme"}
+NORM_SCHEMA = "\"reva_mart\".\"norm_acme\""
+
+
+def column(name, udt_name="text", is_nullable="YES"):
+  return {"table_name": "Party", "table_schema": "tenant_acme", "column_name": name, "udt_name": udt_name, "is_nullable": is_nullable,
+          "character_maximum_length": None}
+
+
+PARTY = [column("id", "uuid", "NO"), column("state"), column("notes"), column("created_at", "timestamptz"), column("updated_at", "timestamptz")]
+PARTY_KEY = {"columns": ["id"], "inkey": "id", "indexes": []}
+TABLES = {"Party": (PARTY, PARTY_KEY)}
+
+
+def change(op, values, old_key=None):
+  return {"schema": "tenant_acme", "table": "Party", "op": op, "old_key": old_key, "values": values}
+
+
+def party(party_id, state, updated_at="2020-01-31 10:00:00+00", notes="n"):
+  return {"id": party_id, "state": state, "notes": notes, "created_at": "2020-01-01 10:00:00+00", "updated_at": updated_at}
+
+
+class RecordingCursor:
+  """records the statements; execute_values() is patched to record its statement and rows the same way"""
+
+  def __init__(self, conn):
+    self.connection = conn
+
+  def execute(self, sql, params=None):
+    self.connection.executed.append((sql, params))
+
+  def fetchone(self):
+    return (self.connection.checkpoint,) if self.connection.checkpoint != None else None
+
+  def close(self):
+    pass
+
+
+class FakeMartConn:
+
+  def __init__(self, checkpoint=None):
+    self.checkpoint = checkpoint
+    self.executed = []
+    self.commits = 0
+
+  def cursor(self):
+    return RecordingCursor(self)
+
+  def commit(self):
+    self.commits += 1
+
+  def rollback(self):
+    pass
+
+  def statements(self, prefix):
+    return [(sql, params) for sql, params in self.executed if sql.startswith(prefix)]
+
+
+def record_execute_values(cur, sql, rows, template=None, page_size=None):
+  cur.execute(sql, list(rows))
+
+
+class TableBatchTest(unittest.TestCase):
+
+  def batch(self, *changes):
+    batch = reddm_l1_cdc.TableBatch(PARTY, PARTY_KEY)
+    for one_change in changes:
+      batch.add(one_change)
+    return batch
+
+  def apply(self, batch):
+    conn = FakeMartConn()
+    with unittest.mock.patch.object(reddm_l1_cdc.psycopg2.extras, "execute_values", record_execute_values):
+      counts = batch.apply(conn.cursor(), NORM_SCHEMA)
+    return counts, conn
+
+  def test_changes_of_a_key_are_folded_into_the_last(self):
+    batch = self.batch(change("INSERT", party("p1", "Lead")),
+                       change("UPDATE", party("p1", "Prospect", "2020-01-31 11:00:00+00")),
+                       change("UPDATE", party("p1", "Applicant", "2020-01-31 12:00:00+00")))
+
+    self.assertEqual(batch.rows, {("p1",): party("p1", "Applicant", "2020-01-31 12:00:00+00")})
+
+  def test_unchanged_toast_values_are_left_alone(self):
+    batch = self.batch(change("UPDATE", party("p1", "Applicant", notes=reddm_l1_cdc.UNCHANGED_TOAST)))
+    (upserted, deleted), conn = self.apply(batch)
+
+    self.assertNotIn("notes", batch.rows[("p1",)])
+    sql, rows = conn.statements("INSERT INTO " + NORM_SCHEMA + ".\"n_Party\"")[0]
+    self.assertIn("(\"partyId\", \"state\", \"created_at\", \"updated_at\")", sql)
+    self.assertNotIn("notes", sql)
+    self.assertEqual(rows, [("p1", "Applicant", "2020-01-01 10:00:00+00", "2020-01-31 10:00:00+00")])
+    self.assertEqual((upserted, deleted), (1, 0))
+
+  def test_unchanged_toast_value_of_an_earlier_change_is_kept(self):
+    batch = self.batch(change("INSERT", party("p1", "Lead", notes="long notes")),
+                       change("UPDATE", party("p1", "Applicant", notes=reddm_l1_cdc.UNCHANGED_TOAST)))
+
+    self.assertEqual(batch.rows[("p1",)]["notes"], "long notes")
+    self.assertEqual(batch.rows[("p1",)]["state"], "Applicant")
+
+  def test_key_change_deletes_the_old_key(self):
+    batch = self.batch(change("INSERT", party("p1", "Lead", notes="long notes")),
+                       change("UPDATE", party("p2", "Prospect", notes=reddm_l1_cdc.UNCHANGED_TOAST), old_key={"id": "p1"}))
+    (upserted, deleted), conn = self.apply(batch)
+
+    # the new key carries on from the old one's changes
+    self.assertEqual(batch.rows, {("p1",): None, ("p2",): dict(party("p2", "Prospect"), notes="long notes")})
+    self.assertEqual((upserted, deleted), (1, 1))
+    sql, rows = conn.statements("DELETE FROM")[0]
+    self.assertIn("WHERE \"n\".\"partyId\" = \"d\".\"id\"", sql)
+    self.assertEqual(rows, [("p1",)])
+
+  def test_update_with_an_unchanged_key_is_not_a_key_change(self):
+    batch = self.batch(change("UPDATE", party("p1", "Prospect"), old_key={"id": "p1"}))
+
+    self.assertEqual(batch.rows, {("p1",): party("p1", "Prospect")})
+
+  def test_delete_then_reinsert_is_an_upsert(self):
+    batch = self.batch(change("DELETE", {"id": "p1"}), change("INSERT", party("p1", "Lead")))
+    (upserted, deleted), conn = self.apply(batch)
+
+    self.assertEqual(batch.rows, {("p1",): party("p1", "Lead")})
+    self.assertEqual((upserted, deleted), (1, 0))
+    self.assertEqual(conn.statements("DELETE FROM"), [])
+
+  def test_insert_then_delete_is_a_delete(self):
+    batch = self.batch(change("INSERT", party("p1", "Lead")), change("DELETE", {"id": "p1"}))
+    (upserted, deleted), conn = self.apply(batch)
+
+    self.assertEqual((upserted, deleted), (0, 1))
+    self.assertEqual(conn.statements("INSERT INTO " + NORM_SCHEMA + ".\"n_Party\""), [])
+
+  def test_changes_without_a_key_are_counted(self):
+    batch = self.batch(change("DELETE", {}), change("UPDATE", {"state": "Lead"}))
+
+    self.assertEqual((batch.rows, batch.missing_keys), ({}, 2))
+
+  def test_upserts_move_the_watermark(self):
+    batch = self.batch(change("INSERT", party("p1", "Lead", "2020-01-31 10:00:00+00")), change("INSERT", party("p2", "Lead", "2020-01-31 12:00:00+00")))
+    counts, conn = self.apply(batch)
+
+    sql, params = conn.statements("INSERT INTO " + NORM_SCHEMA + ".\"s_L1Watermark\"")[0]
+    self.assertEqual(params, ("Party", 2, ["2020-01-31 10:00:00+00", "2020-01-31 12:00:00+00"]))
+
+
+class FakeSourceCursor:
+  """pg_logical_slot_peek_changes returns the transactions the slot isn't past, pg_replication_slot_advance moves the slot"""
+
+  def __init__(self, conn):
+    self.connection = conn
+    self.rows = []
+
+  def execute(self, sql, params=None):
+    if "pg_logical_slot_peek_changes" in sql:
+      self.rows = []
+      for lsn, changes in self.connection.transactions:
+        if reddm_l1_cdc.lsn_value(lsn) > reddm_l1_cdc.lsn_value(self.connection.confirmed):
+          self.rows += [(lsn, "BEGIN")] + [(lsn, data) for data in changes] + [(lsn, "COMMIT")]
+    elif "pg_replication_slot_advance" in sql:
+      if reddm_l1_cdc.lsn_value(self.connection.confirmed) < reddm_l1_cdc.lsn_value(params[0]):
+        self.connection.confirmed = params[0]
+        self.connection.advanced.append(params[0])
+
+  def fetchall(self):
+    return self.rows
+
+  def close(self):
+    pass
+
+
+class FakeSourceConn:
+
+  def __init__(self, transactions, confirmed="0/0"):
+    self.transactions = transactions
+    self.confirmed = confirmed
+    self.advanced = []
+
+  def cursor(self):
+    return FakeSourceCursor(self)
+
+  def commit(self):
+    pass
+
+
+def insert_line(party_id):
+  return "table tenant_acme.\"Party\": INSERT: id[uuid]:'%s' state[text]:'Lead' updated_at[timestamp with time zone]:'2020-01-31 10:00:00+00'" % (party_id)
+
+
+class RunSlotTest(unittest.TestCase):
+
+  def run_slot(self, src_conn, dst_conn):
+    with unittest.mock.patch.object(reddm_l1_cdc.psycopg2.extras, "execute_values", record_execute_values), \
+         unittest.mock.patch.object(reddm_l1_cdc.reddm_runjobgroup, "log"):
+      return reddm_l1_cdc.run_slot(src_conn, dst_conn, TENANT_VARS, TABLES, "reddm_l1_tenant_acme", {"BATCH_CHANGES": 100, "FOLLOW": False})
+
+  def upserted_ids(self, dst_conn):
+    return [row[0] for sql, rows in dst_conn.statements("INSERT INTO " + NORM_SCHEMA + ".\"n_Party\"") for row in rows]
+
+  def test_transactions_up_to_the_checkpoint_are_skipped(self):
+    # applied and checkpointed on the mart, but the slot wasn't moved past them before the crash
+    src_conn = FakeSourceConn([("0/120", [insert_line("p1")]), ("0/200", [insert_line("p2")]), ("0/1A00", [insert_line("p3")])])
+    dst_conn = FakeMartConn(checkpoint="0/200")
+    totals = self.run_slot(src_conn, dst_conn)
+
+    self.assertEqual(self.upserted_ids(dst_conn), ["p3"])
+    self.assertEqual((totals["batches"], totals["changes"], totals["upserted"]), (1, 1, 1))
+    self.assertEqual(src_conn.advanced, ["0/200", "0/1A00"])
+    sql, params = dst_conn.statements("INSERT INTO " + NORM_SCHEMA + ".\"s_L1CdcCheckpoint\"")[0]
+    self.assertEqual(params, ("reddm_l1_tenant_acme", "0/1A00", 1))
+
+  def test_nothing_past_the_checkpoint(self):
+    src_conn = FakeSourceConn([("0/120", [insert_line("p1")]), ("0/200", [insert_line("p2")])])
+    dst_conn = FakeMartConn(checkpoint="0/200")
+    totals = self.run_slot(src_conn, dst_conn)
+
+    self.assertEqual(self.upserted_ids(dst_conn), [])
+    self.assertEqual(totals["batches"], 0)
+    self.assertEqual(src_conn.advanced, ["0/200"])
+
+  def test_checkpoint_the_slot_is_past_is_left_alone(self):
+    src_conn = FakeSourceConn([("0/1A00", [insert_line("p3")])], confirmed="0/300")
+    dst_conn = FakeMartConn(checkpoint="0/200")
+    totals = self.run_slot(src_conn, dst_conn)
+
+    self.assertEqual(self.upserted_ids(dst_conn), ["p3"])
+    self.assertEqual(src_conn.advanced, ["0/1A00"])
+
+  def test_without_a_checkpoint_everything_is_applied(self):
+    src_conn = FakeSourceConn([("0/120", [insert_line("p1"), "table tenant_other.\"Party\": INSERT: id[uuid]:'x'"]), ("0/200", [insert_line("p2")])])
+    dst_conn = FakeMartConn()
+    totals = self.run_slot(src_conn, dst_conn)
+
+    self.assertEqual(sorted(self.upserted_ids(dst_conn)), ["p1", "p2"])
+    self.assertEqual((totals["batches"], totals["changes"]), (1, 2))
+    self.assertEqual(src_conn.advanced, ["0/200"])
+
+
+if __name__ == "__main__":
+  unittest.main()
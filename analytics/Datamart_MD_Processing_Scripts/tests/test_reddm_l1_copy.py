@@ -0,0 +1,107 @@
+# test_reddm_l1_copy.py
+#	unit tests of the COPY pipe of reddm_l1_copy.py (CopyPipe, stream_rows), against fake source and mart cursors
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_l1_copy
+
+
+class FakeCursor:
+  """copy_expert runs copy(file) -- writing to the pipe on the source side, reading from it on the mart side"""
+
+  def __init__(self, copy):
+    self.copy = copy
+
+  def copy_expert(self, sql, file, size=None):
+    self.copy(file)
+
+  def close(self):
+    pass
+
+
+class FakeSourceConn:
+
+  def __init__(self, copy):
+    self.copy = copy
+    self.calls = []
+
+  def cursor(self):
+    return FakeCursor(self.copy)
+
+  def commit(self):
+    self.calls.append("commit")
+
+  def rollback(self):
+    self.calls.append("rollback")
+
+
+def write_rows(rows):
+  def copy(pipe):
+    for row in rows:
+      pipe.write(row)
+  return copy
+
+
+def read_all(received):
+  def copy(pipe):
+    while True:
+      data = pipe.read(7)
+      if not data:
+        return
+      received.append(data)
+  return copy
+
+
+class StreamRowsTest(unittest.TestCase):
+
+  def test_rows_reach_the_mart(self):
+    received = []
+    src_conn = FakeSourceConn(write_rows([b"1\ta\n", b"2\tb\n", b"3\tc\n"]))
+    reddm_l1_copy.stream_rows(src_conn, FakeCursor(read_all(received)), "SELECT 1", "\"t_x\"", 2)
+
+    self.assertEqual(b"".join(received), b"1\ta\n2\tb\n3\tc\n")
+    self.assertEqual(src_conn.calls, ["commit"])
+
+  def test_source_failure_is_a_load_error(self):
+    def copy(pipe):
+      pipe.write(b"1\ta\n")
+      b"\xff".decode("utf-8")
+    src_conn = FakeSourceConn(copy)
+
+    with self.assertRaises(reddm_l1_copy.L1LoadError) as raised:
+      reddm_l1_copy.stream_rows(src_conn, FakeCursor(read_all([])), "SELECT 1", "\"t_x\"", 2)
+
+    self.assertIsInstance(raised.exception.cause, UnicodeDecodeError)
+    self.assertIn("UnicodeDecodeError", str(raised.exception))
+    # the source connection is left for the caller to replace
+    self.assertEqual(src_conn.calls, [])
+
+  def test_source_socket_error_is_a_load_error(self):
+    def copy(pipe):
+      raise OSError("connection reset")
+
+    with self.assertRaises(reddm_l1_copy.L1LoadError):
+      reddm_l1_copy.stream_rows(FakeSourceConn(copy), FakeCursor(read_all([])), "SELECT 1", "\"t_x\"", 2)
+
+  def test_mart_failure_stops_the_source(self):
+    def mart_copy(pipe):
+      pipe.read(1)
+      raise reddm_l1_copy.psycopg2.Error("invalid input syntax")
+    rows = [b"x" * reddm_l1_copy.COPY_CHUNK_SIZE] * 20
+
+    with self.assertRaises(reddm_l1_copy.psycopg2.Error):
+      reddm_l1_copy.stream_rows(FakeSourceConn(write_rows(rows)), FakeCursor(mart_copy), "SELECT 1", "\"t_x\"", 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
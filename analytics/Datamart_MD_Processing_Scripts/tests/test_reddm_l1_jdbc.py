@@ -0,0 +1,87 @@
+# test_reddm_l1_jdbc.py
+#	unit tests of the n_ table index names reddm_l1_jdbc.py generates (pg_name, norm_indexes), and of its staging SQL (gen_loadsql)
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_l1_jdbc
+
+
+class PgNameTest(unittest.TestCase):
+
+  def test_short_names_are_kept(self):
+    name = "n_" + "x" * 61
+
+    self.assertEqual(reddm_l1_jdbc.pg_name(name), name)
+
+  def test_long_names_stay_distinct(self):
+    prefix = "n_applicationpayments_" + "a" * 50
+    first, second = reddm_l1_jdbc.pg_name(prefix + "_party_idx"), reddm_l1_jdbc.pg_name(prefix + "_state_idx")
+
+    self.assertNotEqual(first, second)
+    self.assertEqual((len(first), len(second)), (reddm_l1_jdbc.MAX_NAME_LENGTH, reddm_l1_jdbc.MAX_NAME_LENGTH))
+    self.assertEqual(first, reddm_l1_jdbc.pg_name(prefix + "_party_idx"))
+
+  def test_length_is_counted_in_bytes(self):
+    name = reddm_l1_jdbc.pg_name("n_" + "é" * 40)
+
+    self.assertLessEqual(len(name.encode("utf-8")), reddm_l1_jdbc.MAX_NAME_LENGTH)
+
+
+class NormIndexesTest(unittest.TestCase):
+
+  def test_long_source_index_names_dont_collide(self):
+    dm_table = [{"table_name": "ApplicationPayments"}]
+    long_name = "applicationpayments_" + "b" * 45
+    dm_key = {"columns": ["id"], "inkey": "id", "indexes": [
+      {"name": long_name + "_1", "method": "btree", "columns": ["partyId"]},
+      {"name": long_name + "_2", "method": "btree", "columns": ["state"]},
+      {"name": "applicationpayments_updated_at", "method": "btree", "columns": ["updated_at"]}]}
+    names = [name for name, ddl in reddm_l1_jdbc.norm_indexes(dm_table, dm_key)]
+
+    self.assertEqual(len(set(names)), 3)
+    self.assertEqual(names[2], "n_applicationpayments_updated_at")
+
+
+def column(name, udt_name="text", is_nullable="YES"):
+  return {"table_name": "Party", "table_schema": "tenant_acme", "column_name": name, "udt_name": udt_name, "is_nullable": is_nullable,
+          "character_maximum_length": None}
+
+
+PARTY = [column("id", "uuid", "NO"), column("state"), column("created_at", "timestamptz"), column("updated_at", "timestamptz")]
+PARTY_KEY = {"columns": ["id"], "inkey": "id", "indexes": []}
+
+
+class GenLoadSqlTest(unittest.TestCase):
+
+  def load_sql(self, strategy):
+    out = io.StringIO()
+    reddm_l1_jdbc.gen_loadsql(out, PARTY, PARTY_KEY, strategy)
+    return out.getvalue()
+
+  def test_unlogged_staging_table_is_made_unlogged(self):
+    # the t_ table a --staging=table load left behind is kept by CREATE UNLOGGED TABLE IF NOT EXISTS
+    sql = self.load_sql("unlogged")
+    staging_table = reddm_l1_jdbc.staging_name("Party", "unlogged")
+
+    self.assertIn("CREATE UNLOGGED TABLE IF NOT EXISTS %s (" % (staging_table), sql)
+    self.assertLess(sql.index("TRUNCATE %s;" % (staging_table)), sql.index("ALTER TABLE %s SET UNLOGGED;" % (staging_table)))
+    self.assertLess(sql.index("SET UNLOGGED;"), sql.index("INSERT INTO %s" % (staging_table)))
+
+  def test_other_strategies_dont_alter_the_staging_table(self):
+    for strategy in ("table", "temp", "direct"):
+      self.assertNotIn("SET UNLOGGED", self.load_sql(strategy), strategy)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,108 @@
+# test_reddm_l1_runner.py
+#	unit tests of the manifest units of reddm_l1_runner.py (run_manifest_unit), on the manifest reddm_l1_jdbc.py writes, against a fake
+#	mart connection
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import io
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_l1_jdbc
+import reddm_l1_runner
+
+TENANT_VARS = {"srcDB": "reva", "srcSchema": "tenant_acme", "srcServer": "localhost", "srcUser": "u", "srcPassword": "p",
+               "dstNormDB": "reva_mart", "dstNormSchema": "norm_acme", "tmpNormDB": "reva_mart", "tmpNormSchema": "tmp_acme"}
+
+
+def column(name, udt_name="text", is_nullable="YES"):
+  return {"table_name": "Party", "table_schema": "tenant_acme", "column_name": name, "udt_name": udt_name, "is_nullable": is_nullable,
+          "character_maximum_length": None}
+
+
+PARTY = [column("id", "uuid", "NO"), column("state"), column("created_at", "timestamptz"), column("updated_at", "timestamptz")]
+PARTY_KEY = {"columns": ["id"], "inkey": "id", "indexes": []}
+
+
+class FakeCursor:
+  """a staging INSERT reports the rows it staged, the merge returns the rows it merged"""
+
+  def __init__(self, conn):
+    self.conn = conn
+    self.rowcount = -1
+
+  def execute(self, sql, params=None):
+    self.conn.executed.append(sql)
+    if sql.startswith("WITH") or "AS \"merged\"" in sql:
+      self.rowcount = 1 if self.conn.merged != None else 0
+    elif sql.startswith("INSERT"):
+      self.rowcount = self.conn.staged
+    else:
+      self.rowcount = -1
+
+  def fetchone(self):
+    return (self.conn.merged,)
+
+  def close(self):
+    pass
+
+
+class FakeConn:
+
+  def __init__(self, staged, merged):
+    self.staged = staged
+    self.merged = merged
+    self.executed = []
+
+  def cursor(self):
+    return FakeCursor(self)
+
+  def commit(self):
+    pass
+
+  def rollback(self):
+    pass
+
+
+def manifest_unit(strategy):
+  out = io.StringIO()
+  reddm_l1_jdbc.gen_loadmanifest(out, [(PARTY, PARTY_KEY)], strategy)
+  manifest = json.loads(out.getvalue())
+  return reddm_l1_runner.manifest_units(manifest, None)[0]
+
+
+def run_unit(unit, conn):
+  worker = {"dst_conn": conn, "expander": reddm_l1_runner.ManifestExpander("acme", TENANT_VARS)}
+  return reddm_l1_runner.run_manifest_unit(worker, unit)
+
+
+class RunManifestUnitTest(unittest.TestCase):
+
+  def test_rows_are_the_rows_merged(self):
+    for strategy in reddm_l1_jdbc.STAGING_STRATEGIES:
+      unit = manifest_unit(strategy)
+      conn = FakeConn(staged=120, merged=100)
+
+      self.assertEqual(run_unit(unit, conn), 100, strategy)
+      self.assertIn("\"merged\" AS (", conn.executed[unit["merge"]])
+
+  def test_nothing_staged_merges_nothing(self):
+    self.assertEqual(run_unit(manifest_unit("table"), FakeConn(staged=0, merged=None)), 0)
+
+  def test_merge_is_the_last_instruction(self):
+    unit = manifest_unit("table")
+
+    self.assertEqual(unit["merge"], len(unit["instructions"]) - 1)
+    self.assertIn("RETURNING \"rowCount\"", unit["instructions"][unit["merge"]])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,62 @@
+# test_reddm_partition.py
+#	unit tests of the PARTITION instruction parser of reddm_partition.py
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import reddm_partition
+
+
+class ParseTest(unittest.TestCase):
+
+  def test_database_schema_and_table(self):
+    self.assertEqual(reddm_partition.parse("PARTITION \"reva_mart\".\"star_acme\".\"f_PaymentsAndRefunds\" AHEAD 3 RETAIN 36;"),
+                     {"schema": "star_acme", "table": "f_PaymentsAndRefunds", "ahead": 3, "retain": 36, "archive": None})
+
+  def test_schema_and_table_unquoted(self):
+    spec = reddm_partition.parse("partition star_acme . f_payments ahead 1 retain 12")
+
+    self.assertEqual((spec["schema"], spec["table"], spec["ahead"], spec["retain"]), ("star_acme", "f_payments", 1, 12))
+
+  def test_archive(self):
+    spec = reddm_partition.parse("PARTITION \"star_acme\".\"f_PaymentsAndRefunds\" AHEAD 3 RETAIN 36 ARCHIVE \"archive_acme\";")
+
+    self.assertEqual(spec["archive"], "archive_acme")
+
+  def test_comments_and_line_breaks(self):
+    spec = reddm_partition.parse("-- the partitions of the retention window\nPARTITION \"s\".\"f\"\n  AHEAD 0\n  RETAIN 6;\n")
+
+    self.assertEqual((spec["schema"], spec["table"], spec["ahead"], spec["retain"]), ("s", "f", 0, 6))
+
+  def test_invalid_instructions(self):
+    for instruction in ("PARTITION \"f_PaymentsAndRefunds\" AHEAD 3 RETAIN 36;",
+                        "PARTITION \"s\".\"f\" AHEAD 3;",
+                        "PARTITION \"s\".\"f\" AHEAD three RETAIN 36;",
+                        "PARTITION \"s\".\"f\" AHEAD 3 RETAIN 36 ARCHIVE;",
+                        "PARTITION \"s\".\"f\" AHEAD 3 RETAIN 36; DROP TABLE x;",
+                        "SELECT 1;"):
+      with self.assertRaises(ValueError, msg=instruction):
+        reddm_partition.parse(instruction)
+
+
+class PartitionSqlTest(unittest.TestCase):
+
+  def test_names_are_sql_literals(self):
+    sql = reddm_partition.partition_sql("PARTITION \"star_acme\".\"o'brien\" AHEAD 2 RETAIN 24;")
+
+    self.assertTrue(sql.startswith("DO $reddm_partition$"))
+    self.assertIn("schema_name CONSTANT text := 'star_acme';", sql)
+    self.assertIn("table_name CONSTANT text := 'o''brien';", sql)
+    self.assertIn("archive_schema CONSTANT text := NULL;", sql)
+    self.assertIn("interval '24 months'", sql)
+    self.assertIn("interval '2 months'", sql)
+
+
+if __name__ == "__main__":
+  unittest.main()
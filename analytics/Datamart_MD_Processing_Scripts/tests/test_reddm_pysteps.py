@@ -0,0 +1,83 @@
+# test_reddm_pysteps.py
+#	unit tests of the PYTHON steps of reddm_pysteps.py (parse, table_checksum), against a fake mart connection
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_pysteps
+
+
+class FakeCursor:
+
+  def __init__(self, rows):
+    self.rows = rows
+    self.itersize = None
+
+  def execute(self, sql, params=None):
+    pass
+
+  def fetchone(self):
+    return ("\"star_acme\".\"d_Party\"",)
+
+  def __iter__(self):
+    return iter((row,) for row in self.rows)
+
+  def close(self):
+    pass
+
+
+class FakeConn:
+
+  def __init__(self, rows):
+    self.rows = rows
+
+  def cursor(self, name=None):
+    return FakeCursor(self.rows)
+
+
+def checksum(rows):
+  logged = []
+  rows_read = reddm_pysteps.table_checksum({"mart": FakeConn(rows), "log": logged.append}, "star_acme.d_Party")
+  return rows_read, logged[0].split()[-1]
+
+
+class TableChecksumTest(unittest.TestCase):
+
+  def test_row_order_doesnt_matter(self):
+    self.assertEqual(checksum(["(1,a)", "(2,b)", "(3,c)"]), checksum(["(3,c)", "(1,a)", "(2,b)"]))
+
+  def test_duplicate_rows_count(self):
+    once = checksum(["(1,a)", "(2,b)"])
+    twice = checksum(["(1,a)", "(2,b)", "(2,b)", "(2,b)"])
+
+    self.assertEqual((once[0], twice[0]), (2, 4))
+    self.assertNotEqual(once[1], twice[1])
+    self.assertNotEqual(checksum(["(1,a)", "(1,a)"])[1], checksum([])[1])
+
+  def test_checksum_is_32_hex_digits(self):
+    self.assertEqual(len(checksum(["(%i,x)" % (n) for n in range(1000)])[1]), 32)
+
+
+class ParseTest(unittest.TestCase):
+
+  def test_step_and_arguments(self):
+    step, arguments = reddm_pysteps.parse("-- compare the tables\nPYTHON table_checksum \"s\".\"a\" \"s\".\"b\";")
+
+    self.assertEqual((step["name"], arguments), ("table_checksum", ["\"s\".\"a\"", "\"s\".\"b\""]))
+
+  def test_unknown_step(self):
+    with self.assertRaises(ValueError):
+      reddm_pysteps.parse("PYTHON no_such_step;")
+
+
+if __name__ == "__main__":
+  unittest.main()
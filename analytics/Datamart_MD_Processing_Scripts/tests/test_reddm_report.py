@@ -0,0 +1,212 @@
+# test_reddm_report.py
+#	unit tests of the report runner reddm_report.py:  parameter binding, the cache key, invalidation by load state and the cache
+#	entries themselves, against a fake mart connection
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import io
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_report
+
+TENANT_VARS = {"dstStarSchema": "star_acme"}
+
+REPORT_SQL = """SELECT t."eventDt", t."leads"
+FROM "${dstStarSchema}$"."f_TrafficSummary" t
+WHERE t."eventDt" = date("${date}$") AND t."name" LIKE '%x';
+"""
+
+
+class FakeCursor:
+
+  def __init__(self, conn, name=None):
+    self.connection = conn
+    self.name = name
+    self.description = None
+
+  def execute(self, sql, params=None):
+    self.connection.executed.append((sql, params))
+    if self.name == None and self.connection.load_dates == None:
+      raise reddm_report.psycopg2.Error("relation \"s_LastLoadDate\" does not exist")
+    self.description = [("eventDt",), ("leads",)]
+
+  def fetchall(self):
+    return list(self.connection.load_dates.items())
+
+  def __iter__(self):
+    return iter(self.connection.rows)
+
+  def close(self):
+    pass
+
+
+class FakeConn:
+
+  def __init__(self, load_dates, rows):
+    self.load_dates = load_dates
+    self.rows = rows
+    self.executed = []
+
+  def cursor(self, name=None):
+    return FakeCursor(self, name)
+
+  def commit(self):
+    pass
+
+  def rollback(self):
+    pass
+
+  def queries(self):
+    return [sql for sql, params in self.executed if "s_LastLoadDate" not in sql]
+
+
+class BindQueryTest(unittest.TestCase):
+
+  def test_tenant_variables_are_expanded_and_parameters_bound(self):
+    sql, unknown = reddm_report.bind_query(REPORT_SQL, TENANT_VARS, {"date": "2022-03-31"})
+
+    self.assertIn("FROM \"star_acme\".\"f_TrafficSummary\" t", sql)
+    # the quotes around a parameter go, it becomes a placeholder -- and a literal % is escaped for the driver
+    self.assertIn("date(%(date)s)", sql)
+    self.assertIn("LIKE '%%x'", sql)
+    self.assertEqual(unknown, set())
+
+  def test_quote_forms(self):
+    for placeholder in ("'\"${date}$\"'", "'${date}$'", "\"${date}$\"", "${date}$"):
+      sql, unknown = reddm_report.bind_query("SELECT %s;" % (placeholder), TENANT_VARS, {"date": "x"})
+      self.assertEqual(sql, "SELECT %(date)s;", placeholder)
+
+  def test_parameter_without_a_value(self):
+    sql, unknown = reddm_report.bind_query(REPORT_SQL, TENANT_VARS, {})
+
+    self.assertEqual(unknown, {"date"})
+
+  def test_parameter_values_are_never_spliced(self):
+    sql, unknown = reddm_report.bind_query(REPORT_SQL, TENANT_VARS, {"date": "x'); DROP TABLE y; --"})
+
+    self.assertNotIn("DROP", sql)
+
+
+class CacheKeyTest(unittest.TestCase):
+
+  def test_key_covers_tenant_report_and_parameters(self):
+    path = reddm_report.cache_path("/c", "acme", "r.sql", {"date": "2022-03-31", "team": "a"})
+
+    self.assertEqual(path, reddm_report.cache_path("/c", "acme", "r.sql", {"team": "a", "date": "2022-03-31"}))
+    self.assertNotEqual(path, reddm_report.cache_path("/c", "other", "r.sql", {"date": "2022-03-31", "team": "a"}))
+    self.assertNotEqual(path, reddm_report.cache_path("/c", "acme", "s.sql", {"date": "2022-03-31", "team": "a"}))
+    self.assertNotEqual(path, reddm_report.cache_path("/c", "acme", "r.sql", {"date": "2022-04-01", "team": "a"}))
+    self.assertTrue(os.path.basename(path).startswith("report_"))
+
+  def test_default_directory_is_per_user(self):
+    saved = os.environ.pop("REDDM_REPORT_CACHE_DIR", None)
+    try:
+      self.assertTrue(reddm_report.default_cache_dir().endswith("reddm_reports-%s" % (reddm_report.reddm_snapshot.current_user())))
+    finally:
+      if saved != None:
+        os.environ["REDDM_REPORT_CACHE_DIR"] = saved
+
+
+class CacheVersionTest(unittest.TestCase):
+
+  def version(self, load_dates, tables=("f_TrafficSummary",)):
+    return reddm_report.cache_version(FakeConn(load_dates, []).cursor(), TENANT_VARS, list(tables))
+
+  def test_version_follows_the_load_state_of_the_report_tables(self):
+    loaded = {"f_TrafficSummary": "2022-03-31 01:00", "d_Party": "2022-03-31 01:00"}
+
+    self.assertEqual(self.version(loaded), self.version(dict(loaded, d_Party="2022-04-01 01:00")))
+    self.assertNotEqual(self.version(loaded), self.version(dict(loaded, f_TrafficSummary="2022-04-01 01:00")))
+
+  def test_table_without_a_load_date_follows_every_load(self):
+    loaded = {"d_Party": "2022-03-31 01:00"}
+
+    self.assertNotEqual(self.version(loaded), self.version({"d_Party": "2022-04-01 01:00"}))
+
+  def test_nothing_is_cached_without_s_last_load_date(self):
+    self.assertIsNone(self.version(None))
+    self.assertIsNone(self.version({}))
+
+
+class RunReportTest(unittest.TestCase):
+
+  def setUp(self):
+    self.work_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.work_dir, "cache")
+    self.report_path = os.path.join(self.work_dir, "Traffic.sql")
+    with open(self.report_path, "w") as report_file:
+      report_file.write(REPORT_SQL)
+
+  def tearDown(self):
+    shutil.rmtree(self.work_dir)
+
+  def run_report(self, conn, params=None):
+    out = io.StringIO()
+    source = reddm_report.run_report(conn, "acme", TENANT_VARS, self.report_path, {"date": "2022-03-31"} if params == None else params, out, "csv", self.cache_dir)
+    return source, out.getvalue()
+
+  def entry(self):
+    return reddm_report.cache_path(self.cache_dir, "acme", self.report_path, {"date": "2022-03-31"})
+
+  def test_second_run_is_served_from_the_cache(self):
+    loaded = {"f_TrafficSummary": "2022-03-31 01:00"}
+    first = self.run_report(FakeConn(loaded, [("2022-03-31", 4)]))
+    conn = FakeConn(loaded, [])
+    second = self.run_report(conn)
+
+    self.assertEqual(first, ("query", "eventDt,leads\r\n2022-03-31,4\r\n"))
+    self.assertEqual(second, ("cache", first[1]))
+    self.assertEqual(conn.queries(), [])
+    self.assertEqual(os.stat(self.cache_dir).st_mode & 0o777, 0o700)
+
+  def test_a_load_invalidates_the_entry(self):
+    self.run_report(FakeConn({"f_TrafficSummary": "2022-03-31 01:00"}, [("2022-03-31", 4)]))
+    source, output = self.run_report(FakeConn({"f_TrafficSummary": "2022-04-01 01:00"}, [("2022-03-31", 5)]))
+
+    self.assertEqual((source, output), ("query", "eventDt,leads\r\n2022-03-31,5\r\n"))
+
+  def test_truncated_entry_is_a_miss_and_removed(self):
+    loaded = {"f_TrafficSummary": "2022-03-31 01:00"}
+    self.run_report(FakeConn(loaded, [("2022-03-31", n) for n in range(2000)]))
+    with open(self.entry(), "rb") as cache_file:
+      data = cache_file.read()
+    with open(self.entry(), "wb") as cache_file:
+      cache_file.write(data[:len(data) // 2])
+
+    self.assertIsNone(reddm_report.cache_entry(self.entry(), reddm_report.cache_version(FakeConn(loaded, []).cursor(), TENANT_VARS, ["f_TrafficSummary"])))
+    self.assertFalse(os.path.exists(self.entry()))
+    self.assertEqual(self.run_report(FakeConn(loaded, [("2022-03-31", 1)]))[0], "query")
+
+  def test_entry_that_isnt_json_is_a_miss(self):
+    loaded = {"f_TrafficSummary": "2022-03-31 01:00"}
+    self.run_report(FakeConn(loaded, [("2022-03-31", 4)]))
+    with gzip.open(self.entry(), "wt") as cache_file:
+      cache_file.write("not json\n")
+
+    self.assertEqual(self.run_report(FakeConn(loaded, [("2022-03-31", 4)]))[0], "query")
+
+  def test_entry_writable_by_others_is_ignored(self):
+    loaded = {"f_TrafficSummary": "2022-03-31 01:00"}
+    self.run_report(FakeConn(loaded, [("2022-03-31", 4)]))
+    os.chmod(self.entry(), 0o666)
+
+    self.assertEqual(self.run_report(FakeConn(loaded, [("2022-03-31", 6)])), ("query", "eventDt,leads\r\n2022-03-31,6\r\n"))
+
+  def test_unbound_parameter_is_an_error(self):
+    with self.assertRaises(ValueError):
+      self.run_report(FakeConn({}, []), params={})
+
+
+if __name__ == "__main__":
+  unittest.main()
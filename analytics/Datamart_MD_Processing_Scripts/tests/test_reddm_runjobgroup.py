@@ -0,0 +1,48 @@
+# test_reddm_runjobgroup.py
+#	unit tests of the metadata handling helpers of reddm_runjobgroup.py that don't need a database
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pgstub
+pgstub.install()
+
+import reddm_runjobgroup
+
+
+class SessionSettingsTest(unittest.TestCase):
+
+  def test_instruction_profile_overrides_the_job(self):
+    session, unknown = reddm_runjobgroup.session_settings('{"work_mem": "64MB", "jit": "off"}', {"work_mem": "256MB"})
+
+    self.assertEqual(session, [("jit", "off"), ("work_mem", "256MB")])
+    self.assertEqual(unknown, [])
+
+  def test_values_are_strings(self):
+    session, unknown = reddm_runjobgroup.session_settings({"jit": False, "max_parallel_workers_per_gather": 0, "synchronous_commit": True})
+
+    self.assertEqual(session, [("jit", "off"), ("max_parallel_workers_per_gather", "0"), ("synchronous_commit", "on")])
+
+  def test_null_keeps_the_session_default(self):
+    session, unknown = reddm_runjobgroup.session_settings({"statement_timeout": "10min"}, '{"statement_timeout": null}')
+
+    self.assertEqual(session, [])
+
+  def test_unknown_settings_are_reported(self):
+    session, unknown = reddm_runjobgroup.session_settings({"work_mem": "1GB", "search_path": "x", "role": "postgres"})
+
+    self.assertEqual(session, [("work_mem", "1GB")])
+    self.assertEqual(unknown, ["role", "search_path"])
+
+  def test_no_profiles(self):
+    self.assertEqual(reddm_runjobgroup.session_settings(None, None), ([], []))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,106 @@
+# test_reddm_scheduler.py
+#	unit tests of the load unit split and dependency graph of reddm_scheduler.py
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import reddm_scheduler
+
+
+def marker(table_name):
+  return "SELECT \"dstStarDB\".\"dstStarSchema\".update_last_load_date('%s', 'resultPrevInstr', 'final');" % (table_name)
+
+
+def lines(*instructions, job="LOAD_DIMENSIONS"):
+  return [{"job": job, "instruction": instruction} for instruction in instructions]
+
+
+class SplitUnitsTest(unittest.TestCase):
+
+  def test_unit_ends_at_its_load_marker(self):
+    units = reddm_scheduler.split_units(lines(
+        "INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property"),
+        "INSERT INTO \"d_Team\" SELECT 1;", marker("d_Team")))
+
+    self.assertEqual([unit["table"] for unit in units], ["d_Property", "d_Team"])
+    self.assertEqual([len(unit["lines"]) for unit in units], [2, 2])
+    self.assertEqual([unit["index"] for unit in units], [0, 1])
+
+  def test_leading_instructions_without_the_table_are_a_barrier(self):
+    units = reddm_scheduler.split_units(lines(
+        "SELECT prepare_for_loading();", "INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property")))
+
+    self.assertEqual([unit["table"] for unit in units], [None, "d_Property"])
+    self.assertEqual(units[0]["lines"][0]["instruction"], "SELECT prepare_for_loading();")
+
+  def test_unit_never_spans_jobs(self):
+    md_lines = lines("CREATE TABLE \"d_Property\" (x int);", job="DDL") + lines("INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property"))
+    units = reddm_scheduler.split_units(md_lines)
+
+    self.assertEqual([unit["table"] for unit in units], [None, "d_Property"])
+    self.assertEqual(len(units[1]["lines"]), 2)
+
+  def test_trailing_instructions_are_a_barrier(self):
+    units = reddm_scheduler.split_units(lines("INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property"), "ANALYZE;"))
+
+    self.assertEqual([unit["table"] for unit in units], ["d_Property", None])
+
+
+class BuildGraphTest(unittest.TestCase):
+
+  def units(self):
+    return reddm_scheduler.split_units(lines(
+        "SELECT prepare_for_loading();",
+        "INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property"),
+        "INSERT INTO \"d_Team\" SELECT 1;", marker("d_Team"),
+        "INSERT INTO \"d_Party\" SELECT * FROM \"d_Property\";", marker("d_Party"),
+        "INSERT INTO \"d_Program\" SELECT 1;", marker("d_Program")))
+
+  def test_no_dependencies_runs_sequentially(self):
+    units = reddm_scheduler.build_graph(self.units(), None)
+
+    self.assertEqual([sorted(unit["deps"]) for unit in units], [[], [0], [1], [2], [3]])
+
+  def test_declared_and_referenced_tables(self):
+    units = reddm_scheduler.build_graph(self.units(), [("d_Program", "d_Team"), ("d_Team", None)])
+    deps = dict((unit["table"], sorted(unit["deps"])) for unit in units)
+
+    # every table waits for the barrier in front of it, d_Party for the d_Property its SQL reads, d_Program for its declared d_Team
+    self.assertEqual(deps[None], [])
+    self.assertEqual(deps["d_Property"], [0])
+    self.assertEqual(deps["d_Team"], [0])
+    self.assertEqual(deps["d_Party"], [0, 1])
+    self.assertEqual(deps["d_Program"], [0, 2])
+
+  def test_dependency_on_a_later_unit_is_dropped(self):
+    units = reddm_scheduler.build_graph(self.units(), [("d_Property", "d_Program")])
+
+    self.assertEqual(sorted(units[1]["deps"]), [0])
+
+  def test_barrier_waits_for_everything_since_the_previous_one(self):
+    units = reddm_scheduler.split_units(lines(
+        "INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property"),
+        "INSERT INTO \"d_Team\" SELECT 1;", marker("d_Team"),
+        "ANALYZE;") + lines("INSERT INTO \"d_Party\" SELECT 1;", marker("d_Party"), job="LOAD_FACTS"))
+    units = reddm_scheduler.build_graph(units, [])
+
+    self.assertEqual([unit["table"] for unit in units], ["d_Property", "d_Team", None, "d_Party"])
+    self.assertEqual(sorted(units[2]["deps"]), [0, 1])
+    self.assertEqual(sorted(units[3]["deps"]), [2])
+
+  def test_table_loaded_twice_keeps_its_loads_in_order(self):
+    units = reddm_scheduler.split_units(lines("INSERT INTO \"d_Property\" SELECT 1;", marker("d_Property"))
+                                        + lines("UPDATE \"d_Property\" SET x = 1;", marker("d_Property"), job="LOAD_FACTS"))
+    units = reddm_scheduler.build_graph(units, [])
+
+    self.assertEqual(sorted(units[1]["deps"]), [0])
+
+
+if __name__ == "__main__":
+  unittest.main()
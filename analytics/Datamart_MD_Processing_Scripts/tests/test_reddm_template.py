@@ -0,0 +1,87 @@
+# test_reddm_template.py
+#	unit tests of the tenant variable templates of reddm_template.py
+#
+# Usage:
+#   "python -m pytest tests" (or "python -m unittest discover -s tests") from Datamart_MD_Processing_Scripts
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import reddm_template
+
+TENANT_VARS = {"dstStarDB": "reva_mart", "dstStarSchema": "star_acme", "dstStar": "wrong", "loadDay": "2020-01-31"}
+
+
+class TemplateEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.engine = reddm_template.TemplateEngine(TENANT_VARS.keys())
+
+  def test_psql_and_bare_variables(self):
+    template = self.engine.compile("SELECT * FROM \"dstStarDB\".\"dstStarSchema\".\"d_Property\" WHERE d = '%{loadDay}%';")
+    bound = self.engine.expand("acme", TENANT_VARS, template)
+
+    self.assertEqual(reddm_template.render(bound), "SELECT * FROM \"reva_mart\".\"star_acme\".\"d_Property\" WHERE d = '2020-01-31';")
+    self.assertEqual(template["vars"], {"dstStarDB", "dstStarSchema", "loadDay"})
+
+  def test_bare_names_match_anywhere(self):
+    # as expand_tenantvar() always did -- a bare variable name is replaced inside other words too
+    template = self.engine.compile("SELECT dstStarDB_x;")
+
+    self.assertEqual(reddm_template.render(self.engine.expand("acme", TENANT_VARS, template)), "SELECT reva_mart_x;")
+
+  def test_longest_bare_name_wins(self):
+    # dstStar is a prefix of dstStarSchema -- only the full name may match
+    template = self.engine.compile("\"dstStarSchema\" dstStar")
+
+    self.assertEqual(reddm_template.render(self.engine.expand("acme", TENANT_VARS, template)), "\"star_acme\" wrong")
+
+  def test_runtime_variables_are_left_for_render(self):
+    template = self.engine.compile("SELECT update_last_load_date('d_Property', 'resultPrevInstr', 'final');")
+    bound = self.engine.expand("acme", TENANT_VARS, template)
+
+    self.assertIn(("resultPrevInstr",), bound)
+    self.assertEqual(reddm_template.render(bound, {"resultPrevInstr": "Success"}),
+                     "SELECT update_last_load_date('d_Property', 'Success', 'final');")
+    self.assertEqual(reddm_template.render(bound), "SELECT update_last_load_date('d_Property', '', 'final');")
+
+  def test_unknown_vars(self):
+    template = self.engine.compile("SELECT '%{srcSchema}%', '%{loadDay}%', 'resultPrevInstr';")
+
+    self.assertEqual(self.engine.unknown_vars(template, TENANT_VARS), ["srcSchema"])
+    # an unknown variable stays a reference, so it is never silently expanded
+    self.assertIn(("srcSchema",), self.engine.expand("acme", TENANT_VARS, template))
+
+  def test_templates_and_expansions_are_cached(self):
+    instruction = "SELECT '%{loadDay}%';"
+    template = self.engine.compile(instruction)
+
+    self.assertIs(self.engine.compile(instruction), template)
+    self.assertIs(self.engine.expand("acme", TENANT_VARS, template), self.engine.expand("acme", TENANT_VARS, template))
+    other = self.engine.expand("other", dict(TENANT_VARS, loadDay="2021-12-31"), template)
+    self.assertEqual(reddm_template.render(other), "SELECT '2021-12-31';")
+
+  def test_expansion_cache_is_bounded(self):
+    template = self.engine.compile("SELECT '%{loadDay}%';")
+    saved = reddm_template.EXPANSION_CACHE_SIZE
+    reddm_template.EXPANSION_CACHE_SIZE = 2
+    try:
+      for tenant in ("a", "b", "c"):
+        self.engine.expand(tenant, TENANT_VARS, template)
+    finally:
+      reddm_template.EXPANSION_CACHE_SIZE = saved
+
+    self.assertEqual(list(self.engine.expansions), [("b", template["hash"]), ("c", template["hash"])])
+
+  def test_no_variables(self):
+    engine = reddm_template.TemplateEngine([])
+    template = engine.compile("SELECT 1;")
+
+    self.assertEqual(reddm_template.render(engine.expand("acme", {}, template)), "SELECT 1;")
+
+
+if __name__ == "__main__":
+  unittest.main()
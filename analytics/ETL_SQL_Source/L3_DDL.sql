@@ -315,31 +315,70 @@ CREATE TABLE "dstStarDB"."dstStarSchema"."d_Inventory" (
 );
 
 
-CREATE TABLE "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds"
-(
-  "paymentsAndRefundsKey" SERIAL PRIMARY KEY,
-  "partyKey" INTEGER NOT NULL,
-  "applicantPartyMemberKey" INTEGER NOT NULL,
-  "primaryPartyMemberKey" INTEGER NOT NULL,
-  "applicationPropertyKey" INTEGER NOT NULL,
-  "utcDateKey" INTEGER NOT NULL,
-  "utcTimeKey" INTEGER NOT NULL,
-  "propertyDateKey" INTEGER NOT NULL,
-  "propertyTimeKey" INTEGER NOT NULL,
-  "paidBy"  VARCHAR(255) NOT NULL,
-  "AptexxRef" VARCHAR(255) NOT NULL,
-  "transactionType" VARCHAR(80) NOT NULL,
-  "amount" NUMERIC(7,2) NOT NULL,
-  "updated_at" TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-  FOREIGN KEY ("partyKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Party"("partyKey"),
-  FOREIGN KEY ("applicantPartyMemberKey") REFERENCES "dstStarDB"."dstStarSchema"."d_PartyMember"("partyMemberKey"),
-  FOREIGN KEY ("utcDateKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Date"("dateKey"),
-  FOREIGN KEY ("propertyDateKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Date"("dateKey"),
-  FOREIGN KEY ("utcTimeKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Time"("timeKey"),
-  FOREIGN KEY ("propertyTimeKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Time"("timeKey"),
-  FOREIGN KEY ("primaryPartyMemberKey") REFERENCES "dstStarDB"."dstStarSchema"."d_PartyMember"("partyMemberKey"),
-  FOREIGN KEY ("applicationPropertyKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Property"("propertyKey")
-);
+-- f_PaymentsAndRefunds is insert only, so it can be range partitioned on "utcDateKey" when the tenant has partitionFacts on.
+-- The partitioned variant needs PostgreSQL 13 or later (its BEFORE UPDATE ... FOR EACH ROW trigger, below) -- on older servers, and for
+-- tenants without partitionFacts, the table is created unpartitioned.   One DO block picks the variant, so the instruction is plain SQL
+-- for every executor (run_analytics_restart_mart_process too).   The partitioned table starts with its DEFAULT partition only, so loads
+-- work right away; the monthly partitions are kept by the PARTITIONFACTS job group (L3_partition_facts.sql, reddm_runjobgroup.py only)
+DO $f_paymentsandrefunds$
+BEGIN
+  IF 'partitionFacts' = 'on' AND current_setting('server_version_num')::integer >= 130000 THEN
+    CREATE TABLE "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds"
+    (
+      "paymentsAndRefundsKey" SERIAL,
+      "partyKey" INTEGER NOT NULL,
+      "applicantPartyMemberKey" INTEGER NOT NULL,
+      "primaryPartyMemberKey" INTEGER NOT NULL,
+      "applicationPropertyKey" INTEGER NOT NULL,
+      "utcDateKey" INTEGER NOT NULL,
+      "utcTimeKey" INTEGER NOT NULL,
+      "propertyDateKey" INTEGER NOT NULL,
+      "propertyTimeKey" INTEGER NOT NULL,
+      "paidBy"  VARCHAR(255) NOT NULL,
+      "AptexxRef" VARCHAR(255) NOT NULL,
+      "transactionType" VARCHAR(80) NOT NULL,
+      "amount" NUMERIC(7,2) NOT NULL,
+      "updated_at" TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+      FOREIGN KEY ("partyKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Party"("partyKey"),
+      FOREIGN KEY ("applicantPartyMemberKey") REFERENCES "dstStarDB"."dstStarSchema"."d_PartyMember"("partyMemberKey"),
+      FOREIGN KEY ("utcDateKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Date"("dateKey"),
+      FOREIGN KEY ("propertyDateKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Date"("dateKey"),
+      FOREIGN KEY ("utcTimeKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Time"("timeKey"),
+      FOREIGN KEY ("propertyTimeKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Time"("timeKey"),
+      FOREIGN KEY ("primaryPartyMemberKey") REFERENCES "dstStarDB"."dstStarSchema"."d_PartyMember"("partyMemberKey"),
+      FOREIGN KEY ("applicationPropertyKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Property"("propertyKey"),
+      PRIMARY KEY ("paymentsAndRefundsKey", "utcDateKey")
+    ) PARTITION BY RANGE ("utcDateKey");
+    CREATE TABLE "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds_default" PARTITION OF "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds" DEFAULT;
+  ELSE
+    CREATE TABLE "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds"
+    (
+      "paymentsAndRefundsKey" SERIAL PRIMARY KEY,
+      "partyKey" INTEGER NOT NULL,
+      "applicantPartyMemberKey" INTEGER NOT NULL,
+      "primaryPartyMemberKey" INTEGER NOT NULL,
+      "applicationPropertyKey" INTEGER NOT NULL,
+      "utcDateKey" INTEGER NOT NULL,
+      "utcTimeKey" INTEGER NOT NULL,
+      "propertyDateKey" INTEGER NOT NULL,
+      "propertyTimeKey" INTEGER NOT NULL,
+      "paidBy"  VARCHAR(255) NOT NULL,
+      "AptexxRef" VARCHAR(255) NOT NULL,
+      "transactionType" VARCHAR(80) NOT NULL,
+      "amount" NUMERIC(7,2) NOT NULL,
+      "updated_at" TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+      FOREIGN KEY ("partyKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Party"("partyKey"),
+      FOREIGN KEY ("applicantPartyMemberKey") REFERENCES "dstStarDB"."dstStarSchema"."d_PartyMember"("partyMemberKey"),
+      FOREIGN KEY ("utcDateKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Date"("dateKey"),
+      FOREIGN KEY ("propertyDateKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Date"("dateKey"),
+      FOREIGN KEY ("utcTimeKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Time"("timeKey"),
+      FOREIGN KEY ("propertyTimeKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Time"("timeKey"),
+      FOREIGN KEY ("primaryPartyMemberKey") REFERENCES "dstStarDB"."dstStarSchema"."d_PartyMember"("partyMemberKey"),
+      FOREIGN KEY ("applicationPropertyKey") REFERENCES "dstStarDB"."dstStarSchema"."d_Property"("propertyKey")
+    );
+  END IF;
+END
+$f_paymentsandrefunds$;
 
 CREATE TABLE "dstStarDB"."dstStarSchema"."f_PartyConversion"
 (
@@ -1,3 +1,7 @@
+DROP MATERIALIZED VIEW IF EXISTS "dstStarDB"."dstStarSchema"."r_TrafficSummary";
+DROP MATERIALIZED VIEW IF EXISTS "dstStarDB"."dstStarSchema"."r_ConversionSummary";
+DROP MATERIALIZED VIEW IF EXISTS "dstStarDB"."dstStarSchema"."r_DiscountedPipelineProp";
+DROP MATERIALIZED VIEW IF EXISTS "dstStarDB"."dstStarSchema"."r_DiscountedPipelineUser";
 DROP VIEW IF EXISTS "dstStarDB"."dstStarSchema"."d_ApplicantPartyMember";
 DROP VIEW IF EXISTS "dstStarDB"."dstStarSchema"."d_PrimaryPartyMember";
 DROP VIEW IF EXISTS "dstStarDB"."dstStarSchema"."d_TaskDetails";
@@ -62,6 +62,7 @@ DO UPDATE
 		"isSameStore" = EXCLUDED."isSameStore";
 
 -- d_Property - UPSERT
+-- guard: SELECT NOT EXISTS (SELECT 1 FROM "dstStarDB"."dstStarSchema"."d_Property" WHERE "propertyKey" <> -1) OR EXISTS (SELECT 1 FROM "dstStarDB"."dstStarSchema"."s_LastLoadDate" AS lst WHERE lst."tableName" = 'd_Property' AND (EXISTS (SELECT 1 FROM "dstReplicaDB"."dstReplicaSchema"."Property" AS p WHERE p.updated_at > lst."loadDate") OR EXISTS (SELECT 1 FROM "dstReplicaDB"."dstReplicaSchema"."Address" AS a WHERE a.updated_at > lst."loadDate")))
 INSERT INTO "dstStarDB"."dstStarSchema"."d_Property"
 (
 	"propertyId",
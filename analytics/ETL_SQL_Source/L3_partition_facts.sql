@@ -0,0 +1,9 @@
+-- PARTITIONFACTS: keeps the monthly partitions of the fact tables created partitioned (L3_DDL.sql, tenants with partitionFacts on) --
+-- the partitions of the coming months are created, rows of those months moved out of the DEFAULT partition, and the ones past
+-- retention detached.   A no-op for tables that aren't partitioned.
+-- PARTITION instructions are only understood by reddm_runjobgroup.py (see reddm_partition.py), which is why they are kept out of
+-- RESTARTMART and LOADMART:  run_analytics_restart_mart_process / run_analytics_load_process EXECUTE every instruction as SQL.
+-- Run it after RESTARTMART, and before LOADMART.
+
+-- f_PaymentsAndRefunds
+PARTITION "dstStarDB"."dstStarSchema"."f_PaymentsAndRefunds" AHEAD 3 RETAIN 36;
@@ -0,0 +1,30 @@
+-- REFRESHREPORTS: refresh the report aggregates (L4_reports_DDL.sql) whose sources were loaded since their last refresh
+-- CONCURRENTLY keeps the aggregates readable while they refresh; report_refreshed then records the load date it caught up with
+
+-- r_TrafficSummary
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_TrafficSummary', ARRAY['f_TrafficSummary'])
+REFRESH MATERIALIZED VIEW CONCURRENTLY "dstStarDB"."dstStarSchema"."r_TrafficSummary";
+
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_TrafficSummary', ARRAY['f_TrafficSummary'])
+SELECT "dstStarDB"."dstStarSchema".report_refreshed('r_TrafficSummary', ARRAY['f_TrafficSummary'], 'resultPrevInstr');
+
+-- r_ConversionSummary
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_ConversionSummary', ARRAY['f_ConversionSummaryRolling12', 'd_Property'])
+REFRESH MATERIALIZED VIEW CONCURRENTLY "dstStarDB"."dstStarSchema"."r_ConversionSummary";
+
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_ConversionSummary', ARRAY['f_ConversionSummaryRolling12', 'd_Property'])
+SELECT "dstStarDB"."dstStarSchema".report_refreshed('r_ConversionSummary', ARRAY['f_ConversionSummaryRolling12', 'd_Property'], 'resultPrevInstr');
+
+-- r_DiscountedPipelineProp
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_DiscountedPipelineProp', ARRAY['f_PipelineStateAnalysis', 'd_Property', 'd_PipelineState', 'd_TeamSalesTargets', 'd_UserTeamProperty'])
+REFRESH MATERIALIZED VIEW CONCURRENTLY "dstStarDB"."dstStarSchema"."r_DiscountedPipelineProp";
+
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_DiscountedPipelineProp', ARRAY['f_PipelineStateAnalysis', 'd_Property', 'd_PipelineState', 'd_TeamSalesTargets', 'd_UserTeamProperty'])
+SELECT "dstStarDB"."dstStarSchema".report_refreshed('r_DiscountedPipelineProp', ARRAY['f_PipelineStateAnalysis', 'd_Property', 'd_PipelineState', 'd_TeamSalesTargets', 'd_UserTeamProperty'], 'resultPrevInstr');
+
+-- r_DiscountedPipelineUser
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_DiscountedPipelineUser', ARRAY['f_PipelineStateAnalysis', 'd_User', 'd_PipelineState', 'd_TeamMemberSalesTargets'])
+REFRESH MATERIALIZED VIEW CONCURRENTLY "dstStarDB"."dstStarSchema"."r_DiscountedPipelineUser";
+
+-- guard: SELECT "dstStarDB"."dstStarSchema".report_needs_refresh('r_DiscountedPipelineUser', ARRAY['f_PipelineStateAnalysis', 'd_User', 'd_PipelineState', 'd_TeamMemberSalesTargets'])
+SELECT "dstStarDB"."dstStarSchema".report_refreshed('r_DiscountedPipelineUser', ARRAY['f_PipelineStateAnalysis', 'd_User', 'd_PipelineState', 'd_TeamMemberSalesTargets'], 'resultPrevInstr');
@@ -0,0 +1,170 @@
+-- report aggregates: the ReportsQueries aggregations materialized for every "eventDt", refreshed by the REFRESHREPORTS job group
+-- each aggregate has an s_LastLoadDate row (r_<name>), holding the load date of its sources it was last refreshed with
+
+-- latest load date of a set of source tables -- a source loaded outside of s_LastLoadDate makes it the latest load of the whole mart
+CREATE OR REPLACE FUNCTION "dstStarDB"."dstStarSchema".report_sources_loaded(sources text[])
+RETURNS timestamptz
+LANGUAGE sql STABLE
+AS $$
+	SELECT max(src."loadDate")
+	FROM "dstStarDB"."dstStarSchema"."s_LastLoadDate" AS src
+	WHERE src."tableName" = ANY(sources)
+		OR (src."tableName" NOT LIKE 'r\_%'
+			AND (SELECT count(*) FROM "dstStarDB"."dstStarSchema"."s_LastLoadDate" WHERE "tableName" = ANY(sources)) < cardinality(sources))
+$$;
+
+-- does an aggregate exist, and was one of its sources loaded since it was last refreshed
+CREATE OR REPLACE FUNCTION "dstStarDB"."dstStarSchema".report_needs_refresh(aggregate text, sources text[])
+RETURNS boolean
+LANGUAGE sql STABLE
+AS $$
+	SELECT to_regclass(quote_ident('dstStarSchema') || '.' || quote_ident(aggregate)) IS NOT NULL
+		AND COALESCE("dstStarDB"."dstStarSchema".report_sources_loaded(sources) >
+			(SELECT agg."loadDate" FROM "dstStarDB"."dstStarSchema"."s_LastLoadDate" AS agg WHERE agg."tableName" = aggregate), TRUE)
+$$;
+
+-- after a successful refresh, the aggregate is as recent as its sources
+CREATE OR REPLACE FUNCTION "dstStarDB"."dstStarSchema".report_refreshed(aggregate text, sources text[], result text)
+RETURNS void
+LANGUAGE sql
+AS $$
+	INSERT INTO "dstStarDB"."dstStarSchema"."s_LastLoadDate" ("tableName", "loadDate")
+	SELECT aggregate, COALESCE("dstStarDB"."dstStarSchema".report_sources_loaded(sources), now())
+	WHERE result = 'Success'
+	ON CONFLICT ("tableName") DO UPDATE SET "loadDate" = EXCLUDED."loadDate"
+$$;
+
+-- r_TrafficSummary - TrafficSummary.sql, at its finest grain (both of its queries roll up from it)
+-- guard: SELECT to_regclass('"dstStarSchema"."f_TrafficSummary"') IS NOT NULL
+CREATE MATERIALIZED VIEW "dstStarDB"."dstStarSchema"."r_TrafficSummary" AS
+SELECT ts."eventDt",
+       coalesce(ts."type", 'UNKNOWN') AS "partyType",
+       CASE
+           WHEN ts."score" IS NULL
+                OR ts."score"='' THEN 'UNKNOWN'
+           ELSE ts."score"
+       END AS "partyScore",
+       SUM(coalesce(ts."newContactsQty", 0)) AS "newContacts",
+       SUM(coalesce(ts."toursQty", 0)) AS tours,
+       SUM(coalesce(ts."salesQty", 0)) AS "sales"
+FROM "dstStarDB"."dstStarSchema"."f_TrafficSummary" ts
+WHERE ts."eventDt" IS NOT NULL
+GROUP BY ts."eventDt",
+         "partyType",
+         "partyScore";
+
+-- REFRESH ... CONCURRENTLY needs a unique index over plain columns
+-- guard: SELECT to_regclass('"dstStarSchema"."r_TrafficSummary"') IS NOT NULL
+CREATE UNIQUE INDEX "r_TrafficSummary_key" ON "dstStarDB"."dstStarSchema"."r_TrafficSummary" ("eventDt", "partyType", "partyScore");
+
+-- r_ConversionSummary - CSR12.sql per day and property; the rate is kept as sum and count, so months average it correctly
+-- guard: SELECT to_regclass('"dstStarSchema"."f_ConversionSummaryRolling12"') IS NOT NULL
+CREATE MATERIALIZED VIEW "dstStarDB"."dstStarSchema"."r_ConversionSummary" AS
+SELECT csr."eventDt",
+       prop."propertyId",
+       prop."name",
+       SUM(COALESCE(csr."MTDnewContactsQty", 0)) AS "MTDnewContacts",
+       SUM(COALESCE(csr."MTDtoursQty", 0)) AS "MTDtours",
+       SUM(COALESCE(csr."MTDleasesQty", 0)) AS "MTDleases",
+       SUM(COALESCE(csr."MTDsalesQty", 0)) AS "MTDsales",
+       SUM(COALESCE(csr."newContactsQty", 0)) AS "newContacts",
+       SUM(COALESCE(csr."toursQty", 0)) AS "tours",
+       SUM(COALESCE(csr."leasesQty", 0)) AS "leases",
+       SUM(COALESCE(csr."salesQty", 0)) AS "sales",
+       SUM(COALESCE(csr."rateIncreasePercent", 0)) AS "rateIncreasePercentSum",
+       COUNT(*) AS "rowCount"
+FROM "dstStarDB"."dstStarSchema"."f_ConversionSummaryRolling12" csr
+INNER JOIN "dstStarDB"."dstStarSchema"."d_Property" prop ON prop."propertyId" = csr."propertyId"
+WHERE csr."eventDt" IS NOT NULL
+GROUP BY csr."eventDt",
+         prop."propertyId",
+         prop."name";
+
+-- guard: SELECT to_regclass('"dstStarSchema"."r_ConversionSummary"') IS NOT NULL
+CREATE UNIQUE INDEX "r_ConversionSummary_key" ON "dstStarDB"."dstStarSchema"."r_ConversionSummary" ("eventDt", "propertyId");
+
+-- r_DiscountedPipelineProp - DiscountedPipelineProp.sql for every "eventDt"
+-- guard: SELECT to_regclass('"dstStarSchema"."f_PipelineStateAnalysis"') IS NOT NULL AND to_regclass('"dstStarSchema"."d_PipelineState"') IS NOT NULL AND to_regclass('"dstStarSchema"."d_TeamSalesTargets"') IS NOT NULL AND to_regclass('"dstStarSchema"."d_UserTeamProperty"') IS NOT NULL
+CREATE MATERIALIZED VIEW "dstStarDB"."dstStarSchema"."r_DiscountedPipelineProp" AS
+SELECT prop."propertyId",
+       prop."name",
+       ps."pipelineStateId",
+       psa."eventDt",
+
+  ( SELECT DISTINCT "salesTarget"
+   FROM "dstStarDB"."dstStarSchema"."d_TeamSalesTargets" tst
+   INNER JOIN "dstStarDB"."dstStarSchema"."d_UserTeamProperty" usp ON usp."teamId" = tst."teamId"
+   WHERE usp."propertyId" = prop."propertyId"
+     AND (extract(MONTH
+                  FROM psa."eventDt") = tst."month"
+          AND extract(YEAR
+                      FROM psa."eventDt") = tst."year") LIMIT 1) AS "salesTarget",
+       SUM(psa."MTDactiveStateQty") AS "Current",
+       0 AS "Projected",
+       ps.state,
+       AVG(psa."activeStateDurationHours") AS "activeInStateAvgHours",
+       SUM(psa."fullCycleProcessDurationHours") AS "fullCycleHours"
+FROM "dstStarDB"."dstStarSchema"."f_PipelineStateAnalysis" psa
+INNER JOIN "dstStarDB"."dstStarSchema"."d_Property" prop ON prop."propertyId" = psa."propertyId"
+INNER JOIN "dstStarDB"."dstStarSchema"."d_PipelineState" ps ON ps."pipelineStateId" = psa."pipelineStateId"
+WHERE psa."eventDt" IS NOT NULL
+GROUP BY prop."propertyId",
+         prop."name",
+         ps."pipelineStateId",
+         ps.state,
+         psa."eventDt";
+
+-- guard: SELECT to_regclass('"dstStarSchema"."r_DiscountedPipelineProp"') IS NOT NULL
+CREATE UNIQUE INDEX "r_DiscountedPipelineProp_key" ON "dstStarDB"."dstStarSchema"."r_DiscountedPipelineProp" ("eventDt", "propertyId", "pipelineStateId");
+
+-- r_DiscountedPipelineUser - DiscountedPipelineUser.sql for every "eventDt"
+-- a user can have a sales target in several teams for the same month -- the most recently updated one is reported, so there is one row per state
+-- guard: SELECT to_regclass('"dstStarSchema"."f_PipelineStateAnalysis"') IS NOT NULL AND to_regclass('"dstStarSchema"."d_PipelineState"') IS NOT NULL AND to_regclass('"dstStarSchema"."d_TeamMemberSalesTargets"') IS NOT NULL
+CREATE MATERIALIZED VIEW "dstStarDB"."dstStarSchema"."r_DiscountedPipelineUser" AS
+SELECT usr."userId",
+       usr."fullName",
+       ps."pipelineStateId",
+       psa."eventDt",
+       COUNT (DISTINCT psa."partyId") AS "Current",
+             0 AS "Projected",
+             tmst."salesTarget",
+             tmst."contactsToSalesConv",
+             tmst."leadsToSalesConv",
+             tmst."prospectsToSalesConv",
+             tmst."applicantsToSalesConv",
+             ps.state,
+             AVG(psa."activeStateDurationHours") AS "activeInStateAvgHours",
+
+  (SELECT SUM(fc."fullCycleProcessDurationHours")
+   FROM "dstStarDB"."dstStarSchema"."f_PipelineStateAnalysis" fc
+   WHERE fc."eventDt" = psa."eventDt"
+     AND fc."pipelineStateId" = ps."pipelineStateId"
+     AND fc."ownerId" = usr."userId" ) AS "fullCycleHours"
+FROM "dstStarDB"."dstStarSchema"."f_PipelineStateAnalysis" psa
+INNER JOIN "dstStarDB"."dstStarSchema"."d_User" usr ON usr."userId" = psa."ownerId"
+INNER JOIN "dstStarDB"."dstStarSchema"."d_PipelineState" ps ON ps."pipelineStateId" = psa."pipelineStateId"
+LEFT JOIN LATERAL
+  (SELECT t."salesTarget",
+          t."contactsToSalesConv",
+          t."leadsToSalesConv",
+          t."prospectsToSalesConv",
+          t."applicantsToSalesConv"
+   FROM "dstStarDB"."dstStarSchema"."d_TeamMemberSalesTargets" t
+   WHERE t."userId" = psa."ownerId"
+     AND t."month" = extract(MONTH FROM psa."eventDt")
+     AND t."year" = extract(YEAR FROM psa."eventDt")
+   ORDER BY t."updated_at" DESC NULLS LAST, t."teamId" LIMIT 1) tmst ON true
+WHERE psa."eventDt" IS NOT NULL
+GROUP BY tmst."salesTarget",
+         tmst."contactsToSalesConv",
+         tmst."leadsToSalesConv",
+         tmst."prospectsToSalesConv",
+         tmst."applicantsToSalesConv",
+         usr."fullName",
+         ps.state,
+         psa."eventDt",
+         ps."pipelineStateId",
+         usr."userId";
+
+-- guard: SELECT to_regclass('"dstStarSchema"."r_DiscountedPipelineUser"') IS NOT NULL
+CREATE UNIQUE INDEX "r_DiscountedPipelineUser_key" ON "dstStarDB"."dstStarSchema"."r_DiscountedPipelineUser" ("eventDt", "userId", "pipelineStateId");
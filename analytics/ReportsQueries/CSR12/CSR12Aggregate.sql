@@ -0,0 +1,27 @@
+-- CSR12.sql read from the r_ConversionSummary aggregate (refreshed by the REFRESHREPORTS job group)
+
+SELECT csr."name",
+       to_char(csr."eventDt", 'Month') AS "month",
+       SUM(csr."MTDnewContacts") AS "newContacts",
+       SUM(csr."MTDtours") AS "tours",
+       SUM(csr."MTDleases") AS "leases",
+       SUM(csr."MTDsales") AS "sales",
+       SUM(csr."rateIncreasePercentSum") / SUM(csr."rowCount") AS "rentIncreasePercent"
+FROM "${dstStarSchema}$"."r_ConversionSummary" csr
+WHERE csr."eventDt" = date("${date}$") -- this should be the current date the report is generated.
+GROUP BY csr."name",
+         "month"
+UNION ALL
+SELECT csr."name",
+       to_char(csr."eventDt", 'Month') AS "month",
+       SUM(csr."newContacts") AS "newContacts",
+       SUM(csr."tours") AS "tours",
+       SUM(csr."leases") AS "leases",
+       SUM(csr."sales") AS "sales",
+       SUM(csr."rateIncreasePercentSum") / SUM(csr."rowCount") AS "rentIncreasePercent"
+FROM "${dstStarSchema}$"."r_ConversionSummary" csr
+INNER JOIN generate_series(1, 11) AS prev("months")
+  ON extract(MONTH FROM csr."eventDt") = extract(MONTH FROM (date("${date}$") - prev."months" * interval '1 month'))
+GROUP BY prev."months",
+         csr."name",
+         "month";
@@ -0,0 +1,12 @@
+-- DiscountedPipelineProp.sql read from the r_DiscountedPipelineProp aggregate (refreshed by the REFRESHREPORTS job group)
+
+SELECT dp."name",
+       dp."eventDt",
+       dp."salesTarget",
+       dp."Current",
+       dp."Projected",
+       dp.state,
+       dp."activeInStateAvgHours",
+       dp."fullCycleHours"
+FROM "${dstStarSchema}$"."r_DiscountedPipelineProp" dp
+WHERE dp."eventDt" = date("${date}$");
@@ -0,0 +1,16 @@
+-- DiscountedPipelineUser.sql read from the r_DiscountedPipelineUser aggregate (refreshed by the REFRESHREPORTS job group)
+
+SELECT dp."fullName",
+       dp."eventDt",
+       dp."Current",
+       dp."Projected",
+       dp."salesTarget",
+       dp."contactsToSalesConv",
+       dp."leadsToSalesConv",
+       dp."prospectsToSalesConv",
+       dp."applicantsToSalesConv",
+       dp.state,
+       dp."activeInStateAvgHours",
+       dp."fullCycleHours"
+FROM "${dstStarSchema}$"."r_DiscountedPipelineUser" dp
+WHERE dp."eventDt" = date("${date}$");
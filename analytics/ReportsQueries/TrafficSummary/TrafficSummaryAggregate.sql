@@ -0,0 +1,19 @@
+-- TrafficSummary.sql read from the r_TrafficSummary aggregate (refreshed by the REFRESHREPORTS job group)
+
+SELECT ts."partyScore",
+       SUM(ts."newContacts") AS "newContacts",
+       SUM(ts.tours) AS tours,
+       SUM(ts."sales") AS "sales"
+FROM "${dstStarSchema}$"."r_TrafficSummary" ts
+WHERE ts."eventDt" = date("${date}$")
+GROUP BY ts."partyScore";
+
+------------------------------------------------------------------------------------------
+
+SELECT ts."partyType",
+       ts."partyScore",
+       ts."newContacts",
+       ts.tours,
+       ts."sales"
+FROM "${dstStarSchema}$"."r_TrafficSummary" ts
+WHERE ts."eventDt" = date("${date}$");
@@ -19,6 +19,19 @@ module.exports = {
       jobName: 'L3_DDL',
       sequenceNumber: 10,
     },
+    {
+      jobGroup: 'RESTARTMART',
+      fileName: 'L4_reports_DDL.sql',
+      jobName: 'L4_REPORTS_DDL',
+      sequenceNumber: 20,
+    },
+    {
+      // PARTITION instructions -- run by reddm_runjobgroup.py only, never by the run_analytics_* procedures
+      jobGroup: 'PARTITIONFACTS',
+      fileName: 'L3_partition_facts.sql',
+      jobName: 'L3_PARTITION_FACTS',
+      sequenceNumber: 70,
+    },
     {
       jobGroup: 'LOADMART',
       fileName: 'L3_load_dimensions.sql',
@@ -30,6 +43,14 @@ module.exports = {
       fileName: 'L3_load_facts.sql',
       jobName: 'L3_LOAD_FACTS',
       sequenceNumber: 81,
+      // the fact loads' window function CTEs (e.g. CurrentPartyMember) spill to disk with the default work_mem
+      settings: { work_mem: '256MB' },
+    },
+    {
+      jobGroup: 'REFRESHREPORTS',
+      fileName: 'L4_refresh_reports.sql',
+      jobName: 'L4_REFRESH_REPORTS',
+      sequenceNumber: 90,
     },
   ],
 };